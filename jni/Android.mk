@@ -179,6 +179,7 @@ LOCAL_SRC_FILES := \
   ../source/benchmark.cpp                                              \
   ../source/tune.cpp                                                   \
   ../source/book/apery_book.cpp                                        \
+  ../source/book/binary_book.cpp                                       \
   ../source/book/book.cpp                                              \
   ../source/extra/bitop.cpp                                            \
   ../source/extra/long_effect.cpp                                      \
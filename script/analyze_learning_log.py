@@ -1,98 +1,247 @@
 # -*- coding: cp932 -*-
+#
+# ˂牤learnR}hoO(<root>/*/log)OtɂB
+#
+#   python analyze_learning_log.py <root>
+#       O񂩂eOɒǋLꂽǂ݁ASruñOtyane.pdfɏoB(EBhEɂ\)
+#
+#   python analyze_learning_log.py <root> --follow [--interval 30]
+#       OĎBVL^run <state_dir>/<run>.png ɕ`̂ŁA
+#       \̊wK𓯎ɑ点ĂĂyĂB
+#
+# ǂݎL^ <state_dir> ( <root>/.learnlog) ɕۑĂB
+#   state.json   runƂ́AO̓ǂݏIʒu(oCg)AŌ"N sfens"̒lA\̍sAO擪̎w
+#   <run>.f8     float64̍sǋLĂ̕\BCOLUMNS
+import argparse
 import os
 import sys
 import re
 import glob
+import json
+import time
+import hashlib
 import datetime
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.backends.backend_pdf
 import pandas as pd
 
 
-def analyze_log(file_path):
-    with open(file_path, 'rb') as fi:
-        sfens_pat = re.compile(r'^(?P<sfens>\d+) sfens ,')
-#        record_pat = re.compile(r'^hirate eval = (?P<hirate_eval>.*) , dsig rmse = (?P<dsig_rmse>.*) , dsig mae = (?P<dsig_mae>.*) , eval mae = (?P<eval_mae>.*) , test_cross_entropy_eval = (?P<tcee>.*) , test_cross_entropy_win = (?P<tcew>.*) , test_cross_entropy = (?P<tce>.*) , learn_cross_entropy_eval = (?P<lcee>.*) , learn_cross_entropy_win = (?P<lcew>.*) , learn_cross_entropy = (?P<lce>.*)')
+sfens_pat = re.compile(r'^(?P<sfens>\d+) sfens ,')
+#record_pat = re.compile(r'^hirate eval = (?P<hirate_eval>.*) , dsig rmse = (?P<dsig_rmse>.*) , dsig mae = (?P<dsig_mae>.*) , eval mae = (?P<eval_mae>.*) , test_cross_entropy_eval = (?P<tcee>.*) , test_cross_entropy_win = (?P<tcew>.*) , test_cross_entropy = (?P<tce>.*) , learn_cross_entropy_eval = (?P<lcee>.*) , learn_cross_entropy_win = (?P<lcew>.*) , learn_cross_entropy = (?P<lce>.*)')
+record_pat = re.compile(r'^hirate eval = (?P<hirate_eval>.*) , test_cross_entropy_eval = (?P<tcee>.*) , test_cross_entropy_win = (?P<tcew>.*) , test_cross_entropy = (?P<tce>.*) , learn_cross_entropy_eval = (?P<lcee>.*) , learn_cross_entropy_win = (?P<lcew>.*) , learn_cross_entropy = (?P<lce>.*) , norm = (?P<norm>.*) , move accuracy = (?P<move_acc>.*)%')
 
-        record_pat = re.compile(r'^hirate eval = (?P<hirate_eval>.*) , test_cross_entropy_eval = (?P<tcee>.*) , test_cross_entropy_win = (?P<tcew>.*) , test_cross_entropy = (?P<tce>.*) , learn_cross_entropy_eval = (?P<lcee>.*) , learn_cross_entropy_win = (?P<lcew>.*) , learn_cross_entropy = (?P<lce>.*) , norm = (?P<norm>.*) , move accuracy = (?P<move_acc>.*)%')
+COLUMNS = 'sfens hirate_eval tce lce norm move_acc'.split()
 
-        epoch_pat = re.compile(r'^epoch.*')
+# OւꂽƂ邽߂ɁA擪̂̃oCg̎wƂĂB
+# (wKn߂蒼ƁAOO蒷ȂĂĂg͕ʕ)
+FINGERPRINT_BYTES = 4096
 
-        log = []
-        for line in fi.readlines():
-            mo = sfens_pat.search(line)
-            if mo:
-                sfens = int(mo.groupdict()['sfens'])
-                continue
 
-            mo = epoch_pat.search(line)
+# ----------------------------------------------------------------------
+# ǋL̓ǂݍ
+# ----------------------------------------------------------------------
+
+def parse_new_lines(file_path, offset, sfens):
+    """
+    file_pathoffsetoCgڈȍ~́As܂ŏꂽsǂށB
+    Ō̉ŝȂśAlearnerĂrmȂ̂Ŏɉ񂷁B
+    ߂l (rows, new_offset, sfens)
+    """
+    rows = []
+    with open(file_path, 'rb') as fi:
+        fi.seek(offset)
+        for raw in fi:
+            if not raw.endswith(b'\n'):
+                break
+            offset += len(raw)
+            # OlearnerASCIIŏĂBstr̃p^[ŏƍł悤ɃfR[hB
+            line = raw.decode('utf-8', errors='replace')
+
+            mo = sfens_pat.search(line)
             if mo:
+                sfens = int(mo.group('sfens'))
                 continue
 
             mo = record_pat.search(line)
             if mo:
-#                sfens += 1000000     # output every 1M sfens.
-                if sfens < 2000000: # skip early period
-                    continue;
-                hirate_eval = float(mo.groupdict()['hirate_eval'])
-
-#                dsig_rmse    = float(mo.groupdict()['dsig_rmse'])
-#                dsig_mae    = float(mo.groupdict()['dsig_mae'])
-#                eval_mae    = float(mo.groupdict()['eval_mae'])
-
-                tce         = float(mo.groupdict()['tce'])
-                lce         = float(mo.groupdict()['lce'])
-                norm        = float(mo.groupdict()['norm'])
-                move_acc    = float(mo.groupdict()['move_acc'])
-#                log.append((sfens, hirate_eval, dsig_rmse , dsig_mae , eval_mae , tce , lce))
-                log.append((sfens, hirate_eval, tce , lce , norm , move_acc))
-
-    if len(log) == 0:
-        print('{}: Empty'.format(file_path))
+                d = mo.groupdict()
+                try:
+                    rows.append((sfens, float(d['hirate_eval']), float(d['tce']), float(d['lce']),
+                                 float(d['norm']), float(d['move_acc'])))
+                except ValueError:
+                    continue
+    return rows, offset, sfens
+
+
+def head_fingerprint(file_path, length):
+    """ t@C̐擪lengthoCg̃nbVl(16i)B """
+    with open(file_path, 'rb') as fi:
+        return hashlib.sha1(fi.read(length)).hexdigest()
+
+
+class LogStore:
+    """ state_dirȉɒuArunƂ̓ǂݏIʒu(state.json)ƋL^̕\(<run>.f8)B """
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self.state_path = os.path.join(state_dir, 'state.json')
+        self.state = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def table_path(self, run):
+        return os.path.join(self.state_dir, run + '.f8')
+
+    def save(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_path, self.state_path)
+
+    def reset(self, run):
+        """ run̋L^̂ĂāAOŏǂݒƂɂB """
+        if os.path.exists(self.table_path(run)):
+            os.remove(self.table_path(run))
+        return {'offset': 0, 'sfens': 0, 'rows': 0, 'head_len': 0, 'head': hashlib.sha1(b'').hexdigest()}
+
+    def update(self, run, file_path):
+        """ 1run̐VL^\ɒǋLBǋLsԂB """
+        st = self.state.get(run)
+        size = os.path.getsize(file_path)
+        if st is None or 'head' not in st or size < st['offset'] \
+                or head_fingerprint(file_path, st['head_len']) != st['head']:
+            # ߂ČrunAO؂l߂ꂽւꂽB(wK̂蒼Ȃ) ŏǂݒB
+            st = self.reset(run)
+
+        # \͒ǋLĂstate.jsonۑ̂ŁÅԂɗƕ\ɂscĂB
+        # state.jsonɋL^śAɓǂݒȂ̂Ő؂̂ĂĂB
+        table = self.table_path(run)
+        table_bytes = st['rows'] * len(COLUMNS) * 8
+        if os.path.exists(table) and os.path.getsize(table) > table_bytes:
+            with open(table, 'r+b') as f:
+                f.truncate(table_bytes)
+
+        # O̐擪FINGERPRINT_BYTESɖȂ́ALт܂ŎwɊ܂ߒB
+        head_len = min(size, FINGERPRINT_BYTES)
+        if head_len != st['head_len']:
+            st['head_len'] = head_len
+            st['head'] = head_fingerprint(file_path, head_len)
+
+        if size == st['offset']:
+            self.state[run] = st
+            return 0
+
+        rows, st['offset'], st['sfens'] = parse_new_lines(file_path, st['offset'], st['sfens'])
+        if rows:
+            with open(table, 'ab') as f:
+                np.asarray(rows, dtype=np.float64).tofile(f)
+            st['rows'] += len(rows)
+        self.state[run] = st
+        return len(rows)
+
+    def load(self, run):
+        path = self.table_path(run)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=COLUMNS)
+        # state.jsonɋL^s܂łǂށB(͕ۑ̑OɗƂ̏)
+        rows = self.state.get(run, {}).get('rows', 0)
+        a = np.fromfile(path, dtype=np.float64, count=rows * len(COLUMNS))
+        a = a[:len(a) - len(a) % len(COLUMNS)].reshape(-1, len(COLUMNS))
+        return pd.DataFrame(a, columns=COLUMNS)
+
+
+def run_name(root, file_path):
+    """ <root>/<run>/log -> <run> """
+    return os.path.relpath(os.path.dirname(file_path), root).replace(os.sep, '_')
+
+
+def update_all(root, store):
+    """ ׂĂrun̐VL^ǂށBL^̑ (run, file_path) listԂB """
+    changed = []
+    for file_path in sorted(glob.glob(os.path.join(root, '*', 'log'))):
+        run = run_name(root, file_path)
+        n = store.update(run, file_path)
+        if n:
+            print('{}: +{} ({})'.format(file_path, n, store.state[run]['rows']))
+            changed.append((run, file_path))
+    store.save()
+    return changed
+
+
+# ----------------------------------------------------------------------
+# Ot̕`
+# ----------------------------------------------------------------------
+def plot_run(df, title, skip_sfens):
+    df = df[df['sfens'] >= skip_sfens]
+    if len(df) == 0:
         return None
-    else:
-        print('{}: {}'.format(file_path, len(log)))
-
-    # dataframe
-#    df = pd.DataFrame(data=log, columns='sfens hirate_eval dsig_rmse dsig_mae eval_mae tce lce'.split())
-    df = pd.DataFrame(data=log, columns='sfens hirate_eval tce lce norm move_acc'.split())
-
-    # plot
-    fig, ax = plt.subplots(1, 1)
-
-    ax.plot(
-            df['sfens'],
-            df['tce'],
-		    color='red', label='tce')
-    ax.set_xlabel('# SFENs')
-    ax.legend(loc='upper left').get_frame().set_alpha(0.5)
-    ax.plot(
-            df['sfens'],
-            df['lce'],
-#            df['move_acc'],
-		    color='green', label='lce')
-    ax.legend(loc='upper right').get_frame().set_alpha(0.5)
 
-#    ax.plot(
-#           df['sfens'],
-#           df['norm'],
-#		    color='black', label='norm')
+    fig, (ax, ax2) = plt.subplots(2, 1, sharex=True)
+
+    ax.plot(df['sfens'], df['tce'], color='red', label='tce')
+    ax.plot(df['sfens'], df['lce'], color='green', label='lce')
+    ax.legend(loc='upper right').get_frame().set_alpha(0.5)
+    ax.set_title(title)
 
-    ax.set_title(file_path)
+    ax2.plot(df['sfens'], df['move_acc'], color='blue', label='move accuracy [%]')
+    ax2.legend(loc='upper left').get_frame().set_alpha(0.5)
+    ax3 = ax2.twinx()
+    ax3.plot(df['sfens'], df['norm'], color='black', label='norm')
+    ax3.legend(loc='upper right').get_frame().set_alpha(0.5)
+    ax2.set_xlabel('# SFENs')
 
     return fig
 
-if __name__ == '__main__':
 
-    with matplotlib.backends.backend_pdf.PdfPages('yane.pdf') as pdf:
-        for file_path in sorted(glob.glob(os.path.join(sys.argv[1], '*', 'log'))):
-            fig = analyze_log(file_path)
-            if fig is not None:
-                pdf.savefig(fig)
+def write_pdf(root, store, pdf_path, skip_sfens):
+    with matplotlib.backends.backend_pdf.PdfPages(pdf_path) as pdf:
+        for file_path in sorted(glob.glob(os.path.join(root, '*', 'log'))):
+            fig = plot_run(store.load(run_name(root, file_path)), file_path, skip_sfens)
+            if fig is None:
+                print('{}: Empty'.format(file_path))
+                continue
+            pdf.savefig(fig)
 
         d = pdf.infodict()
-        d['Title'] = u'Yanelog analysis of [{}]'.format(sys.argv[1])
+        d['Title'] = u'Yanelog analysis of [{}]'.format(root)
         d['CreationDate'] = datetime.datetime.now()
 
-    plt.show()
+
+def write_pngs(store, changed, skip_sfens):
+    for run, file_path in changed:
+        fig = plot_run(store.load(run), file_path, skip_sfens)
+        if fig is None:
+            continue
+        fig.savefig(os.path.join(store.state_dir, run + '.png'))
+        plt.close(fig)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Plot YaneuraOu learner logs incrementally.')
+    parser.add_argument('root', help='folder containing <run>/log')
+    parser.add_argument('--state_dir', default='', help='where offsets, tables and pngs are kept (default: <root>/.learnlog)')
+    parser.add_argument('--pdf', default='yane.pdf', help='output pdf (one-shot mode)')
+    parser.add_argument('--skip_sfens', type=int, default=2000000, help='do not plot records before this many sfens')
+    parser.add_argument('--follow', action='store_true', help='keep tailing the logs and re-plot changed runs')
+    parser.add_argument('--interval', type=float, default=30.0, help='seconds between polls in --follow mode')
+    args = parser.parse_args()
+
+    store = LogStore(args.state_dir or os.path.join(args.root, '.learnlog'))
+
+    if not args.follow:
+        update_all(args.root, store)
+        write_pdf(args.root, store, args.pdf, args.skip_sfens)
+        plt.show()
+        sys.exit(0)
+
+    # follow modeł̓EBhE͏oɃt@CɂB
+    plt.switch_backend('Agg')
+    while True:
+        changed = update_all(args.root, store)
+        write_pngs(store, changed, args.skip_sfens)
+        time.sleep(args.interval)
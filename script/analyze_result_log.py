@@ -4,106 +4,250 @@
 対局させたときのログを集計して一番勝率の高いものを選ぶための分析スクリプト。
 
 2023.10.25 : Python 3系に対応させた。
-'''
-import os
-import sys
-import glob
-import math
-from collections import OrderedDict
-
-params = OrderedDict()
-res = {}
-res["win"]  = 0
-res["lose"] = 0
-res["draw"] = 0
-
-def analyze_log(file_path):
 
-	#	print "file_path = " + file_path
+ログは
+	PARAM1:123,PARAM2:234,...
+	gameover win
+のように、パラメーターの行の次の行に対局結果が書かれている。
 
-	with open(file_path, 'r', encoding='utf-8') as fi:
+数GBあるログを読めるように、ファイルを一定サイズの区間に分けて複数プロセスで並列に読み、
+1局1行の列指向の表(pandas.DataFrame。列 = result + 各パラメーター)にしてから
+パラメーターの値ごとの勝敗・Elo・信頼区間をまとめて計算する。
+さらにパラメーターごとに、値に対する勝率を重み付き2次式で回帰して、最も勝率の高い値の推定も出す。
 
-		last_line = ""
-		for line in fi.readlines():
-			if ("draw" in line) or ("win" in line) or ("lose" in line):
-				# "gameover win"の"win"の部分を取り出す
-				result = line.split(' ')[1].strip()
+使い方:
+	python analyze_result_log.py <logのあるフォルダ> [--jobs 8] [--chunk_mb 64] [--sort elo|lower|value] [--table out.parquet]
 
-				res[result] += 1
-
-				plist = last_line.split(",");
+	--table を指定すると、集めた表をparquet(拡張子が.csvならcsv)で保存する。
+	次回は<logのあるフォルダ>のかわりにそのファイルを指定すると、ログを読み直さずに集計だけ行う。
+'''
+import argparse
+import os
+import sys
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Elo・信頼区間の計算は対局スクリプトと共通のものを使う。
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaneuraou_python', 'tools'))
+from elo_stats import elo_arrays, elo_from_score, format_result
+
+# 対局結果の列(result)の値。 engine側から見た勝ち点と同じ 0 / 0.5 / 1 の2倍にしておく。
+RESULT_CODES = {"lose": 0, "draw": 1, "win": 2}
+
+# ======================================================================
+# ログの読み込み
+# ======================================================================
+
+def split_chunks(file_path, chunk_size):
+	""" ファイルを chunk_size バイトごとの区間 (file_path, start, end) のlistにする。"""
+	size = os.path.getsize(file_path)
+	if size == 0:
+		return []
+	return [(file_path, start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+def analyze_chunk(chunk):
+	'''
+	ファイルの [start, end) の区間を読み、その区間で始まるパラメーター行と、その次の結果行の組を集める。
+	区間の境界をまたぐ組は、パラメーター行のある側の区間で数える。(結果行を読むために区間の末尾から1行はみ出して読む)
+
+	戻り値 : (results, params)
+		results : 対局結果のlist (RESULT_CODESの値)
+		params  : { パラメーター名 : [(対局の番号, 値), ...] }
+	'''
+	file_path, start, end = chunk
+	results = []
+	params = {}
+
+	with open(file_path, 'rb') as fi:
+		pos = start
+		fi.seek(start)
+		if start > 0:
+			# 途中から読むときは、行の途中かも知れないので次の行頭まで読み捨てる。
+			# (ちょうど行頭ならstart-1が改行なので、1バイト戻ってから読み捨てる)
+			fi.seek(start - 1)
+			pos = start - 1 + len(fi.readline())
+
+		last_line = None
+		last_pos = -1
+		while True:
+			line_pos = pos
+			# 直前の行(パラメーター行の候補)も区間外になったら終わり。
+			if line_pos >= end and last_pos >= end:
+				break
+			raw = fi.readline()
+			if not raw:
+				break
+			pos += len(raw)
+			line = raw.decode('utf-8', errors='replace')
+
+			q = line.split(' ')
+			result = RESULT_CODES.get(q[1].strip()) if len(q) >= 2 else None
+			if result is not None and last_line is not None and start <= last_pos < end:
+				game = len(results)
+				results.append(result)
 				# PARAM1:123,PARAM2:234,...のように並んでいる。
-				for p in plist:
-					q = p.split(":")
-					# 末尾のカンマの可能性がある。
-					if len(q) < 2:
+				for p in last_line.split(","):
+					kv = p.split(":")
+					# 末尾のカンマや改行の可能性がある。
+					if len(kv) < 2:
 						continue
+					try:
+						value = int(kv[1])
+					except ValueError:
+						continue
+					params.setdefault(kv[0].strip(), []).append((game, value))
 
-					# keyがなければ作る。
-					if not q[0] in params:
-						params[q[0]] = {}
-					if not q[1] in params[q[0]]:
-						params[q[0]][q[1]] = {}
-					if not result in params[q[0]][q[1]]:
-						params[q[0]][q[1]][result] = 0
+			last_line = line
+			last_pos = line_pos
+
+	return results, params
+
+def chunk_to_frame(results, params):
+	""" analyze_chunk()の戻り値を、1局1行のDataFrameにする。出現しなかったパラメーターはNaN。"""
+	n = len(results)
+	columns = {"result": np.asarray(results, dtype=np.int8)}
+	for name, pairs in params.items():
+		col = np.full(n, np.nan)
+		idx = np.fromiter((g for g, _ in pairs), dtype=np.int64, count=len(pairs))
+		val = np.fromiter((v for _, v in pairs), dtype=np.float64, count=len(pairs))
+		col[idx] = val
+		columns[name] = col
+	return pd.DataFrame(columns)
+
+def _analyze_chunk_to_frame(chunk):
+	return chunk_to_frame(*analyze_chunk(chunk))
+
+def load_logs(paths, jobs, chunk_size):
+	""" ログファイル群を並列に読み、1局1行のDataFrameを返す。"""
+	chunks = []
+	for path in paths:
+		chunks.extend(split_chunks(path, chunk_size))
+
+	frames = []
+	with ProcessPoolExecutor(max_workers=jobs) as ex:
+		for df in ex.map(_analyze_chunk_to_frame, chunks):
+			frames.append(df)
+			sys.stdout.write(".")
+			sys.stdout.flush()
+	print()
 
-					params[q[0]][q[1]][result] += 1
+	if not frames:
+		return pd.DataFrame({"result": np.zeros(0, dtype=np.int8)})
+	# パラメーター列の出現順は最初に現れたchunkの順にしておく。
+	return pd.concat(frames, ignore_index=True, sort=False)
 
-			last_line = line
-		print(file_path + " total : " + rating(res["win"],res["lose"],res["draw"]))
+def load_table(path):
+	if path.endswith(".csv"):
+		return pd.read_csv(path)
+	return pd.read_parquet(path)
 
-def rating(win,lose,draw):
-	total = win + lose
-	if total != 0 :
-		win_rate = win / float(win+lose)
+def save_table(df, path):
+	if path.endswith(".csv"):
+		df.to_csv(path, index=False)
 	else:
-		win_rate = 0
-
-	if win_rate == 0 or win_rate == 1:
-		rating = ""
+		df.to_parquet(path, index=False)
+
+# ======================================================================
+# 集計
+# ======================================================================
+
+def summarize(df):
+	'''
+	パラメーターごとに、値ごとの勝敗とElo(信頼区間付き)の表を作る。
+	戻り値 : { パラメーター名 : DataFrame(index = 値 , columns = win draw lose games score elo elo_lo elo_hi los) }
+	'''
+	result = df["result"].to_numpy()
+	# 結果のone-hot。 groupby().sum() 1回で勝ち/引き分け/負けの数がまとめて出る。
+	wdl = pd.DataFrame({
+		"win":  (result == RESULT_CODES["win"]).astype(np.int64),
+		"draw": (result == RESULT_CODES["draw"]).astype(np.int64),
+		"lose": (result == RESULT_CODES["lose"]).astype(np.int64),
+	})
+
+	tables = {}
+	for name in df.columns:
+		if name == "result":
+			continue
+		t = wdl.groupby(df[name]).sum()
+		t.index = t.index.astype(np.int64)
+		t["games"] = t["win"] + t["draw"] + t["lose"]
+		st = elo_arrays(t["win"], t["draw"], t["lose"])
+		t["score"], t["elo"], t["elo_lo"], t["elo_hi"], t["los"] = st.score, st.elo, st.elo_lo, st.elo_hi, st.los
+		tables[name] = t.sort_index()
+	return tables
+
+def fit_marginal(t):
+	'''
+	値に対する勝率を、対局数で重み付けした2次式で回帰する。
+	上に凸なら頂点(観測した値の範囲に収める)を、そうでなければ端のうち勝率の高い方を返す。
+	戻り値 : (推定最適値, そこでのElo) 。値が3種類未満ならNone。
+	'''
+	t = t[t["games"] > 0]
+	if len(t) < 3:
+		return None
+	x = t.index.to_numpy(dtype=np.float64)
+	y = t["score"].to_numpy()
+	# 勝率の標準誤差 ∝ 1/sqrt(n) なので、polyfitの重みは sqrt(n)。
+	w = np.sqrt(t["games"].to_numpy(dtype=np.float64))
+	c2, c1, c0 = np.polyfit(x, y, 2, w=w)
+
+	lo, hi = x.min(), x.max()
+	if c2 < 0:
+		best = min(max(-c1 / (2 * c2), lo), hi)
 	else:
-		rating = " R" + str(round(-400*math.log(1/win_rate-1,10),2))
-
-	return str(win) + " - " + str(draw) + " - " + str(lose) + "(" + str(round(win_rate*100,2)) + "%" + rating + ")"
+		best = lo if np.polyval((c2, c1, c0), lo) >= np.polyval((c2, c1, c0), hi) else hi
+	s = float(np.clip(np.polyval((c2, c1, c0), best), 1e-6, 1 - 1e-6))
+	return best, elo_from_score(s)
+
+def print_summary(df, tables, sort):
+	r = df["result"].to_numpy()
+	win = int((r == RESULT_CODES["win"]).sum())
+	draw = int((r == RESULT_CODES["draw"]).sum())
+	lose = int((r == RESULT_CODES["lose"]).sum())
+	print("total : " + format_result(win,draw,lose))
+
+	for name, t in tables.items():
+		print(name + ":")
+		if sort == "elo":
+			t = t.sort_values("elo", ascending=False)
+		elif sort == "lower":
+			# 信頼区間の下限で並べると、対局数の少ない値がたまたま上に来ることがない。
+			t = t.sort_values("elo_lo", ascending=False)
+
+		for value, row in t.iterrows():
+			print("  " + str(value) + " : " + format_result(int(row["win"]),int(row["draw"]),int(row["lose"])))
+
+		fit = fit_marginal(t.sort_index())
+		if fit is not None:
+			print(f"  fit : best = {fit[0]:.1f} (R{fit[1]:.2f})")
 
 def main():
-	#	print os.path.join(sys.argv[1], '*', 'log')
-	for file_path in sorted(glob.glob(os.path.join(sys.argv[1], '*.log'))):
-		fig = analyze_log(file_path)
-		sys.stdout.write(".")
-	print()
+	parser = argparse.ArgumentParser(description="Summarize random-parameter match logs per parameter value.")
+	parser.add_argument('source', type=str, help="Folder containing *.log files, or a table saved with --table.")
+	parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Number of worker processes.")
+	parser.add_argument('--chunk_mb', type=int, default=64, help="Split each log into chunks of this many MB.")
+	parser.add_argument('--sort', type=str, default="value", choices=["value", "elo", "lower"], help="Order of values within each parameter.")
+	parser.add_argument('--table', type=str, default="", help="Save the per-game table to this file (.parquet or .csv).")
+	args = parser.parse_args()
+
+	if args.chunk_mb < 1:
+		print("Error! --chunk_mb must be 1 or more : " + str(args.chunk_mb))
+		sys.exit(1)
+
+	if os.path.isfile(args.source):
+		df = load_table(args.source)
+	else:
+		paths = sorted(glob.glob(os.path.join(args.source, '*.log')))
+		df = load_logs(paths, args.jobs, args.chunk_mb << 20)
 
-	print("total : " + rating(res["win"],res["lose"],res["draw"]))
-
-	t_win = t_lose = t_draw = 0
-	first = True
-	for key,param in params.items():
-
-		if first:
-			first = False
-			for key2,result in param.items():
-				if "win" in result:
-					t_win += result["win"]
-				if "lose" in result:
-					t_lose += result["lose"]
-				if "draw" in result:
-					t_draw += result["draw"]
-			total = t_win+t_lose+t_draw
-			print("  total : " + rating(t_win,t_lose,t_draw))
-
-		print(key + ":")
-
-		for key2,result in sorted(param.items(),key = lambda x:int(x[0])):
-			win = lose = draw = 0
-			if "win" in result:
-				win = result["win"]
-			if "lose" in result:
-				lose = result["lose"]
-			if "draw" in result:
-				draw = result["draw"]
-			print("  " + key2 + " : " + rating(win,lose,draw))
+	if args.table:
+		save_table(df, args.table)
+
+	print_summary(df, summarize(df), args.sort)
 
 
 if __name__ == '__main__':
 	main()
-
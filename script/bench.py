@@ -1,23 +1,28 @@
 #!/usr/bin/python3
+import asyncio
 import yaml
-import pexpect
-import pexpect.popen_spawn
 import pandas
 import statsmodels.stats.weightstats
 import cpuid
-import re
 import argparse
 import platform
 import logging
+import os
+import sys
+
+# エンジンとの通信とUSI出力のパーサーは yaneuraou_python/tools の usi_engine.py / usi_parser.py を共通で使う。
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaneuraou_python', 'tools'))
+from usi_engine import UsiEngine
+from usi_parser import parse_lines, BenchRecord
 
 # python package install (Windows):
 # https://www.microsoft.com/store/productId/9P7QFQMJRFP7
-# python3 -m pip install cpuid pandas pexpect pyyaml statsmodels numpy==1.19.3
+# python3 -m pip install cpuid pandas pyyaml statsmodels numpy==1.19.3
 
 # python package install (Ubuntu):
 # sudo apt-get update
 # sudo apt-get install python3 python3-pip
-# python3 -m pip install cpuid pandas pexpect pyyaml statsmodels numpy
+# python3 -m pip install cpuid pandas pyyaml statsmodels numpy
 
 # python package list:
 # python3 -m pip list
@@ -53,26 +58,27 @@ class YOBench():
     self.eval = eval
     self.cmd = cmd
 
+  async def exec_async(self):
+    async with UsiEngine(self.path, encoding="cp932") as engine:
+      engine.setoption("EvalDir", self.eval)
+      engine.setoption("PvInterval", 0)
+      rlines = await engine.isready(60)
+      engine.send("bench %s" % self.cmd)
+      rlines += await engine.read_until(
+        lambda line, rec: isinstance(rec, BenchRecord) and rec.name == "nps", 600)
+    return "\n".join(rlines) + "\n"
+
   def exec(self):
-    rlines = ""
-    child = pexpect.spawn(self.path) if platform.system() != "Windows" else pexpect.popen_spawn.PopenSpawn(self.path.replace("\\", "/"))
-    child.sendline("setoption name EvalDir value %s" % self.eval)
-    child.sendline("setoption name PvInterval value %s" % 0)
-    child.sendline("isready")
-    child.expect(r"readyok\s*\n", 60)
-    rlines += child.before.decode("cp932", errors="ignore")
-    rlines += child.after.decode("cp932", errors="ignore")
-    child.sendline("bench %s" % self.cmd)
-    child.expect(r"Nodes\/second +: \d+\s*\n", 600)
-    rlines += child.before.decode("cp932", errors="ignore")
-    rlines += child.after.decode("cp932", errors="ignore")
-    child.sendline("quit")
-    if platform.system() != "Windows":
-      child.close()
-    return rlines
-
-ptn1 = re.compile(r'Total time \(ms\) +: (?P<time_e1>\d+)\s+Nodes searched +: (?P<nodes_e1>\d+)\s+Nodes\/second +: (?P<nps_e1>\d+)')
-ptn2 = re.compile(r'Total time \(ms\) +: (?P<time_e2>\d+)\s+Nodes searched +: (?P<nodes_e2>\d+)\s+Nodes\/second +: (?P<nps_e2>\d+)')
+    return asyncio.run(self.exec_async())
+
+def parse_bench(res, suffix):
+  # benchの集計行(Total time / Nodes searched / Nodes/second)を取り出す。
+  # 3つ揃っていなければNoneを返す。
+  m = {}
+  for rec in parse_lines(res.splitlines()):
+    if isinstance(rec, BenchRecord):
+      m[rec.name + suffix] = rec.value
+  return m if len(m) == 3 else None
 
 bench1 = YOBench(args.engine1, args.eval1, args.cmd)
 bench2 = YOBench(args.engine2, args.eval2, args.cmd)
@@ -88,10 +94,8 @@ for i in range(args.loop):
     logger.debug('run {:d} {:s}'.format(i + 1, args.engine1))
     res = bench1.exec()
     logger.debug(res)
-    m = ptn1.search(res).groupdict()
+    m = parse_bench(res, '_e1')
     if m is not None :
-      for k, v in m.items():
-        m[k] = int(v)
       dic.update(m)
       print('{:10d} '.format(m['nps_e1']), end='', flush=True)
 
@@ -99,10 +103,8 @@ for i in range(args.loop):
     logger.debug('run {:d} {:s}'.format(i + 1, args.engine2))
     res = bench2.exec()
     logger.debug(res)
-    m = ptn2.search(res).groupdict()
+    m = parse_bench(res, '_e2')
     if m is not None :
-      for k, v in m.items():
-        m[k] = int(v)
       dic.update(m)
       print('{:10d} '.format(m['nps_e2']), end='', flush=True)
 
@@ -1,17 +1,14 @@
+import os
 import sys
-import math
 
-# python calc_rating.py 60 40
+# python calc_rating.py 60 40 [draw]
 
-param = sys.argv
-win = float(param[1])
-lose = float(param[2])
-draw = 0
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaneuraou_python', 'tools'))
+from elo_stats import format_result
 
-total = win + lose
-if total != 0 :
-	win_rate = win / float(win+lose)
-else:
-	win_rate = 0
-print "finish " + str(win) + " - " + str(draw) + " - " + str(lose) + "(" + str(round(win_rate*100,2)) + "% R" + str(round(-400*math.log(1/win_rate-1,10),2)) + ")\n"
+param = sys.argv
+win = int(param[1])
+lose = int(param[2])
+draw = int(param[3]) if len(param) > 3 else 0
 
+print "finish " + format_result(win,draw,lose) + "\n"
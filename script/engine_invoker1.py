@@ -2,7 +2,10 @@ import time
 import sys
 import subprocess
 import os.path
-import math
+
+# Elo and its confidence interval come from yaneuraou_python/tools/elo_stats.py (Python 2 compatible).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaneuraou_python', 'tools'))
+from elo_stats import format_result
 
 def write_engine_file(num , engine_name , eval_dir , byoyomi , hash):
 	f = open("engine-config"+str(num)+".txt","w")
@@ -19,18 +22,7 @@ def write_engine_file(num , engine_name , eval_dir , byoyomi , hash):
 	f.close()
 
 def output_rating(win,draw,lose):
-		total = win + lose
-		if total != 0 :
-			win_rate = win / float(win+lose)
-		else:
-			win_rate = 0
-
-		if win_rate == 0 or win_rate == 1:
-			rating = ""
-		else:
-			rating = " R" + str(round(-400*math.log(1/win_rate-1,10),2))
-
-		print str(win) + " - " + str(draw) + " - " + str(lose) + "(" + str(round(win_rate*100,2)) + "%" + rating + ")"
+		print format_result(win,draw,lose)
 		sys.stdout.flush()
 
 
@@ -8,6 +8,10 @@ import subprocess
 import sys
 import time
 
+# Elo・信頼区間の計算はyaneuraou_python/tools/elo_stats.py(Python 2でも動く)を共通で使う。
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaneuraou_python', 'tools'))
+from elo_stats import format_result
+
 # -----------------------------------------------------------------
 
 # subprocessでnon blockingなreadにするhack。
@@ -50,26 +54,18 @@ win = lose = draw = 0
 win_black = lose_black = 0
 
 # レーティングの出力
+# 勝率は引き分けを0.5勝として数え、Eloの95%信頼区間とLOSも表示する。
 def output_rating(win,draw,lose,win_black,win_white,opt2):
 	total = win + lose
 	if total != 0 :
-		# 普通の勝率
-		win_rate = win / float(win+lose)
 		# 先手番/後手番のときの勝率内訳
 		win_rate_black = win_black / float(win + lose)
 		win_rate_white = win_white / float(win + lose)
 	else:
-		win_rate = 0
 		win_rate_black = 0
 		win_rate_white = 0
 
-	if win_rate == 0 or win_rate == 1:
-		rating = ""
-	else:
-		rating = " R" + str(round(-400*math.log(1/win_rate-1,10),2))
-
-	print opt2 + "," + str(win) + " - " + str(draw) + " - " + str(lose) + \
-		"(" + str(round(win_rate*100,2)) + "%" + rating + ")" + \
+	print opt2 + "," + format_result(win,draw,lose) + \
 		" win black : white = " + \
 		str(round(win_rate_black*100,2)) + "% : " + \
 		str(round(win_rate_white*100,2)) + "%"
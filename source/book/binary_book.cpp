@@ -0,0 +1,145 @@
+﻿#include "../config.h"
+
+#include "binary_book.h"
+
+#include <cstring>   // memcmp()
+#include <mutex>
+
+namespace YaneuraOu {
+namespace Book {
+
+u64 BinaryBook::ZobPiece[PIECE_NB][SQ_NB];
+u64 BinaryBook::ZobHand[COLOR_NB][PIECE_HAND_NB];
+u64 BinaryBook::ZobSide;
+
+void BinaryBook::init()
+{
+	static std::once_flag once;
+	std::call_once(once, []() {
+		// Pythonの側(yaneuraou_python/tools/book_bin.py)でも同じ順番で乱数を取り出している。
+		// 順番を変えるとファイルの互換性がなくなるので注意。
+		PRNG rng(BinaryBookKeySeed);
+
+		ZobSide = rng.rand<u64>();
+
+		// NO_PIECEのときは0であることを保証したいので乱数を入れない。
+		for (Piece pc = Piece(1); pc < PIECE_NB; ++pc)
+			for (Square sq = SQ_ZERO; sq < SQ_NB; ++sq)
+				ZobPiece[pc][sq] = rng.rand<u64>();
+
+		for (Color c : COLOR)
+			for (PieceType pr = PAWN; pr < PIECE_HAND_NB; ++pr)
+				ZobHand[c][pr] = rng.rand<u64>();
+	});
+}
+
+u64 BinaryBook::book_key(const Position& pos, bool flipped)
+{
+	init();
+
+	u64 key = 0;
+
+	// 盤面を反転させるときは、升を180度回転させて、駒の先後を入れ替える。
+	for (Square sq = SQ_ZERO; sq < SQ_NB; ++sq)
+	{
+		Piece pc = pos.piece_on(sq);
+		if (pc == NO_PIECE)
+			continue;
+		key ^= flipped ? ZobPiece[pc ^ PIECE_WHITE][Flip(sq)] : ZobPiece[pc][sq];
+	}
+
+	// 手駒は枚数分だけ加算する。(Position::key()と同じく加算型)
+	for (Color c : COLOR)
+	{
+		Hand h = pos.hand_of(flipped ? ~c : c);
+		for (PieceType pr = PAWN; pr < PIECE_HAND_NB; ++pr)
+			key += ZobHand[c][pr] * u64(hand_count(h, pr));
+	}
+
+	Color us = flipped ? ~pos.side_to_move() : pos.side_to_move();
+	if (us == WHITE)
+		key ^= ZobSide;
+
+	return key;
+}
+
+bool BinaryBook::is_binary_book(const std::string& filename)
+{
+	return StringExtension::EndsWith(filename, ".ybb");
+}
+
+Tools::Result BinaryBook::open(const std::string& filename)
+{
+	init();
+
+	if (fs.is_open())
+		fs.close();
+
+	fs.open(filename, std::ios::in | std::ios::binary);
+	if (fs.fail())
+		return Tools::Result(Tools::ResultCode::FileNotFound);
+
+	header = {};
+	fs.read(reinterpret_cast<char*>(&header), sizeof(header));
+	if (!fs
+		|| memcmp(header.magic, BinaryBookMagic, sizeof(BinaryBookMagic)) != 0
+		|| header.version != BinaryBookVersion
+		|| header.header_size != sizeof(BinaryBookHeader)
+		|| header.table_size == 0
+		|| (header.table_size & (header.table_size - 1)) != 0)
+	{
+		fs.close();
+		header = {};
+		return Tools::Result(Tools::ResultCode::FileMismatch);
+	}
+
+	return Tools::Result::Ok();
+}
+
+BookMovesPtr BinaryBook::probe(const Position& pos, bool flipped)
+{
+	if (!fs.is_open())
+		return BookMovesPtr();
+
+	const u64 key   = book_key(pos, flipped);
+	const u64 mask  = header.table_size - 1;
+	const u64 slots_offset     = sizeof(BinaryBookHeader);
+	const u64 positions_offset = slots_offset     + header.table_size     * sizeof(BinaryBookSlot);
+	const u64 moves_offset     = positions_offset + header.position_count * sizeof(BinaryBookPosition);
+
+	// 前回のreadでeofに達しているかも知れないのでclear()してからseekする。
+	auto read_at = [&](u64 offset, void* dst, size_t size) {
+		fs.clear();
+		fs.seekg(std::streamoff(offset), std::ios::beg);
+		fs.read(reinterpret_cast<char*>(dst), std::streamsize(size));
+		return bool(fs);
+	};
+
+	// 線形探査。load factorは0.5以下にしてあるので、すぐに空きslotに当たる。
+	BinaryBookSlot slot;
+	for (u64 i = key & mask; ; i = (i + 1) & mask)
+	{
+		if (!read_at(slots_offset + i * sizeof(BinaryBookSlot), &slot, sizeof(slot)) || slot.position == 0)
+			return BookMovesPtr();
+		if (slot.key == key)
+			break;
+	}
+
+	BinaryBookPosition bp;
+	if (!read_at(positions_offset + u64(slot.position - 1) * sizeof(BinaryBookPosition), &bp, sizeof(bp)))
+		return BookMovesPtr();
+
+	std::vector<BinaryBookMove> moves(bp.move_count);
+	if (bp.move_count == 0
+		|| !read_at(moves_offset + u64(bp.first_move) * sizeof(BinaryBookMove), moves.data(), moves.size() * sizeof(BinaryBookMove)))
+		return BookMovesPtr();
+
+	BookMovesPtr entry(new BookMoves());
+	for (auto& m : moves)
+		entry->push_back(BookMove(Move16(m.move), Move16(m.ponder), m.value, m.depth, m.move_count));
+	entry->sort_moves();
+	return entry;
+}
+
+} // namespace Book
+} // namespace YaneuraOu
@@ -0,0 +1,120 @@
+﻿#ifndef BINARY_BOOK_H_INCLUDED
+#define BINARY_BOOK_H_INCLUDED
+
+#include "../types.h"
+#include "../position.h"
+#include "../misc.h"
+#include "book.h"
+
+#include <fstream>
+
+namespace YaneuraOu {
+namespace Book {
+
+// ----------------------------------
+//  やねうら王バイナリ定跡(.ybb)
+// ----------------------------------
+
+/*
+	局面の64bitのhash keyをkeyとするopen addressing(線形探査)のhash tableに、
+	固定長の指し手レコードを並べた定跡ファイル。
+	テキスト形式の定跡(YANEURAOU-DB2016)のようにsfen文字列で引かないので、読み込み処理が要らず、
+	probeのたびにファイルから必要なところだけ読む。(BookFileの拡張子が".ybb"のときにこれを使う)
+
+	ファイルの変換は yaneuraou_python/tools/book_bin.py で行う。
+		python book_bin.py to_binary   user_book1.db user_book1.ybb
+		python book_bin.py to_db       user_book1.ybb user_book1.db
+
+	ファイルのレイアウト(little endian) :
+		BinaryBookHeader
+		BinaryBookSlot     [table_size]      hash table。 key & (table_size-1) の位置から線形探査。position == 0 なら空き。
+		BinaryBookPosition [position_count]  局面。sfen文字列の辞書順。
+		BinaryBookMove     [move_count]      指し手。局面ごとに採択回数→評価値の降順。
+		sfen文字列         [sfen_pool_size]  局面のsfen文字列(手数なし)。.dbに戻すときに使う。
+
+	hash keyは、Position::key()ではなく、この定跡用のZobrist key(BinaryBook::book_key())である。
+	Position::key()はUSE_PARTIAL_KEYやHASH_KEY_BITSによってエディションごとに値が変わるので、
+	どのエディションのエンジンからでも、Pythonからでも同じ値になるように、固定のseedのPRNGで別途作る。
+	手数は含まないので、IgnoreBookPly == trueのときと同じく手数違いの局面は同一視される。
+*/
+
+// ファイルの先頭に書かれている識別文字列
+static const char BinaryBookMagic[8] = { 'Y','O','B','O','O','K','B','1' };
+static const u32  BinaryBookVersion = 1;
+
+// 定跡用のZobrist keyのPRNGのseed
+static const u64  BinaryBookKeySeed = 0x5942424B;
+
+struct BinaryBookHeader {
+	char magic[8];        // BinaryBookMagic
+	u32  version;         // BinaryBookVersion
+	u32  header_size;     // sizeof(BinaryBookHeader)
+	u64  table_size;      // hash tableのslot数(2の累乗)
+	u64  position_count;  // 局面数
+	u64  move_count;      // 指し手の数
+	u64  sfen_pool_size;  // sfen文字列の領域のbyte数
+	u64  reserved[2];
+};
+
+struct BinaryBookSlot {
+	u64  key;             // 局面のbook_key()
+	u32  position;        // BinaryBookPositionのindex + 1。0なら空きslot。
+	u32  reserved;
+};
+
+struct BinaryBookPosition {
+	u64  sfen_offset;     // sfen文字列の領域の先頭からのoffset
+	u32  first_move;      // BinaryBookMoveのindex
+	u16  move_count;      // 指し手の数
+	u16  ply;             // 元の定跡ファイルでの手数
+	u32  sfen_length;     // sfen文字列の長さ
+	u32  reserved;
+};
+
+struct BinaryBookMove {
+	u16  move;            // Move16
+	u16  ponder;          // Move16
+	s32  value;
+	s32  depth;
+	u32  move_count;      // 採択回数(u32に収まらない値は飽和させてある)
+};
+
+static_assert(sizeof(BinaryBookHeader)   == 64, "");
+static_assert(sizeof(BinaryBookSlot)     == 16, "");
+static_assert(sizeof(BinaryBookPosition) == 24, "");
+static_assert(sizeof(BinaryBookMove)     == 16, "");
+
+class BinaryBook {
+public:
+	// 定跡ファイルを開く。headerを読むだけなので一瞬で終わる。
+	Tools::Result open(const std::string& filename);
+
+	// 局面posの定跡の指し手を返す。なければnullptr。
+	// flipped == trueなら盤面を先後反転した局面を探す。(指し手は反転せずにファイルに書かれているまま返す)
+	// ※　ファイルのseekを伴うので、thread safeではない。呼び出し側で排他すること。
+	BookMovesPtr probe(const Position& pos, bool flipped = false);
+
+	// 局面数
+	size_t size() const { return size_t(header.position_count); }
+
+	// 定跡用のZobrist key。flipped == trueなら盤面を先後反転した局面のkeyを返す。
+	static u64 book_key(const Position& pos, bool flipped = false);
+
+	// filenameがバイナリ定跡のファイル名(拡張子が".ybb")であるか。
+	static bool is_binary_book(const std::string& filename);
+
+private:
+	static void init();
+
+	std::ifstream fs;
+	BinaryBookHeader header = {};
+
+	static u64 ZobPiece[PIECE_NB][SQ_NB];
+	static u64 ZobHand[COLOR_NB][PIECE_HAND_NB];
+	static u64 ZobSide;
+};
+
+} // namespace Book
+} // namespace YaneuraOu
+
+#endif // #ifndef BINARY_BOOK_H_INCLUDED
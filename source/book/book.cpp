@@ -6,6 +6,7 @@
 
 #include "book.h"
 #include "apery_book.h"
+#include "binary_book.h"
 #include "../position.h"
 #include "../misc.h"
 #include "../search.h"
@@ -211,6 +212,9 @@ namespace Book
 	static std::unique_ptr<AperyBook> apery_book;
 	static const constexpr char* kAperyBookName = "book.bin";
 
+	// やねうら王バイナリ定跡(.ybb)。ファイル名の拡張子が".ybb"のときに使う。
+	static std::unique_ptr<BinaryBook> binary_book;
+
 	void MemoryBook::set_options(OptionsMap& options)
 	{
 		this->options.set_ref(options);
@@ -258,6 +262,24 @@ namespace Book
 			return Tools::Result::Ok();
 		}
 
+		if (BinaryBook::is_binary_book(pure_filename)) {
+			// やねうら王バイナリ定跡。headerを読むだけで、指し手はprobeのたびにファイルから読む。
+			// (メモリに丸読みしないので、BookOnTheFlyの設定によらない)
+			binary_book = std::unique_ptr<BinaryBook>(new BinaryBook());
+			auto result = binary_book->open(filename);
+			if (result.is_not_ok())
+			{
+				sync_cout << "info string Error! : can't read binary book file : " + filename << sync_endl;
+				binary_book.reset();
+				return result;
+			}
+
+			this->book_name = filename;
+			this->pure_book_name = pure_filename;
+			sync_cout << "info string read binary book done. number of positions = " << binary_book->size() << sync_endl;
+			return Tools::Result::Ok();
+		}
+
 		if (pure_filename == kAperyBookName) {
 			// Apery定跡データベースを読み込む
 			//	apery_book = std::make_unique<AperyBook>(kAperyBookName);
@@ -740,6 +762,21 @@ namespace Book
 
 			return 	pml_entry;
 		}
+		else if (binary_book && BinaryBook::is_binary_book(pure_book_name)) {
+
+			// やねうら王バイナリ定跡を用いて指し手を選択する
+			auto entry = binary_book->probe(pos);
+
+			// FlippedBookが有効なら、反転させた局面にhitするか調べる。
+			if (entry == nullptr && options["FlippedBook"])
+			{
+				entry = binary_book->probe(pos, true);
+				// 指し手をflipさせる
+				if (entry != nullptr)
+					entry = make_flipped_bookmoves(entry);
+			}
+			return entry;
+		}
 		else {
 			// やねうら王定跡データベースを用いて指し手を選択する
 
@@ -1023,10 +1060,11 @@ namespace Book
 		//  user_book2.db    ユーザー定跡2
 		//  user_book3.db    ユーザー定跡3
 		//  book.bin         Apery型の定跡DB
+		//  user_book1.ybb   やねうら王バイナリ定跡(user_book1.dbを yaneuraou_python/tools/book_bin.py で変換したもの)
 
 		std::vector<std::string> book_list = { "no_book" , "standard_book.db"
 			, "yaneura_book1.db" , "yaneura_book2.db" , "yaneura_book3.db", "yaneura_book4.db"
-			, "user_book1.db", "user_book2.db", "user_book3.db", "book.bin" };
+			, "user_book1.db", "user_book2.db", "user_book3.db", "book.bin", "user_book1.ybb" };
 
 #if !defined(__EMSCRIPTEN__)
 		options.add("BookFile", Option(book_list, book_list[1]));
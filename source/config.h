@@ -161,7 +161,7 @@
 
 // 評価関数パラメーターを共有メモリを用いて他プロセスのものと共有する。
 // 少ないメモリのマシンで思考エンジンを何十個も立ち上げようとしたときにメモリ不足になるので
-// 評価関数をshared memoryを用いて他のプロセスと共有する機能。(対応しているのはいまのところKPPT評価関数のみ。かつWindows限定)
+// 評価関数をshared memoryを用いて他のプロセスと共有する機能。(KPPT/KPP_KKPT評価関数はWindows限定。NNUEはshm.hを用いるのでLinuxでも有効)
 // #define USE_SHARED_MEMORY_IN_EVAL
 
 
@@ -406,6 +406,12 @@ constexpr int MAX_PLY_NUM = 246;
 		#define USE_SHARED_MEMORY_IN_EVAL
 	#endif
 
+	#if defined(YANEURAOU_ENGINE_NNUE) && !defined(EVAL_LEARN) && !defined(__EMSCRIPTEN__)
+		// NNUEはshm.hのSystemWideSharedConstantを用いて共有する。(Windows/Linux/macOS)
+		// 学習時はパラメーターを書き換えるので共有しない。
+		#define USE_SHARED_MEMORY_IN_EVAL
+	#endif
+
 	#if defined(YANEURAOU_ENGINE_KPPT) || defined(YANEURAOU_ENGINE_KPP_KKPT) || defined(YANEURAOU_ENGINE_NNUE)
 		#define USE_DIFF_EVAL
 	#endif
@@ -1,213 +1,186 @@
 # NNUE architecture header generator
 #
 #  NNUE評価関数のarchitecture headerを動的に生成するPythonで書かれたスクリプト。
-# 
+#
+#  他のスクリプトからimportして、parse_arch()でアーキテクチャ名を解釈したり、
+#  generate_header()でheaderの中身を得たりすることもできる。
+#  (yaneuraou_python/tools/nnue_file.py が nn.bin の検証に用いている。)
+#
+#  使い方
+#    1つだけ生成する。(Makefileから呼び出される)
+#      python nnue_arch_gen.py halfkp_1024x2-8-64 eval/nnue/architectures
+#
+#    まとめて生成する。{a,b,c} は列挙、{256..1536..256} は範囲(最後の..256は刻み。省略すると1)。
+#      python nnue_arch_gen.py --batch "halfkp_{256..1024..256}x2-{8,16,32}-32" "SFNNwoPSQT_halfkahm_1536-{15,31}-32"
+#                              --out_dir eval/nnue/architectures --manifest ../obj/arch_manifest.json
+#      python nnue_arch_gen.py --list archs.txt --out_dir eval/nnue/architectures --manifest ../obj/arch_manifest.json
+#
+#  headerは中身のhash値が変わったときだけ書き換える。(書き換えるとNNUEのソースがすべて再コンパイルされるため)
+#  --manifest で指定したファイルには、各アーキテクチャを並列にビルドするための情報をJSONで書き出す。
+#
 
 import argparse
+import hashlib
+import json
 import os
+import re
+from collections import namedtuple
 
 def dedent4(text: str) -> str:
     # 各行の先頭4文字（スペース4つ）を削除して結合し直す
     # 行が4文字未満、あるいはスペースでない場合を考慮して lstrip でも可
-    return "\n".join(line[4:] if line.startswith("    ") else line 
+    return "\n".join(line[4:] if line.startswith("    ") else line
                         for line in text.strip("\n").splitlines())
 
 
-print("NNUE architecture header generator by yaneurao V1.02 , 2026/01/31")
-
-parser = argparse.ArgumentParser(description="NNUEのarchitecture headerを生成する。")
-parser.add_argument('arch', type=str, nargs='?', default="halfkp_256x2-32-32", help="architectureを指定する。例) halfkp_1024x2-8-64, YANEURAOU_ENGINE_NNUE_HALFKP_1024X2_16_32とか")
-parser.add_argument('out_dir', type=str, nargs='?', default="", help="出力先のフォルダを指定する。例) /source/eval/nnue/architectures/")
-
-args = parser.parse_args()
-
-arch    : str = args.arch
-out_dir : str = args.out_dir
-
-# SFNNで末尾のls9が省略されているっぽいので足しておく。
-if arch.startswith("SFNN") and not "ls" in arch.lower():
-    arch += "_ls9"
+# parse_arch()の結果。
+#   name         : 出力ファイル名(拡張子なし)。例) "halfkp_256x2-32-32" , "SFNNwoPSQT_halfkahm_1536-15-32-ls9"
+#   arch         : 大文字化して'-'を'_'に置換したアーキテクチャ名。例) "HALFKP_256X2_32_32"
+#   sfnn         : SFNNwoPSQT型か。
+#   feature      : 入力特徴量。例) "halfkp"
+#   transformed  : 変換後の入力特徴量の次元数(片側)。例) 256
+#   slices       : 変換後の入力特徴量を何視点分連結するか。SFNNなら1。例) 256x2 なら 2
+#   hidden1      : 隠れ層1の次元数
+#   hidden2      : 隠れ層2の次元数
+#   ls           : SFNNのlayer stack数。SFNNでなければNone。
+ArchSpec = namedtuple("ArchSpec", "name arch sfnn feature transformed slices hidden1 hidden2 ls")
+
+# 現在サポートしている入力特徴量。
+#   入力特徴量名 → (includeするheader , RawFeaturesの定義)
+FEATURES = {
+    "halfkp"    : (["half_kp.h"]     , "Features::HalfKP<Features::Side::kFriend>"),
+    "kp"        : (["k.h", "p.h"]    , None),
+    "halfkpe9"  : (["half_kpe9.h"]   , "Features::HalfKPE9<Features::Side::kFriend>"),
+    "halfkpvm"  : (["half_kp_vm.h"]  , "Features::HalfKP_vm<Features::Side::kFriend>"),
+    "halfka1"   : (["half_ka1.h"]    , "Features::HalfKA1<Features::Side::kFriend>"),
+    "halfkahm1" : (["half_ka_hm1.h"] , "Features::HalfKA_hm1<Features::Side::kFriend>"),
+    "halfka2"   : (["half_ka2.h"]    , "Features::HalfKA2<Features::Side::kFriend>"),
+    "halfkahm2" : (["half_ka_hm2.h"] , "Features::HalfKA_hm2<Features::Side::kFriend>"),
+    # sfnnwop-1536.h が用いている入力特徴量。
+    "halfkahm"  : (["half_ka_hm.h"]  , "Features::HalfKA_hm<Features::Side::kFriend>"),
+}
+
+
+def parse_arch(arch: str) -> ArchSpec:
+    """
+    アーキテクチャ名を解釈してArchSpecを返す。
+    解釈できなければValueErrorを投げる。
 
-# makefileで指定したエディション名そのままかも知れないので削除
-arch   = arch.replace("YANEURAOU_ENGINE_NNUE_","")
+    例) halfkp_1024x2-8-64, YANEURAOU_ENGINE_NNUE_HALFKP_1024X2_16_32, SFNNwoPSQT_halfkahm_1536-15-32-ls9
+    """
 
-# 出力ファイル名
-filename = arch + ".h"
+    # SFNNで末尾のls9が省略されているっぽいので足しておく。
+    if arch.startswith("SFNN") and not "ls" in arch.lower():
+        arch += "_ls9"
+
+    # makefileで指定したエディション名そのままかも知れないので削除
+    arch = arch.replace("YANEURAOU_ENGINE_NNUE_","")
+
+    name = arch
+
+    # 大文字化して、'-'を'_'に置換したアーキテクチャ名
+    arch   = arch.replace('-','_')
+    arch   = arch.upper()
+
+    arches = arch.split('_')
+    if len(arches) <= 3 :
+        # アーキテクチャ名は、アンダースコアは3つ以上ないと駄目。
+        raise ValueError("architecture name must be like halfkp_256x2-32-32 or kp_256x2-32-32 halfkpvm_256x2_32_32")
+
+    # 📝 SFNNwoPSQT_halfkahm_1536-15-32-ls9のように指定されていれば、SFNNのheaderを生成する。
+    SFNN = False
+    if arches[0].startswith("SFNN"):
+        SFNN = True
+        if len(arches) <= 5 or not arches[5].startswith("LS"):
+            # 最後、"LS9"のような文字でないとおかしい。あるいは省略されているか。
+            raise ValueError("SFNNwoPSQT architecture name must be like SFNNwoPSQT_halfkahm_1536-15-32-ls9 or SFNNwoPSQT_halfkahm_1536-15-32")
+        else:
+            # 先頭の"LS"を削除。
+            arches[5] = arches[5][2:]
+
+        # 先頭の"SFNNWOPSQT"削除
+        arches.pop(0)
+
+    # アーキテクチャ名のアンダースコアでsplitした1つ目は入力特徴量。
+    input_feature = arches[0].lower()
+    if input_feature not in FEATURES:
+        # 知らない入力特徴量だった。
+        raise ValueError(f"input feature {input_feature} is not supported.")
+
+    # レイヤ情報
+    # 例えば、"256x2_32_32" ならば ["256x2","32","32"]のように分解される。
+    #   (SFNNで) "1536-15-32-ls9" なら ["1536","15","32","9"]のように分解される。
+    layers = arches[1:]
+    layers[0] = layers[0].lower()
+
+    if SFNN:
+        if len(layers) != 4:
+            raise ValueError(f"layers must be like 1536-15-32-ls9 , layers = {layers}.")
+        # SFNNは変換後の入力特徴量を1つにまとめてfc_0に入力する。
+        dims = [layers[0], "1", layers[1], layers[2], layers[3]]
+    else:
+        if len(layers) != 3 or len(layers[0].split('x')) != 2:
+            raise ValueError(f"layers must be like 256x2-32-32 , layers = {layers}.")
+        first_layer = layers[0].split('x')
+        dims = [first_layer[0], first_layer[1], layers[1], layers[2]]
 
-# 出力file path
-out_path = os.path.join(out_dir, filename)
+    if not all(d.isdigit() for d in dims):
+        raise ValueError(f"layer size must be a number , layers = {layers}.")
+    dims = [int(d) for d in dims]
 
-print(f"output file path  : {out_path}")
+    return ArchSpec(name, arch, SFNN, input_feature, *dims[:4], dims[4] if SFNN else None)
 
-# 大文字化して、'-'を'_'に置換したアーキテクチャ名
-arch   = arch.replace('-','_')
-arch   = arch.upper()
 
-print(f"architecture name : {arch}")
+def generate_header(spec: ArchSpec) -> str:
+    """ parse_arch()の結果から、architecture headerの中身を生成して返す。"""
 
-# if os.path.exists(out_path):
-#     print("Warning : file already exists. stop.")
-#     exit()
-#  🤔 ファイルがすでに存在していても上書きしたほうがいいと思う。
+    arch = spec.arch
+    SFNN = spec.sfnn
 
-arches = arch.split('_')
-if len(arches) <= 3 :
-    # アーキテクチャ名は、アンダースコアは3つ以上ないと駄目。
-    print("Error! : architecture name must be like halfkp_256x2-32-32 or kp_256x2-32-32 halfkpvm_256x2_32_32")
-    exit()
+    # ============================================================
+    #                        includes
+    # ============================================================
 
-# 📝 SFNNwoPSQT_halfkahm_1536-15-32-ls9のように指定されていれば、SFNNのheaderを生成する。
-SFNN = False
-if arches[0].startswith("SFNN"):
-    SFNN = True
-    if len(arches) <= 5 or not arches[5].startswith("LS"):
-        # 最後、"LS9"のような文字でないとおかしい。あるいは省略されているか。
-        print("Error! : SFNNwoPSQT architecture name must be like SFNNwoPSQT_halfkahm_1536-15-32-ls9 or SFNNwoPSQT_halfkahm_1536-15-32")
-        exit()
-    else:
-        # 先頭の"LS"を削除。
-        arches[5] = arches[5][2:]
-    
-    # 先頭の"SFNNWOPSQT"削除
-    arches.pop(0)
-
-# ============================================================
-#                        includes
-# ============================================================
-
-if SFNN:
-    header = f"""
+    if SFNN:
+        header = f"""
     // SFNN without PSQT 1536 architecture
 
     #ifndef CLASSIC_NNUE_SFNNWOP_{arch}_H_INCLUDED
     #define CLASSIC_NNUE_SFNNWOP_{arch}_H_INCLUDED
     """
-else:
-    header = f"""
+    else:
+        header = f"""
     // Definition of input features and network structure used in NNUE evaluation function
     // NNUE評価関数で用いる入力特徴量とネットワーク構造の定義
     #ifndef NNUE_{arch}_H_INCLUDED
     #define NNUE_{arch}_H_INCLUDED
     """
 
-# ============================================================
-#                     input features
-# ============================================================
-
-# アーキテクチャ名のアンダースコアでsplitした1つ目は入力特徴量。
-# 現在サポートしている入力特徴量は、
-#   halfkp
-#   kp
-#   halfkpe9
-#   halfkpvm
-#   halfka1
-#   halfkahm1
-#   halfka2
-#   halfkahm2
+    # ============================================================
+    #                     input features
+    # ============================================================
 
-input_feature = arches[0].lower()
-
-print(f"input feature     : {input_feature}")
-
-header += f"""
+    header += f"""
     #include "../features/feature_set.h"
     """
 
-if input_feature == "halfkp":
-
-    header += f"""
-    #include "../features/half_kp.h"
-    """
+    includes, feature_class = FEATURES[spec.feature]
 
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKP<Features::Side::kFriend>>;
-    """
+    header += "\n" + "".join(f'    #include "../features/{h}"\n' for h in includes) + "    "
 
-elif input_feature == "kp":
-
-    header += f"""
-    #include "../features/k.h"
-    #include "../features/p.h"
-    """
-    
-    raw_features = f"""
+    if feature_class is None:
+        # kp型は K と P の2つの特徴量を組み合わせる。
+        raw_features = f"""
         using RawFeatures = Features::FeatureSet<Features::K, Features::P>;
     """
-
-elif input_feature == "halfkpe9":
-
-    header += f"""
-    #include "../features/half_kpe9.h"
-    """
-
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKPE9<Features::Side::kFriend>>;
-    """
-
-elif input_feature == "halfkpvm":
-
-    header += f"""
-    #include "../features/half_kp_vm.h"
-    """
-
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKP_vm<Features::Side::kFriend>>;
-    """
-
-elif input_feature == "halfka1":
-
-    header += f"""
-    #include "../features/half_ka1.h"
-    """
-
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKA1<Features::Side::kFriend>>;
-    """
-
-elif input_feature == "halfkahm1":
-
-    header += f"""
-    #include "../features/half_ka_hm1.h"
-    """
-
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKA_hm1<Features::Side::kFriend>>;
-    """
-
-elif input_feature == "halfka2":
-
-    header += f"""
-    #include "../features/half_ka2.h"
-    """
-
-    raw_features = f"""
-        using RawFeatures = Features::FeatureSet<
-            Features::HalfKA2<Features::Side::kFriend>>;
-    """
-
-elif input_feature == "halfkahm2":
-
-    header += f"""
-    #include "../features/half_ka_hm2.h"
-    """
-
-    raw_features = f"""
+    else:
+        raw_features = f"""
         using RawFeatures = Features::FeatureSet<
-            Features::HalfKA_hm2<Features::Side::kFriend>>;
+            {feature_class}>;
     """
 
-else:
-    # 知らない入力特徴量だった。
-    print(f"Error : input feature {input_feature} is not supported.")
-    exit()
-
-if SFNN:
-    header += """
+    if SFNN:
+        header += """
     #include <cstring>
 
     #include "../layers/affine_transform_explicit.h"
@@ -222,9 +195,9 @@ if SFNN:
     // 評価関数で用いる入力特徴量
     """
 
-else:    
+    else:
 
-    header += """
+        header += """
     #include "../layers/input_slice.h"
     #include "../layers/affine_transform.h"
     #include "../layers/affine_transform_sparse_input.h"
@@ -237,71 +210,51 @@ else:
     // 評価関数で用いる入力特徴量
     """
 
-header += raw_features
+    header += raw_features
 
-# ============================================================
-#                     hidden layers
-# ============================================================
+    # ============================================================
+    #                     hidden layers
+    # ============================================================
 
-# レイヤ情報
-# 例えば、"256x2_32_32" ならば ["256x2","32","32"]のように分解される。
-#   (SFNNで) "1536-15-32-ls9" なら ["1536","15","32","9"]のように分解される。
-layers = arches[1:]
-layers[0] = layers[0].lower()
-
-if SFNN:
-    if len(layers) != 4:
-        print(f"Error : layers must be like 1536-15-32-ls9 , layers = {layers}.")
-        exit()
-
-    print(f"layers feature    : {layers}")
-
-    header += f"""
+    if SFNN:
+        header += f"""
 
         // Number of input feature dimensions after conversion
         // 変換後の入力特徴量の次元数
-        constexpr IndexType kTransformedFeatureDimensions = {layers[0]};
+        constexpr IndexType kTransformedFeatureDimensions = {spec.transformed};
 
         // 各層の次元数
         constexpr IndexType kInputDims   = kTransformedFeatureDimensions;
-        constexpr IndexType kHidden1Dims = {layers[1]};
-        constexpr IndexType kHidden2Dims = {layers[2]};                              
+        constexpr IndexType kHidden1Dims = {spec.hidden1};
+        constexpr IndexType kHidden2Dims = {spec.hidden2};
     """
 
-else:
-
-    if len(layers) != 3 or len(layers[0].split('x')) != 2:
-        print(f"Error : layers must be like 256x2-32-32 , layers = {layers}.")
-        exit()
-
-    first_layer = layers[0].split('x')
-
-    print(f"layers feature    : {layers}")
+    else:
 
-    header += f"""
+        header += f"""
         // Number of input feature dimensions after conversion
         // 変換後の入力特徴量の次元数
-        constexpr IndexType kTransformedFeatureDimensions = {first_layer[0]};
+        constexpr IndexType kTransformedFeatureDimensions = {spec.transformed};
 
         namespace Layers {{
 
             // Define network structure
             // ネットワーク構造の定義
-            using InputLayer = InputSlice<kTransformedFeatureDimensions * {first_layer[1]}>;
-            using HiddenLayer1 = ClippedReLU<AffineTransformSparseInput<InputLayer, {layers[1]}>>;
-            using HiddenLayer2 = ClippedReLU<AffineTransform<HiddenLayer1, {layers[2]}>>;
+            using InputLayer = InputSlice<kTransformedFeatureDimensions * {spec.slices}>;
+            using HiddenLayer1 = ClippedReLU<AffineTransformSparseInput<InputLayer, {spec.hidden1}>>;
+            using HiddenLayer2 = ClippedReLU<AffineTransform<HiddenLayer1, {spec.hidden2}>>;
             using OutputLayer = AffineTransform<HiddenLayer2, 1>;
 
         }}  // namespace Layers
     """
 
-# ============================================================
-#                     output layer
-# ============================================================
+    # ============================================================
+    #                     output layer
+    # ============================================================
 
-if SFNN:
-    # `sfnnwop-1536.h`からそのままコピペ。
-    header += f"""
+    if SFNN:
+        # `sfnnwop-1536.h`からそのままコピペ。
+        header += f"""
         struct Network {{
 
             // Define network structure
@@ -312,7 +265,7 @@ if SFNN:
 
             Layers::AffineTransformExplicit<kHidden1Dims * 2, kHidden2Dims> fc_1;
             Layers::ClippedReLUExplicit<kHidden2Dims> ac_1;
-            
+
         Layers::AffineTransformExplicit<kHidden2Dims, 1> fc_2;
 
             using OutputType = std::int32_t;
@@ -324,7 +277,7 @@ if SFNN:
             }}
 
             static std::string GetStructureString() {{
-                return "{'SFNN-1536' if arch == 'SFNNWOPSQT_HALFKAHM_1536_15_32_LS9' else arch}";
+                return "{structure_string(spec)}";
             }}
 
             Tools::Result ReadParameters(std::istream& stream) {{
@@ -382,10 +335,8 @@ if SFNN:
     #endif // CLASSIC_NNUE_{arch}_H_INCLUDED
     """
 
-    # 💡 GetStructureString()で異なる文字列を返すと別のアーキテクチャとみなされてしまう。
-
-else:
-    header += f"""
+    else:
+        header += f"""
         using Network = Layers::OutputLayer;
 
     }} // namespace Eval::NNUE
@@ -394,7 +345,199 @@ else:
     #endif // #ifndef NNUE_{arch}_H_INCLUDED
     """
 
-with open(out_path, "w", encoding = 'utf-8') as f:
-    f.write(dedent4(header))
+    return dedent4(header)
+
+
+def edition_name(spec: ArchSpec) -> str:
+    """
+    Makefileで YANEURAOU_EDITION=YANEURAOU_ENGINE_NNUE_{これ} と指定してビルドできる名前。
+    Makefileはこの名前の.hをincludeするので、まとめて生成するときはheaderのファイル名もこれにする。
+
+    例) halfkp_256x2-8-32 → HALFKP_256X2_8_32 , SFNNwoPSQT_halfkahm_1536-15-32-ls9 → SFNNwoPSQT_HALFKAHM_1536_15_32_LS9
+    💡 SFNNはMakefileが"SFNNwoPSQT"を大文字・小文字を区別して探すので、そこだけ元の表記にする。
+    """
+    return "SFNNwoPSQT_" + spec.arch.split('_', 1)[1] if spec.sfnn else spec.arch
+
+
+def expand_arch(pattern: str) -> list:
+    """
+    アーキテクチャ名の{}を展開する。
+    {256,512} は列挙、{256..1024} , {256..1024..256} は範囲(両端を含む)。{}が複数あれば、すべての組み合わせを返す。
+
+    例) halfkp_{256..512..256}x2-{8,32}-32 → halfkp_256x2-8-32 , halfkp_256x2-32-32 , halfkp_512x2-8-32 , halfkp_512x2-32-32
+    """
+    m = re.search(r"\{([^{}]*)\}", pattern)
+    if m is None:
+        return [pattern]
+
+    r = re.fullmatch(r"(\d+)\.\.(\d+)(?:\.\.(\d+))?", m.group(1))
+    if r:
+        start, stop, step = int(r[1]), int(r[2]), int(r[3] or 1)
+        if step == 0:
+            raise ValueError(f"range step must not be 0 : {pattern}")
+        values = range(start, stop + 1, step) if start <= stop else range(start, stop - 1, -step)
+    else:
+        values = m.group(1).split(',')
+
+    return [arch for v in values for arch in expand_arch(pattern[:m.start()] + str(v) + pattern[m.end():])]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """
+    ファイルの中身のhash値が変わるときだけ書き出す。書き出したらTrueを返す。
+    中身が同じなのに書き換えると、更新日時が変わってNNUEのソースがすべて再コンパイルされてしまう。
+    書き出し先のフォルダがなければ作る。
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    if os.path.exists(path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            if content_hash(f.read()) == content_hash(text):
+                return False
+
+    # 並列ビルド中に読みかけのheaderが見えないように、一時ファイルに書いてから置き換える。
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def layers_string(spec: ArchSpec) -> str:
+    """ 例) 256x2-32-32 , 1536-15-32-ls9 """
+    if spec.sfnn:
+        return f"{spec.transformed}-{spec.hidden1}-{spec.hidden2}-ls{spec.ls}"
+    return f"{spec.transformed}x{spec.slices}-{spec.hidden1}-{spec.hidden2}"
+
+
+def generate_batch(patterns: list, out_dir: str, manifest_path: str = "") -> list:
+    """
+    patternsの各アーキテクチャ名を展開して、まとめてheaderを生成する。
+    各アーキテクチャについて (ArchSpec , header path , 書き出したか) のlistを返す。
+    アーキテクチャ名が1つでも解釈できなければ、何も書き出さずにValueErrorを投げる。
+
+    manifest_pathを指定すると、ビルド用の情報をJSONで書き出す。(これも中身が変わったときだけ)
+        variants[i].edition   : MakefileのYANEURAOU_EDITIONに指定する名前
+        variants[i].make_args : makeに渡す引数。OBJDIRと実行ファイルの出力先(TARGETDIR)をアーキテクチャごとに
+                                分けているので、並列にmakeできる。(実行ファイルは ../build/{name}/ にできる)
+        variants[i].sha256    : headerの中身のhash値
+    """
+
+    specs = {}
+    for pattern in patterns:
+        for arch in expand_arch(pattern):
+            spec = parse_arch(arch)
+            # 同じアーキテクチャを別の表記で指定していたら1つにまとめる。
+            specs.setdefault(edition_name(spec), spec)
+
+    results = []
+    variants = []
+    for name, spec in specs.items():
+        header = generate_header(spec)
+        out_path = os.path.join(out_dir, name + ".h")
+        results.append((spec, out_path, write_if_changed(out_path, header)))
+
+        edition = "YANEURAOU_ENGINE_NNUE_" + name
+        variants.append({
+            "name"      : name,
+            "edition"   : edition,
+            "header"    : out_path,
+            "sha256"    : content_hash(header),
+            "sfnn"      : spec.sfnn,
+            "feature"   : spec.feature,
+            "layers"    : layers_string(spec),
+            "make_args" : [f"YANEURAOU_EDITION={edition}", f"OBJDIR=../obj/{name}", f"TARGETDIR=../build/{name}"],
+        })
+
+    if manifest_path:
+        manifest = {"generator": "nnue_arch_gen.py", "out_dir": out_dir, "variants": variants}
+        write_if_changed(manifest_path, json.dumps(manifest, indent=2) + "\n")
+
+    return results
+
+
+def structure_string(spec: ArchSpec) -> str:
+    """
+    SFNNのNetwork::GetStructureString()が返す文字列。
+    💡 GetStructureString()で異なる文字列を返すと別のアーキテクチャとみなされてしまう。
+    """
+    return 'SFNN-1536' if spec.arch == 'SFNNWOPSQT_HALFKAHM_1536_15_32_LS9' else spec.arch
+
+
+def main():
+
+    print("NNUE architecture header generator by yaneurao V1.03 , 2026/10/19")
+
+    parser = argparse.ArgumentParser(description="NNUEのarchitecture headerを生成する。")
+    parser.add_argument('arch', type=str, nargs='?', default=None, help="architectureを指定する。例) halfkp_1024x2-8-64, YANEURAOU_ENGINE_NNUE_HALFKP_1024X2_16_32とか")
+    parser.add_argument('out_dir', type=str, nargs='?', default=None, help="出力先のフォルダを指定する。例) /source/eval/nnue/architectures/")
+    parser.add_argument('--batch', type=str, nargs='+', default=[], help="まとめて生成するarchitecture。{a,b}や{256..1536..256}で列挙できる。例) \"halfkp_{256..1024..256}x2-{8,16,32}-32\"")
+    parser.add_argument('--list', type=str, default="", help="まとめて生成するarchitectureを1行に1つ書いたファイル。(#以降はコメント)")
+    parser.add_argument('--out_dir', type=str, dest='batch_out_dir', default=None, help="まとめて生成するときの出力先のフォルダ。")
+    parser.add_argument('--manifest', type=str, default="", help="まとめて生成したarchitectureのビルド用の情報をJSONで書き出すファイル。")
+
+    args = parser.parse_args()
+
+    if args.batch or args.list:
+        # まとめて生成するときの出力先は--out_dirで指定する。位置引数で書いたものを黙って無視しないようにエラーにする。
+        # (--batchは後ろの引数をすべて取るので、--batchの後ろに書いたフォルダはアーキテクチャとして渡ってくる)
+        misplaced = [a for a in (args.arch, args.out_dir) if a is not None]
+        misplaced += [p for p in args.batch if p.endswith(('/', '\\')) or os.path.isdir(p)]
+        if misplaced:
+            print(f"Error! : {' '.join(misplaced)} : positional arch/out_dir cannot be used with --batch/--list. Use --out_dir to specify the output folder.")
+            exit(1)
+
+        patterns = list(args.batch)
+        if args.list:
+            with open(args.list, encoding='utf-8') as f:
+                patterns += [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+
+        out_dir = args.batch_out_dir if args.batch_out_dir is not None else ""
+        try:
+            results = generate_batch(patterns, out_dir, args.manifest)
+        except ValueError as e:
+            print(f"Error! : {e}")
+            exit(1)
+
+        for spec, out_path, written in results:
+            print(f"{'written  ' if written else 'unchanged'} : {out_path}")
+        written = sum(1 for _, _, w in results if w)
+        print(f"..done! {len(results)} architectures , {written} written , {len(results) - written} unchanged")
+        if args.manifest:
+            print(f"manifest : {args.manifest}")
+        return
+
+    try:
+        spec = parse_arch(args.arch if args.arch is not None else "halfkp_256x2-32-32")
+    except ValueError as e:
+        print(f"Error! : {e}")
+        exit()
+
+    # 出力file path
+    out_path = os.path.join(args.out_dir or "", spec.name + ".h")
+
+    print(f"output file path  : {out_path}")
+    print(f"architecture name : {spec.arch}")
+    print(f"input feature     : {spec.feature}")
+    print(f"layers feature    : {layers_string(spec)}")
+
+    # if os.path.exists(out_path):
+    #     print("Warning : file already exists. stop.")
+    #     exit()
+    #  🤔 ファイルがすでに存在していても上書きしたほうがいいと思う。
+    #  → 中身が同じときは書き換えない。(更新日時が変わると再コンパイルが走るので)
+
+    header = generate_header(spec)
+
+    if write_if_changed(out_path, header):
+        print("..done!")
+    else:
+        print("..unchanged. (same content)")
+
 
-print("..done!")
+if __name__ == "__main__":
+    main()
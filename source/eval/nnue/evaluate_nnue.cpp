@@ -23,9 +23,26 @@
 
 #include "evaluate_nnue.h"
 
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+#include <filesystem>
+#include "../../shm.h"
+#endif
+
 namespace YaneuraOu::Eval::NNUE {
 extern int FV_SCALE;
 }
+
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+namespace YaneuraOu::Eval::NNUE {
+
+	// EvalShareのときにshared memoryに置く評価関数パラメーター一式。
+	// 📝 SystemWideSharedConstantに置くものは、trivially copyableでなければならない。
+	struct SharedNetworks {
+		FeatureTransformer feature_transformer;
+		Network            network;
+	};
+}
+#endif
  
 // ============================================================
 //              旧評価関数のためのヘルパー
@@ -91,6 +108,12 @@ void add_options_(OptionsMap& options, ThreadPool& threads) {
                     YaneuraOu::Eval::NNUE::FV_SCALE = int(o);
                     return std::nullopt;
                 }));
+
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+    // 評価関数パラメーターをshared memoryに置いて、他のプロセスと共有するか。
+    // 並列対局で同じ評価関数のエンジンを何十個も起動するときのメモリを節約する。
+    Options.add("EvalShare", Option(true));
+#endif
 }
 #endif
 
@@ -163,6 +186,17 @@ namespace NNUE {
     // 評価関数
     AlignedPtr<Network> network;
 
+	// 評価時に参照する入力特徴量変換器と評価関数。
+	// 通常はfeature_transformer/networkを指しているが、EvalShareのときはshared memory上のものを指す。
+	const FeatureTransformer* active_feature_transformer = nullptr;
+	const Network*            active_network             = nullptr;
+
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+	// shared memory上の評価関数パラメーター
+	// (shared memoryが確保できなかったときは、SystemWideSharedConstantの中でlocalに確保したもの)
+	SystemWideSharedConstant<SharedNetworks> shared_networks;
+#endif
+
     // 評価関数ファイル名
     const char* const kFileName = EvalFileDefaultName;
 
@@ -212,6 +246,18 @@ namespace {
 				return pointer->ReadParameters(stream);
 			}
 
+			// 評価関数パラメータを読み込む(読み込み先を直接渡す版)
+			template <typename T>
+			Tools::Result ReadParameters(std::istream& stream, T& object) {
+				std::uint32_t header;
+				stream.read(reinterpret_cast<char*>(&header), sizeof(header));
+				if (!stream)                     return Tools::ResultCode::FileReadError;
+				// 🤔 hash値、古い評価関数ファイルに対して一致するとは限らないので、警告に変更する。
+				if (header != T::GetHashValue())
+                    sync_cout << "info string Warning : nn.bin hash mismatch." << sync_endl;
+				return object.ReadParameters(stream);
+			}
+
 			// 評価関数パラメータを書き込む
             template <typename T>
             bool WriteParameters(std::ostream& stream, const AlignedPtr<T>& pointer) {
@@ -234,6 +280,14 @@ namespace {
 		void Initialize() {
 			Detail::Initialize<FeatureTransformer>(feature_transformer);
 			Detail::Initialize<Network>(network);
+
+			active_feature_transformer = feature_transformer.get();
+			active_network             = network.get();
+
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+			// EvalShareで読み込んでいたものは、もう参照しないので解放する。
+			shared_networks = SystemWideSharedConstant<SharedNetworks>();
+#endif
 		}
 	
 		}  // namespace
@@ -268,8 +322,8 @@ namespace {
         return !stream.fail();
     }
 
-    	// 評価関数パラメータを読み込む
-    	Tools::Result ReadParameters(std::istream& stream) {
+    	// 評価関数パラメータをft, netに読み込む
+    	Tools::Result ReadParameters(std::istream& stream, FeatureTransformer& ft, Network& net) {
     		std::uint32_t hash_value;
     		std::string architecture;
     		Tools::Result result = ReadHeader(stream, &hash_value, &architecture, nullptr);
@@ -283,7 +337,7 @@ namespace {
     			return Tools::ResultCode::FileMismatch;
     		}
     
-    		result = Detail::ReadParameters<FeatureTransformer>(stream, feature_transformer);
+    		result = Detail::ReadParameters<FeatureTransformer>(stream, ft);
     		if (result.is_not_ok()) {
     			sync_cout << "info string NNUE feature params read failed: " << result.to_string() << sync_endl;
     			return result;
@@ -293,11 +347,11 @@ namespace {
 			std::uint32_t fc_hash;
 			stream.read(reinterpret_cast<char*>(&fc_hash), sizeof(fc_hash));
 
-			if (!network->fc_0.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
+			if (!net.fc_0.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
 			
 			// L2, Output層 (共通) の読み込み
-			if (!network->fc_1.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
-			if (!network->fc_2.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
+			if (!net.fc_1.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
+			if (!net.fc_2.ReadParameters(stream).is_ok()) return Tools::ResultCode::FileReadError;
 
     		if (stream && stream.peek() == std::ios::traits_type::eof())
     			return Tools::ResultCode::Ok;
@@ -305,6 +359,11 @@ namespace {
     			return Tools::ResultCode::FileCloseError;
     	}
 
+    	// 評価関数パラメータを読み込む
+    	Tools::Result ReadParameters(std::istream& stream) {
+    		return ReadParameters(stream, *feature_transformer, *network);
+    	}
+
     // 評価関数パラメータを書き込む
     bool WriteParameters(std::ostream& stream) {
         if (!WriteHeader(stream, kHashValue, GetArchitectureString())) return false;
@@ -322,9 +381,74 @@ namespace {
         return !stream.fail();
     }
 
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+	// 評価関数パラメーターをshared memoryに読み込む。
+	// keyはshared memoryの名前になる値で、評価関数ファイルのpath、size、更新日時などから作る。
+	// 同じ実行ファイルで同じkeyの領域がすでにあれば(他のプロセスが先に読み込んでいれば)、
+	// ファイルは読まずにそれをmapするだけで済む。
+	// read(std::istream& → Tools::Result)は、評価関数ファイルを開いてstreamを渡すもの。
+	// 📝 feature_transformer/networkは確保しない。(private copyを持たない)
+	template <typename Read>
+	Tools::Result ReadSharedParameters(std::size_t key, Read read) {
+		// 以前に読み込んだもの(EvalDirを変更した場合など)は先に解放しておく。
+		feature_transformer.reset();
+		network.reset();
+		shared_networks = SystemWideSharedConstant<SharedNetworks>();
+
+		Tools::Result result = Tools::ResultCode::Ok;
+		bool          read_file = false;
+
+		// この関数は、shared memoryを新たに作ったプロセスでだけ呼び出される。
+		// 他のプロセスはその間、待たされる。
+		auto init = [&](SharedNetworks* networks) {
+			read_file = true;
+			result    = read([&](std::istream& stream) {
+				return ReadParameters(stream, networks->feature_transformer, networks->network);
+			});
+			return result.is_ok();
+		};
+		shared_networks = SystemWideSharedConstant<SharedNetworks>::with_key(key, init);
+
+		if (shared_networks == nullptr)
+			return result.is_ok() ? Tools::Result(Tools::ResultCode::MemoryAllocationError) : result;
+
+		active_feature_transformer = &(*shared_networks).feature_transformer;
+		active_network             = &(*shared_networks).network;
+
+		if (shared_networks.get_status() == SystemWideSharedConstantAllocationStatus::SharedMemory)
+			sync_cout << "info string use shared eval memory" << (read_file ? "." : " loaded by another process.") << sync_endl;
+		else
+			sync_cout << "info string use non-shared eval memory. " << shared_networks.get_error_message().value_or("") << sync_endl;
+
+		return result;
+	}
+
+	// ReadSharedParameters()に渡すkeyを作る。
+	// file_pathが"<internal>"のときは、実行ファイルに埋め込まれたもの。(実行ファイルの違いはshared memoryの名前に含まれる)
+	std::size_t SharedParametersKey(const std::string& file_path, std::uint64_t embedded_size) {
+		std::size_t key = 0;
+		hash_combine(key, hash_string(file_path));
+		hash_combine(key, kHashValue);
+
+		if (file_path == "<internal>")
+			hash_combine(key, embedded_size);
+		else
+		{
+			// 同じpathでも、ファイルが差し替えられていたら別の領域にする。
+			// 📝 -fno-exceptionsなので、error_codeを受け取る版を使う。
+			std::error_code ec;
+			const auto size  = std::filesystem::file_size(file_path, ec);
+			hash_combine(key, ec ? std::uintmax_t(0) : size);
+			const auto mtime = std::filesystem::last_write_time(file_path, ec);
+			hash_combine(key, ec ? std::int64_t(0) : std::int64_t(mtime.time_since_epoch().count()));
+		}
+		return key;
+	}
+#endif
+
     // 差分計算ができるなら進める
     static void UpdateAccumulatorIfPossible(const Position& pos) {
-        feature_transformer->UpdateAccumulatorIfPossible(pos);
+        active_feature_transformer->UpdateAccumulatorIfPossible(pos);
     }
 
     // 評価値を計算する
@@ -336,10 +460,10 @@ namespace {
 
         alignas(kCacheLineSize) TransformedFeatureType
             transformed_features[FeatureTransformer::kBufferSize];
-        feature_transformer->Transform(pos, transformed_features, refresh);
+        active_feature_transformer->Transform(pos, transformed_features, refresh);
         alignas(kCacheLineSize) char buffer[Network::kBufferSize];
 
-        const auto output = network->Propagate(transformed_features, buffer);
+        const auto output = active_network->Propagate(transformed_features, buffer);
 
         // 仕様書 4項: FinalScore = NNUE_Output + (SideToMove_PSQT - Opponent_PSQT)
         // 今回の指示では PSQT 重みは別途読み込むか、既存のものを利用する。
@@ -436,8 +560,16 @@ void load_eval() {
     if (eval_loaded)
         return;
 
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+    const bool eval_share = (bool)Options["EvalShare"];
+#else
+    const bool eval_share = false;
+#endif
+
 	// 初期化もここでやる。
-	NNUE::Initialize();
+	// EvalShareのときは、shared memoryに直接読み込むので確保しない。
+	if (!eval_share)
+		NNUE::Initialize();
 
 #if defined(EVAL_LEARN)
     if (!Options["SkipLoadingEval"])
@@ -450,16 +582,19 @@ void load_eval() {
 		// WASM
         const std::string file_name = Options["EvalFile"];
     #endif
-        const Tools::Result result = [&] {
+        const std::string file_path = dir_name != "<internal>"
+            ? Path::Combine(Path::Combine(Directory::GetBinaryFolder(), dir_name), file_name)
+            : dir_name;
+
+        // 評価関数ファイルを開いて、そのstreamをreadに渡す。
+        auto read_eval = [&](auto read) -> Tools::Result {
             if (dir_name != "<internal>") {
-                auto abs_eval_path = Path::Combine(Directory::GetBinaryFolder(), dir_name);
-                const std::string file_path = Path::Combine(abs_eval_path, file_name);
                 std::ifstream stream(file_path, std::ios::binary);
                 sync_cout << "info string loading eval file : " << file_path << sync_endl;
 				if (!stream.is_open())
 					return Tools::Result(Tools::ResultCode::FileNotFound);
 
-                return NNUE::ReadParameters(stream);
+                return read(stream);
             }
             else {
                 // C++ way to prepare a buffer for a memory stream
@@ -479,8 +614,21 @@ void load_eval() {
                 std::istream stream(&buffer);
                 sync_cout << "info string loading eval file : <internal>" << sync_endl;
 
-                return NNUE::ReadParameters(stream);
+                return read(stream);
             }
+        };
+
+        const Tools::Result result = [&] {
+#if defined(USE_SHARED_MEMORY_IN_EVAL)
+            // EvalShareのときは、shared memoryに直接読み込む。
+            // 他のプロセスがすでに読み込んでいれば、ファイルは読まない。
+            if (eval_share)
+                return NNUE::ReadSharedParameters(
+                  NNUE::SharedParametersKey(file_path, get_embedded().size), read_eval);
+
+            sync_cout << "info string use non-shared eval memory." << sync_endl;
+#endif
+            return read_eval([](std::istream& stream) { return NNUE::ReadParameters(stream); });
         }();
 
         //      ASSERT(result);
@@ -863,6 +863,10 @@ void gen_sfen(Position&, istringstream& is)
 	// ファイル名の末尾にランダムな数値を付与する。
 	bool random_file_name = false;
 
+	// 乱数seed。0なら時刻などから自動的に決める。
+	// 複数プロセスで並列に生成するときにプロセスごとに異なるseedを与えれば、局面の重複を避けられる。
+	u64 seed = 0;
+
 	while (true)
 	{
 		token = "";
@@ -908,6 +912,8 @@ void gen_sfen(Position&, istringstream& is)
 			is >> save_every;
 		else if (token == "random_file_name")
 			is >> random_file_name;
+		else if (token == "seed")
+			is >> seed;
 		else
 			cout << "Error! : Illegal token " << token << endl;
 	}
@@ -958,7 +964,8 @@ void gen_sfen(Position&, istringstream& is)
 		<< "  output_file_name       = " << output_file_name << endl
 		<< "  use_eval_hash          = " << use_eval_hash << endl
 		<< "  save_every             = " << save_every << endl
-		<< "  random_file_name       = " << random_file_name << endl;
+		<< "  random_file_name       = " << random_file_name << endl
+		<< "  seed                   = " << seed << endl;
 
 	// Options["Threads"]の数だけスレッドを作って実行。
 	{
@@ -977,6 +984,11 @@ void gen_sfen(Position&, istringstream& is)
 		multi_think.random_multi_pv_depth = random_multi_pv_depth;
 		multi_think.write_minply = write_minply;
 		multi_think.write_maxply = write_maxply;
+		if (seed != 0)
+		{
+			multi_think.set_seed(seed);
+			std::cout << "set seed : " << seed << endl;
+		}
 		multi_think.start_file_write_worker();
 		multi_think.go_think();
 
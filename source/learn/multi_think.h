@@ -66,6 +66,10 @@ struct MultiThink
 		return loop_count++;
 	}
 
+	// 乱数seedを設定する。go_think()より前に呼び出すこと。
+	// seedは0以外であること。
+	void set_seed(u64 seed) { prng.set_seed(seed); }
+
 	// [ASYNC] 処理した個数を返す用。呼び出されるごとにインクリメントされたカウンターが返る。
 	u64 get_done_count() {
 		std::unique_lock<std::mutex> lk(loop_mutex);
@@ -1105,6 +1105,13 @@ struct AsyncPRNG
 	// 内部で使用している乱数seedを返す。
 	u64 get_seed() const { return prng.get_seed(); }
 
+	// [ASYNC] 乱数seedを設定し直す。(seedは0以外であること)
+	// 複数プロセスで教師生成をするときなどに、プロセスごとに異なるseedを明示的に与えるために用いる。
+	void set_seed(u64 seed) {
+		std::unique_lock<std::mutex> lk(mutex);
+		prng = PRNG(seed);
+	}
+
 protected:
 	std::mutex mutex;
 	PRNG prng;
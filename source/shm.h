@@ -178,6 +178,7 @@ class SharedMemoryBackend {
         MutexCreateError,
         MutexWaitError,
         MutexReleaseError,
+        InitializerError,
         NotInitialized
     };
 
@@ -189,7 +190,18 @@ class SharedMemoryBackend {
     SharedMemoryBackend(const std::string& shm_name, const T& value) :
         status(Status::NotInitialized) {
 
-        initialize(shm_name, value);
+        initialize(shm_name, [&](T* object) {
+            new (object) T{value};
+            return true;
+        });
+    }
+
+    // The first process fills the object in place with init(T*). See SharedMemory::open_with().
+    template<typename Init>
+    SharedMemoryBackend(const std::string& shm_name, Init&& init, std::in_place_t) :
+        status(Status::NotInitialized) {
+
+        initialize(shm_name, init);
     }
 
     bool is_valid() const { return status == Status::Success; }
@@ -211,6 +223,8 @@ class SharedMemoryBackend {
             return "Failed to wait on mutex: " + last_error_message;
         case Status::MutexReleaseError :
             return "Failed to release mutex: " + last_error_message;
+        case Status::InitializerError :
+            return "Failed to initialize the shared object";
         case Status::NotInitialized :
             return "Not initialized";
         default :
@@ -258,7 +272,8 @@ class SharedMemoryBackend {
     }
 
    private:
-    void initialize(const std::string& shm_name, const T& value) {
+    template<typename Init>
+    void initialize(const std::string& shm_name, Init& init) {
         const size_t total_size = sizeof(T) + sizeof(IS_INITIALIZED_VALUE);
 
         // Try allocating with large pages first.
@@ -334,16 +349,26 @@ class SharedMemoryBackend {
           std::launder(reinterpret_cast<DWORD*>(reinterpret_cast<char*>(pMap) + sizeof(T)));
         T* object = std::launder(reinterpret_cast<T*>(pMap));
 
+        bool init_failed = false;
         if (*is_initialized != IS_INITIALIZED_VALUE)
         {
             // First time initialization, message for debug purposes
-            new (object) T{value};
-            *is_initialized = IS_INITIALIZED_VALUE;
+            if (init(object))
+                *is_initialized = IS_INITIALIZED_VALUE;
+            else
+                init_failed = true;
         }
 
         BOOL release_result = ReleaseMutex(hMutex);
         CloseHandle(hMutex);
 
+        if (init_failed)
+        {
+            status = Status::InitializerError;
+            cleanup_partial();
+            return;
+        }
+
         if (!release_result)
         {
             const DWORD err    = GetLastError();
@@ -398,6 +423,10 @@ class SharedMemoryBackend {
     SharedMemoryBackend(const std::string& shm_name, const T& value) :
         shm1(shm::create_shared<T>(shm_name, value)) {}
 
+    template<typename Init>
+    SharedMemoryBackend(const std::string& shm_name, Init&& init, std::in_place_t) :
+        shm1(shm::create_shared_with<T>(shm_name, init)) {}
+
     void* get() const {
         const T* ptr = &shm1->get();
         return reinterpret_cast<void*>(const_cast<T*>(ptr));
@@ -440,6 +469,11 @@ class SharedMemoryBackend {
     SharedMemoryBackend([[maybe_unused]] const std::string& shm_name,
                         [[maybe_unused]] const T&           value) {}
 
+    template<typename Init>
+    SharedMemoryBackend([[maybe_unused]] const std::string& shm_name,
+                        [[maybe_unused]] Init&&             init,
+                        std::in_place_t) {}
+
     void* get() const { return nullptr; }
 
     bool is_valid() const { return false; }
@@ -460,6 +494,14 @@ struct SharedMemoryBackendFallback {
     SharedMemoryBackendFallback(const std::string&, const T& value) :
         fallback_object(make_unique_large_page<T>(value)) {}
 
+    template<typename Init>
+    SharedMemoryBackendFallback(const std::string&, Init&& init, std::in_place_t) :
+        fallback_object(make_unique_large_page<T>()) {
+        std::memset(static_cast<void*>(fallback_object.get()), 0, sizeof(T));
+        if (!init(fallback_object.get()))
+            fallback_object.reset();
+    }
+
     void* get() const { return fallback_object.get(); }
 
     SharedMemoryBackendFallback(const SharedMemoryBackendFallback&)            = delete;
@@ -515,23 +557,7 @@ struct SystemWideSharedConstant {
     // Content is addressed by its hash. An additional discriminator can be added to account for differences
     // that are not present in the content, for example NUMA node allocation.
     SystemWideSharedConstant(const T& value, std::size_t discriminator = 0) {
-        std::size_t content_hash    = std::hash<T>{}(value);
-        std::size_t executable_hash = std::hash<std::string>{}(getExecutablePathHash());
-
-        std::string shm_name = std::string("Local\\sf_") + std::to_string(content_hash) + "$"
-                             + std::to_string(executable_hash) + "$"
-                             + std::to_string(discriminator);
-
-#if !defined(_WIN32)
-        // POSIX shared memory names must start with a slash
-        shm_name = "/sf_" + createHashString(shm_name);
-
-        // hash name and make sure it is not longer than SF_MAX_SEM_NAME_LEN
-        if (shm_name.size() > SF_MAX_SEM_NAME_LEN)
-        {
-            shm_name = shm_name.substr(0, SF_MAX_SEM_NAME_LEN - 1);
-        }
-#endif
+        const std::string shm_name = make_shm_name(std::hash<T>{}(value), discriminator);
 
         SharedMemoryBackend<T> shm_backend(shm_name, value);
 
@@ -545,6 +571,38 @@ struct SystemWideSharedConstant {
         }
     }
 
+    // Addressed by a key chosen by the caller instead of the content hash, so that a process can
+    // attach to an existing object without building its own copy first.
+    // Only the process that creates the object calls init(T*) to fill it in place (the memory is
+    // zero-filled). init returns false on failure, which leaves the result empty (== nullptr).
+    // If shared memory is not available, init is called on a local allocation instead.
+    template<typename Init>
+    static SystemWideSharedConstant with_key(std::size_t key, Init&& init, std::size_t discriminator = 0) {
+        const std::string shm_name = make_shm_name(key, discriminator);
+
+        // If init itself failed, trying again on a local allocation would fail the same way.
+        bool init_failed = false;
+        auto guarded_init = [&](T* object) {
+            if (init(object))
+                return true;
+            init_failed = true;
+            return false;
+        };
+
+        SystemWideSharedConstant result;
+        SharedMemoryBackend<T>   shm_backend(shm_name, guarded_init, std::in_place);
+
+        if (shm_backend.is_valid())
+        {
+            result.backend = std::move(shm_backend);
+        }
+        else if (!init_failed)
+        {
+            result.backend = SharedMemoryBackendFallback<T>(shm_name, guarded_init, std::in_place);
+        }
+        return result;
+    }
+
     SystemWideSharedConstant(const SystemWideSharedConstant&)            = delete;
     SystemWideSharedConstant& operator=(const SystemWideSharedConstant&) = delete;
 
@@ -593,6 +651,26 @@ struct SystemWideSharedConstant {
     }
 
    private:
+    static std::string make_shm_name(std::size_t key, std::size_t discriminator) {
+        std::size_t executable_hash = std::hash<std::string>{}(getExecutablePathHash());
+
+        std::string shm_name = std::string("Local\\sf_") + std::to_string(key) + "$"
+                             + std::to_string(executable_hash) + "$"
+                             + std::to_string(discriminator);
+
+#if !defined(_WIN32)
+        // POSIX shared memory names must start with a slash
+        shm_name = "/sf_" + createHashString(shm_name);
+
+        // hash name and make sure it is not longer than SF_MAX_SEM_NAME_LEN
+        if (shm_name.size() > SF_MAX_SEM_NAME_LEN)
+        {
+            shm_name = shm_name.substr(0, SF_MAX_SEM_NAME_LEN - 1);
+        }
+#endif
+        return shm_name;
+    }
+
     auto get_ptr() const {
         return std::visit(
           [](const auto& end) -> void* {
@@ -229,6 +229,17 @@ class SharedMemory: public detail::SharedMemoryBase {
     }
 
     [[nodiscard]] bool open(const T& initial_value) noexcept {
+        return open_with([&](T* object) noexcept {
+            new (object) T{initial_value};
+            return true;
+        });
+    }
+
+    // Like open(), but the process that creates the region fills it in place with init(T*),
+    // while holding the file lock, so that other processes wait for it and then only map it.
+    // The object passed to init is zero-filled. If init returns false, the region is removed.
+    template<typename Init>
+    [[nodiscard]] bool open_with(Init&& init) noexcept {
         detail::CleanupHooks::ensure_registered();
 
         bool retried_stale = false;
@@ -259,7 +270,7 @@ class SharedMemory: public detail::SharedMemoryBase {
 
             bool invalid_header = false;
             bool success =
-              created_new ? setup_new_region(initial_value) : setup_existing_region(invalid_header);
+              created_new ? setup_new_region(init) : setup_existing_region(invalid_header);
 
             if (!success)
             {
@@ -581,7 +592,8 @@ class SharedMemory: public detail::SharedMemoryBase {
         return found;
     }
 
-    [[nodiscard]] bool setup_new_region(const T& initial_value) noexcept {
+    template<typename Init>
+    [[nodiscard]] bool setup_new_region(Init& init) noexcept {
         if (ftruncate(fd_, static_cast<off_t>(total_size_)) == -1)
             return false;
 
@@ -600,7 +612,8 @@ class SharedMemory: public detail::SharedMemoryBase {
           reinterpret_cast<detail::ShmHeader*>(static_cast<char*>(mapped_ptr_) + sizeof(T));
 
         new (header_ptr_) detail::ShmHeader{};
-        new (data_ptr_) T{initial_value};
+        if (!init(data_ptr_))
+            return false;
 
         if (!initialize_shared_mutex())
             return false;
@@ -653,6 +666,15 @@ template<typename T>
     return std::nullopt;
 }
 
+template<typename T, typename Init>
+[[nodiscard]] std::optional<SharedMemory<T>> create_shared_with(const std::string& name,
+                                                                Init&&             init) noexcept {
+    SharedMemory<T> shm(name);
+    if (shm.open_with(init))
+        return shm;
+    return std::nullopt;
+}
+
 }  // namespace YaneuraOu::shm
 
 #endif  // #ifndef SHM_LINUX_H_INCLUDED
@@ -0,0 +1,243 @@
+"""
+詰将棋の問題集を core.solve_mate_stats で並列に解いて、正解率と速度を測るベンチマーク。
+
+df-pnソルバーの種類(DfpnSolverType)やメモリ量を変えて、同じ問題集・同じマシンで比較するために使う。
+
+使い方:
+    python bench_mate.py mate.sfen [--jobs 8] [--pool process|thread]
+                         [--solvers Node32bit,Node48bitOrdering] [--mem_mb 0,16,64]
+                         [--nodes_limit 1000000] [--csv result.csv]
+
+問題集の形式 (1行1問、'#'で始まる行は読み飛ばす):
+    <sfen> [answer...]
+    sfen      : 局面。先頭の"sfen "はあってもなくてもよい。(source/testcmd/mate_test_cmd.cppの"test genmate"の出力もそのまま読める)
+    answer    : 省略可。以下の並び。
+                  整数        ... 詰み手数
+                  nomate      ... 不詰の問題
+                  USIの指し手 ... 正解の初手(複数書けばどれでも正解)
+
+集計:
+    solved  : 詰み/不詰を判定できた問題の割合
+    correct : 答えと一致した割合(答えのない問題は判定できれば正解とする)
+    ソルバー×メモリ量ごとに、1問あたりの時間とノード数、全体のスループット(問/秒, ノード/秒)
+"""
+import argparse
+import csv
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Add the project root to the Python path to allow importing 'yaneuraou_python'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    from yaneuraou_python import core
+except ImportError as e:
+    print(f"Error: Could not import the wrapper module: {e}")
+    print("Please make sure you have built the wrapper by running 'build.sh' in the 'yaneuraou_python' directory.")
+    sys.exit(1)
+
+
+class MateProblem:
+    """ 問題1つ。mate_plyとfirst_movesは分からなければNone/空。is_mateは不詰の問題ならFalse。"""
+
+    __slots__ = ("no", "sfen", "is_mate", "mate_ply", "first_moves")
+
+    def __init__(self, no, sfen, is_mate=True, mate_ply=None, first_moves=()):
+        self.no = no
+        self.sfen = sfen
+        self.is_mate = is_mate
+        self.mate_ply = mate_ply
+        self.first_moves = tuple(first_moves)
+
+
+def parse_problem(no, line):
+    """ 問題集の1行をMateProblemにする。空行・コメント行ならNone。"""
+    tokens = line.split()
+    if not tokens or tokens[0].startswith("#"):
+        return None
+    if tokens[0] == "sfen":
+        tokens = tokens[1:]
+    if len(tokens) < 4:
+        raise ValueError(f"line {no + 1} : too few sfen fields")
+    problem = MateProblem(no, " ".join(tokens[:4]))
+    for t in tokens[4:]:
+        if t == "nomate":
+            problem.is_mate = False
+        elif t.isdigit():
+            problem.mate_ply = int(t)
+        else:
+            problem.first_moves += (t,)
+    return problem
+
+
+def read_problems(path, limit=0):
+    problems = []
+    with open(path, "r", encoding="utf-8") as f:
+        for no, line in enumerate(f):
+            problem = parse_problem(no, line)
+            if problem is None:
+                continue
+            problems.append(problem)
+            if limit and len(problems) >= limit:
+                break
+    return problems
+
+
+def check_answer(problem, result):
+    """ 解いた結果が問題の答えと一致しているか。 """
+    if result["is_mate"] is None:
+        return False
+    if result["is_mate"] != problem.is_mate:
+        return False
+    if not problem.is_mate:
+        return True
+    pv = result["pv"]
+    if problem.first_moves and (not pv or pv[0] not in problem.first_moves):
+        return False
+    # df-pnの手順は最短とは限らないので、手数は答えより短くないことだけ確かめる。
+    if problem.mate_ply is not None and len(pv) < problem.mate_ply:
+        return False
+    return True
+
+
+# ======================================================================
+# 並列に解く
+# ======================================================================
+
+def _init_worker():
+    core.init()
+
+
+def solve_one(args):
+    """ 1問解いて、(問題番号, 結果のdict, 経過時間[秒]) を返す。ワーカープロセス/スレッドで呼ばれる。"""
+    problem, nodes_limit, solver_name, mem_mb = args
+    solver_type = getattr(core.DfpnSolverType, solver_name)
+    start = time.perf_counter()
+    result = core.solve_mate_stats(problem.sfen, nodes_limit=nodes_limit, solver_type=solver_type, mem_mb=mem_mb)
+    return problem.no, result, time.perf_counter() - start
+
+
+def run_bench(problems, solver_name, mem_mb, nodes_limit, jobs, pool):
+    """ 問題集を1通りの設定で解く。戻り値 : (行のlist, 壁時計の経過時間) """
+    if pool == "thread":
+        # solve_mate_statsは探索中にGILを手放すので、スレッドでも並列に解ける。
+        _init_worker()
+        executor = ThreadPoolExecutor(max_workers=jobs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker)
+
+    by_no = {p.no: p for p in problems}
+    rows = []
+    start = time.perf_counter()
+    with executor:
+        tasks = ((p, nodes_limit, solver_name, mem_mb) for p in problems)
+        # 1問が短いので、プロセスプールではまとめて渡してプロセス間通信の回数を減らす。
+        chunksize = 1 if pool == "thread" else max(1, len(problems) // (jobs * 16))
+        for count, (no, result, elapsed) in enumerate(executor.map(solve_one, tasks, chunksize=chunksize), 1):
+            problem = by_no[no]
+            rows.append({
+                "solver": solver_name,
+                "mem_mb": mem_mb,
+                "no": no,
+                "sfen": problem.sfen,
+                "is_mate": result["is_mate"],
+                "correct": check_answer(problem, result),
+                "mate_ply": result["mate_ply"],
+                "nodes": result["nodes"],
+                "time": elapsed,
+                "out_of_memory": result["out_of_memory"],
+                "hashfull": result["hashfull"],
+                "pv": " ".join(result["pv"]),
+            })
+            if count % 100 == 0:
+                sys.stdout.write(".")
+                sys.stdout.flush()
+    wall = time.perf_counter() - start
+    print()
+    return rows, wall
+
+
+# ======================================================================
+# 集計
+# ======================================================================
+
+def summarize(rows, wall):
+    n = len(rows)
+    times = [r["time"] for r in rows]
+    nodes = [r["nodes"] for r in rows]
+    return {
+        "problems": n,
+        "solved": sum(r["is_mate"] is not None for r in rows) / n if n else 0.0,
+        "correct": sum(r["correct"] for r in rows) / n if n else 0.0,
+        "oom": sum(r["out_of_memory"] for r in rows),
+        "time_mean": statistics.fmean(times) if n else 0.0,
+        "time_median": statistics.median(times) if n else 0.0,
+        "time_max": max(times) if n else 0.0,
+        "nodes_mean": statistics.fmean(nodes) if n else 0.0,
+        "problems_per_sec": n / wall if wall > 0 else 0.0,
+        "nodes_per_sec": sum(nodes) / wall if wall > 0 else 0.0,
+        "wall": wall,
+    }
+
+
+def print_summary(results):
+    print("\n{:<20} {:>7} {:>8} {:>8} {:>5} {:>10} {:>10} {:>10} {:>12} {:>10} {:>12}".format(
+        "solver", "mem_mb", "solved", "correct", "oom", "mean[ms]", "med[ms]", "max[ms]", "nodes/prob", "probs/s", "nodes/s"))
+    for (solver_name, mem_mb), s in results:
+        print("{:<20} {:>7} {:>7.2f}% {:>7.2f}% {:>5} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.0f} {:>10.1f} {:>12.0f}".format(
+            solver_name, mem_mb if mem_mb else "auto", s["solved"] * 100, s["correct"] * 100, s["oom"],
+            s["time_mean"] * 1000, s["time_median"] * 1000, s["time_max"] * 1000,
+            s["nodes_mean"], s["problems_per_sec"], s["nodes_per_sec"]))
+    sys.stdout.flush()
+
+
+def write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    solver_names = list(core.DfpnSolverType.__members__)
+
+    parser = argparse.ArgumentParser(description="Solve a file of mate problems in parallel and benchmark the df-pn solvers.")
+    parser.add_argument('problems', type=str, help="Problem file (one sfen per line, optionally followed by the answer).")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="Number of worker processes/threads.")
+    parser.add_argument('--pool', type=str, default="process", choices=["process", "thread"], help="Worker pool type.")
+    parser.add_argument('--solvers', type=str, default="Node32bit", help="Comma separated DfpnSolverType names, or 'all'. (" + ",".join(solver_names) + ")")
+    parser.add_argument('--mem_mb', type=str, default="0", help="Comma separated memory sizes per solver in MB (0 = derived from nodes_limit).")
+    parser.add_argument('--nodes_limit', type=int, default=1000000, help="Node limit per problem.")
+    parser.add_argument('--limit', type=int, default=0, help="Use only the first N problems (0 = all).")
+    parser.add_argument('--csv', type=str, default="", help="Write per-problem results to this CSV file.")
+    args = parser.parse_args()
+
+    solvers = solver_names if args.solvers == "all" else args.solvers.split(",")
+    for name in solvers:
+        if name not in solver_names:
+            print(f"Error! unknown solver type : {name}")
+            sys.exit(1)
+    mem_list = [int(m) for m in args.mem_mb.split(",")]
+
+    problems = read_problems(args.problems, args.limit)
+    print(f"problems : {len(problems)} , jobs : {args.jobs} ({args.pool}) , nodes_limit : {args.nodes_limit}")
+
+    all_rows = []
+    results = []
+    for solver_name in solvers:
+        for mem_mb in mem_list:
+            print(f"{solver_name} , mem_mb = {mem_mb if mem_mb else 'auto'}")
+            rows, wall = run_bench(problems, solver_name, mem_mb, args.nodes_limit, args.jobs, args.pool)
+            results.append(((solver_name, mem_mb), summarize(rows, wall)))
+            all_rows.extend(rows)
+
+    print_summary(results)
+    if args.csv and all_rows:
+        write_csv(args.csv, all_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 
 #include <string>
 #include <vector>
@@ -7,6 +8,7 @@
 #include <iostream>
 #include <variant>
 #include <cstring>
+#include <deque>
 
 #include "config.h"
 #include "types.h"
@@ -118,46 +120,206 @@ py::list get_legal_moves_info(const std::string& sfen_str) {
     return results;
 }
 
-// 詰み探索を実行するラッパー
-// 戻り値: (is_mate, pv)
-// is_mate: bool | None (詰み:True, 不詰:False, 不明:None)
-// pv: list[str] (詰み手順のUSI文字列リスト)
-py::tuple solve_mate(const std::string& sfen_str, u64 nodes_limit) {
-    // df-pnソルバーのインスタンスを作成
-    // ここでは一番シンプルなNode32bitを使用
-    Mate::Dfpn::MateDfpnSolver solver(Mate::Dfpn::DfpnSolverType::Node32bit);
+// 開始局面から指し手を順に進めて、開始局面と各指し手のあとの局面のsfenを返す。(tools/game_book.py 用)
+// sfen_str は"startpos"でもよい。非合法手や局面を進められない指し手("resign"など)があれば、その手の前までを返す。
+std::vector<std::string> replay_game(const std::string& sfen_str, const std::vector<std::string>& moves) {
+    Position pos;
+    std::deque<StateInfo> states(1);
+    pos.set(sfen_str == "startpos" ? StartSFEN : sfen_str, &states.back());
+
+    std::vector<std::string> sfens;
+    sfens.reserve(moves.size() + 1);
+    sfens.push_back(pos.sfen());
+    for (const auto& usi : moves) {
+        Move move = USIEngine::to_move(pos, usi);
+        if (move == Move::none() || !move.is_ok())
+            break;
+        states.emplace_back();
+        pos.do_move(move, states.back());
+        sfens.push_back(pos.sfen());
+    }
+    return sfens;
+}
+
+// --- NNUEの入力特徴量 ---
+
+// NNUEの入力特徴量で使う駒の番号(BonaPiece)。source/evaluate.h の enum BonaPiece と同じ値。
+// このモジュールはUSE_EVAL_LISTなしでビルドするので、EvalListは使わずにここで求める。
+namespace NNUEPieces {
+    // SquareのままだとSQ_NB * 18などがSquare(int8_t)の演算になって桁あふれするのでintにしておく。
+    constexpr int sq_nb = (int)SQ_NB;
+    constexpr int fe_hand_end = 90;
+    constexpr int f_king = fe_hand_end + sq_nb * 18;  // == fe_end
+
+    // 盤上の駒の、先手(friend)から見た番号の開始位置。後手(enemy)の駒はこれに+81。PieceTypeで引く。
+    // 成歩・成香・成桂・成銀は金と同じ。(DISTINGUISH_GOLDSなし)
+    constexpr int board[16] = {
+        0,
+        fe_hand_end + sq_nb * 0,  fe_hand_end + sq_nb * 2,  fe_hand_end + sq_nb * 4,  fe_hand_end + sq_nb * 6,  // 歩,香,桂,銀
+        fe_hand_end + sq_nb * 10, fe_hand_end + sq_nb * 14, fe_hand_end + sq_nb * 8,  f_king,                    // 角,飛,金,玉
+        fe_hand_end + sq_nb * 8,  fe_hand_end + sq_nb * 8,  fe_hand_end + sq_nb * 8,  fe_hand_end + sq_nb * 8,  // 成歩,成香,成桂,成銀
+        fe_hand_end + sq_nb * 12, fe_hand_end + sq_nb * 16, 0,                                                  // 馬,龍
+    };
+
+    // 手駒の1枚目の番号。[PieceType][friend=0 / enemy=1]
+    constexpr int hand[8][2] = {
+        { 0, 0 }, { 1, 20 }, { 39, 44 }, { 49, 54 }, { 59, 64 }, { 79, 82 }, { 85, 88 }, { 69, 74 },
+    };
+}
+
+// 各局面の、先手から見た駒リスト(piece_list_fb)と後手から見た駒リスト(piece_list_fw)を返す。(tools/nnue_eval.py 用)
+// 戻り値 : (pieces , side_to_move)
+//   pieces       : int32の配列 [局面数][2(先手視点,後手視点)][40]。
+//                  0～37が玉以外の駒、38が先手玉、39が後手玉。駒落ちなどで足りない駒は0(BONA_PIECE_ZERO)。
+//                  EvalListとは駒の並び順が異なることがあるが、入力特徴量は並び順によらない。
+//   side_to_move : uint8の配列 [局面数]。先手なら0。
+py::tuple nnue_piece_lists(const std::vector<std::string>& sfens) {
+    const py::ssize_t n = (py::ssize_t)sfens.size();
+    py::array_t<int32_t> pieces({ n, (py::ssize_t)2, (py::ssize_t)PIECE_NUMBER_NB });
+    py::array_t<uint8_t> side_to_move(n);
+    auto pl = pieces.mutable_unchecked<3>();
+    auto stm = side_to_move.mutable_unchecked<1>();
+
+    Position pos;
+    StateInfo si;
+    for (py::ssize_t i = 0; i < n; ++i) {
+        pos.set(sfens[i] == "startpos" ? StartSFEN : sfens[i], &si);
+        stm(i) = (uint8_t)pos.side_to_move();
+        for (Color perspective : COLOR) {
+            // 玉がいない局面では玉の番号を0(BONA_PIECE_ZERO)にしておく。
+            pl(i, perspective, PIECE_NUMBER_BKING) = pl(i, perspective, PIECE_NUMBER_WKING) = 0;
+            int count = 0;
+            auto put = [&](int bp) {
+                if (count < PIECE_NUMBER_KING)
+                    pl(i, perspective, count++) = bp;
+            };
+            for (Square sq : SQ) {
+                Piece pc = pos.piece_on(sq);
+                if (pc == NO_PIECE)
+                    continue;
+                // 後手視点では盤面を180度回転させる。
+                int bp = NNUEPieces::board[type_of(pc)] + (color_of(pc) == perspective ? 0 : NNUEPieces::sq_nb)
+                       + (perspective == BLACK ? (int)sq : (int)Inv(sq));
+                if (type_of(pc) == KING)
+                    pl(i, perspective, PIECE_NUMBER_KING + color_of(pc)) = bp;
+                else
+                    put(bp);
+            }
+            for (Color c : COLOR)
+                for (PieceType pt = PAWN; pt < KING; ++pt)
+                    for (int k = 0; k < hand_count(pos.hand_of(c), pt); ++k)
+                        put(NNUEPieces::hand[pt][c == perspective ? 0 : 1] + k);
+            while (count < PIECE_NUMBER_KING)
+                pl(i, perspective, count++) = 0;
+        }
+    }
+    return py::make_tuple(pieces, side_to_move);
+}
+
+// df-pnで詰み探索をした結果
+struct MateResult {
+    Move move = MOVE_NONE;        // 初手。不詰ならMOVE_NULL、不明ならMOVE_NONE
+    std::vector<Move> pv;         // 詰み手順
+    u64 nodes = 0;                // 探索ノード数
+    int mate_ply = 0;             // 詰み手数
+    bool out_of_memory = false;   // メモリ不足で打ち切られた
+    int hashfull = 0;             // メモリの使用率(1000分率)
+};
+
+// 詰み探索を実行する。
+// solver_type : df-pnソルバーの種類。WithHashの種類は共有の置換表(MateHashTable)が要るので使えない。
+// mem_mb      : 探索用のメモリ[MB]。0ならnodes_limitから決める。
+MateResult run_mate_dfpn(const std::string& sfen_str, u64 nodes_limit,
+                         Mate::Dfpn::DfpnSolverType solver_type, size_t mem_mb) {
+    using Mate::Dfpn::DfpnSolverType;
+    if (solver_type == DfpnSolverType::None
+        || solver_type == DfpnSolverType::Node32bitWithHash
+        || solver_type == DfpnSolverType::Node16bitOrderingWithHash
+        || solver_type == DfpnSolverType::Node64bitWithHash
+        || solver_type == DfpnSolverType::Node48bitOrderingWithHash) {
+        throw std::invalid_argument("solver_type must be one of the solvers without a hash table.");
+    }
+
+    Mate::Dfpn::MateDfpnSolver solver(solver_type);
 
     // メモリ確保 (ノード数に応じて)
     // ノードあたり32bitなので、nodes_limit * 4 バイト。少し多めに確保。
     // alloc()はMB単位なので注意。最低でも1MBは確保。
-    size_t mem_size_mb = std::max((size_t)1, (size_t)(nodes_limit * 5 / (1024 * 1024)));
-    solver.alloc(mem_size_mb);
+    if (mem_mb == 0)
+        mem_mb = std::max((size_t)1, (size_t)(nodes_limit * 5 / (1024 * 1024)));
+    solver.alloc(mem_mb);
 
     // 局面のセット
     Position pos;
-    pos.set(sfen_str);
+    StateInfo si;
+    pos.set(sfen_str, &si);
 
-    // 詰み探索の実行
-    Move result_move = solver.mate_dfpn(pos, nodes_limit);
+    MateResult r;
+    {
+        // 探索中はGILを手放して、Pythonのスレッドから複数の局面を並列に解けるようにする。
+        py::gil_scoped_release release;
+        r.move = solver.mate_dfpn(pos, nodes_limit);
+    }
+    r.nodes = solver.get_nodes_searched();
+    r.out_of_memory = solver.is_out_of_memory();
+    r.hashfull = solver.hashfull();
+    if (r.move != MOVE_NULL && r.move != MOVE_NONE) {
+        r.pv = solver.get_pv();
+        r.mate_ply = solver.get_mate_ply();
+    }
+    return r;
+}
+
+py::list pv_to_usi(const std::vector<Move>& pv_moves) {
+    py::list pv_usi;
+    for (const auto& move : pv_moves) {
+        pv_usi.append(move_to_usi_str(move));
+    }
+    return pv_usi;
+}
+
+// 詰み探索を実行するラッパー
+// 戻り値: (is_mate, pv)
+// is_mate: bool | None (詰み:True, 不詰:False, 不明:None)
+// pv: list[str] (詰み手順のUSI文字列リスト)
+py::tuple solve_mate(const std::string& sfen_str, u64 nodes_limit,
+                     Mate::Dfpn::DfpnSolverType solver_type, size_t mem_mb) {
+    MateResult r = run_mate_dfpn(sfen_str, nodes_limit, solver_type, mem_mb);
 
     // 結果の判定
-    if (result_move == MOVE_NULL) {
+    if (r.move == MOVE_NULL) {
         // 不詰が証明された
         return py::make_tuple(false, py::list());
-    } else if (result_move == MOVE_NONE) {
+    } else if (r.move == MOVE_NONE) {
         // 制限内に解けなかった (メモリ不足 or ノード数超過)
         return py::make_tuple(py::none(), py::list());
     } else {
         // 詰みを発見
-        std::vector<Move> pv_moves = solver.get_pv();
-        py::list pv_usi;
-        for (const auto& move : pv_moves) {
-            pv_usi.append(move_to_usi_str(move));
-        }
-        return py::make_tuple(true, pv_usi);
+        return py::make_tuple(true, pv_to_usi(r.pv));
     }
 }
 
+// solve_mate()と同じ探索をして、探索ノード数などもまとめたdictを返す。(ベンチマーク用)
+// keys: is_mate, pv, nodes, mate_ply, out_of_memory, hashfull
+py::dict solve_mate_stats(const std::string& sfen_str, u64 nodes_limit,
+                          Mate::Dfpn::DfpnSolverType solver_type, size_t mem_mb) {
+    MateResult r = run_mate_dfpn(sfen_str, nodes_limit, solver_type, mem_mb);
+
+    py::dict d;
+    if (r.move == MOVE_NULL)
+        d["is_mate"] = false;
+    else if (r.move == MOVE_NONE)
+        d["is_mate"] = py::none();
+    else
+        d["is_mate"] = true;
+    d["pv"] = pv_to_usi(r.pv);
+    d["nodes"] = r.nodes;
+    d["mate_ply"] = r.mate_ply;
+    d["out_of_memory"] = r.out_of_memory;
+    d["hashfull"] = r.hashfull;
+    return d;
+}
+
 
 // --- pybind11モジュール定義 ---
 
@@ -171,10 +333,33 @@ PYBIND11_MODULE(core, m) {
     m.def("get_legal_moves_info", &get_legal_moves_info,
           "Generates all legal moves for a given SFEN position and returns their details.");
 
+    // --- 棋譜の局面 ---
+    m.def("replay_game", &replay_game,
+          "Play the moves from a SFEN (or 'startpos') and return the SFEN of every position, including the first one.",
+          py::arg("sfen"), py::arg("moves"));
+
+    // --- NNUEの入力特徴量 ---
+    m.def("nnue_piece_lists", &nnue_piece_lists,
+          "Return the BonaPiece lists from both perspectives (N x 2 x 40 int32) and the side to move of each SFEN.",
+          py::arg("sfens"));
+
     // --- 詰み探索 ---
+    // WithHashの種類は共有の置換表が要るので公開しない。
+    py::enum_<Mate::Dfpn::DfpnSolverType>(m, "DfpnSolverType")
+        .value("Node32bit", Mate::Dfpn::DfpnSolverType::Node32bit)
+        .value("Node16bitOrdering", Mate::Dfpn::DfpnSolverType::Node16bitOrdering)
+        .value("Node64bit", Mate::Dfpn::DfpnSolverType::Node64bit)
+        .value("Node48bitOrdering", Mate::Dfpn::DfpnSolverType::Node48bitOrdering);
+
     m.def("solve_mate", &solve_mate,
           "Solve mate problem for a given SFEN position.",
-          py::arg("sfen"), py::arg("nodes_limit") = 1000000);
+          py::arg("sfen"), py::arg("nodes_limit") = 1000000,
+          py::arg("solver_type") = Mate::Dfpn::DfpnSolverType::Node32bit, py::arg("mem_mb") = 0);
+
+    m.def("solve_mate_stats", &solve_mate_stats,
+          "Solve mate problem and return a dict with the result, nodes searched and memory usage.",
+          py::arg("sfen"), py::arg("nodes_limit") = 1000000,
+          py::arg("solver_type") = Mate::Dfpn::DfpnSolverType::Node32bit, py::arg("mem_mb") = 0);
 
     // --- 静止局面判定 ---
     m.def("is_quiescent", &is_quiescent,
@@ -0,0 +1,109 @@
+import sys
+import os
+
+# tools/ のモジュールをそのままimportする。
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+
+import tempfile
+
+import numpy as np
+
+from psv_file import PSV_DTYPE, PSV_SIZE, read_records
+from psv_shuffle import DEDUP_BYTES, HYPERGEOMETRIC_LIMIT, block_counts, shuffle_dedup
+
+
+def test_block_counts_above_limit():
+    """
+    残りの合計が10億局面を超えても、ブロックの取り出し数が求まることを確かめる。
+    (実際のファイルは作らずに、remainだけ大きな値にする)
+    """
+    print("--- block_counts() with more than 1e9 positions left ---")
+    rng = np.random.default_rng(1)
+    remain = np.array([600_000_000, 700_000_000, 500_000_000, 1, 0, 3], dtype=np.int64)
+    assert remain.sum() >= HYPERGEOMETRIC_LIMIT
+    n = 1_000_000
+    draws = np.array([block_counts(rng, remain, n) for _ in range(20)])
+    assert (draws.sum(axis=1) == n).all()
+    assert (draws <= remain).all() and (draws >= 0).all()
+    # 各ファイルからの取り出し数の平均は、残りの局面数に比例する。
+    expected = n * remain / remain.sum()
+    mean = draws.mean(axis=0)
+    assert np.all(np.abs(mean - expected) <= 5 * np.sqrt(expected) / np.sqrt(len(draws)) + 1), (mean, expected)
+    print(f"mean : {mean.round(1)}")
+    print(f"expected : {expected.round(1)}")
+
+
+def test_block_counts_whole_population():
+    """
+    合計の1/4ずつ続けて選ぶ場合も、取り出し数の合計がnになり、最後まで取り出せばちょうどremainになること。
+    (10億個の通し番号は作れないので、上限を小さくして試す)
+    """
+    print("--- block_counts() taking every position ---")
+    import psv_shuffle
+    limit = psv_shuffle.HYPERGEOMETRIC_LIMIT
+    psv_shuffle.HYPERGEOMETRIC_LIMIT = 1000
+    try:
+        rng = np.random.default_rng(2)
+        remain = np.array([5000, 3, 0, 7000], dtype=np.int64)
+        left = remain.copy()
+        for n in (9000, 2000, 1003):
+            take = block_counts(rng, left, n)
+            assert take.sum() == n and (take <= left).all() and (take >= 0).all()
+            left -= take
+        assert (left == 0).all()
+    finally:
+        psv_shuffle.HYPERGEOMETRIC_LIMIT = limit
+    print("ok")
+
+
+def _keys(records, n):
+    return np.ascontiguousarray(records.view(np.uint8).reshape(len(records), PSV_SIZE)[:, :n]).view(f"V{n}").ravel()
+
+
+def test_shuffle_dedup_skewed():
+    """
+    1つの局面だけが--memoryに載らないほど大量にある教師で、すべての--dedupの結果が正しいことを確かめる。
+      - 同じPackedSfenで評価値が違うものが大量 (sfenなら1つにまとまる。recordとnoneではhashで分け直せる)
+      - 40バイトまったく同じものが大量 (noneではhashで分けられないので、そのまま書き出す)
+    """
+    print("--- shuffle_dedup() with a heavily repeated position ---")
+    rng = np.random.default_rng(3)
+    n = 40000
+    a = np.zeros(n, PSV_DTYPE)
+    a["sfen"][:, :8] = rng.integers(0, 15000, n).astype(np.uint64).view(np.uint8).reshape(-1, 8)
+    a["score"] = rng.integers(-3, 3, n)
+    same_sfen = np.zeros(30000, PSV_DTYPE)
+    same_sfen["sfen"][:, 9] = 7
+    same_sfen["score"] = np.arange(30000) % 20000
+    same_record = np.zeros(30000, PSV_DTYPE)
+    same_record["sfen"][:, 10] = 9
+    data = np.concatenate([a, same_sfen, same_record])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "in.bin")
+        data.tofile(src)
+        for mode, key_bytes in DEDUP_BYTES.items():
+            outputs = []
+            for i in range(2):
+                out = os.path.join(tmp, f"out_{mode}_{i}.bin")
+                # 1プロセスあたり約2000局面のバケツになる。
+                shuffle_dedup([src], out, dedup_mode=mode, workers=2, memory_mb=1, tmp_dir=tmp, seed=5)
+                outputs.append(out)
+            result = read_records(outputs[0])
+            if key_bytes:
+                expected = np.unique(_keys(data, key_bytes))
+                assert np.array_equal(np.unique(_keys(result, key_bytes)), expected)
+                assert len(result) == len(expected)
+            else:
+                assert np.array_equal(np.sort(_keys(result, PSV_SIZE)), np.sort(_keys(data, PSV_SIZE)))
+            with open(outputs[0], "rb") as f0, open(outputs[1], "rb") as f1:
+                assert f0.read() == f1.read(), "same seed must give the same output"
+            # 一時ファイルのフォルダは消えている。
+            assert not [f for f in os.listdir(tmp) if f.startswith("psv_shuffle_")]
+            print(f"{mode} : {len(result)} positions")
+
+
+if __name__ == "__main__":
+    test_block_counts_above_limit()
+    test_block_counts_whole_population()
+    test_shuffle_dedup_skewed()
@@ -0,0 +1,114 @@
+"""
+対局の途中で勝敗が明らかになったときに、評価値から勝ち/負け/引き分けを判定(adjudication)して打ち切るモジュール。
+
+engine_invoker.py の vs_match で使う。エンジンが"bestmove"を返すたびに、その手を探索したときの
+評価値(usi_parser.SearchInfo)を GameAdjudicator.update() に渡す。
+
+判定の規則(AdjudicationRules):
+  - resign : 両エンジンの評価値が、同じ側から見て resign_score 以上の差を resign_plies 手連続で示したら、
+             優勢な側の勝ち。(片方のエンジンだけが悲観/楽観しているときは判定しない)
+  - draw   : draw_min_ply 手目以降に、評価値の絶対値が draw_score 以下の手が draw_plies 手連続したら引き分け。
+  - mate   : 指したエンジンが詰みのスコア(score mate)を返したら、その時点で判定する。
+             mate +N なら指した側の勝ち、mate -N なら指した側の負け。lowerbound/upperboundのときは判定しない。
+
+resign_score / draw_score を0にするとその規則は使わない。
+"""
+
+# 判定の理由。棋譜にもこの文字列で記録する。
+REASON_RESIGN = "resign"
+REASON_DRAW = "draw"
+REASON_MATE = "mate"
+
+
+class AdjudicationRules:
+    """ 判定の規則。既定値ではどの規則も使わない。 """
+
+    def __init__(self, resign_score=0, resign_plies=6, draw_score=0, draw_plies=20, draw_min_ply=160, mate=False):
+        self.resign_score = resign_score
+        self.resign_plies = resign_plies
+        self.draw_score = draw_score
+        self.draw_plies = draw_plies
+        self.draw_min_ply = draw_min_ply
+        self.mate = mate
+
+    @classmethod
+    def from_dict(cls, d):
+        """ YAMLの adjudication: {resign_score: 3000, ...} のような辞書から作る。Noneや空ならNone。"""
+        if not d:
+            return None
+        rules = cls(**d)
+        return rules if rules.enabled else None
+
+    @property
+    def enabled(self):
+        return self.resign_score > 0 or self.draw_score > 0 or self.mate
+
+    def __str__(self):
+        s = []
+        if self.resign_score > 0:
+            s.append(f"resign |score| >= {self.resign_score} for {self.resign_plies} plies")
+        if self.draw_score > 0:
+            s.append(f"draw |score| <= {self.draw_score} for {self.draw_plies} plies after ply {self.draw_min_ply}")
+        if self.mate:
+            s.append("mate score")
+        return " , ".join(s) if s else "none"
+
+
+class GameAdjudicator:
+    """
+    対局1つ分の判定の状態。対局を始めるたびに reset() する。
+
+    update() の戻り値 : 判定がついたら (winner, reason) 、つかなければ None 。
+        winner : 勝った側のエンジン番号 0 / 1 (対局スロット内のengine index & 1)。引き分けならNone。
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.reset()
+
+    def reset(self):
+        # engine 0 から見て、+resign_score以上(1) / -resign_score以下(-1) が続いている手数
+        self.resign_side = 0
+        self.resign_count = 0
+        self.draw_count = 0
+
+    def update(self, ply, engine, info):
+        """
+        ply    : 指した手を含めた、開始局面からの手数
+        engine : 指したエンジン(0 / 1)
+        info   : その手を探索したときの SearchInfo 。scoreは指した側から見た値。
+        """
+        rules = self.rules
+        if info.score is None:
+            # 評価値を出さないエンジンや、すぐに指した手では判定できないので数え直す。
+            self.reset()
+            return None
+
+        if rules.mate and info.score_type == "mate" and info.bound is None:
+            if info.score > 0:
+                return engine, REASON_MATE
+            return engine ^ 1, REASON_MATE
+
+        # engine 0 から見た評価値
+        score = info.score if engine == 0 else -info.score
+
+        if rules.resign_score > 0:
+            side = 1 if score >= rules.resign_score else -1 if score <= -rules.resign_score else 0
+            if side != 0 and side == self.resign_side:
+                self.resign_count += 1
+            else:
+                self.resign_side = side
+                self.resign_count = 1 if side != 0 else 0
+            if self.resign_count >= rules.resign_plies:
+                return (0 if self.resign_side > 0 else 1), REASON_RESIGN
+
+        if rules.draw_score > 0:
+            # draw_min_ply 手目より前の手は数えない。(draw_min_ply 手目から draw_plies 手続いて初めて引き分け)
+            if ply >= rules.draw_min_ply and abs(score) <= rules.draw_score:
+                self.draw_count += 1
+            else:
+                self.draw_count = 0
+            if self.draw_count >= rules.draw_plies:
+                return None, REASON_DRAW
+
+        return None
@@ -0,0 +1,586 @@
+"""
+局面の検討(解析)をHTTPで受け付けるローカルサーバー。
+
+思考エンジンを起動したままプールしておき、JSONで送られてきた局面を空いたエンジンに振り分けて思考させる。
+リクエストごとにエンジンを起動しない(NNUEの読み込みも1回だけ)ので、処理速度は探索の時間だけで決まる。
+思考結果は局面のhash key(book_bin.book_key())と探索の条件ごとにキャッシュし、同じ問い合わせにはすぐに返す。
+
+使い方:
+    python -m yaneuraou_python.tools.analysis_server --engine YaneuraOu-by-gcc [--workers 4] [--port 8765]
+                                 [--threads 1] [--hash 256] [--option EvalDir=eval]
+                                 [--cache_size 100000] [--cache_file analysis_cache.jsonl] [--max_time 60]
+                                 [--search_timeout 600]
+    (python analysis_server.py ... でもよい)
+
+    curl -s localhost:8765/analyze -d '{"sfen": "startpos", "moves": ["7g7f"], "depth": 12, "multipv": 3}'
+    curl -s localhost:8765/analyze -d '[{"sfen": "startpos", "nodes": 100000}, {"sfen": "lnsgkgsnl/...", "movetime": 1000}]'
+    curl -s localhost:8765/stats
+
+リクエスト (POST /analyze) :
+    1局面ならJSONのobject、まとめて送るならobjectのlist。listならそれぞれ並列に思考させて、同じ順に結果のlistを返す。
+        sfen     : "startpos" か局面のsfen文字列(先頭の"sfen "はあってもなくてもよい)
+        moves    : sfenの局面から進める指し手(USI形式)のlist。省略可。
+        depth / nodes / movetime[ms] : 探索の条件。少なくとも1つ指定する。(--default_depthを指定したときは省略可)
+        multipv  : 候補手の数。既定は1。
+        id       : 任意の値。結果にそのまま入れて返す。
+    結果 :
+        {"id": .., "sfen": 思考した局面のsfen , "bestmove": "7g7f" , "ponder": "3c3d" ,
+         "pvs": [{"multipv": 1, "score": 35, "score_type": "cp", "mate": null, "bound": null,
+                  "depth": 12, "seldepth": 16, "nodes": 123456, "pv": ["7g7f", "3c3d", ...]}, ...],
+         "time": 思考にかかった秒数 , "stopped": --max_timeで打ち切ったならtrue , "cached": キャッシュから返したならtrue}
+        指し手が非合法などで思考できなかった局面は {"id": .., "error": "..."} になる。
+
+応答しなくなったエンジン:
+  - --max_time (0なら --search_timeout)秒たってもbestmoveが来なければstopを送る。
+    それからSTOP_TIMEOUT秒待ってもbestmoveが来なければ、エンジンが固まったとみなして起動し直し、その局面を1回だけやり直す。
+
+キャッシュ:
+  - keyは (思考した局面のbook_key , depth , nodes , movetime , multipv) 。手順違い・手数違いの同一局面は同じkeyになる。
+    (千日手の判定に関わる手順の違いは区別しない。定跡と同じ考え方)
+  - 最大 --cache_size 局面で、あふれたら最後に使われたのが最も古いものから捨てる(LRU)。
+  - --cache_file を指定すると、思考結果を1行1局面のJSONで追記していき、次の起動時に読み込む。
+    ファイルの先頭行には、エンジン(実行ファイルのpathと"id name")と送ったsetoptionの一覧を書いておき、
+    起動時にこれが一致しなければ(エンジンや評価関数・オプションを変えたなら)、ファイルの中身は捨てる。
+  - --max_time 秒で打ち切った(stopした)結果はキャッシュしない。
+
+局面は yaneuraou_python.core.replay_game() で進めて求める。ラッパーがビルドされていなければ、
+エンジンに"position"と"d"を送って求める。(book_builder.resolve_sfens() と同じ)
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# python -m yaneuraou_python.tools.analysis_server で起動したときも、このフォルダのモジュールをそのままimportできるようにする。
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from book_bin import book_key
+from book_builder import position_command, resolve_sfens
+from book_db import sfen_ply, trim_ply
+from usi_engine import EngineHost, UsiEngine, UsiEngineError
+
+# ラッパー(yaneuraou_python/core)は、あればそれで局面を進める。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+try:
+    from yaneuraou_python import core
+except ImportError:
+    core = None
+
+# 1回のPOSTで受け付ける局面数の上限
+MAX_BATCH = 10000
+
+# 探索の条件として受け付けるキー
+LIMIT_KEYS = ("depth", "nodes", "movetime")
+
+# stopを送ってから、bestmoveが来るのを待つ秒数。これを過ぎたらエンジンが固まったとみなす。
+STOP_TIMEOUT = 60.0
+
+
+class RequestError(ValueError):
+    """ リクエストの中身がおかしいときに送出する。その局面の結果は"error"になる。"""
+
+
+def parse_request(item, default_depth=0):
+    """
+    リクエストの1局面分(dict)を (sfen , moves , limits) にする。
+    limitsは (depth , nodes , movetime , multipv) のtupleで、キャッシュのkeyにもそのまま使う。
+    """
+    if not isinstance(item, dict):
+        raise RequestError("each request must be a JSON object.")
+    sfen = item.get("sfen", "startpos")
+    moves = item.get("moves", [])
+    if not isinstance(sfen, str) or not sfen.strip():
+        raise RequestError("'sfen' must be a string.")
+    if isinstance(moves, str):
+        moves = moves.split()
+    if not isinstance(moves, list) or not all(isinstance(m, str) for m in moves):
+        raise RequestError("'moves' must be a list of USI moves.")
+
+    values = []
+    for key in LIMIT_KEYS + ("multipv",):
+        value = item.get(key, 0 if key != "multipv" else 1)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise RequestError(f"'{key}' must be a non-negative integer.")
+        values.append(value)
+    depth, nodes, movetime, multipv = values
+    if not (depth or nodes or movetime):
+        if not default_depth:
+            raise RequestError("one of 'depth', 'nodes' or 'movetime' is required.")
+        depth = default_depth
+    if multipv < 1:
+        raise RequestError("'multipv' must be 1 or more.")
+
+    sfen = sfen.strip()
+    if sfen.startswith("sfen "):
+        sfen = sfen[5:].strip()
+    return sfen, moves, (depth, nodes, movetime, multipv)
+
+
+def go_command(limits):
+    depth, nodes, movetime, _ = limits
+    args = []
+    if depth:
+        args.append(f"depth {depth}")
+    if nodes:
+        args.append(f"nodes {nodes}")
+    if movetime:
+        args.append(f"movetime {movetime}")
+    return " ".join(args)
+
+
+# ======================================================================
+# キャッシュ
+# ======================================================================
+
+class AnalysisCache:
+    """
+    思考結果のLRUキャッシュ。イベントループのスレッドからだけ触る。
+
+    capacity : 保持する局面数の上限
+    path     : Noneでなければ、追加した結果をこのファイルにJSONで1行ずつ追記し、起動時に読み込む。
+               先頭行は {"signature": ..} で、load()に渡したsignatureと一致したときだけ中身を使う。
+    """
+
+    def __init__(self, capacity=100000, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.entries = OrderedDict()    # key → (手数を除いたsfen , 結果のdict)
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self._file = None
+
+    def load(self, signature=None):
+        """
+        cacheファイルを読み込む。
+        signature : 思考結果を作ったエンジンと設定(JSONにできるもの)。ファイルの先頭行のものと違えば、中身は捨てる。
+                    (捨てた行数はdiscardedに入れる)
+        捨てたときや、ファイルが上限の2倍を超える行数になっていたら、残った分だけで書き直す。
+        """
+        if self.path is None:
+            return
+        # tupleとlistの違いで一致しなくならないように、一度JSONを通しておく。
+        signature = json.loads(json.dumps(signature))
+        lines = 0
+        matched = False
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                first = f.readline()
+                try:
+                    header = json.loads(first)
+                    matched = header.get("signature") == signature
+                except (ValueError, AttributeError):
+                    header = None
+                if not isinstance(header, dict) or "signature" not in header:
+                    # signatureのない古い形式のファイル。先頭行も思考結果なので捨てた数に入れる。
+                    self.discarded += 1 if first.strip() else 0
+                for line in f:
+                    lines += 1
+                    if not matched:
+                        self.discarded += 1
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        key = tuple(entry["key"])
+                        self._insert(key, entry["sfen"], entry["result"])
+                    except (ValueError, KeyError, TypeError):
+                        # 書き込み途中で落ちたときの最後の行など。
+                        continue
+        if not matched or lines > self.capacity * 2:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+                f.write(json.dumps({"signature": signature}, ensure_ascii=False) + "\n")
+                for key, (sfen, result) in self.entries.items():
+                    f.write(self._line(key, sfen, result))
+            os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding="utf-8", newline="\n")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @staticmethod
+    def _line(key, sfen, result):
+        return json.dumps({"key": list(key), "sfen": sfen, "result": result}, separators=(",", ":")) + "\n"
+
+    def _insert(self, key, sfen, result):
+        self.entries[key] = (sfen, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get(self, key, sfen):
+        """ keyの結果を返す。なければNone。hash keyが衝突していても、sfenが違えば別の局面として扱う。"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != sfen:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, sfen, result):
+        self._insert(key, sfen, result)
+        if self._file is not None:
+            self._file.write(self._line(key, sfen, result))
+            self._file.flush()
+
+
+# ======================================================================
+# エンジンのプール
+# ======================================================================
+
+class AnalysisPool:
+    """
+    起動したままのエンジンをいくつか持ち、空いたエンジンから順に局面を思考させる。
+    メソッドはすべてイベントループ(EngineHost)の上で呼ぶこと。
+
+    options : エンジンに送るsetoptionの (name, value) のlist。Threads/USI_Hash/BookFileは自動で送る。
+    max_time : 0でなければ、1局面の思考がこの秒数を超えたらstopする。
+    search_timeout : max_timeが0のとき、この秒数を超えたらstopする。(固まったエンジンを見つけるため。0なら待ち続ける)
+    """
+
+    def __init__(self, engine_path, workers=1, threads=1, hash_mb=256, options=(), cache=None, max_time=0,
+                 default_depth=0, search_timeout=600):
+        self.engine_path = engine_path
+        self.workers = workers
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.options = list(options)
+        self.cache = cache if cache is not None else AnalysisCache()
+        self.max_time = max_time
+        self.search_timeout = search_timeout
+        self.default_depth = default_depth
+
+        self.engines = []
+        self.idle = None
+        self.inflight = {}      # 思考中のkey → Future (同じ局面を同時に頼まれたら1回だけ思考する)
+        self.waiting = 0
+        self.searched = 0
+        self.search_time = 0.0
+        self.restarts = 0
+
+    # ------------------------------------------------------------------
+
+    def engine_options(self):
+        """ エンジンに送るsetoptionの (name, value) のlist。"""
+        return [("Threads", self.threads), ("USI_Hash", self.hash_mb), ("BookFile", "no_book")] + self.options
+
+    def signature(self):
+        """ キャッシュした思考結果が、どのエンジンと設定で作られたものかを表すdict。start()のあとで呼ぶ。"""
+        return {
+            "engine": os.path.abspath(self.engine_path),
+            "name": self.engines[0].name if self.engines else None,
+            "options": [[name, str(value)] for name, value in self.engine_options()],
+        }
+
+    async def _start_engine(self):
+        cwd = os.path.dirname(os.path.abspath(self.engine_path)) or None
+        engine = await UsiEngine(self.engine_path, cwd=cwd).start()
+        await engine.usi()
+        for name, value in self.engine_options():
+            engine.setoption(name, value)
+        await engine.isready(timeout=600.0)
+        engine.multipv = None
+        return engine
+
+    async def start(self):
+        self.idle = asyncio.Queue()
+        self.engines = list(await asyncio.gather(*(self._start_engine() for _ in range(self.workers))))
+        for engine in self.engines:
+            self.idle.put_nowait(engine)
+        if core is not None:
+            core.init()
+
+    async def close(self):
+        await asyncio.gather(*(engine.quit() for engine in self.engines), return_exceptions=True)
+
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            return await self.idle.get()
+        finally:
+            self.waiting -= 1
+
+    def _release(self, engine):
+        self.idle.put_nowait(engine)
+
+    async def _replace(self, engine):
+        """ 落ちた(応答しなくなった)エンジンを起動し直して、新しいエンジンを返す。"""
+        if engine.poll() is None:
+            engine.kill_now()
+        await engine.wait_closed()
+        self.restarts += 1
+        new_engine = await self._start_engine()
+        self.engines[self.engines.index(engine)] = new_engine
+        return new_engine
+
+    # ------------------------------------------------------------------
+    # 局面
+    # ------------------------------------------------------------------
+
+    async def resolve(self, sfen, moves):
+        """ 開始局面から指し手を進めた局面のsfen(手数つき)を返す。非合法手があればRequestError。"""
+        if core is not None:
+            sfens = core.replay_game(sfen, moves)
+            if len(sfens) != len(moves) + 1:
+                raise RequestError(f"illegal move : {moves[len(sfens) - 1]}")
+            return sfens[-1]
+
+        engine = await self._acquire()
+        try:
+            base, last = await resolve_sfens([engine], [(sfen, ()), (sfen, tuple(moves))])
+        except UsiEngineError:
+            engine = await self._replace(engine)
+            raise RequestError("engine failed while reading the position.")
+        finally:
+            self._release(engine)
+        # エンジンは非合法手の手前で止まるので、手数が進んでいなければ非合法手があった。
+        if sfen_ply(last) - sfen_ply(base) != len(moves):
+            raise RequestError(f"illegal move : {moves[sfen_ply(last) - sfen_ply(base)]}")
+        return last
+
+    # ------------------------------------------------------------------
+    # 思考
+    # ------------------------------------------------------------------
+
+    async def _search(self, engine, sfen, moves, limits):
+        multipv = limits[3]
+        if engine.multipv != multipv:
+            engine.setoption("MultiPV", multipv)
+            engine.multipv = multipv
+        engine.send("usinewgame")
+        engine.send(position_command(sfen, moves))
+        start = time.time()
+        search = engine.go(go_command(limits))
+
+        last = {}
+
+        async def drain():
+            async for rec in search:
+                if rec.pv is None or rec.score is None:
+                    continue
+                i = rec.multipv or 1
+                # lowerbound/upperboundの読み筋は、確定した読み筋がまだないときだけ使う。
+                if rec.bound is None or i not in last or last[i].bound is not None:
+                    last[i] = rec
+
+        stopped = False
+        try:
+            await asyncio.wait_for(drain(), self.max_time or self.search_timeout or None)
+        except asyncio.TimeoutError:
+            stopped = True
+            engine.stop()
+            try:
+                await search.wait(timeout=STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                # _search_with_retry()でエンジンを起動し直してもらう。(このエンジンはもう使えない)
+                raise UsiEngineError(f"{engine.path} : no bestmove in {STOP_TIMEOUT} sec after stop") from None
+
+        pvs = []
+        for i in sorted(last)[:multipv]:
+            rec = last[i]
+            pvs.append({"multipv": i, "score": rec.score, "score_type": rec.score_type, "mate": rec.mate,
+                        "bound": rec.bound, "depth": rec.depth, "seldepth": rec.seldepth, "nodes": rec.nodes,
+                        "pv": rec.pv})
+        return {
+            "bestmove": search.bestmove.move,
+            "ponder": search.bestmove.ponder,
+            "pvs": pvs,
+            "time": round(time.time() - start, 3),
+            "stopped": stopped,
+        }
+
+    async def _search_with_retry(self, sfen, moves, limits):
+        """ 空いたエンジンで思考する。エンジンが落ちたら起動し直して1回だけやり直す。"""
+        engine = await self._acquire()
+        try:
+            for retry in range(2):
+                try:
+                    return await self._search(engine, sfen, moves, limits)
+                except UsiEngineError:
+                    engine = await self._replace(engine)
+                    if retry:
+                        raise
+        finally:
+            self._release(engine)
+
+    async def analyze(self, item):
+        """ リクエストの1局面分を思考して、結果のdictを返す。"""
+        result_id = item.get("id") if isinstance(item, dict) else None
+        try:
+            sfen, moves, limits = parse_request(item, self.default_depth)
+            position = await self.resolve(sfen, moves)
+            key = (f"{book_key(position):016x}",) + limits
+            trimmed = trim_ply(position)
+
+            result = self.cache.get(key, trimmed)
+            cached = result is not None
+            if not cached:
+                future = self.inflight.get(key)
+                if future is not None:
+                    result = await asyncio.shield(future)
+                    cached = True
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    self.inflight[key] = future
+                    try:
+                        result = await self._search_with_retry(sfen, moves, limits)
+                        self.searched += 1
+                        self.search_time += result["time"]
+                        if not result["stopped"]:
+                            self.cache.put(key, trimmed, result)
+                        future.set_result(result)
+                    except BaseException as e:
+                        future.set_exception(e)
+                        # 待っている人がいなくても "exception was never retrieved" と言われないようにする。
+                        future.exception()
+                        raise
+                    finally:
+                        del self.inflight[key]
+        except (RequestError, UsiEngineError) as e:
+            return {"id": result_id, "error": str(e)}
+        except Exception as e:
+            # 壊れたsfen(book_key()のIndexErrorなど)。他の局面の結果は返せるように、この局面だけエラーにする。
+            print(f"Error! analyze failed : {e!r}")
+            sys.stdout.flush()
+            return {"id": result_id, "error": f"internal error : {e!r}"}
+        return dict(result, id=result_id, sfen=position, cached=cached)
+
+    async def analyze_batch(self, items):
+        return await asyncio.gather(*(self.analyze(item) for item in items))
+
+    def stats(self):
+        return {
+            "engines": len(self.engines),
+            "idle": self.idle.qsize() if self.idle is not None else 0,
+            "waiting": self.waiting,
+            "searching": len(self.inflight),
+            "searched": self.searched,
+            "search_time": round(self.search_time, 3),
+            "restarts": self.restarts,
+            "cache_size": len(self.cache.entries),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+
+# ======================================================================
+# HTTPサーバー
+# ======================================================================
+
+def make_server(host, pool, address="127.0.0.1", port=8765):
+    """
+    poolをHTTPで公開するサーバーを作る。リクエストごとのスレッドからhost(EngineHost)のイベントループに投げる。
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code, obj):
+            body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/stats":
+                self.send_error(404)
+                return
+            self._reply(200, host.run(_call(pool.stats)))
+
+        def do_POST(self):
+            if self.path.split("?")[0] != "/analyze":
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length).decode("utf-8"))
+            except (ValueError, UnicodeDecodeError) as e:
+                self._reply(400, {"error": f"bad JSON : {e}"})
+                return
+            items = request if isinstance(request, list) else [request]
+            if len(items) > MAX_BATCH:
+                self._reply(400, {"error": f"too many positions (max {MAX_BATCH})."})
+                return
+            try:
+                results = host.run(pool.analyze_batch(items))
+            except Exception as e:
+                self._reply(500, {"error": f"internal error : {e!r}"})
+                return
+            self._reply(200, results if isinstance(request, list) else results[0])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+async def _call(func):
+    """ 同期関数をイベントループのスレッドで呼ぶためのラッパー。"""
+    return func()
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve position analysis over HTTP from a pool of warm USI engines with a result cache.")
+    parser.add_argument("--engine", type=str, required=True, help="Engine executable.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of engine processes.")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per engine process.")
+    parser.add_argument("--hash", type=int, default=256, help="USI_Hash per engine process [MB].")
+    parser.add_argument("--option", type=str, action="append", default=[], help="NAME=VALUE engine option. Can be given multiple times.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--cache_size", type=int, default=100000, help="Maximum number of cached results (LRU).")
+    parser.add_argument("--cache_file", type=str, default=None, help="Persist cached results to this JSON lines file and reload them on start.")
+    parser.add_argument("--max_time", type=float, default=0, help="Stop a search after this many seconds (0 = no limit). Stopped results are not cached.")
+    parser.add_argument("--search_timeout", type=float, default=600, help="With --max_time 0, stop a search after this many seconds and restart the engine if it does not answer (0 = wait forever).")
+    parser.add_argument("--default_depth", type=int, default=0, help="Depth used when a request gives no depth/nodes/movetime (0 = reject such requests).")
+    args = parser.parse_args()
+
+    options = []
+    for option in args.option:
+        name, sep, value = option.partition("=")
+        if not sep:
+            print(f"Error! bad option (NAME=VALUE) : {option}")
+            sys.exit(1)
+        options.append((name, value))
+
+    cache = AnalysisCache(args.cache_size, args.cache_file)
+
+    host = EngineHost()
+    pool = AnalysisPool(args.engine, workers=args.workers, threads=args.threads, hash_mb=args.hash, options=options,
+                        cache=cache, max_time=args.max_time, default_depth=args.default_depth,
+                        search_timeout=args.search_timeout)
+    host.run(pool.start())
+    # エンジンの"id name"が要るので、エンジンを起動してから読み込む。(まだリクエストは受け付けていない)
+    cache.load(pool.signature())
+    if args.cache_file:
+        print(f"cache : {len(cache.entries)} positions from {args.cache_file}"
+              + (f" ({cache.discarded} discarded: different engine or options)" if cache.discarded else ""))
+    server = make_server(host, pool, args.host, args.port)
+    print(f"engines : {len(pool.engines)} ({pool.engines[0].name}) , listening on http://{args.host}:{args.port}/analyze")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        host.run(pool.close())
+        host.close()
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+"""
+やねうら王バイナリ定跡(.ybb)の読み書きと、テキスト定跡(.db)との相互変換を行うモジュール。
+
+.ybb は局面の64bitのZobrist keyをkeyとするopen addressingのhash tableに、固定長の指し手レコードを
+並べたファイルで、エンジンはBookFileの拡張子が".ybb"ならこれをファイルから直接probeする。
+(フォーマットの定義は source/book/binary_book.h を参照のこと)
+
+使い方:
+    python book_bin.py to_binary user_book1.db user_book1.ybb
+    python book_bin.py to_db     user_book1.ybb user_book1.db
+    python book_bin.py probe     user_book1.ybb --sfen "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+    with BinaryBook("user_book1.ybb") as book:
+        moves = book.probe(sfen)                 # 見つからなければNone
+        results = book.probe_many(sfen_list)
+
+hash keyは Position::key() ではなく、この定跡用に固定のseedから作ったZobrist key(book_key())である。
+C++側の BinaryBook::book_key() と同じ値になるように、乱数を取り出す順番を合わせてある。
+手数はkeyに含まれないので、エンジンの IgnoreBookPly == true のときと同じく手数違いの局面は同一視される。
+(.dbから変換するときに手数違いの局面があれば、手数の一番小さいものを残す)
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from book_db import BookMove, flip_move, flip_sfen, iter_book, normalize_sfen, sort_moves, trim_ply, write_book
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"YOBOOKB1"
+VERSION = 1
+
+# 定跡用のZobrist keyのPRNGのseed (binary_book.h の BinaryBookKeySeed)
+KEY_SEED = 0x5942424B
+
+MASK64 = (1 << 64) - 1
+
+# BinaryBookHeader : magic , version , header_size , table_size , position_count , move_count , sfen_pool_size , reserved[2]
+HEADER = struct.Struct("<8sIIQQQQ16x")
+
+# 使っていないslotのほうが多くなるようにする。(線形探査が長くならないように)
+MAX_LOAD_FACTOR = 0.5
+
+# 1局面あたりの指し手の数の上限(BinaryBookPosition::move_countがu16)
+MAX_MOVES = 0xFFFF
+# 採択回数はu32に飽和させる。
+MAX_COUNT = 0xFFFFFFFF
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+def _dtypes():
+    slot = np.dtype([("key", "<u8"), ("position", "<u4"), ("reserved", "<u4")])
+    position = np.dtype([("sfen_offset", "<u8"), ("first_move", "<u4"), ("move_count", "<u2"), ("ply", "<u2"),
+                         ("sfen_length", "<u4"), ("reserved", "<u4")])
+    move = np.dtype([("move", "<u2"), ("ponder", "<u2"), ("value", "<i4"), ("depth", "<i4"), ("move_count", "<u4")])
+    return slot, position, move
+
+
+# ======================================================================
+# 定跡用のZobrist key
+# ======================================================================
+
+# 駒の文字 → Piece(types.hのenum Piece)。後手の駒はこれに16(PIECE_WHITE)を足す。
+_PIECE_CHARS = {"P": 1, "L": 2, "N": 3, "S": 4, "B": 5, "R": 6, "G": 7, "K": 8}
+PIECE_PROMOTE = 8
+PIECE_WHITE = 16
+PIECE_NB = 32
+SQ_NB = 81
+
+_zobrist = None
+
+
+def _prng(seed):
+    """ misc.h の PRNG (xorshift64*) と同じ乱数列。"""
+    s = seed
+    while True:
+        s ^= s >> 12
+        s ^= (s << 25) & MASK64
+        s ^= s >> 27
+        yield (s * 2685821657736338717) & MASK64
+
+
+def _tables():
+    """ (side, piece[pc][sq], hand[color][pr]) 。BinaryBook::init() と同じ順番で乱数を取り出す。"""
+    global _zobrist
+    if _zobrist is None:
+        rng = _prng(KEY_SEED)
+        side = next(rng)
+        piece = [[0] * SQ_NB] + [[next(rng) for _ in range(SQ_NB)] for _ in range(1, PIECE_NB)]
+        hand = [[0] + [next(rng) for _ in range(1, 8)] for _ in range(2)]
+        _zobrist = side, piece, hand
+    return _zobrist
+
+
+# 段ごとの盤面の文字列 → その段のkeyのcache。定跡の局面は同じ段の並びが繰り返し現れるので、これで大半を省ける。
+_row_cache = {}
+_hand_cache = {}
+_CACHE_LIMIT = 1 << 20
+
+
+def _row_key(rank, row):
+    key = _row_cache.get((rank, row))
+    if key is None:
+        piece_key = _tables()[1]
+        key = 0
+        file = 8
+        promote = 0
+        for c in row:
+            if c.isdigit():
+                file -= int(c)
+            elif c == "+":
+                promote = PIECE_PROMOTE
+            else:
+                pc = _PIECE_CHARS[c.upper()] + promote + (PIECE_WHITE if c.islower() else 0)
+                key ^= piece_key[pc][file * 9 + rank]
+                file -= 1
+                promote = 0
+        if len(_row_cache) >= _CACHE_LIMIT:
+            _row_cache.clear()
+        _row_cache[(rank, row)] = key
+    return key
+
+
+def _hand_key(hand):
+    key = _hand_cache.get(hand)
+    if key is None:
+        hand_key = _tables()[2]
+        key = 0
+        if hand != "-":
+            n = 0
+            for c in hand:
+                if c.isdigit():
+                    n = n * 10 + int(c)
+                else:
+                    key += hand_key[1 if c.islower() else 0][_PIECE_CHARS[c.upper()]] * (n if n else 1)
+                    n = 0
+        if len(_hand_cache) >= _CACHE_LIMIT:
+            _hand_cache.clear()
+        _hand_cache[hand] = key
+    return key
+
+
+def book_key(sfen):
+    """ sfen文字列の局面の、定跡用のZobrist keyを返す。手数は見ない。"""
+    fields = normalize_sfen(sfen).split()
+    board, turn, hand = fields[0], fields[1], fields[2]
+
+    # sfenの盤面は1段目(a)から、各段は9筋から1筋の順。Squareは (筋-1)*9 + (段-1)。
+    key = 0
+    for rank, row in enumerate(board.split("/")):
+        key ^= _row_key(rank, row)
+
+    # 手駒は枚数分だけ加算する。(C++側と同じく、盤面のxorのあとに足す)
+    key = (key + _hand_key(hand)) & MASK64
+
+    if turn == "w":
+        key ^= _tables()[0]
+    return key
+
+
+# ======================================================================
+# Move16
+# ======================================================================
+
+# Move16の特殊な値 (types.hのMoveEnum)
+MOVE_NONE = 0
+MOVE_NULL = (1 << 7) + 1
+MOVE_RESIGN = (2 << 7) + 2
+MOVE_WIN = (3 << 7) + 3
+MOVE_DROP = 1 << 14
+MOVE_PROMOTE = 1 << 15
+
+_SPECIAL_MOVES = {MOVE_NONE: "none", MOVE_NULL: "null", MOVE_RESIGN: "resign", MOVE_WIN: "win"}
+_DROP_CHARS = "PLNSBRG"
+
+
+def _usi_to_sq(f, r):
+    return (int(f) - 1) * 9 + ord(r) - ord("a")
+
+
+def _sq_to_usi(sq):
+    return str(sq // 9 + 1) + chr(ord("a") + sq % 9)
+
+
+def move_to_move16(move):
+    """ USIの指し手文字列をMove16にする。USIEngine::to_move16() と同じく、解釈できなければMOVE_NONE。"""
+    if len(move) < 4:
+        return MOVE_NONE
+    try:
+        to = _usi_to_sq(move[2], move[3])
+        if move[1] == "*":
+            return to + ((_DROP_CHARS.index(move[0]) + 1) << 7) + MOVE_DROP
+        m = to + (_usi_to_sq(move[0], move[1]) << 7)
+    except ValueError:
+        return MOVE_NONE
+    return m + MOVE_PROMOTE if move.endswith("+") else m
+
+
+def move16_to_move(m):
+    """ Move16をUSIの指し手文字列にする。"""
+    if m in _SPECIAL_MOVES:
+        return _SPECIAL_MOVES[m]
+    to = _sq_to_usi(m & 0x7F)
+    frm = (m >> 7) & 0x7F
+    if m & MOVE_DROP:
+        return _DROP_CHARS[frm - 1] + "*" + to
+    return _sq_to_usi(frm) + to + ("+" if m & MOVE_PROMOTE else "")
+
+
+# ======================================================================
+# 書き出し
+# ======================================================================
+
+def _insert_slots(keys, table_size):
+    """
+    keys(重複なし)を線形探査のhash tableに入れて、各slotの(key, position)を返す。positionは1-origin。
+    全要素を同時に1 slotずつ進めるので、numpyで一度に処理できる。
+    ある要素が次のslotに進むのは、今のslotが埋まっているときだけなので、probeの線形探査で必ず見つかる。
+    """
+    mask = np.uint64(table_size - 1)
+    slot_key = np.zeros(table_size, dtype=np.uint64)
+    slot_pos = np.zeros(table_size, dtype=np.uint32)
+
+    idx = np.arange(len(keys), dtype=np.int64)
+    probe = (keys & mask).astype(np.int64)
+    while len(idx):
+        free = slot_pos[probe] == 0
+        # 空いているslotを狙っている要素のうち、slotごとに先頭の1つだけが入る。
+        slots, first = np.unique(probe[free], return_index=True)
+        winners = idx[free][first]
+        slot_key[slots] = keys[winners]
+        slot_pos[slots] = winners + 1
+
+        placed = np.zeros(len(idx), dtype=bool)
+        placed[np.flatnonzero(free)[first]] = True
+        idx = idx[~placed]
+        probe = (probe[~placed] + 1) & int(mask)
+    return slot_key, slot_pos
+
+
+def write_binary(path, entries):
+    """
+    (sfen, BookMoveのlist) を並べたものを .ybb に書き出す。
+    局面はこの順番のまま書き出す。(.dbから変換するならsfen文字列の辞書順になっている)
+    戻り値 : (書き出した局面数, 手数違いで除いた局面数, hash keyの衝突で除いた局面数)
+    """
+    _require_numpy()
+    slot_dtype, position_dtype, move_dtype = _dtypes()
+
+    keys = array("Q")
+    plies = array("H")
+    sfen_offsets = array("Q")
+    sfen_lengths = array("I")
+    first_moves = array("I")
+    move_counts = array("H")
+    mv = array("H")
+    ponder = array("H")
+    value = array("i")
+    depth = array("i")
+    count = array("I")
+    pool = bytearray()
+    sfens = []
+
+    for sfen, moves in entries:
+        sfen = normalize_sfen(sfen)
+        body = trim_ply(sfen)
+        ply = sfen[len(body):].strip()
+        keys.append(book_key(sfen))
+        plies.append(min(int(ply), 0xFFFF) if ply.isdigit() else 0)
+        body = body.encode("ascii")
+        sfen_offsets.append(len(pool))
+        sfen_lengths.append(len(body))
+        sfens.append(body)
+        pool += body
+        moves = sort_moves(list(moves))[:MAX_MOVES]
+        first_moves.append(len(mv))
+        move_counts.append(len(moves))
+        for m in moves:
+            mv.append(move_to_move16(m.move))
+            ponder.append(move_to_move16(m.ponder))
+            value.append(m.value)
+            depth.append(m.depth)
+            count.append(min(m.move_count, MAX_COUNT))
+
+    keys = np.frombuffer(keys, dtype=np.uint64) if len(keys) else np.zeros(0, np.uint64)
+    plies = np.frombuffer(plies, dtype=np.uint16) if len(plies) else np.zeros(0, np.uint16)
+
+    # 同じkeyの局面が複数あれば、手数の小さいものを1つだけ残す。(MemoryBook::write_book()と同じ)
+    # sfenまで同じなら手数違い、sfenが違うならhash keyの衝突。
+    order = np.lexsort((plies, keys))
+    dup = np.zeros(len(keys), dtype=bool)
+    dup[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+    sorted_keys = keys[order]
+    collisions = 0
+    for i in np.flatnonzero(dup).tolist():
+        j = order[np.searchsorted(sorted_keys, keys[i])]
+        if sfens[i] != sfens[j]:
+            collisions += 1
+    keep = np.flatnonzero(~dup)
+    duplicated = int(dup.sum()) - collisions
+
+    position_count = len(keep)
+    table_size = 2
+    while table_size * MAX_LOAD_FACTOR < position_count:
+        table_size *= 2
+
+    positions = np.zeros(position_count, dtype=position_dtype)
+    if position_count:
+        positions["sfen_offset"] = np.frombuffer(sfen_offsets, dtype=np.uint64)[keep]
+        positions["sfen_length"] = np.frombuffer(sfen_lengths, dtype=np.uint32)[keep]
+        positions["first_move"] = np.frombuffer(first_moves, dtype=np.uint32)[keep]
+        positions["move_count"] = np.frombuffer(move_counts, dtype=np.uint16)[keep]
+        positions["ply"] = plies[keep]
+
+    move_records = np.zeros(len(mv), dtype=move_dtype)
+    if len(mv):
+        move_records["move"] = np.frombuffer(mv, dtype=np.uint16)
+        move_records["ponder"] = np.frombuffer(ponder, dtype=np.uint16)
+        move_records["value"] = np.frombuffer(value, dtype=np.int32)
+        move_records["depth"] = np.frombuffer(depth, dtype=np.int32)
+        move_records["move_count"] = np.frombuffer(count, dtype=np.uint32)
+
+    slots = np.zeros(table_size, dtype=slot_dtype)
+    slots["key"], slots["position"] = _insert_slots(keys[keep], table_size)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, HEADER.size, table_size, position_count, len(move_records), len(pool)))
+        slots.tofile(f)
+        positions.tofile(f)
+        move_records.tofile(f)
+        f.write(pool)
+    os.replace(tmp_path, path)
+    return position_count, duplicated, collisions
+
+
+def db_to_binary(db_path, ybb_path):
+    return write_binary(ybb_path, iter_book(db_path))
+
+
+def binary_to_db(ybb_path, db_path):
+    """ .ybb を .db に書き出す。局面は.ybbに入っている順(.dbから作ったならsfen文字列の辞書順)。"""
+    with BinaryBook(ybb_path) as book:
+        return write_book(db_path, book)
+
+
+# ======================================================================
+# 読み込み
+# ======================================================================
+
+class BinaryBook:
+    """
+    mmapで開いた .ybb ファイル。開くときはheaderを読むだけ。
+
+    slots / positions / moves は、ファイルの各領域をそのまま見せるnumpyの構造化配列。
+    """
+
+    def __init__(self, path, flipped=False):
+        _require_numpy()
+        self.path = path
+        self.flipped = flipped
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, header_size, table_size, position_count, move_count, pool_size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or header_size != HEADER.size:
+            self.close()
+            raise ValueError(f"{path} is not a binary book file (version {VERSION}).")
+        self.table_size = table_size
+
+        slot_dtype, position_dtype, move_dtype = _dtypes()
+        offset = HEADER.size
+        self.slots = np.frombuffer(self._mm, dtype=slot_dtype, count=table_size, offset=offset)
+        offset += table_size * slot_dtype.itemsize
+        self.positions = np.frombuffer(self._mm, dtype=position_dtype, count=position_count, offset=offset)
+        offset += position_count * position_dtype.itemsize
+        self.moves = np.frombuffer(self._mm, dtype=move_dtype, count=move_count, offset=offset)
+        offset += move_count * move_dtype.itemsize
+        self._pool_offset = offset
+        self._slot_keys = self.slots["key"]
+        self._slot_positions = self.slots["position"]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def find_key(self, key):
+        """ keyの局面のpositionsのindexを返す。なければ-1。 """
+        mask = self.table_size - 1
+        i = key & mask
+        while True:
+            k, pos = struct.unpack_from("<QI", self._mm, HEADER.size + i * 16)
+            if pos == 0:
+                return -1
+            if k == key:
+                return pos - 1
+            i = (i + 1) & mask
+
+    def find_keys(self, keys):
+        """ find_key()のベクトル版。keysはuint64の配列。全要素を同時に1 slotずつ進める。"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        result = np.full(len(keys), -1, dtype=np.int64)
+        mask = self.table_size - 1
+        idx = np.arange(len(keys))
+        probe = (keys & np.uint64(mask)).astype(np.int64)
+        while len(idx):
+            pos = self._slot_positions[probe]
+            hit = (pos != 0) & (self._slot_keys[probe] == keys[idx])
+            result[idx[hit]] = pos[hit].astype(np.int64) - 1
+            cont = (pos != 0) & ~hit
+            idx = idx[cont]
+            probe = (probe[cont] + 1) & mask
+        return result
+
+    def sfen(self, index):
+        """ positions[index]のsfen文字列(手数つき)。"""
+        p = self.positions[index]
+        start = self._pool_offset + int(p["sfen_offset"])
+        body = self._mm[start:start + int(p["sfen_length"])].decode("ascii")
+        return f"{body} {int(p['ply'])}"
+
+    def moves_of(self, index, flip=False):
+        """ positions[index]の指し手をBookMoveのlistで返す。flipなら指し手を反転する。"""
+        p = self.positions[index]
+        first = int(p["first_move"])
+        result = []
+        for m, pd, v, d, c in self.moves[first:first + int(p["move_count"])].tolist():
+            move, ponder = move16_to_move(m), move16_to_move(pd)
+            if flip:
+                move, ponder = flip_move(move), flip_move(ponder)
+            result.append(BookMove(move, ponder, v, d, c))
+        return result
+
+    def probe(self, sfen, flipped=None):
+        """ sfenの局面の定跡の指し手をBookMoveのlistで返す。なければNone。"""
+        flipped = self.flipped if flipped is None else flipped
+        index = self.find_key(book_key(sfen))
+        if index >= 0:
+            return self.moves_of(index)
+        if flipped:
+            index = self.find_key(book_key(flip_sfen(normalize_sfen(sfen))))
+            if index >= 0:
+                return self.moves_of(index, flip=True)
+        return None
+
+    def probe_many(self, sfens, flipped=None):
+        """ probe()をまとめて行う。sfensと同じ順番で、BookMoveのlistかNoneを並べたlistを返す。"""
+        flipped = self.flipped if flipped is None else flipped
+        sfens = [normalize_sfen(s) for s in sfens]
+        keys = np.fromiter((book_key(s) for s in sfens), dtype=np.uint64, count=len(sfens))
+        indices = self.find_keys(keys).tolist()
+        results = [self.moves_of(i) if i >= 0 else None for i in indices]
+        if flipped:
+            missing = [i for i, r in enumerate(results) if r is None]
+            if missing:
+                keys = np.fromiter((book_key(flip_sfen(sfens[i])) for i in missing), dtype=np.uint64, count=len(missing))
+                for i, index in zip(missing, self.find_keys(keys).tolist()):
+                    if index >= 0:
+                        results[i] = self.moves_of(index, flip=True)
+        return results
+
+    def __iter__(self):
+        """ ファイルに入っている順に (sfen, BookMoveのlist) を返す。 """
+        for index in range(len(self.positions)):
+            yield self.sfen(index), self.moves_of(index)
+
+    def close(self):
+        # numpyの配列がmmapを参照している間はcloseできないので先に捨てる。
+        self.slots = self.positions = self.moves = None
+        self._slot_keys = self._slot_positions = None
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between YaneuraOu-DB2016 text books (.db) and binary books (.ybb).")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("to_binary", help="Convert a .db book to a .ybb book.")
+    p.add_argument("db", type=str)
+    p.add_argument("ybb", type=str)
+    p = sub.add_parser("to_db", help="Convert a .ybb book back to a .db book.")
+    p.add_argument("ybb", type=str)
+    p.add_argument("db", type=str)
+    p = sub.add_parser("probe", help="Look up positions in a .ybb book.")
+    p.add_argument("ybb", type=str)
+    p.add_argument("--sfen", type=str, action="append", default=[], help="Position to look up. Can be given multiple times.")
+    p.add_argument("--flipped", action="store_true", help="Also look up the flipped position (FlippedBook).")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "to_binary":
+        positions, duplicated, collisions = db_to_binary(args.db, args.ybb)
+        print(f"{args.ybb} : {positions} positions ({duplicated} duplicated plies, {collisions} key collisions skipped)"
+              f" , {os.path.getsize(args.ybb)} bytes , {time.perf_counter() - start:.1f}s")
+    elif args.command == "to_db":
+        positions = binary_to_db(args.ybb, args.db)
+        print(f"{args.db} : {positions} positions , {time.perf_counter() - start:.1f}s")
+    else:
+        with BinaryBook(args.ybb, flipped=args.flipped) as book:
+            print(f"{args.ybb} : {len(book)} positions")
+            for sfen, moves in zip(args.sfen, book.probe_many(args.sfen)):
+                print("sfen " + normalize_sfen(sfen))
+                for m in moves or []:
+                    print(f"  {m.move} {m.ponder} {m.value} {m.depth} {m.move_count}")
+                if moves is None:
+                    print("  (not found)")
+
+
+if __name__ == "__main__":
+    main()
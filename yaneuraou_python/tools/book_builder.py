@@ -0,0 +1,454 @@
+"""
+棋譜の序盤の局面を複数の思考エンジンに並列に思考させて、定跡DB(.db)に追加するドライバ。
+
+やることは "makebook think" (source/book/makebook2015.cpp) と同じで、棋譜ファイルの各棋譜の
+start_moves手目から moves手目までの局面を depth固定・MultiPVで思考させ、読み筋の1手目と2手目・評価値を
+定跡の指し手として書き込む。makebook think がエンジン1プロセスのスレッドで並列化するのに対して、
+こちらはUSIエンジンのプロセスを並べる(1プロセス1スレッドならコア数に比例して速くなる)ので、
+評価関数や探索部を差し替えたエンジンでもそのまま使え、sshで他のマシンのエンジンも足せる。
+
+使い方:
+    python book_builder.py think --engine YaneuraOu-by-gcc --sfen_file records.sfen --book user_book1.db
+                                 [--workers 8] [--remote host:16[:/path/to/engine]]
+                                 [--depth 24] [--nodes 0] [--multipv 1] [--start_moves 1] [--moves 16]
+                                 [--cluster 1/1] [--save_interval 900] [--option EvalDir=eval]
+    python book_builder.py merge user_book1.db part1.journal part2.db ...
+
+処理の流れ:
+  1. 棋譜を読んで、思考対象の局面の"position"コマンド(開始局面+指し手)を列挙する。同じ手順は1回だけ。
+  2. エンジンに"position ..."と"d"を送って局面のsfenを得る。(Python側で指し手を適用しない)
+     局面はbook_bin.book_key()のhash keyで重複を除くので、手順違いの同一局面(手数違いも含む)は1回だけ思考する。
+     定跡にすでにあって、深さが今回以上(同じ深さならMultiPVの数以上)の局面は思考しない。(makebook thinkと同じ)
+  3. 残った局面を手数の浅い順にキューに積み、空いたエンジンから1局面ずつ取って "go depth N" で思考させる。
+  4. 結果は1局面ごとに "<book>.journal" に追記する。中断しても、同じコマンドで再開すればjournalにある局面は飛ばす。
+  5. save_interval秒ごとと最後に、元の定跡とjournalの結果をsfen文字列の順にマージして定跡ファイルを書き直す。
+     (同じ局面は新しい思考結果で上書きし、手数違いの局面は手数の小さいsfenで1つにまとめる)
+
+--cluster 2/7 は、makebook think の "cluster 2 7" と同じく7台で分担するときの2台目の意味で、
+hash keyの剰余で局面を割り振る。各マシンの定跡(またはjournal)は merge サブコマンドで1つにまとめる。
+
+--remote host:N[:path] は "ssh host path" でエンジンをN個起動する。pathを省略したら--engineと同じパス。
+(公開鍵認証などで、パスワードを聞かれずにsshできるようにしておくこと)
+"""
+import argparse
+import asyncio
+import heapq
+import os
+import sys
+import time
+from collections import namedtuple
+from itertools import groupby
+
+from book_bin import book_key
+from book_db import BOOK_HEADER, BookDB, BookMove, iter_book, sfen_ply, sort_moves, trim_ply, write_book
+from usi_engine import UsiEngine, UsiEngineError
+
+# makebook think と同じく、思考して追加した指し手の採択回数は800固定。
+THINK_MOVE_COUNT = 800
+
+# 1回の"isready"までにまとめて送る"position"+"d"の数
+RESOLVE_CHUNK = 256
+
+# エンジンの起動方法。pathとargsをそのまま UsiEngine に渡す。
+EngineSpec = namedtuple("EngineSpec", "name path args")
+
+
+# ======================================================================
+# 棋譜と思考対象の局面
+# ======================================================================
+
+def parse_record(line):
+    """
+    棋譜ファイルの1行を (開始局面, 指し手のlist) にする。空行・コメント行ならNone。
+    開始局面は"startpos"か、"sfen"を除いた局面文字列。先頭の"position "はあってもなくてもよい。
+    """
+    tokens = line.split()
+    if not tokens or tokens[0].startswith("#"):
+        return None
+    if tokens[0] == "position":
+        tokens = tokens[1:]
+    if tokens[0] == "startpos":
+        base, rest = "startpos", tokens[1:]
+    else:
+        if tokens[0] == "sfen":
+            tokens = tokens[1:]
+        base, rest = " ".join(tokens[:4]), tokens[4:]
+    if rest and rest[0] == "moves":
+        rest = rest[1:]
+    # 局面を進められない指し手以降は使わない。(makebook thinkと同じ)
+    moves = []
+    for m in rest:
+        if m in ("resign", "win", "none", "null"):
+            break
+        moves.append(m)
+    return base, moves
+
+
+def enumerate_positions(records, start_moves, moves):
+    """
+    思考対象の局面を (開始局面, 指し手のtuple) で返す。makebook thinkと同じく、棋譜ごとに
+    start_moves手目からmoves手目まで(初期局面が1手目)の局面で、棋譜がそれより短ければ最後の局面まで。
+    同じ手順の局面は1つにまとめ、手数の浅い順に並べる。
+    """
+    seen = set()
+    positions = []
+    for base, record in records:
+        for i in range(start_moves - 1, min(moves, len(record) + 1)):
+            p = (base, tuple(record[:i]))
+            if p not in seen:
+                seen.add(p)
+                positions.append(p)
+    positions.sort(key=lambda p: len(p[1]))
+    return positions
+
+
+def position_command(base, moves):
+    cmd = "position startpos" if base == "startpos" else "position sfen " + base
+    if moves:
+        cmd += " moves " + " ".join(moves)
+    return cmd
+
+
+async def _resolve_chunk(engine, chunk):
+    for base, moves in chunk:
+        engine.send(position_command(base, moves))
+        engine.send("d")
+    lines = await engine.isready(timeout=600.0)
+    sfens = [line[5:] for line in lines if line.startswith("sfen ")]
+    if len(sfens) != len(chunk):
+        raise UsiEngineError(f"{engine.path} : expected {len(chunk)} sfen lines for 'd', got {len(sfens)}")
+    return sfens
+
+
+async def resolve_sfens(engines, positions):
+    """
+    局面の (開始局面, 指し手) のlistを、エンジンの"d"コマンドでsfen(手数つき)のlistにする。
+    RESOLVE_CHUNK局面ずつ、空いたエンジンに分担させる。(Python側で指し手を適用しなくて済む)
+    """
+    chunks = [positions[i:i + RESOLVE_CHUNK] for i in range(0, len(positions), RESOLVE_CHUNK)]
+    sfens = [None] * len(chunks)
+    next_chunk = iter(range(len(chunks)))
+
+    async def worker(engine):
+        for i in next_chunk:
+            sfens[i] = await _resolve_chunk(engine, chunks[i])
+
+    await asyncio.gather(*(worker(engine) for engine in engines))
+    return [s for chunk in sfens for s in chunk]
+
+
+def needs_thinking(moves, depth, multipv):
+    """ 定跡の指し手movesの局面を、今回の設定で思考し直すべきか。(makebook thinkと同じ判定)"""
+    if not moves:
+        return True
+    return moves[0].depth < depth or (moves[0].depth == depth and len(moves) < multipv)
+
+
+# ======================================================================
+# journal と 定跡のマージ
+# ======================================================================
+
+def load_journal(path):
+    """
+    journalを読んで (sfen, BookMoveのlist) のlistを返す。ファイルがなければ空のlist。
+    書き込み中に落ちて末尾の局面が途中で切れていたら、その局面を切り詰めてから読む。
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\nsfen ") + 1)
+    return list(iter_book(path))
+
+
+def merge_books(sources, updates=()):
+    """
+    sfen文字列の順に並んだ定跡(sfen, BookMoveのlist)のiterableをいくつかと、上書きする局面のiterableをマージして、
+    sfen文字列の順に (sfen, BookMoveのlist) を返すgenerator。
+    手数違いの同じ局面は1つにまとめて手数の一番小さいsfenを使い、指し手はupdatesにあればそれ、
+    なければsourcesのうち後ろのもの(同じsourceなら手数の小さいもの)を使う。
+    updatesは並んでいなくてよい。
+    """
+    # (sfen, 優先順位, moves) 。優先順位が大きいほうを採用する。
+    streams = [((sfen, i, moves) for sfen, moves in source) for i, source in enumerate(sources)]
+    streams.append((sfen, len(sources), moves) for sfen, moves in sorted(updates, key=lambda e: e[0]))
+
+    # 手数以外が同じsfen文字列は、sfen文字列の辞書順でも隣り合う。
+    for body, group in groupby(heapq.merge(*streams, key=lambda e: e[0]), key=lambda e: trim_ply(e[0])):
+        group = list(group)
+        sfen = min((e[0] for e in group), key=sfen_ply)
+        moves = max(group, key=lambda e: (e[1], -sfen_ply(e[0])))[2]
+        yield sfen, moves
+
+
+# ======================================================================
+# エンジン
+# ======================================================================
+
+def engine_specs(engine, workers, remotes):
+    """ --engine/--workers/--remote から、起動するエンジンのEngineSpecのlistを作る。"""
+    specs = [EngineSpec(f"local{i + 1}", engine, ()) for i in range(workers)]
+    for remote in remotes:
+        host, _, rest = remote.partition(":")
+        count, _, path = rest.partition(":")
+        count = int(count) if count else 1
+        for i in range(count):
+            specs.append(EngineSpec(f"{host}{i + 1}", "ssh", ("-T", host, path or engine)))
+    return specs
+
+
+class BookBuilder:
+    """
+    定跡を広げる処理1回分。
+
+    options : エンジンに送るsetoptionの (name, value) のlist。Threads/USI_Hash/MultiPV/BookFileは自動で送る。
+    """
+
+    def __init__(self, book_path, specs, depth=24, nodes=0, multipv=1, threads=1, hash_mb=256, options=(),
+                 cluster=(1, 1), save_interval=15 * 60, out_path=None):
+        self.book_path = book_path
+        self.out_path = out_path or book_path
+        self.journal_path = self.out_path + ".journal"
+        self.specs = specs
+        self.depth = depth
+        self.nodes = nodes
+        self.multipv = multipv
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.options = list(options)
+        self.cluster_id, self.cluster_num = cluster
+        self.save_interval = save_interval
+
+        self.results = {}       # book_key → (sfen, BookMoveのlist) 。今回とjournalの思考結果
+        self.engines = []
+        self.journal = None
+        self.total = 0
+        self.done = 0
+        self.appended = False
+        self.last_save = time.time()
+
+    # ------------------------------------------------------------------
+
+    async def _start_engine(self, spec):
+        cwd = None if spec.path == "ssh" else (os.path.dirname(os.path.abspath(spec.path)) or None)
+        engine = await UsiEngine(spec.path, spec.args, cwd=cwd).start()
+        await engine.usi()
+        engine.setoption("Threads", self.threads)
+        engine.setoption("USI_Hash", self.hash_mb)
+        engine.setoption("MultiPV", self.multipv)
+        engine.setoption("BookFile", "no_book")
+        for name, value in self.options:
+            engine.setoption(name, value)
+        await engine.isready(timeout=600.0)
+        engine.spec = spec
+        return engine
+
+    async def start_engines(self):
+        self.engines = await asyncio.gather(*(self._start_engine(spec) for spec in self.specs))
+        print(f"engines : {len(self.engines)} ({self.engines[0].name})")
+
+    async def stop_engines(self):
+        await asyncio.gather(*(engine.quit() for engine in self.engines), return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # 思考
+    # ------------------------------------------------------------------
+
+    def select(self, sfens):
+        """ sfenのlistから、重複と思考済みの局面を除き、このマシンの担当分の (key, sfen) のlistを返す。"""
+        book = BookDB(self.book_path, ignore_ply=True) if os.path.exists(self.book_path) else None
+        try:
+            seen = set()
+            targets = []
+            for sfen in sfens:
+                key = book_key(sfen)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if (key % self.cluster_num) != self.cluster_id - 1:
+                    continue
+                if key in self.results:
+                    moves = self.results[key][1]
+                else:
+                    moves = book.probe(sfen) if book is not None else None
+                if needs_thinking(moves, self.depth, self.multipv):
+                    targets.append((key, sfen))
+            return targets
+        finally:
+            if book is not None:
+                book.close()
+
+    def go_command(self):
+        s = f"depth {self.depth}"
+        if self.nodes:
+            s += f" nodes {self.nodes}"
+        return s
+
+    async def think(self, engine, sfen):
+        """ 1局面を思考させて、定跡の指し手のlistを返す。詰んでいるなどで指し手がなければNone。"""
+        engine.send("usinewgame")
+        engine.position(sfen)
+        search = engine.go(self.go_command())
+        last = {}
+        async for rec in search:
+            if rec.pv and rec.score is not None:
+                last[rec.multipv or 1] = rec
+        if search.bestmove.move in ("resign", "win") or not last:
+            return None
+        moves = []
+        for i in sorted(last)[:self.multipv]:
+            rec = last[i]
+            ponder = rec.pv[1] if len(rec.pv) >= 2 else "none"
+            moves.append(BookMove(rec.pv[0], ponder, rec.score, self.depth, THINK_MOVE_COUNT))
+        return sort_moves(moves)
+
+    def _append(self, key, sfen, moves):
+        self.results[key] = (sfen, moves)
+        lines = ["sfen " + sfen] + [f"{m.move} {m.ponder} {m.value} {m.depth} {m.move_count}" for m in moves]
+        self.journal.write("\n".join(lines) + "\n")
+        self.journal.flush()
+        self.appended = True
+
+    async def _think_worker(self, engine, queue):
+        while not queue.empty():
+            key, sfen = queue.get_nowait()
+            start = time.time()
+            moves = await self.think(engine, sfen)
+            self.done += 1
+            if moves is not None:
+                self._append(key, sfen, moves)
+            print(f"[{self.done}/{self.total}:{engine.spec.name}] {time.strftime('%Y/%m/%d %H:%M:%S')}"
+                  f" {time.time() - start:.1f}s : {sfen}")
+            sys.stdout.flush()
+            if self.save_interval and time.time() - self.last_save >= self.save_interval:
+                self.save()
+
+    # ------------------------------------------------------------------
+
+    def save(self):
+        """ 元の定跡に思考結果をマージして書き出す。前回から追加がなければ何もしない。"""
+        self.last_save = time.time()
+        if not self.appended:
+            return
+        start = time.time()
+        sources = [iter_book(self.book_path)] if os.path.exists(self.book_path) else []
+        count = write_book(self.out_path, merge_books(sources, self.results.values()))
+        # out_pathが元の定跡と同じなら、次からはマージ済みの定跡が元になる。
+        self.appended = False
+        print(f"saved {self.out_path} : {count} positions , {time.time() - start:.1f}s")
+
+    async def run(self, records, start_moves=1, moves=16):
+        for sfen, book_moves in load_journal(self.journal_path):
+            self.results[book_key(sfen)] = (sfen, book_moves)
+        if self.results:
+            print(f"resume : {len(self.results)} positions in {self.journal_path}")
+            self.appended = True
+
+        positions = enumerate_positions(records, start_moves, moves)
+        print(f"positions : {len(positions)} (moves {start_moves} to {moves})")
+
+        await self.start_engines()
+        try:
+            start = time.time()
+            sfens = await resolve_sfens(self.engines, positions)
+            targets = self.select(sfens)
+            self.total = len(targets)
+            print(f"thinking : {self.total} positions (cluster {self.cluster_id}/{self.cluster_num}) ,"
+                  f" resolved in {time.time() - start:.1f}s")
+
+            queue = asyncio.Queue()
+            for target in targets:
+                queue.put_nowait(target)
+            new_journal = not os.path.exists(self.journal_path)
+            with open(self.journal_path, "a", encoding="utf-8", newline="\n") as self.journal:
+                if new_journal:
+                    self.journal.write(BOOK_HEADER + "\n")
+                start = time.time()
+                await asyncio.gather(*(self._think_worker(engine, queue) for engine in self.engines))
+            elapsed = time.time() - start
+            if self.total:
+                print(f"done : {self.done} positions in {elapsed:.1f}s ({self.done / max(elapsed, 1e-9):.2f} positions/s)")
+        finally:
+            self.journal = None
+            await self.stop_engines()
+            self.save()
+        # 最後まで終わって定跡に書き出せたので、journalはもう要らない。(中断したときは再開用に残す)
+        os.remove(self.journal_path)
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [r for r in (parse_record(line) for line in f) if r is not None]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expand a YaneuraOu book by analysing game positions on a pool of USI engines.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("think", help="Analyse positions from a record file with fixed depth MultiPV and add them to the book.")
+    p.add_argument("--engine", type=str, required=True, help="Engine executable.")
+    p.add_argument("--sfen_file", type=str, required=True, help="Record file. One game per line ('startpos moves ...' or 'sfen ... moves ...').")
+    p.add_argument("--book", type=str, required=True, help="Book file (.db) to expand. Created if it does not exist.")
+    p.add_argument("--out", type=str, default="", help="Write the merged book here instead of overwriting --book.")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of local engine processes.")
+    p.add_argument("--remote", type=str, action="append", default=[], help="host:N[:path] - start N engines with 'ssh host path'. Can be given multiple times.")
+    p.add_argument("--threads", type=int, default=1, help="Threads per engine process.")
+    p.add_argument("--hash", type=int, default=256, help="USI_Hash per engine process [MB].")
+    p.add_argument("--option", type=str, action="append", default=[], help="NAME=VALUE engine option. Can be given multiple times.")
+    p.add_argument("--depth", type=int, default=24, help="Search depth.")
+    p.add_argument("--nodes", type=int, default=0, help="Node limit per position (0 = no limit).")
+    p.add_argument("--multipv", type=int, default=1, help="Number of moves added per position.")
+    p.add_argument("--start_moves", type=int, default=1, help="First ply to analyse (the initial position is ply 1).")
+    p.add_argument("--moves", type=int, default=16, help="Last ply to analyse.")
+    p.add_argument("--cluster", type=str, default="1/1", help="ID/NUM - analyse only this machine's share when NUM machines split the work.")
+    p.add_argument("--save_interval", type=int, default=15 * 60, help="Seconds between book saves (0 = only at the end).")
+
+    p = sub.add_parser("merge", help="Merge books and journals into one book. Later files win for the same position.")
+    p.add_argument("out", type=str, help="Output book file (.db).")
+    p.add_argument("inputs", type=str, nargs="+", help="Book files (.db) or journals (.journal).")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        start = time.time()
+        # journalはsfenの順に並んでいないので、並べてからマージする。
+        sources = [sorted(iter_book(path), key=lambda e: e[0]) if path.endswith(".journal") else iter_book(path)
+                   for path in args.inputs]
+        count = write_book(args.out, merge_books(sources))
+        print(f"{args.out} : {count} positions , {time.time() - start:.1f}s")
+        return
+
+    cluster_id, _, cluster_num = args.cluster.partition("/")
+    cluster = (int(cluster_id), int(cluster_num or 1))
+    if not 1 <= cluster[0] <= cluster[1]:
+        print(f"Error! bad cluster : {args.cluster}")
+        sys.exit(1)
+
+    options = []
+    for option in args.option:
+        name, sep, value = option.partition("=")
+        if not sep:
+            print(f"Error! bad option (NAME=VALUE) : {option}")
+            sys.exit(1)
+        options.append((name, value))
+
+    specs = engine_specs(args.engine, args.workers, args.remote)
+    if not specs:
+        print("Error! no engines (--workers 0 and no --remote)")
+        sys.exit(1)
+
+    records = read_records(args.sfen_file)
+    print(f"records : {len(records)} , engines : {len(specs)} , depth : {args.depth} , nodes : {args.nodes} , multipv : {args.multipv}")
+
+    builder = BookBuilder(args.book, specs, depth=args.depth, nodes=args.nodes, multipv=args.multipv,
+                          threads=args.threads, hash_mb=args.hash, options=options, cluster=cluster,
+                          save_interval=args.save_interval, out_path=args.out or None)
+    asyncio.run(builder.run(records, args.start_moves, args.moves))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,516 @@
+"""
+やねうら王の定跡DBファイル(#YANEURAOU-DB2016 1.00 形式の .db)を、ファイルを丸読みせずに引くモジュール。
+
+.db ファイルはmmapで開き、"sfen "で始まる行のファイル上の位置を並べたインデックスを
+定跡ファイルの横に "<定跡ファイル>.idx" として作っておく。2回目からはインデックスもmmapで開くだけなので、
+数GBの定跡(makebook peta_shock で作ったものなど)でも開くのは一瞬で、局面あたり数マイクロ秒で引ける。
+
+    with BookDB("user_book1.db") as book:
+        moves = book.probe(sfen)                 # 見つからなければNone
+        results = book.probe_many(sfen_list)     # 大量の局面をまとめて引く
+
+定跡ファイルの形式 (source/book/book.cpp の MemoryBook::write_book() が書き出すもの):
+    #YANEURAOU-DB2016 1.00
+    sfen <sfen文字列(末尾に手数あり)>
+    <指し手> <相手の応手> <評価値> <探索深さ> <採択回数>
+    ...
+  - "sfen"の行はsfen文字列の辞書順に並んでいること。(エンジンの BookOnTheFly と同じ前提)
+  - '#' と "//" で始まる行は読み飛ばす。評価値以降は省略可。
+
+probe() は BookOnTheFly と同じく、インデックス上の二分探索で局面を探す。
+probe_many() は、インデックスに入れてある局面の64bitハッシュ値を numpy.searchsorted でまとめて引く。
+
+ignore_ply=True はエンジンの IgnoreBookPly オプションに相当し、sfen文字列の末尾の手数を無視して比較する。
+flipped=True はエンジンの FlippedBook オプションに相当し、見つからなければ盤面を先後反転した局面も探して、
+指し手も反転して返す。
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 定跡ファイルの1行目(バージョン識別文字列)
+BOOK_HEADER = "#YANEURAOU-DB2016 1.00"
+
+# 平手の初期局面
+STARTPOS_SFEN = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+# インデックスファイルのヘッダ : magic , 定跡ファイルのサイズ , 定跡ファイルの更新時刻[ns] , 局面数
+INDEX_MAGIC = b"YOBKIDX1"
+INDEX_HEADER = struct.Struct("<8sQQQ")
+
+# インデックスを作るときに定跡ファイルを走査する単位
+SCAN_CHUNK = 64 * 1024 * 1024
+
+# 定跡の1手。moveとponderはUSIの指し手文字列("none"もありうる)。
+BookMove = namedtuple("BookMove", "move ponder value depth move_count")
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+# ======================================================================
+# sfen文字列の操作
+# ======================================================================
+
+def trim_ply(sfen):
+    """
+    sfen文字列の末尾の手数を取り除く。StringExtension::trim_number() と同じく、
+    末尾の空白 → 数字 → 空白 の順に取り除く。bytesでもstrでもよい。
+    """
+    space, digits = (b" \t\r\n", b"0123456789") if isinstance(sfen, bytes) else (" \t\r\n", "0123456789")
+    return sfen.rstrip(space).rstrip(digits).rstrip(space)
+
+
+def sfen_ply(sfen):
+    """ sfen文字列の末尾の手数。なければ0。"""
+    ply = sfen[len(trim_ply(sfen)):].strip()
+    return int(ply) if ply.isdigit() else 0
+
+
+def normalize_sfen(sfen):
+    """ 先頭の"sfen "を取り除き、"startpos"を平手の初期局面のsfenにする。"""
+    sfen = sfen.strip()
+    if sfen.startswith("sfen "):
+        sfen = sfen[5:].strip()
+    if sfen == "startpos":
+        sfen = STARTPOS_SFEN
+    return sfen
+
+
+# 手駒をsfenに書く順番 (Position::sfen() の USI_Hand と同じ)
+_HAND_ORDER = "RBGSNLP"
+
+
+def flip_sfen(sfen):
+    """
+    盤面を先後反転したsfen文字列を返す。Position::sfen_to_flipped_sfen() を文字列操作だけで行うもの。
+    手数はそのまま残す。
+    """
+    fields = sfen.split()
+    board, turn, hand = fields[0], fields[1], fields[2]
+
+    # 盤面は180度回転させて、駒の先後(大文字/小文字)を入れ替える。"+"は直後の駒にかかるので駒と一緒に動かす。
+    rows = []
+    for row in reversed(board.split("/")):
+        tokens = []
+        promote = ""
+        for c in row:
+            if c == "+":
+                promote = c
+                continue
+            tokens.append(promote + c.swapcase())
+            promote = ""
+        rows.append("".join(reversed(tokens)))
+
+    # 手駒は先手の分 → 後手の分 の順に、それぞれ_HAND_ORDERの順で書き直す。
+    counts = {}
+    if hand != "-":
+        n = 0
+        for c in hand:
+            if c.isdigit():
+                n = n * 10 + int(c)
+            else:
+                counts[c.swapcase()] = n if n else 1
+                n = 0
+    new_hand = ""
+    for pieces in (_HAND_ORDER, _HAND_ORDER.lower()):
+        for p in pieces:
+            n = counts.get(p, 0)
+            if n:
+                new_hand += (str(n) if n > 1 else "") + p
+
+    return " ".join(["/".join(rows), "w" if turn == "b" else "b", new_hand or "-"] + fields[3:])
+
+
+def _flip_square(file_char, rank_char):
+    return str(10 - int(file_char)) + chr(ord("a") + ord("i") - ord(rank_char))
+
+
+def flip_move(move):
+    """ USIの指し手を、盤面を先後反転したときの指し手にする。"none"などはそのまま。"""
+    if len(move) < 4:
+        return move
+    if move[1] == "*":
+        return move[:2] + _flip_square(move[2], move[3]) + move[4:]
+    if move[0].isdigit():
+        return _flip_square(move[0], move[1]) + _flip_square(move[2], move[3]) + move[4:]
+    return move
+
+
+def parse_move_line(line):
+    """ 定跡の指し手の行をBookMoveにする。BookMove::from_string() と同じく、評価値以降は省略可。"""
+    tokens = line.split()
+    move = tokens[0]
+    ponder = tokens[1] if len(tokens) > 1 else "none"
+    if move in ("None", "resign"):
+        move = "none"
+    if ponder in ("None", "resign"):
+        ponder = "none"
+    value = int(tokens[2]) if len(tokens) > 2 else 0
+    depth = int(tokens[3]) if len(tokens) > 3 else 0
+    move_count = int(tokens[4]) if len(tokens) > 4 else 1
+    return BookMove(move, ponder, value, depth, move_count)
+
+
+def sort_moves(moves):
+    """ BookMoves::sort_moves() と同じく、採択回数 → 評価値 の降順に(安定ソートで)並べる。"""
+    moves.sort(key=lambda m: (-m.move_count, -m.value))
+    return moves
+
+
+def iter_book(path):
+    """
+    定跡ファイルを先頭から順に読んで、(sfen, BookMoveのlist) を返すgenerator。
+    インデックスを作らずに全局面を1回なめるとき(変換など)に使う。sfenは手数を含んだまま。
+    """
+    sfen = None
+    moves = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip()
+            if not line or line.startswith("#") or line.startswith("//"):
+                continue
+            if line.startswith("sfen "):
+                if sfen is not None and moves:
+                    yield sfen, sort_moves(moves)
+                sfen = line[5:].strip()
+                moves = []
+            elif sfen is not None:
+                moves.append(parse_move_line(line))
+    if sfen is not None and moves:
+        yield sfen, sort_moves(moves)
+
+
+def write_book(path, entries):
+    """
+    (sfen, BookMoveのlist) を並べたものを定跡ファイルに書き出す。局面はこの順番のまま書き出すので、
+    エンジンやBookDBで引くならsfen文字列の辞書順に並べて渡すこと。書き出した局面数を返す。
+    一時ファイルに書いてからos.replace()するので、書き出し中に落ちても元のファイルは壊れない。
+    """
+    tmp_path = path + ".tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(BOOK_HEADER + "\n")
+        for sfen, moves in entries:
+            f.write("sfen " + sfen + "\n")
+            for m in moves:
+                f.write(f"{m.move} {m.ponder} {m.value} {m.depth} {m.move_count}\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def _key_hash(key):
+    """ 手数を取り除いた局面のbytesから、probe_many()で使う64bitのハッシュ値を求める。"""
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+# ======================================================================
+# 定跡DB
+# ======================================================================
+
+class BookDB:
+    """
+    mmapで開いた定跡DBファイル。
+
+    path       : 定跡ファイル(.db)
+    index_path : インデックスファイル。省略時は path + ".idx" 。
+                 定跡ファイルのサイズか更新時刻が変わっていたら作り直す。書き込めなければメモリ上に持つだけにする。
+    ignore_ply : probe()/probe_many() の既定値。Trueならsfenの手数を無視して比較する。
+    flipped    : probe()/probe_many() の既定値。Trueなら先後反転した局面も探す。
+
+    offsets : 各局面の"sfen "の直後のファイル位置。ファイルの並び順(=sfen文字列の辞書順)。
+    hashes  : 各局面の(手数を除いた)sfenのハッシュ値を昇順に並べたもの。
+    order   : hashes[i] の局面が offsets の何番目か。
+    """
+
+    def __init__(self, path, index_path=None, ignore_ply=False, flipped=False):
+        _require_numpy()
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.ignore_ply = ignore_ply
+        self.flipped = flipped
+
+        self._file = open(path, "rb")
+        st = os.fstat(self._file.fileno())
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        # 空のファイルはmmapできない。
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+
+        if not self._load_index():
+            self._build_index()
+
+    # ------------------------------------------------------------------
+    # インデックス
+    # ------------------------------------------------------------------
+
+    def _load_index(self):
+        """ 定跡ファイルと合っているインデックスファイルがあれば開く。 """
+        try:
+            with open(self.index_path, "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+        except OSError:
+            return False
+        if len(header) != INDEX_HEADER.size:
+            return False
+        magic, size, mtime_ns, count = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or size != self.size or mtime_ns != self.mtime_ns:
+            return False
+        if os.path.getsize(self.index_path) != INDEX_HEADER.size + count * 8 * 3:
+            return False
+        if count == 0:
+            self._set_index(np.zeros(0, np.uint64), np.zeros(0, np.uint64), np.zeros(0, np.uint64))
+            return True
+        index = np.memmap(self.index_path, dtype=np.uint64, mode="r", offset=INDEX_HEADER.size, shape=(3, count))
+        self._set_index(index[0], index[1], index[2])
+        return True
+
+    def _set_index(self, offsets, hashes, order):
+        self.offsets = offsets
+        self.hashes = hashes
+        self.order = order
+        # 1要素ずつ読むときはnumpyの添字アクセスが遅いので、memoryview経由でintとして読む。
+        self._offset_view = memoryview(offsets) if offsets is not None else None
+        self._hash_view = memoryview(hashes) if hashes is not None else None
+        self._order_view = memoryview(order) if order is not None else None
+
+    def _scan_offsets(self):
+        """ "\\nsfen " の位置を numpy でまとめて探して、各局面のsfen文字列の先頭位置を返す。 """
+        mm = self._mm
+        if not self.size:
+            return np.zeros(0, np.uint64)
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        pattern = np.frombuffer(b"sfen ", dtype=np.uint8)
+        parts = []
+        if mm[:5] == b"sfen ":
+            parts.append(np.array([5], np.int64))
+        for start in range(0, self.size, SCAN_CHUNK):
+            end = min(start + SCAN_CHUNK, self.size)
+            nl = np.flatnonzero(buf[start:end] == 10) + start
+            # 改行の後ろに"sfen "が収まらないものは除く。
+            nl = nl[nl + 5 < self.size]
+            mask = np.ones(len(nl), dtype=bool)
+            for k, c in enumerate(pattern):
+                mask &= buf[nl + 1 + k] == c
+            parts.append(nl[mask] + 6)
+        del buf
+        return np.concatenate(parts).astype(np.uint64) if parts else np.zeros(0, np.uint64)
+
+    def _build_index(self):
+        offsets = self._scan_offsets()
+        count = len(offsets)
+        hashes = np.empty(count, dtype=np.uint64)
+        prev = None
+        for i, off in enumerate(offsets.tolist()):
+            key = self._key_at(off)
+            # 二分探索するので、エンジンのBookOnTheFlyと同じくsfen文字列の辞書順に並んでいる必要がある。
+            if prev is not None and key <= prev:
+                raise ValueError(f"{self.path} is not sorted at byte {off} . Please rewrite it with 'makebook' (MemoryBook::write_book).")
+            prev = key
+            hashes[i] = _key_hash(trim_ply(key))
+        order = np.argsort(hashes, kind="stable").astype(np.uint64)
+        hashes = hashes[order]
+        self._set_index(offsets, hashes, order)
+
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.size, self.mtime_ns, count))
+                offsets.tofile(f)
+                hashes.tofile(f)
+                order.tofile(f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Warning : could not write the book index {self.index_path} : {e}")
+
+    # ------------------------------------------------------------------
+    # 読み出し
+    # ------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _key_at(self, off):
+        """ ファイル位置offから始まるsfen文字列(bytes, 手数を含む)。 """
+        end = self._mm.find(b"\n", off)
+        if end < 0:
+            end = self.size
+        return self._mm[off:end].rstrip(b"\r \t")
+
+    def _moves_at(self, off):
+        """ ファイル位置offのsfenの次の行から、次の"sfen "の行までの指し手を読む。 """
+        mm = self._mm
+        pos = mm.find(b"\n", off)
+        moves = []
+        while 0 <= pos < self.size:
+            end = mm.find(b"\n", pos + 1)
+            if end < 0:
+                end = self.size
+            line = mm[pos + 1:end].rstrip(b"\r")
+            pos = end
+            if not line or line.startswith(b"sfen "):
+                break
+            if line.startswith(b"#") or line.startswith(b"//"):
+                continue
+            moves.append(parse_move_line(line.decode("ascii")))
+        return sort_moves(moves)
+
+    def _bsearch(self, key, ignore_ply):
+        """ offsetsを二分探索して、keyの局面のファイル位置を返す。なければ-1。 """
+        offsets = self._offset_view
+        mm = self._mm
+        lo, hi = 0, len(offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = offsets[mid]
+            end = mm.find(b"\n", off)
+            k = mm[off:end if end >= 0 else self.size].rstrip(b"\r \t")
+            if ignore_ply:
+                k = trim_ply(k)
+            if k < key:
+                lo = mid + 1
+            elif key < k:
+                hi = mid
+            else:
+                return off
+        return -1
+
+    def _hash_lookup(self, key, h, pos, ignore_ply):
+        """ hashes[pos]から同じハッシュ値の局面を順に見て、keyと一致するもののファイル位置を返す。なければ-1。 """
+        hashes = self._hash_view
+        while pos < len(hashes) and hashes[pos] == h:
+            off = self._offset_view[self._order_view[pos]]
+            k = self._key_at(off)
+            if (trim_ply(k) if ignore_ply else k) == key:
+                return off
+            pos += 1
+        return -1
+
+    @staticmethod
+    def _query_key(sfen, ignore_ply):
+        key = normalize_sfen(sfen).encode("ascii")
+        return trim_ply(key) if ignore_ply else key
+
+    def probe(self, sfen, ignore_ply=None, flipped=None):
+        """
+        sfenの局面の定跡の指し手を、BookMoveのlist(採択回数 → 評価値 の降順)で返す。なければNone。
+        flippedで反転した局面が見つかったときは、指し手も反転して返す。
+        """
+        ignore_ply = self.ignore_ply if ignore_ply is None else ignore_ply
+        flipped = self.flipped if flipped is None else flipped
+        sfen = normalize_sfen(sfen)
+
+        off = self._bsearch(self._query_key(sfen, ignore_ply), ignore_ply)
+        if off >= 0:
+            return self._moves_at(off)
+        if flipped:
+            off = self._bsearch(self._query_key(flip_sfen(sfen), ignore_ply), ignore_ply)
+            if off >= 0:
+                return [m._replace(move=flip_move(m.move), ponder=flip_move(m.ponder)) for m in self._moves_at(off)]
+        return None
+
+    def probe_many(self, sfens, ignore_ply=None, flipped=None):
+        """
+        probe()をまとめて行う。sfensと同じ順番で、BookMoveのlistかNoneを並べたlistを返す。
+        ハッシュ値の探索は numpy.searchsorted で一度に行うので、大量の局面を引くときはprobe()を繰り返すより速い。
+        """
+        ignore_ply = self.ignore_ply if ignore_ply is None else ignore_ply
+        flipped = self.flipped if flipped is None else flipped
+        sfens = [normalize_sfen(s) for s in sfens]
+
+        offs = self._lookup_many(sfens, ignore_ply)
+        results = [self._moves_at(off) if off >= 0 else None for off in offs]
+
+        if flipped:
+            missing = [i for i, r in enumerate(results) if r is None]
+            if missing:
+                flip_offs = self._lookup_many([flip_sfen(sfens[i]) for i in missing], ignore_ply)
+                for i, off in zip(missing, flip_offs):
+                    if off >= 0:
+                        results[i] = [m._replace(move=flip_move(m.move), ponder=flip_move(m.ponder))
+                                      for m in self._moves_at(off)]
+        return results
+
+    def _lookup_many(self, sfens, ignore_ply):
+        keys = [self._query_key(s, ignore_ply) for s in sfens]
+        hs = np.fromiter((_key_hash(trim_ply(k)) for k in keys), dtype=np.uint64, count=len(keys))
+        pos = np.searchsorted(self.hashes, hs).tolist()
+        return [self._hash_lookup(k, h, p, ignore_ply) for k, h, p in zip(keys, hs.tolist(), pos)]
+
+    def __iter__(self):
+        """ ファイルの並び順に (sfen, BookMoveのlist) を返す。 """
+        for off in self.offsets.tolist():
+            yield self._key_at(off).decode("ascii"), self._moves_at(off)
+
+    # ------------------------------------------------------------------
+
+    def close(self):
+        for view in (self._offset_view, self._hash_view, self._order_view):
+            if view is not None:
+                view.release()
+        self._set_index(None, None, None)
+        if self.size:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up positions in a YaneuraOu-DB2016 book file without loading it.")
+    parser.add_argument('book', type=str, help="Book file (.db). The index is written next to it as <book>.idx.")
+    parser.add_argument('--sfen', type=str, action="append", default=[], help="Position to look up. Can be given multiple times.")
+    parser.add_argument('--sfen_file', type=str, default="", help="File with one sfen per line to look up.")
+    parser.add_argument('--ignore_ply', action="store_true", help="Ignore the ply at the end of the sfen (IgnoreBookPly).")
+    parser.add_argument('--flipped', action="store_true", help="Also look up the flipped position (FlippedBook).")
+    args = parser.parse_args()
+
+    import time
+    start = time.perf_counter()
+    with BookDB(args.book, ignore_ply=args.ignore_ply, flipped=args.flipped) as book:
+        print(f"{args.book} : {len(book)} positions , opened in {time.perf_counter() - start:.3f}s")
+
+        sfens = list(args.sfen)
+        if args.sfen_file:
+            with open(args.sfen_file, "r", encoding="utf-8") as f:
+                sfens.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        if not sfens:
+            return
+
+        start = time.perf_counter()
+        results = book.probe_many(sfens)
+        elapsed = time.perf_counter() - start
+        hits = sum(r is not None for r in results)
+        if len(sfens) <= 20:
+            for sfen, moves in zip(sfens, results):
+                print("sfen " + normalize_sfen(sfen))
+                for m in moves or []:
+                    print(f"  {m.move} {m.ponder} {m.value} {m.depth} {m.move_count}")
+                if moves is None:
+                    print("  (not found)")
+        print(f"probed {len(sfens)} positions , hit {hits} , {elapsed / len(sfens) * 1e6:.1f}us/position")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+対局ランナーの途中経過をJSONファイルに保存して、中断したところから再開するためのモジュール。
+
+engine_invoker.py の --checkpoint / --resume で使う。
+
+ファイルの中身:
+    {
+      "version": 1,
+      "book_seed": 12345,          # --rand_book のときの定跡シャッフルのseed
+      "blocks": {
+        "<evaldir>|<play_time>": { # vs_match 1回分(対局条件1つ分)の状態
+          "done": false,
+          "result": [win, lose, draw, win_black, win_white],
+          "sfen_no": 123,          # 次に使う定跡の行番号
+          "game_no": 130,          # 開始した対局の通し番号
+          "pending_sfen_nos": [..],# 保存時点で対局中/やり直し待ちだった対局の定跡の行番号
+          "kif_base": "...",       # 棋譜ファイル名の先頭部分
+          "kif_offsets": [..],     # 棋譜ファイルの保存時点でのバイト位置(CSAなら対局スロットごと)
+          "telemetry_part": 3      # テレメトリの次のpart番号
+        }
+      }
+    }
+"""
+import json
+import os
+import threading
+
+CHECKPOINT_VERSION = 1
+
+
+class RunCheckpoint:
+    """
+    チェックポイントファイル1つ分。
+    書き込みは一時ファイルに書いてからos.replace()するので、保存中に落ちても壊れたファイルは残らない。
+    scheduler.py から複数の対局条件を並行して走らせるときは、別スレッドから同時に更新される。
+    """
+
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data if data is not None else {"version": CHECKPOINT_VERSION, "blocks": {}}
+        self.lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"unsupported checkpoint version : {data.get('version')}")
+        return cls(path, data)
+
+    def save(self):
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=1)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+    def block(self, key):
+        """ keyの対局条件の保存済みの状態。なければNone。"""
+        return self.data["blocks"].get(key)
+
+    def update_block(self, key, **state):
+        """ keyの対局条件の状態を更新してファイルに保存する。"""
+        with self.lock:
+            self.data["blocks"].setdefault(key, {}).update(state)
+            self.save()
+
+    @property
+    def book_seed(self):
+        return self.data.get("book_seed")
+
+    @book_seed.setter
+    def book_seed(self, seed):
+        self.data["book_seed"] = seed
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+対局結果(勝ち・引き分け・負け)からElo・信頼区間・LOS・normalized Eloを求める統計モジュール。
+
+engine_invoker.py などの対局スクリプトと、結果ログの分析スクリプトはすべてここを使う。
+
+- 勝率(score)は引き分けを0.5勝として数える。
+- 分散は1局ごとの勝ち点(1 / 0.5 / 0)の標本分散(trinomial)から求める。
+  先後を入れ替えた2局を1組として数えられる場合は、1組の勝ち点(0, 0.5, 1, 1.5, 2)の
+  分散(pentanomial)を使うと、開始局面の有利不利が打ち消される分だけ区間が狭くなる。
+- 1局ごとに呼んでも負担にならないよう、スカラー版は math だけで計算する。
+  多数の集計をまとめて計算するときは numpy を使うベクトル版(elo_arrays)を使う。
+
+Python 2 の古いスクリプト(script/engine_invoker1.py など)からもimportできるように、
+Python 2.7 でも動く書き方にしてある。
+"""
+from __future__ import division
+
+import math
+from collections import namedtuple
+
+# 95%信頼区間に使う正規分布の分位点
+Z95 = 1.959963984540054
+
+# Eloと自然対数のスケールの比 (Elo = ELO_SCALE * ln(score / (1 - score)))
+ELO_SCALE = 400.0 / math.log(10.0)
+
+# normalized Elo の係数 (ELO_SCALEの2倍)
+NELO_SCALE = 2.0 * ELO_SCALE
+
+# 1組(2局)の勝ち点。pentanomialのカウントの並び順に対応する。
+PENTA_POINTS = (0.0, 0.25, 0.5, 0.75, 1.0)
+
+# games   : 対局数
+# score   : 勝率(引き分けは0.5勝)
+# elo     : Elo差。全勝/全敗なら±inf、対局がなければnan。
+# elo_lo  : Elo差の信頼区間の下限
+# elo_hi  : Elo差の信頼区間の上限
+# los     : 優越確率(Likelihood Of Superiority)。引き分けは情報を持たないものとして勝ちと負けの数から求める。
+# nelo    : normalized Elo。勝率の差を標準偏差で割ったもので、引き分け率や持ち時間によらず比較できる。
+EloStats = namedtuple("EloStats", "games score elo elo_lo elo_hi los nelo")
+
+
+def elo_from_score(score):
+    """ 勝率をElo差にする。"""
+    if score <= 0.0:
+        return float("-inf")
+    if score >= 1.0:
+        return float("inf")
+    return 400.0 * math.log10(score / (1.0 - score))
+
+
+def score_from_elo(elo):
+    """ Elo差を期待勝率にする。"""
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def los(win, lose):
+    """ 勝ちと負けの数から、優越確率(正規近似)を求める。"""
+    n = win + lose
+    if n == 0:
+        return 0.5
+    return 0.5 * (1.0 + math.erf((win - lose) / math.sqrt(2.0 * n)))
+
+
+def _stats(games, score, var, los_value, z):
+    """ 1局あたりの勝率scoreとその分散varから、EloStatsを作る。"""
+    if games == 0:
+        nan = float("nan")
+        return EloStats(0, nan, nan, nan, nan, 0.5, nan)
+    se = math.sqrt(var / games)
+    lo = min(max(score - z * se, 0.0), 1.0)
+    hi = min(max(score + z * se, 0.0), 1.0)
+    if var > 0.0:
+        nelo = (score - 0.5) / math.sqrt(var) * NELO_SCALE
+    else:
+        nelo = float("nan")
+    return EloStats(games, score, elo_from_score(score), elo_from_score(lo), elo_from_score(hi),
+                    los_value, nelo)
+
+
+def trinomial(win, draw, lose, z=Z95):
+    """ 1局ごとの勝敗の数からEloStatsを求める。"""
+    n = win + draw + lose
+    if n == 0:
+        return _stats(0, 0.0, 0.0, 0.5, z)
+    score = (win + 0.5 * draw) / n
+    var = (win * (1.0 - score) ** 2 + draw * (0.5 - score) ** 2 + lose * score ** 2) / n
+    return _stats(n, score, var, los(win, lose), z)
+
+
+def pentanomial(counts, z=Z95):
+    """
+    先後を入れ替えた2局を1組とした結果からEloStatsを求める。
+    counts : 1組の勝ち点が 0, 0.5, 1, 1.5, 2 だった組の数 (長さ5)
+    gamesは局数(組の数の2倍)を返す。nEloは1局あたりの標準偏差で割った値。
+    """
+    pairs = sum(counts)
+    if pairs == 0:
+        return _stats(0, 0.0, 0.0, 0.5, z)
+    score = sum(c * p for c, p in zip(counts, PENTA_POINTS)) / pairs
+    var_pair = sum(c * (p - score) ** 2 for c, p in zip(counts, PENTA_POINTS)) / pairs
+    # 組の数で割る標準誤差を、局数(=2*組)で割る形にそろえるため、1局あたりの分散は組の分散の2倍。
+    var = 2.0 * var_pair
+    # LOSは組の勝ち点の平均が0.5より大きい確率(正規近似)。
+    if var_pair > 0.0:
+        los_value = 0.5 * (1.0 + math.erf((score - 0.5) / math.sqrt(2.0 * var_pair / pairs)))
+    else:
+        los_value = 0.5 if score == 0.5 else float(score > 0.5)
+    return _stats(2 * pairs, score, var, los_value, z)
+
+
+def format_result(win, draw, lose, z=Z95):
+    """
+    "W - D - L(勝率% R±Elo [下限, 上限] LOS%)" の形式の文字列にする。
+    対局スクリプトの途中経過の表示用。
+    """
+    s = trinomial(win, draw, lose, z)
+    text = str(win) + " - " + str(draw) + " - " + str(lose)
+    if s.games == 0:
+        return text + "(0.0%)"
+    text += "(" + str(round(s.score * 100, 2)) + "%"
+    if not math.isinf(s.elo):
+        text += " R" + str(round(s.elo, 2))
+        if not (math.isinf(s.elo_lo) or math.isinf(s.elo_hi)):
+            text += " [" + str(round(s.elo_lo, 2)) + ", " + str(round(s.elo_hi, 2)) + "]"
+    text += " LOS " + str(round(s.los * 100, 1)) + "%)"
+    return text
+
+
+def elo_arrays(win, draw, lose, z=Z95):
+    """
+    trinomial()のベクトル版。win, draw, lose は同じ長さの配列。
+    戻り値 : EloStatsと同じ名前の、numpy配列を要素に持つEloStats。
+    対局がないところはnan、全勝/全敗のところは±inf。
+    """
+    import numpy as np
+
+    win = np.asarray(win, dtype=np.float64)
+    draw = np.asarray(draw, dtype=np.float64)
+    lose = np.asarray(lose, dtype=np.float64)
+    n = win + draw + lose
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = (win + 0.5 * draw) / n
+        var = (win * (1.0 - score) ** 2 + draw * (0.5 - score) ** 2 + lose * score ** 2) / n
+        se = np.sqrt(var / n)
+        lo = np.clip(score - z * se, 0.0, 1.0)
+        hi = np.clip(score + z * se, 0.0, 1.0)
+        to_elo = lambda s: 400.0 * np.log10(s / (1.0 - s))
+        nelo = np.where(var > 0.0, (score - 0.5) / np.sqrt(var) * NELO_SCALE, np.nan)
+        wl = win + lose
+        los_ = np.where(wl > 0, 0.5 * (1.0 + _erf(np.where(wl > 0, (win - lose) / np.sqrt(2.0 * wl), 0.0))), 0.5)
+        return EloStats(n, score, to_elo(score), to_elo(lo), to_elo(hi), los_, nelo)
+
+
+def _erf(x):
+    """
+    numpyの配列に対するerf。scipyに頼らないように近似式(Abramowitz & Stegun 7.1.26, 誤差1.5e-7)で求める。
+    LOSの表示にはこれで十分な精度。
+    """
+    import numpy as np
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    y = 1.0 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t * np.exp(-x * x)
+    return sign * y
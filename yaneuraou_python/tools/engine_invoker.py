@@ -3,10 +3,8 @@ import datetime
 import math
 import os.path
 import random
-import subprocess
 import sys
 import time
-import threading
 import queue
 try:
     import yaml
@@ -16,6 +14,14 @@ except ImportError:
 
 from enum import Enum, auto
 
+from usi_parser import parse_line, InfoRecord, BestMoveRecord, ReadyOkRecord, SearchInfo
+from telemetry import TelemetryRecorder
+from metrics import MatchMetrics, start_metrics_server
+from checkpoint import RunCheckpoint
+from adjudication import AdjudicationRules, GameAdjudicator
+from usi_engine import EngineHost
+from elo_stats import format_result
+
 # ======================================================================
 # 定数定義
 # ======================================================================
@@ -25,6 +31,8 @@ class EngineState(Enum):
     START = auto()
     WAIT_FOR_BESTMOVE = auto()
     WAIT_FOR_ANOTHER_PLAYER = auto()
+    PONDERING = auto()        # 相手の手番中に"go ponder"で思考している
+    PONDER_STOPPING = auto()  # 予想が外れて"stop"を送った。ponderのbestmoveを待ってから"go"を送る。
 
 class GameResult(Enum):
     P1_WIN = auto()
@@ -41,26 +49,18 @@ win = lose = draw = 0
 win_black = lose_black = 0
 
 # レーティングの出力
+# 勝率は引き分けを0.5勝として数え、Eloの95%信頼区間とLOSも表示する。(計算はelo_stats.py)
 def output_rating(win,draw,lose,win_black,win_white,opt2):
 	total = win + lose
 	if total != 0 :
-		# 普通の勝率
-		win_rate = win / total
 		# 先手番/後手番のときの勝率内訳
 		win_rate_black = win_black / total
 		win_rate_white = win_white / total
 	else:
-		win_rate = 0
 		win_rate_black = 0
 		win_rate_white = 0
 
-	if win_rate == 0 or win_rate == 1:
-		rating = ""
-	else:
-		rating = " R" + str(round(-400*math.log(1/win_rate-1,10),2))
-
-	print(opt2 + "," + str(win) + " - " + str(draw) + " - " + str(lose) + \
-		"(" + str(round(win_rate*100,2)) + "%" + rating + ")" + \
+	print(opt2 + "," + format_result(win,draw,lose) + \
 		" win black : white = " + \
 		str(round(win_rate_black*100,2)) + "% : " + \
 		str(round(win_rate_white*100,2)) + "%")
@@ -172,21 +172,6 @@ def create_option(engines,engine_threads,evals,times,hashes,PARAMETERS_LOG_FILE_
 
 	return options
 
-# エンジンからの出力を読み取り、メッセージキューに入れるスレッドのターゲット関数
-def read_engine_output(engine_idx, proc, message_queue):
-    while True:
-        line = proc.stdout.readline()
-        if line:
-            message_queue.put({'type': 'output', 'engine_idx': engine_idx, 'line': line})
-        else:
-            # エンジンが終了した場合
-            retcode = proc.poll()
-            if retcode is not None:
-                message_queue.put({'type': 'terminated', 'engine_idx': engine_idx, 'retcode': retcode})
-                break
-        time.sleep(0.001) # 短いスリープでビジーループを避ける
-
-
 # engine1とengine2とを対戦させる
 #  threads    : この数だけ並列対局
 #  cpu        : 実行するプロセッサグループの数
@@ -194,7 +179,29 @@ def read_engine_output(engine_idx, proc, message_queue):
 #  book_sfens : 定跡
 #  opt2       : 勝敗の表示の先頭にT2,b2000 のように対局条件を文字列化して突っ込む用。
 #  book_moves : 定跡の手数
-def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_moves,kifu_format="sfen"):
+#  telemetry_format : "none" | "npy" | "parquet" 1手ごとの探索テレメトリを棋譜と同じ名前で書き出す。
+#  metrics    : metrics.MatchMetrics 。Noneでなければ対局の進行状況を記録する。
+#  checkpoint : checkpoint.RunCheckpoint 。Noneでなければ途中経過を block_key の名前で定期的に保存する。
+#               保存済みの状態があれば、そこから再開する。
+#  max_restarts : 異常終了/タイムアウトしたエンジンを再起動する回数の上限(この対局条件全体で)
+#  should_stop : 終局のたびに should_stop(win, lose, draw) を呼び出し、Trueが返ったら新しい対局を開始せず、
+#               対局中のものが終わりしだい終了する。(SPRTなどの打ち切り判定用)
+#  game_hooks : 対局ごとにエンジンの設定を変えたいとき(SPSAなど)に使う。次の2つのメソッドを持つオブジェクト。
+#                 setup_commands(i)    : エンジンiに"isready"を送る直前に送るコマンド(setoptionなど)のlistを返す。
+#                 on_game_end(g, result) : 対局スロットgの対局が終わったときに呼ばれる。resultはGameResult(engine 0から見た結果)
+#               さらに次のメソッドがあれば、対局開始時に定跡の行番号を決めさせる。(同じ局面を先後入れ替えて指させる用)
+#                 pick_sfen_no(g, no)  : noは次に使う予定の行番号。実際に使う行番号を返す。no以外を返したときは、
+#                                        予定していた行番号は消費せずに次の対局に回す。
+#  ponder     : Trueなら相手の手番中も"go ponder"で予想手を思考させる。(大会と同じ条件での計測用)
+#               相手の指し手が予想と一致すれば"ponderhit"、外れれば"stop"してから改めて"go"を送る。
+#               持ち時間は自分の手番(ponderhitまたはgo)からの経過時間だけを消費する。
+#               ponderさせるには、goコマンドが"go btime ..."の形式(秒読み/フィッシャー/切れ負け)である必要がある。
+#  lease      : scheduler.SlotLease 。Noneでなければ、threadsは並列対局数の上限となり、
+#               lease.acquire()で確保できた分だけ対局スロットを稼働させる。新しい対局が不要になったスロットは
+#               エンジンを終了させて lease.release() で返却する。
+def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_moves,kifu_format="sfen",telemetry_format="none",metrics=None,
+		checkpoint=None,block_key="",max_restarts=10,should_stop=None,lease=None,game_hooks=None,ponder=False,
+		adjudication=None):
 
 	win = lose = draw = 0
 	win_black = win_white = 0
@@ -204,6 +211,23 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 	# 定跡ファイルは1行目から順番に読む。次に読むべき行番号
 	# 定跡ファイルは重複除去された、互角の局面集であるものとする。
 	sfen_no = 0
+	# エンジンの異常終了で無効になった対局の定跡の行番号。次の対局開始時にこちらを優先してやり直す。
+	replay_sfen_nos = []
+	# 開始した対局の通し番号
+	game_no = 0
+	# エンジンを再起動した回数
+	restarts = 0
+	# should_stop()がTrueを返した。
+	stop_requested = False
+
+	# チェックポイントからの再開
+	resume = checkpoint.block(block_key) if checkpoint else None
+	if resume:
+		win, lose, draw, win_black, win_white = resume["result"]
+		sfen_no = resume["sfen_no"]
+		game_no = resume["game_no"]
+		replay_sfen_nos = list(resume["pending_sfen_nos"])
+		print(f"resume {block_key} : {win} - {draw} - {lose} , sfen_no = {sfen_no} , replay = {len(replay_sfen_nos)} games")
 
 	# --- 状態変数の初期化 ---
 	# 対局ごとの状態
@@ -211,57 +235,80 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 	eval_values = [""] * threads
 	moves = [0] * threads
 	turns = [0] * threads
+	# 定跡部分の手数(テレメトリのplyの起点)
+	book_plies = [0] * threads
+	# 対局中かどうかと、その対局で使っている定跡の行番号
+	in_game = [False] * threads
+	game_sfen_nos = [0] * threads
+	# 対局スロットが稼働中か(エンジンが起動しているか)
+	if lease:
+		slot_active = [False] * threads
+		for g in range(threads):
+			if not lease.acquire():
+				break
+			slot_active[g] = True
+	else:
+		slot_active = [True] * threads
 
 	# エンジンプロセスごとの状態
+	# エンジンはusi_engine.UsiEngineで、全エンジンの読み書きはEngineHostのイベントループ(スレッド1本)で行う。
+	# エンジンの出力はmessage_queueに積まれ、このスレッドのメインループで処理する。
+	host = EngineHost()
 	procs = [None] * (threads * 2)
-	engine_reader_threads = [None] * (threads * 2)
 	message_queue = queue.Queue()
 	states = [EngineState.INIT] * (threads * 2)
 	initial_waits = [True] * (threads * 2)
 	rest_times = [0] * (threads * 2)
 	go_times = [0] * (threads * 2)
-	nodes_str = [""] * (threads * 2)
-	nodes = [0] * (threads * 2)
-	eval_value_from_thread = [""] * (threads * 2)
+	# 直近の"go"以降に受信したinfoの集約(nodes, score, depthなど)
+	search_infos = [SearchInfo() for _ in range(threads * 2)]
 	term_procs = [False] * (threads * 2)
+	generations = [0] * (threads * 2)
+
+	# ponderの設定。"go ponder"はgo btime ..の形式のときだけ送れる。
+	can_ponder = [ponder and options[k][0].startswith("go btime") for k in range(2)]
+	if ponder and not all(can_ponder):
+		print("Warning! ponder needs a 'go btime ...' time control. ponder is disabled for engine(s) "
+			+ ",".join(str(k + 1) for k in range(2) if not can_ponder[k]))
+	# 予想手と、engine1/engine2ごとのponderの回数と当たった回数
+	ponder_moves = [None] * (threads * 2)
+	# 予想が外れてstopを送った時刻。ここから持ち時間を消費する。
+	ponder_stop_times = [0] * (threads * 2)
+	ponder_tries = [0, 0]
+	ponder_hits = [0, 0]
+
+	# 評価値による勝敗の判定(adjudication.AdjudicationRules)。判定で終わった対局はその理由を棋譜に残す。
+	adjudicators = [GameAdjudicator(adjudication) for _ in range(threads)] if adjudication else None
+	adjudicated = [None] * threads
+
+	# --- エンジン起動 ---
+	# 起動に失敗したら例外を投げる。
+	# generation : エンジンを再起動するごとに増える番号。再起動前のプロセスからのメッセージを見分けるのに使う。
+	def launch_engine(i):
+		generation = generations[i]
+
+		def on_line(line):
+			message_queue.put({'type': 'output', 'engine_idx': i, 'line': line, 'time': time.time(), 'generation': generation})
+
+		def on_exit(retcode):
+			message_queue.put({'type': 'terminated', 'engine_idx': i, 'retcode': retcode, 'time': time.time(), 'generation': generation})
+
+		# working directoryは実行ファイルのあるフォルダ(UsiEngineの既定)。
+		# Windowsの.exeをWSL2から起動する場合も、そのままパスを指定すればよい。
+		procs[i] = host.spawn(engines_full[i % 2], on_line=on_line, on_exit=on_exit)
 
-	# --- エンジン起動とリーダー・スレッド開始 ---
 	for i in range(threads * 2):
-		# working directoryを実行ファイルのあるフォルダ直下としてやる。
-		# 最後のdirectory separatorを探す
-		engine_path = engines_full[i % 2]
-		pos = max(engine_path.rfind('\\') , engine_path.rfind('/'))
-		if pos <= 0:
-			working_dir = ""
-		else:
-			working_dir = engine_path[:pos]
-
-		# コマンドを構築。Windowsの.exeをWSL2から起動する場合、そのままパスを指定すればよい。
-		# shell=False (デフォルト) を利用するため、コマンドはリスト形式で渡す。
-		# stdout/stdin/stderrはパイプにして、テキストモードで通信するためencodingとtext=Trueを指定。
+		if not slot_active[i // 2]:
+			continue
 		try:
-			proc = subprocess.Popen(
-				[engines_full[i % 2]],
-				cwd=working_dir,
-				stdin=subprocess.PIPE,
-				stdout=subprocess.PIPE,
-				stderr=subprocess.PIPE,
-				encoding='utf-8', # テキストモードで通信
-				text=True,        # Python 3.7+ では encoding='utf-8' と text=True はほぼ同義
-				bufsize=1         # 行バッファリング
-			)
-			procs[i] = proc
-
-			# エンジンからの出力を読み取るスレッドを起動
-			engine_reader_threads[i] = threading.Thread(target=read_engine_output, args=(i, proc, message_queue))
-			engine_reader_threads[i].daemon = True # メインスレッド終了時に一緒に終了
-			engine_reader_threads[i].start()
-
+			launch_engine(i)
 		except FileNotFoundError:
 			print(f"Error: Engine not found at {engines_full[i % 2]}. Please check the path.")
+			host.close()
 			sys.exit(1)
 		except Exception as e:
 			print(f"Error launching engine {engines_full[i % 2]}: {e}")
+			host.close()
 			sys.exit(1)
 
 
@@ -284,6 +331,10 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 	kif_file = None
 	csa_exporters = None
 	kif_base = now.strftime("%Y%m%d%H%M%S") + opt2.replace(",","_")
+	# 再開するときは同じ棋譜ファイルに追記する。チェックポイント以降に書かれた分は切り詰めて捨てる。
+	if resume:
+		kif_base = resume["kif_base"]
+	kif_offsets = resume["kif_offsets"] if resume else None
 	if KifOutput:
 		if kifu_format == "csa":
 			try:
@@ -295,20 +346,63 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 			csa_exporters = []
 			for game_idx in range(threads):
 				csa_path = f"{kif_base}_g{game_idx:03d}.csa"
-				csa_exporters.append(CSA.Exporter(csa_path, append=False))
+				exporter = CSA.Exporter(csa_path, append=bool(resume))
+				if resume:
+					offset = kif_offsets[game_idx] if game_idx < len(kif_offsets) else 0
+					exporter.f.truncate(offset)
+				csa_exporters.append(exporter)
+		elif resume:
+			kif_file = open(kif_base + ".sfen","a")
+			kif_file.truncate(kif_offsets[0])
 		else:
 			kif_file = open(kif_base + ".sfen","w")
 
+	telemetry = None
+	if telemetry_format != "none":
+		telemetry = TelemetryRecorder(kif_base, telemetry_format, threads, MAX_MOVES,
+			part_no=resume.get("telemetry_part", 0) if resume else 0)
+
+	# 途中経過をチェックポイントに保存する。
+	# 棋譜とテレメトリはここまでに終局した分をファイルに書き出しておき、そのバイト位置/part番号を記録する。
+	# 対局中の対局は、再開したときに同じ定跡局面からやり直す。
+	def save_checkpoint(done=False):
+		if not checkpoint:
+			return
+		offsets = []
+		if KifOutput:
+			if kifu_format == "csa":
+				for exporter in csa_exporters:
+					exporter.f.flush()
+					offsets.append(exporter.f.tell())
+			else:
+				kif_file.flush()
+				offsets.append(kif_file.tell())
+		telemetry_part = telemetry.roll() if telemetry else 0
+		pending = [game_sfen_nos[g] for g in range(threads) if in_game[g]] + replay_sfen_nos
+		checkpoint.update_block(block_key,
+			done=done,
+			result=[win, lose, draw, win_black, win_white],
+			sfen_no=sfen_no,
+			game_no=game_no,
+			pending_sfen_nos=pending,
+			kif_base=kif_base,
+			kif_offsets=offsets,
+			telemetry_part=telemetry_part)
+
 	def send_cmd(i,s):
 		p = procs[i]
 		if Logging:
 			print("[" + str(i) + "]<" + s)
 		if FileLogging:
 			log_file.write( "[" + str(i) + "]<" + s + "\n")
-		p.stdin.write(s+"\n")
+		# エンジンが落ちていても例外にはならない。'terminated'が届くのでそちらで処理する。
+		p.post(s)
 
 	def isready_cmd(i):
 		p = procs[i]
+		if game_hooks:
+			for cmd in game_hooks.setup_commands(i):
+				send_cmd(i,cmd)
 		send_cmd(i,"isready")
 		states[i] = EngineState.WAIT_FOR_READYOK
 		# rest_time = total_time
@@ -329,15 +423,54 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 
 		# changes state
 		states[i]   = EngineState.WAIT_FOR_BESTMOVE
-		states[i^1] = EngineState.WAIT_FOR_ANOTHER_PLAYER
+		if states[i^1] != EngineState.PONDERING:
+			states[i^1] = EngineState.WAIT_FOR_ANOTHER_PLAYER
 
 		go_times[i] = time.time()
+		search_infos[i].reset()
+
+	# engine iが指した(bestmove rec)ので、相手に手番を渡す。
+	# 相手がponder中なら、予想が当たっていれば"ponderhit"、外れていれば"stop"する。
+	# そのあと、ponderが有効ならengine iに予想手(rec.ponder)を指した局面を思考させる。
+	def reply_cmd(i, rec):
+		j = i ^ 1
+		if states[j] == EngineState.PONDERING:
+			hit = rec.move == ponder_moves[j]
+			ponder_tries[j & 1] += 1
+			if metrics:
+				metrics.on_ponder(j & 1, hit)
+			if hit:
+				ponder_hits[j & 1] += 1
+				send_cmd(j, "ponderhit")
+				states[j] = EngineState.WAIT_FOR_BESTMOVE
+				# 持ち時間はponderhitから消費する。
+				go_times[j] = time.time()
+			else:
+				send_cmd(j, "stop")
+				states[j] = EngineState.PONDER_STOPPING
+				ponder_stop_times[j] = time.time()
+			states[i] = EngineState.WAIT_FOR_ANOTHER_PLAYER
+		else:
+			go_cmd(j)
+
+		if can_ponder[i & 1] and rec.ponder:
+			ponder_cmd(i, rec.ponder)
+
+	def ponder_cmd(i, move):
+		send_cmd(i, "position startpos moves " + sfens[i//2] + " " + move)
+		# 残り時間は次に自分が指すときと同じ(相手の手番中は減らない)。
+		cmd = options[i & 1][0].replace("go ", "go ponder ", 1)
+		send_cmd(i, cmd.replace("REST_TIME", str(rest_times[i])))
+		states[i] = EngineState.PONDERING
+		ponder_moves[i] = move
+		search_infos[i].reset()
 
 	def usinewgame_cmd(i,sfen_no):
 		p = procs[i]
 		send_cmd(i,"usinewgame")
 		sfens[i//2] = book_sfens[sfen_no]
 		moves[i//2] = 0
+		book_plies[i//2] = len(sfens[i//2].split())
 		# 定跡の評価値はよくわからんので0にしとくしかない。
 		eval_values[i//2] = "0 "*book_moves
 
@@ -357,6 +490,9 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 		else:
 			result = "lose"
 
+		# ponder中なら先に止める。(返ってくるbestmoveは状態が違うので無視される)
+		if states[i] == EngineState.PONDERING:
+			send_cmd(i,"stop")
 		send_cmd(i,"gameover " + result)
 		states[i] = EngineState.INIT
 
@@ -394,14 +530,24 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 			exporter.endgame("%CHUDAN")
 			return
 
+		if adjudicated[game_idx]:
+			exporter.f.write("'adjudication " + adjudicated[game_idx] + "\n")
 		if game_result == GameResult.DRAW:
 			exporter.endgame("%SENNICHITE")
 		else:
 			exporter.endgame("%TORYO")
 
 
+	def output_ponder_rate():
+		rates = []
+		for k in range(2):
+			if can_ponder[k]:
+				rate = ponder_hits[k] / ponder_tries[k] * 100 if ponder_tries[k] else 0.0
+				rates.append(f"engine{k + 1} {round(rate, 2)}% ({ponder_hits[k]}/{ponder_tries[k]})")
+		print("ponder hit : " + " , ".join(rates))
+
 	# set options for each engine
-	for i in range(len(states)):
+	def send_options(i):
 		for j in range(len(options[i % 2])):
 			if j != 0 :
 				opt = options[i % 2][j]
@@ -409,6 +555,110 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 				# 置換対象文字列が含まれているなら置換しておく。
 				opt = opt.replace("%%THREAD_NUMBER%%",str(i))
 				send_cmd(i,opt)
+		if can_ponder[i % 2]:
+			send_cmd(i,"setoption name USI_Ponder value true")
+
+	for i in range(len(states)):
+		if slot_active[i // 2]:
+			send_options(i)
+
+	# まだ新しい対局を開始する必要があるか。
+	# 終局数と対局中の数の合計がloopに達していれば、それ以上は開始しない。
+	def needs_new_game():
+		return not stop_requested and win + lose + draw + sum(in_game) < loop
+
+	# 対局スロットgを止めて、エンジンを終了させる。leaseがあれば返却する。
+	def deactivate_slot(g):
+		slot_active[g] = False
+		for i in (g * 2, g * 2 + 1):
+			generations[i] += 1 # 以降このエンジンからのメッセージは捨てる。
+			p = procs[i]
+			if p and p.poll() is None:
+				send_cmd(i, "quit")
+			states[i] = EngineState.INIT
+		if lease:
+			lease.release()
+
+	# 止まっている対局スロットgのエンジンを起動して稼働させる。
+	def activate_slot(g):
+		for i in (g * 2, g * 2 + 1):
+			generations[i] += 1
+			try:
+				launch_engine(i)
+			except Exception as e:
+				outstd(i, f"Error! launch failed : {e}")
+				term_procs[i] = True
+				continue
+			term_procs[i] = False
+			initial_waits[i] = True
+			states[i] = EngineState.INIT
+			send_options(i)
+		slot_active[g] = True
+
+	# 対局スロットgで新しい対局を始める。やり直し待ちの定跡局面があればそちらを優先する。
+	def start_game(g):
+		nonlocal sfen_no, game_no
+		no = replay_sfen_nos[0] if replay_sfen_nos else sfen_no
+		if game_hooks and hasattr(game_hooks, "pick_sfen_no"):
+			picked = game_hooks.pick_sfen_no(g, no)
+		else:
+			picked = no
+		if picked != no:
+			no = picked
+		elif replay_sfen_nos:
+			replay_sfen_nos.pop(0)
+		else:
+			sfen_no = (sfen_no + 1) % len(book_sfens)
+		# isreadyで待っていた両方のエンジンに対してusinewgameを送る
+		usinewgame_cmd(g * 2, no)
+		usinewgame_cmd(g * 2 + 1, no)
+		in_game[g] = True
+		game_sfen_nos[g] = no
+		adjudicated[g] = None
+		if adjudicators:
+			adjudicators[g].reset()
+		if telemetry:
+			telemetry.begin_game(g, game_no)
+		if metrics:
+			metrics.on_game_start()
+		game_no += 1
+
+	# 対局スロットgの対局を無効にして、同じ定跡局面を後でやり直す。
+	def void_game(g):
+		if not in_game[g]:
+			return
+		in_game[g] = False
+		replay_sfen_nos.append(game_sfen_nos[g])
+		if telemetry:
+			telemetry.discard_game(g)
+		if metrics:
+			metrics.on_game_void()
+
+	# エンジンiを(落ちていなければkillしてから)起動しなおす。再起動できたらTrue。
+	def restart_engine(i):
+		nonlocal restarts
+		if restarts >= max_restarts:
+			return False
+		restarts += 1
+		p = procs[i]
+		if p and p.poll() is None:
+			p.kill()
+		generations[i] += 1
+		try:
+			launch_engine(i)
+		except Exception as e:
+			outstd(i, f"Error! restart failed : {e}")
+			return False
+		mes = f"[{i}]: restarted ({restarts}/{max_restarts})"
+		outlog(i, mes)
+		outstd(i, mes)
+		term_procs[i] = False
+		initial_waits[i] = True
+		states[i] = EngineState.INIT
+		send_options(i)
+		if metrics:
+			metrics.on_restart(i & 1)
+		return True
 
 	# メインループ: メッセージキューからイベントを処理する
 	# このループで、全ての対局の状態が管理される。
@@ -419,6 +669,11 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 			message = message_queue.get(timeout=0.01) # 短いタイムアウトでメッセージを待つ
 			engine_idx = message['engine_idx']
 			proc = procs[engine_idx]
+			if metrics:
+				metrics.on_message(message['time'])
+			# 再起動前のプロセスからのメッセージは捨てる。
+			if message['generation'] != generations[engine_idx]:
+				continue
 			
 			if message['type'] == 'output':
 				line = message['line']
@@ -428,16 +683,16 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 				if ("Error" in line) or ("Display" in line) or ("Failed" in line):
 					outstd(engine_idx,line)
 
-				# node数計測用
-				if "nodes" in line :
-					nodes_str[engine_idx] = line
-				# 評価値計測用
-				if "score" in line :
-					eval_value_from_thread[engine_idx] = line
+				# 1行を1回だけ解析して型付きレコードにする。
+				rec = parse_line(line)
+				# node数・評価値計測用
+				if isinstance(rec, InfoRecord):
+					search_infos[engine_idx].update(rec)
 
 				gameover = GameResult.NO_RESULT # ゲームオーバーフラグ
+				gameover_reason = None # 判定によらない終局の理由("resign" / "win" / "maxmoves")。棋譜に残す。
 
-				if ("readyok" in line) and (states[engine_idx] == EngineState.WAIT_FOR_READYOK):
+				if isinstance(rec, ReadyOkRecord) and (states[engine_idx] == EngineState.WAIT_FOR_READYOK):
 					# 初回のみこの応答に対して1秒待つことにより、
 					# プロセスの初期化タイミングが重複しないようにする。
 					if initial_waits[engine_idx]:
@@ -447,45 +702,23 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 					states[engine_idx] = EngineState.START
 					# 両方のエンジンがstart状態になったら対局開始
 					if states[engine_idx^1] == EngineState.START:
-						# isreadyで待っていた両方のエンジンに対してusinewgameを送る
-						usinewgame_cmd(engine_idx, sfen_no)
-						usinewgame_cmd(engine_idx^1, sfen_no)
-						sfen_no = (sfen_no + 1) % len(book_sfens)
-
-						# 先手→後手、交互に行う。
-						go_cmd((engine_idx & ~1) + turns[engine_idx//2])
-
-				elif ("bestmove" in line) and (states[engine_idx] == EngineState.WAIT_FOR_BESTMOVE):
-					# node数計測用(60手目までのみ)
-					if moves[engine_idx//2] < 60 :
-						ns = nodes_str[engine_idx].split()
-						for j in range(len(ns)):
-							if ns[j] == "nodes":
-								if j+1 < len(ns):
-									nodes[engine_idx] += int(ns[j+1])
-								break
-					
-					# 評価値の計測用
-					vs = eval_value_from_thread[engine_idx].split()
-					for j in range(len(vs)):
-						if vs[j] == "score":
-							if j+2 < len(vs):
-								try:
-									v = int(vs[j+2])
-								except:
-									print(f"Error : score = {eval_value_from_thread[engine_idx]}")
-									eval_value_from_thread[engine_idx] = ""
-
-								if vs[j+1] == "cp" :
-									eval_value_from_thread[engine_idx] = str(v)
-								elif vs[j+1] == "mate" :
-									if v >= 0:
-										eval_value_from_thread[engine_idx] = str(32000 - v)
-									else:
-										eval_value_from_thread[engine_idx] = str(-32000 + v)
-							else:
-								eval_value_from_thread[engine_idx] = "?"
-							break
+						if not needs_new_game():
+							# もう対局は足りているので、このスロットは止める。
+							deactivate_slot(engine_idx//2)
+							update = True
+						else:
+							start_game(engine_idx//2)
+
+							# 先手→後手、交互に行う。
+							go_cmd((engine_idx & ~1) + turns[engine_idx//2])
+
+				elif isinstance(rec, BestMoveRecord) and (states[engine_idx] == EngineState.WAIT_FOR_BESTMOVE):
+					search_info = search_infos[engine_idx]
+					think_time = time.time() - go_times[engine_idx]
+					if telemetry:
+						telemetry.record(engine_idx//2, engine_idx & 1, book_plies[engine_idx//2] + moves[engine_idx//2], int(think_time * 1000), search_info)
+					if metrics:
+						metrics.on_bestmove(engine_idx & 1, think_time, search_info.nps)
 
 					# if (not random time)
 					time_setting = options[2 + (engine_idx & 1)]
@@ -507,7 +740,8 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 						else:
 							rest_times[engine_idx] = r
 					
-					if "resign" in line:
+					if rec.is_resign:
+						gameover_reason = "resign"
 						if (engine_idx % 2) == 1: # 後手エンジンが投了
 							win += 1
 							gameover = GameResult.P1_WIN # 1P勝ち (エンジン0勝ち)
@@ -519,7 +753,8 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 						else: # 先手番で勝った
 							win_white += 1
 						update = True
-					elif "win" in line: # エンジンが勝利宣言した場合
+					elif rec.is_win: # エンジンが勝利宣言した場合
+						gameover_reason = "win"
 						if (engine_idx % 2) == 0: # 先手エンジンが勝ち宣言
 							win += 1
 							gameover = GameResult.P1_WIN # 1P勝ち (エンジン0勝ち)
@@ -532,25 +767,45 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 							win_white += 1
 						update = True
 					else: # 通常のbestmove
-						ss = line.split()
 						if sfens[engine_idx//2] != "":
 							sfens[engine_idx//2] += " "
-						try:
-							sfens[engine_idx//2] += ss[1] # 指し手を追加
-							if KifOutput:
-								eval_values[engine_idx//2] += eval_value_from_thread[engine_idx] + " "
-						except:
-							outlog(engine_idx, "Error! " + line)
+						sfens[engine_idx//2] += rec.move # 指し手を追加
+						if KifOutput:
+							eval_values[engine_idx//2] += search_info.score_str() + " "
 
 						moves[engine_idx//2] += 1
+						verdict = None
+						if adjudicators:
+							verdict = adjudicators[engine_idx//2].update(book_plies[engine_idx//2] + moves[engine_idx//2], engine_idx & 1, search_info)
 						if moves[engine_idx//2] >= MAX_MOVES: # 256手で引き分け
+							gameover_reason = "maxmoves"
 							draw += 1
 							gameover = GameResult.DRAW # Draw
 							update = True
+						elif verdict:
+							winner, adjudicated[engine_idx//2] = verdict
+							if winner is None:
+								draw += 1
+								gameover = GameResult.DRAW
+							else:
+								if winner == 0:
+									win += 1
+									gameover = GameResult.P1_WIN
+								else:
+									lose += 1
+									gameover = GameResult.P2_WIN
+								if winner == turns[engine_idx//2]: # 定跡のあと先に指した側が勝った
+									win_black += 1
+								else:
+									win_white += 1
+							if metrics:
+								metrics.on_adjudication(adjudicated[engine_idx//2])
+							update = True
 						else:
-							go_cmd(engine_idx^1) # 相手のエンジンにgoコマンドを送る
+							reply_cmd(engine_idx, rec) # 相手のエンジンにgo(またはponderhit)を送る
 				
 				if gameover != GameResult.NO_RESULT:
+					in_game[engine_idx//2] = False
 					gameover_cmd(engine_idx, gameover)
 					gameover_cmd(engine_idx^1, gameover)
 					if KifOutput:
@@ -558,17 +813,52 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 							write_csa_game(engine_idx//2, gameover)
 						else:
 							kif_file.write("startpos moves " + sfens[engine_idx//2] + "\n")
-							kif_file.write(eval_values[engine_idx//2] + "\n")
+							# 評価値で判定した対局は、評価値の行の末尾に"# adjudication 理由"を付ける。
+							# それ以外は"# gameover 理由"を付ける。(game_book.pyが棋譜から勝敗を読み取れるように)
+							if adjudicated[engine_idx//2]:
+								kif_file.write(eval_values[engine_idx//2] + "# adjudication " + adjudicated[engine_idx//2] + "\n")
+							else:
+								kif_file.write(eval_values[engine_idx//2] + "# gameover " + gameover_reason + "\n")
+					if telemetry:
+						telemetry.end_game(engine_idx//2)
+					if metrics:
+						metrics.on_game_end({GameResult.P1_WIN: "win", GameResult.P2_WIN: "lose"}.get(gameover, "draw"))
+					if game_hooks:
+						game_hooks.on_game_end(engine_idx//2, gameover)
+					if should_stop and not stop_requested and should_stop(win, lose, draw):
+						stop_requested = True
 					turns[engine_idx//2] = turns[engine_idx//2] ^ 1 # 手番を交代
 
+				elif isinstance(rec, BestMoveRecord) and (states[engine_idx] == EngineState.PONDER_STOPPING):
+					# 予想が外れて止めたponderのbestmove。この手は捨てて、実際の局面で思考させる。
+					go_cmd(engine_idx)
+					# 相手が指した時点から持ち時間を消費させる。
+					go_times[engine_idx] = ponder_stop_times[engine_idx]
+
 			elif message['type'] == 'terminated':
 				# エンジンが予期せず終了した場合はエラーとしてログ
 				retcode = message['retcode']
 				if not term_procs[engine_idx]:
 					print(f"[{engine_idx}]: Error! Process terminated with code {retcode}.")
 					term_procs[engine_idx] = True
-				# ターミネートされた場合も試合を終了させるなどのロジックを追加検討可能
-				update = True # 状態変化として扱う
+					states[engine_idx] = EngineState.INIT
+					if metrics:
+						metrics.on_terminated(engine_idx & 1)
+
+					# 対局中だったならその対局は無効にして、同じ定跡局面を後でやり直す。
+					# 相手のエンジンは探索を止めさせて、次の対局の準備(isready)からやり直させる。
+					g = engine_idx // 2
+					partner = engine_idx ^ 1
+					if in_game[g]:
+						void_game(g)
+						if not term_procs[partner]:
+							if states[partner] in (EngineState.WAIT_FOR_BESTMOVE, EngineState.PONDERING):
+								send_cmd(partner, "stop")
+							gameover_cmd(partner, GameResult.DRAW)
+
+					if not restart_engine(engine_idx):
+						outstd(engine_idx, "Error! restart limit reached. This game slot is stopped.")
+						update = True # 状態変化として扱う(全スロット停止の判定のため)
 
 		except queue.Empty:
 			# キューが空の場合、メインスレッドが行う処理（タイムアウトチェックなど）
@@ -576,7 +866,9 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 
 		# 全エンジンの初期化がまだならisreadyを送る
 		for i in range(len(states)):
-			if states[i] == EngineState.INIT:
+			if not slot_active[i // 2]:
+				continue
+			if states[i] == EngineState.INIT and not term_procs[i]:
 				isready_cmd(i)
 			
 			# goコマンドを送信してから一定時間経過している場合のタイムアウト処理
@@ -595,20 +887,46 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 					win += 1
 				update = True # 状態変化として扱う
 				# タイムアウトした対局を終了させる
+				in_game[i//2] = False
 				gameover_cmd(i, GameResult.DRAW)
 				gameover_cmd(i^1, GameResult.DRAW)
+				if telemetry:
+					telemetry.end_game(i//2)
+				if metrics:
+					metrics.on_timeout(i & 1)
+					metrics.on_game_end("lose" if (i % 2) == 0 else "win")
+				if game_hooks:
+					game_hooks.on_game_end(i//2, GameResult.P2_WIN if (i % 2) == 0 else GameResult.P1_WIN)
+				# 応答しなくなったエンジンは、isreadyにも応答しないのでkillして起動しなおす。
+				if not restart_engine(i):
+					outstd(i, "Error! restart limit reached. This game slot is stopped.")
+					term_procs[i] = True
 
 		# 状態が更新されたら、全体の対局数チェックと途中結果の出力
+		# leaseに空きがあれば、止まっているスロットを稼働させる。
+		if lease and needs_new_game() and not all(slot_active):
+			if lease.acquire():
+				activate_slot(slot_active.index(False))
+
 		if update:
 			loop_count = win + lose + draw
-			if loop_count >= loop :
+			# 稼働中のどのスロットも片方のエンジンが止まっていて、もう対局が進まない。
+			running = [g for g in range(threads) if slot_active[g]]
+			all_stopped = len(running) > 0 and all(term_procs[g * 2] or term_procs[g * 2 + 1] for g in running)
+			if all_stopped:
+				print("Error! All game slots are stopped. Finish this match.")
+			# 打ち切りが決まって、対局中のものもすべて終わったなら終了する。
+			if loop_count >= loop or all_stopped or (stop_requested and not any(in_game)):
 				# 指定のloop回数に達したので終了する。
-				for p in procs:
-					if p and p.poll() is None: # プロセスがまだ実行中なら終了させる
-						p.terminate()
-				for t in engine_reader_threads: # リーダースレッドが終了するのを待つ (joinはしない、daemonなので自動終了)
-					pass # デーモンスレッドなのでjoinは不要だが、念のため
-
+				# まだ実行中のエンジンを終了させて、終了を待つ。
+				host.close()
+
+				for g in range(threads):
+					if slot_active[g]:
+						slot_active[g] = False
+						if lease:
+							lease.release()
+				save_checkpoint(done=not all_stopped)
 				if FileLogging:
 					log_file.close()
 				if KifOutput:
@@ -617,11 +935,17 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 							exporter.close()
 					else:
 						kif_file.close()
+				if telemetry:
+					telemetry.close()
+				if ponder:
+					output_ponder_rate()
 				return win, lose, draw, win_black, win_white
 
 			# 一定回数ごとに途中結果を出力
 			if loop_count % 10 == 0 :
 				output_rating(win,draw,lose,win_black,win_white,opt2)
+				if ponder:
+					output_ponder_rate()
 				if FileLogging:
 					for i in range(len(states)):
 						log_file.write(f"[{i}] State = {states[i]}\n")
@@ -632,6 +956,7 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 							exporter.f.flush()
 					else:
 						kif_file.flush()
+				save_checkpoint()
 
 		# メッセージキューの処理とタイムアウト処理の間で短いスリープを挟む
 		time.sleep(0.001)
@@ -640,6 +965,18 @@ def vs_match(engines_full,options,threads,loop,book_sfens,fileLogging,opt2,book_
 	return win, lose, draw, win_black, win_white
 
 
+# コマンドライン/設定ファイルの--resign_scoreなどからAdjudicationRulesを作る。どの規則も使わないならNone。
+def adjudication_from_config(config):
+	rules = AdjudicationRules(
+		resign_score=config['resign_score'],
+		resign_plies=config['resign_plies'],
+		draw_score=config['draw_score'],
+		draw_plies=config['draw_plies'],
+		draw_min_ply=config['draw_min_ply'],
+		mate=config['mate_adjudication'])
+	return rules if rules.enabled else None
+
+
 # 省略されたエンジン名に対して、フルパス名を返す
 def engine_to_full(e):
 	# 技巧
@@ -654,6 +991,76 @@ def engine_to_full(e):
 
 	return e
 
+# 定跡(home/book/records2016_10818.sfen)を読み込み、各行の先頭book_moves手を
+# "7g7f 3c3d ... "の形式の文字列にしたlistを返す。
+def read_book_sfens(home, book_moves):
+	book_file = open(os.path.join(home, "book", "records2016_10818.sfen"),"r")
+	book_sfens = []
+	count = 1
+	for sfen in book_file:
+		s = sfen.split()
+		sf = ""
+		for i in range(book_moves):
+			try:
+				# skip "startpos moves"
+				sf += s[i+2]+" "
+			except:
+				print("Error! " + " in records2016.sfen line = " + str(count))
+		book_sfens.append(sf)
+		count += 1
+		if count % 100 == 0:
+			sys.stdout.write(".")
+			sys.stdout.flush()
+	book_file.close()
+	print()
+	return book_sfens
+
+# evaldirs × play_time_list の全ての対局条件を、scheduler.MatchSchedulerで
+# config['core_budget']コアの範囲で並行して回す。
+def run_scheduled(evaldirs, play_time_list, config, book_sfens, metrics, checkpoint):
+	from scheduler import MatchJob, MatchScheduler, print_job_results
+
+	home = config['home']
+	engine_threads = config['engine_threads']
+	engines = ( engine_to_full(config['engine1']) , engine_to_full(config['engine2']) )
+	engines_full = ( os.path.join(home, "exe", engines[0]) , os.path.join(home, "exe", engines[1]) )
+	hashes = [config['hash1'], config['hash2']]
+
+	total = [0, 0, 0, 0, 0]
+	jobs = []
+	for evaldir in evaldirs:
+		evals_full = ( os.path.join(home, "eval", config['eval1']) , os.path.join(home, "eval", evaldir) )
+		for play_time in play_time_list:
+			block_key = evaldir + "|" + play_time
+			block = checkpoint.block(block_key) if checkpoint else None
+			if block and block.get("done"):
+				print(block_key + " : skip (already done in checkpoint)")
+				total = [a + b for a, b in zip(total, block["result"])]
+				continue
+
+			options = create_option(engines,engine_threads,evals_full,play_time,hashes,config['param_log_path'])
+			# 棋譜ファイル名が衝突しないように、ジョブ番号をopt2の先頭に入れる。
+			opt2 = "J" + str(len(jobs)) + ",T" + str(engine_threads) + "," + play_time
+			jobs.append(MatchJob(block_key, engines_full, options, config['loop'], book_sfens, config['book_moves'],
+				engine_threads=engine_threads,
+				max_parallel=config['parallel_games'],
+				opt2=opt2,
+				kifu_format=config['kifu_format'],
+				telemetry_format=config['telemetry'],
+				file_logging=config['log'],
+				ponder=config['ponder'],
+				adjudication=adjudication_from_config(config)))
+
+	print("core_budget    : " , config['core_budget'], ", jobs =", len(jobs))
+	MatchScheduler(jobs, config['core_budget'], metrics=metrics, checkpoint=checkpoint, max_restarts=config['max_restarts']).run()
+	print_job_results(jobs)
+
+	for job in jobs:
+		if job.result:
+			total = [a + b for a, b in zip(total, job.result)]
+	print("\nfinal result : ")
+	output_rating(total[0], total[2], total[1], total[3], total[4], "T" + str(engine_threads) + ",total")
+
 # ここからmain()
 
 def main():
@@ -689,6 +1096,21 @@ def main():
 	parser.add_argument('--log', action='store_true', help="Enable file logging for engine communication.")
 	parser.add_argument('--param_log_path', type=str, default="", help="Enable and specify path for parameter logging.")
 	parser.add_argument('--kifu_format', type=str, default="sfen", choices=["sfen", "csa"], help="Output format for game records.")
+	parser.add_argument('--metrics_port', type=int, default=0, help="Serve Prometheus-style match metrics on http://127.0.0.1:PORT/metrics (0 = disabled).")
+	parser.add_argument('--core_budget', type=int, default=0, help="Run all eval/time combinations concurrently, filling this many cores (0 = one after another).")
+	parser.add_argument('--checkpoint', type=str, default="", help="Save progress (results, book cursor, kifu offsets) to this JSON file every 10 games.")
+	parser.add_argument('--resume', action='store_true', help="Continue from the state saved in --checkpoint.")
+	parser.add_argument('--max_restarts', type=int, default=10, help="Maximum number of engine restarts after a crash or timeout per match condition.")
+	parser.add_argument('--telemetry', type=str, default="none", choices=["none", "npy", "parquet"], help="Write per-move search telemetry (time, nodes, nps, depth, score, hashfull) next to the game records.")
+	parser.add_argument('--ponder', action='store_true', help="Let engines think on the opponent's time (go ponder / ponderhit). Each game then keeps both engines busy.")
+
+	# --- Adjudication settings ---
+	parser.add_argument('--resign_score', type=int, default=0, help="Adjudicate a win when both engines agree on |score| >= this for --resign_plies plies (0 = disabled).")
+	parser.add_argument('--resign_plies', type=int, default=6, help="Number of consecutive plies for resign adjudication.")
+	parser.add_argument('--draw_score', type=int, default=0, help="Adjudicate a draw when |score| <= this for --draw_plies plies after --draw_min_ply (0 = disabled).")
+	parser.add_argument('--draw_plies', type=int, default=20, help="Number of consecutive plies for draw adjudication.")
+	parser.add_argument('--draw_min_ply', type=int, default=160, help="Draw adjudication is not applied before this ply.")
+	parser.add_argument('--mate_adjudication', action='store_true', help="Adjudicate the game as soon as the moving engine reports a mate score.")
 	
 	args = parser.parse_args()
 
@@ -742,6 +1164,23 @@ def main():
 	rand_book = config['rand_book']
 	fileLogging = config['log']
 	kifu_format = config['kifu_format']
+	telemetry_format = config['telemetry']
+	metrics_port = config['metrics_port']
+	checkpoint_path = config['checkpoint']
+	resume = config['resume']
+	max_restarts = config['max_restarts']
+	core_budget = config['core_budget']
+	ponder = config['ponder']
+	adjudication = adjudication_from_config(config)
+
+	checkpoint = None
+	if resume:
+		if not checkpoint_path:
+			print("Error: --resume requires --checkpoint.")
+			sys.exit(1)
+		checkpoint = RunCheckpoint.load(checkpoint_path)
+	elif checkpoint_path:
+		checkpoint = RunCheckpoint(checkpoint_path)
 
 	# expand eval_dir
 	evaldirs = []
@@ -762,38 +1201,40 @@ def main():
 	print("engine_threads : " , engine_threads)
 	print("rand_book      : " , rand_book)
 	print("kifu_format    : " , kifu_format)
+	print("telemetry      : " , telemetry_format)
+	print("ponder         : " , ponder)
+	print("adjudication   : " , adjudication or "none")
+	print("metrics_port   : " , metrics_port)
+	print("checkpoint     : " , checkpoint_path, "(resume)" if resume else "")
+
+	metrics = None
+	if metrics_port:
+		metrics = MatchMetrics()
+		start_metrics_server(metrics.registry, metrics_port)
+		print(f"metrics        :  http://127.0.0.1:{metrics_port}/metrics")
 	print("PARAMETERS_LOG_FILE_PATH : " , PARAMETERS_LOG_FILE_PATH)
 
 	total_win = total_lose = total_draw = 0
 	total_win_black = total_win_white = 0
 
-	book_file = open(os.path.join(home, "book", "records2016_10818.sfen"),"r")
-	book_sfens = []
-	count = 1
-	for sfen in book_file:
-		s = sfen.split()
-		sf = ""
-		for i in range(book_moves):
-			try:
-				# skip "startpos moves"
-				sf += s[i+2]+" "
-			except:
-				print("Error! " + " in records2016.sfen line = " + str(count))
-		book_sfens.append(sf)
-		count += 1
-		if count % 100 == 0:
-			sys.stdout.write(".")
-			sys.stdout.flush()
-	book_file.close()
-	print()
+	book_sfens = read_book_sfens(home, book_moves)
 
 	# 定跡をシャッフルする
+	# 再開したときに同じ順番になるように、seedをチェックポイントに保存しておく。
 	if rand_book:
-		random.shuffle(book_sfens)
+		book_seed = checkpoint.book_seed if checkpoint and checkpoint.book_seed is not None else random.randrange(1 << 32)
+		if checkpoint:
+			checkpoint.book_seed = book_seed
+		random.Random(book_seed).shuffle(book_sfens)
 
 	# threadsはparallel_gamesに相当。 engine_threadsはエンジンに渡すスレッド数。
 	# 古いthreads = threads // engine_threads の行は不要。
 
+	# --core_budgetが指定されていれば、全ての対局条件をスケジューラで並行して消化する。
+	if core_budget:
+		run_scheduled(evaldirs, play_time_list, config, book_sfens, metrics, checkpoint)
+		return
+
 	for evaldir in evaldirs:
 		engine1 = engine_to_full(engine1_path)
 		engine2 = engine_to_full(engine2_path)
@@ -820,17 +1261,31 @@ def main():
 			# 短くスレッド数と秒読み条件を文字列化
 			opt2 = "T"+str(engine_threads) + "," + play_time
 
-			w, l, d, wb, ww = vs_match(
-				engines_full,
-				options,
-				threads,
-				loop,
-				book_sfens,
-				fileLogging,
-				opt2,
-				book_moves,
-				kifu_format=kifu_format,
-			)
+			# この対局条件がチェックポイント上で完了済みなら、結果だけ集計してskipする。
+			block_key = evaldir + "|" + play_time
+			block = checkpoint.block(block_key) if checkpoint else None
+			if block and block.get("done"):
+				print("skip (already done in checkpoint)")
+				w, l, d, wb, ww = block["result"]
+			else:
+				w, l, d, wb, ww = vs_match(
+					engines_full,
+					options,
+					threads,
+					loop,
+					book_sfens,
+					fileLogging,
+					opt2,
+					book_moves,
+					kifu_format=kifu_format,
+					telemetry_format=telemetry_format,
+					metrics=metrics,
+					checkpoint=checkpoint,
+					block_key=block_key,
+					max_restarts=max_restarts,
+					ponder=ponder,
+					adjudication=adjudication,
+				)
 
 			total_win += w
 			total_lose += l
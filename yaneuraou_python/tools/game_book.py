@@ -0,0 +1,529 @@
+"""
+対局の棋譜(engine_invoker.py の .sfen 出力)から局面ごとの勝敗と評価値を集計して、
+minimaxで評価値を伝播させた定跡DB(.db)を作るモジュール。
+
+使い方:
+    python game_book.py update games.npz kifu/*.sfen [--book_moves 24] [--engine YaneuraOu-by-gcc]
+    python game_book.py export games.npz user_book1.db [--min_games 2] [--max_ply 40] [--value eval|result]
+    python game_book.py update games.npz kifu/*.sfen --export user_book1.db
+
+  update は棋譜ファイルごとに前回読み終えたバイト位置を集計表に覚えておき、その続き(新しく終わった対局)だけを
+  読んで集計に足す。対局中の engine_invoker.py が書き足している棋譜ファイルに何度かけてもよい。
+
+棋譜ファイルの形式 (engine_invoker.py の kifu_format == "sfen"):
+    startpos moves 7g7f 3c3d ...
+    0 0 ... 0 53 -12 ... # gameover resign
+  1行目が1局の指し手、2行目が各手を指したときの評価値(指した側から見た値)。定跡の部分(--book_moves手)は0が入っている。
+  評価値の行の末尾は "# gameover resign|win|maxmoves" か "# adjudication resign|mate|draw" で、ここから勝敗を決める。
+  (これがない古い棋譜は、book_moves + 256手以上なら引き分け、そうでなければ最後に指した側の勝ちとみなす)
+  評価値の行がまだ書かれていない末尾の対局は、次のupdateで読む。
+
+局面は yaneuraou_python.core.replay_game() で指し手を進めて求める。ラッパーがビルドされていなければ
+--engine のエンジンに"position"と"d"を送って求める。(book_builder.resolve_sfens())
+局面のkeyは book_bin.book_key() なので、手順違い・手数違いの同一局面は1つのノードにまとまる。
+
+集計表(.npz)の中身:
+    nodes : 局面ごと(keyの昇順)。key , games , wins , draws , eval_sum , eval_count , ply , sfen_offset , sfen_length
+            wins/drawsはその局面の手番側から見た数。eval_sumはその局面で指した側の評価値の合計。plyは現れた最小の手数。
+    edges : 指し手ごと。parent , child (局面のkey) , move (Move16) , games
+    sfens : 局面のsfen文字列(手数を除いたもの)を並べたバイト列
+    state : 棋譜ファイルごとの読み終えたバイト位置(JSON)
+
+export のminimax (ペタショック化と同じ考え方):
+  - 局面の素の値 : 評価値の平均。評価値がない局面と --value result のときは勝率を評価値に換算したもの。
+  - min_games局以上指された手があれば、局面の値は max(-子局面の値) 。手数の深い局面から順に求める。
+    (子局面のほうが手数が小さい、つまり千日手などで戻る指し手は、その時点での子局面の値を使う)
+  - 定跡の指し手は min_games局以上指された手で、評価値は伝播した値、採択回数は指された回数、
+    ponderは子局面で最善の手、深さは最善手をたどって伝播できた手数。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+from book_bin import book_key, move16_to_move, move_to_move16
+from book_builder import parse_record, resolve_sfens
+from book_db import BookMove, sfen_ply, sort_moves, trim_ply, write_book
+from usi_engine import UsiEngine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ラッパー(yaneuraou_python/core)は、あればそれで局面を進める。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+try:
+    from yaneuraou_python import core
+except ImportError:
+    core = None
+
+# engine_invoker.py の MAX_MOVES (これだけ指したら引き分け)
+MAX_MOVES = 256
+
+# 勝率を評価値に換算するときの係数。(やねうら王の評価値 → 勝率の換算と同じ)
+WINRATE_SCALE = 600.0
+
+# 局面を求めて集計表に足すときに、一度に扱う対局数
+BATCH_GAMES = 1000
+
+BLACK, WHITE = 0, 1
+
+# 1局分。evalsは各手の評価値(不明ならNone)、endingは ("gameover" | "adjudication" | None, 理由)。
+Game = namedtuple("Game", "base moves evals ending")
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+def _dtypes():
+    node = np.dtype([("key", "<u8"), ("games", "<u4"), ("wins", "<u4"), ("draws", "<u4"), ("eval_sum", "<i8"),
+                     ("eval_count", "<u4"), ("ply", "<u2"), ("sfen_offset", "<u8"), ("sfen_length", "<u2")])
+    edge = np.dtype([("parent", "<u8"), ("child", "<u8"), ("move", "<u2"), ("games", "<u4")])
+    return node, edge
+
+
+# ======================================================================
+# 棋譜
+# ======================================================================
+
+def _is_record(line):
+    tokens = line.split(None, 1)
+    return bool(tokens) and tokens[0] in ("startpos", "sfen", "position")
+
+
+def parse_eval_line(line):
+    """ 評価値の行を (評価値のlist, ending) にする。"""
+    body, _, comment = line.partition("#")
+    evals = [int(t) if t.lstrip("-").isdigit() else None for t in body.split()]
+    comment = comment.split()
+    ending = (comment[0], comment[1]) if len(comment) >= 2 and comment[0] in ("gameover", "adjudication") else (None, None)
+    return evals, ending
+
+
+def read_games(path, offset):
+    """
+    棋譜ファイルのoffsetバイト目以降にある、終わった対局を読む。
+    戻り値 : (Gameのlist, 読み終えたバイト位置)
+    最後の対局の評価値の行がまだ書かれていないときは、その対局の手前までを読む。
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # 改行で終わっていない最後の行は書き込み途中。
+    lines = data.split(b"\n")[:-1]
+
+    games = []
+    i = 0
+    consumed = 0
+    while i < len(lines):
+        line = lines[i].decode("utf-8", errors="replace")
+        if not _is_record(line):
+            # 空行・コメント・対局の行のない評価値の行
+            i += 1
+            consumed = i
+            continue
+        if i + 1 >= len(lines):
+            break
+        base, moves = parse_record(line)
+        following = lines[i + 1].decode("utf-8", errors="replace")
+        if _is_record(following):
+            evals, ending = [], (None, None)
+            i += 1
+        else:
+            evals, ending = parse_eval_line(following)
+            i += 2
+        consumed = i
+        if moves:
+            games.append(Game(base, moves, evals, ending))
+    return games, offset + sum(len(line) + 1 for line in lines[:consumed])
+
+
+def _start_color(base):
+    return WHITE if base != "startpos" and base.split()[1] == "w" else BLACK
+
+
+def game_winner(game, book_moves):
+    """ 対局の勝者(BLACK/WHITE)。引き分けならNone。 """
+    n = len(game.moves)
+    start = _start_color(game.base)
+    last_mover = start ^ ((n - 1) & 1)
+    to_move = start ^ (n & 1)
+    kind, reason = game.ending
+    if reason in ("draw", "maxmoves"):
+        return None
+    if kind == "gameover":
+        return to_move if reason == "win" else last_mover
+    if kind == "adjudication":
+        # 判定は最後に指した側の評価値の符号で決まっている。
+        last = game.evals[n - 1] if len(game.evals) >= n else None
+        return last_mover if last is None or last > 0 else to_move
+    return None if n >= book_moves + MAX_MOVES else last_mover
+
+
+# ======================================================================
+# 局面を求める
+# ======================================================================
+
+class CoreReplayer:
+    """ ラッパーの replay_game() で局面を求める。 """
+
+    async def start(self):
+        core.init()
+
+    async def replay(self, games):
+        return [core.replay_game(g.base, g.moves) for g in games]
+
+    async def close(self):
+        pass
+
+
+class EngineReplayer:
+    """ エンジンの"d"コマンドで局面を求める。エンジンは非合法手の手前で止まるので、手数が進まなくなったら打ち切る。 """
+
+    def __init__(self, path, workers=1, options=()):
+        self.path = path
+        self.workers = workers
+        self.options = list(options)
+        self.engines = []
+
+    async def _start_engine(self):
+        engine = await UsiEngine(self.path).start()
+        await engine.usi()
+        for name, value in self.options:
+            engine.setoption(name, value)
+        await engine.isready(timeout=600.0)
+        return engine
+
+    async def start(self):
+        self.engines = await asyncio.gather(*(self._start_engine() for _ in range(self.workers)))
+
+    async def replay(self, games):
+        positions = [(g.base, tuple(g.moves[:i])) for g in games for i in range(len(g.moves) + 1)]
+        sfens = await resolve_sfens(self.engines, positions)
+        result = []
+        pos = 0
+        for g in games:
+            game_sfens = sfens[pos:pos + len(g.moves) + 1]
+            pos += len(g.moves) + 1
+            first_ply = sfen_ply(game_sfens[0])
+            for i, sfen in enumerate(game_sfens):
+                if sfen_ply(sfen) != first_ply + i:
+                    game_sfens = game_sfens[:i]
+                    break
+            result.append(game_sfens)
+        return result
+
+    async def close(self):
+        await asyncio.gather(*(engine.quit() for engine in self.engines), return_exceptions=True)
+
+
+# ======================================================================
+# 集計表
+# ======================================================================
+
+class GameTable:
+    """ 集計表(.npz)1つ分。nodesはkeyの昇順に並べておく。 """
+
+    def __init__(self, nodes=None, edges=None, sfens=b"", state=None):
+        node_dtype, edge_dtype = _dtypes()
+        self.nodes = nodes if nodes is not None else np.zeros(0, node_dtype)
+        self.edges = edges if edges is not None else np.zeros(0, edge_dtype)
+        self.sfens = sfens
+        self.state = state if state is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """ 集計表を読み込む。ファイルがなければ空の集計表。"""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as z:
+            state = json.loads(z["state"].tobytes().decode("utf-8"))
+            return cls(z["nodes"], z["edges"], z["sfens"].tobytes(), state)
+
+    def save(self, path):
+        """ 一時ファイルに書いてからos.replace()するので、保存中に落ちても前回の集計表が残る。"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, nodes=self.nodes, edges=self.edges,
+                     sfens=np.frombuffer(self.sfens, dtype=np.uint8),
+                     state=np.frombuffer(json.dumps(self.state).encode("utf-8"), dtype=np.uint8))
+        os.replace(tmp_path, path)
+
+    def node_index(self, keys):
+        """ keysのノードの添字。すべて集計表にあること。"""
+        return np.searchsorted(self.nodes["key"], keys)
+
+    def sfen_of(self, i):
+        node = self.nodes[i]
+        off = int(node["sfen_offset"])
+        return self.sfens[off:off + int(node["sfen_length"])].decode("ascii") + " " + str(int(node["ply"]))
+
+    # ------------------------------------------------------------------
+
+    def add_games(self, games, game_sfens, book_moves, eval_clip, max_ply=0):
+        """
+        対局のlistと、それぞれの局面のsfenのlistを集計に足す。
+        戻り値 : (足した対局数, 局面を最後まで進められずに捨てた対局数)
+        """
+        node_dtype, edge_dtype = _dtypes()
+        nodes = {}      # key → [games, wins, draws, eval_sum, eval_count, ply, sfen]
+        edges = {}      # (parent, child, move16) → games
+        added = skipped = 0
+
+        for game, sfens in zip(games, game_sfens):
+            if len(sfens) != len(game.moves) + 1:
+                skipped += 1
+                continue
+            added += 1
+            winner = game_winner(game, book_moves)
+            color = _start_color(game.base)
+            prev = None
+            for i, sfen in enumerate(sfens):
+                ply = sfen_ply(sfen)
+                if max_ply and ply > max_ply:
+                    break
+                key = book_key(sfen)
+                node = nodes.get(key)
+                if node is None:
+                    node = nodes[key] = [0, 0, 0, 0, 0, ply, sfen]
+                node[0] += 1
+                if winner is None:
+                    node[2] += 1
+                elif winner == color:
+                    node[1] += 1
+                if i < len(game.moves) and i >= book_moves and i < len(game.evals) and game.evals[i] is not None:
+                    node[3] += max(-eval_clip, min(eval_clip, game.evals[i]))
+                    node[4] += 1
+                if ply < node[5]:
+                    node[5] = ply
+                if prev is not None:
+                    e = (prev, key, move_to_move16(game.moves[i - 1]))
+                    edges[e] = edges.get(e, 0) + 1
+                prev = key
+                color ^= 1
+
+        if not nodes:
+            return added, skipped
+
+        # 今回の分を配列にする。集計表にまだない局面のsfenだけをプールに足す。
+        new = np.zeros(len(nodes), node_dtype)
+        new["key"] = np.fromiter(nodes.keys(), dtype=np.uint64, count=len(nodes))
+        values = list(nodes.values())
+        for j, field in enumerate(("games", "wins", "draws", "eval_sum", "eval_count", "ply")):
+            new[field] = [v[j] for v in values]
+        known = np.isin(new["key"], self.nodes["key"])
+        pool = bytearray()
+        for j in np.flatnonzero(~known).tolist():
+            body = trim_ply(values[j][6]).encode("ascii")
+            new["sfen_offset"][j] = len(self.sfens) + len(pool)
+            new["sfen_length"][j] = len(body)
+            pool += body
+        self.sfens += bytes(pool)
+        self.nodes = _merge_nodes(self.nodes, new)
+
+        new_edges = np.zeros(len(edges), edge_dtype)
+        if edges:
+            parent, child, move = zip(*edges.keys())
+            new_edges["parent"] = parent
+            new_edges["child"] = child
+            new_edges["move"] = move
+            new_edges["games"] = list(edges.values())
+        self.edges = _merge_edges(self.edges, new_edges)
+        return added, skipped
+
+
+def _merge_nodes(old, new):
+    """ 同じkeyのノードの集計を足し合わせる。sfenは先にあったほう、手数は小さいほう。"""
+    both = np.concatenate([old, new])
+    keys, first, inverse = np.unique(both["key"], return_index=True, return_inverse=True)
+    merged = np.zeros(len(keys), old.dtype)
+    merged["key"] = keys
+    for field in ("games", "wins", "draws", "eval_sum", "eval_count"):
+        np.add.at(merged[field], inverse, both[field])
+    merged["ply"] = np.iinfo(np.uint16).max
+    np.minimum.at(merged["ply"], inverse, both["ply"])
+    merged["sfen_offset"] = both["sfen_offset"][first]
+    merged["sfen_length"] = both["sfen_length"][first]
+    return merged
+
+
+def _merge_edges(old, new):
+    both = np.concatenate([old, new])
+    ids = np.zeros(len(both), np.dtype([("parent", "<u8"), ("child", "<u8"), ("move", "<u2")]))
+    for field in ("parent", "child", "move"):
+        ids[field] = both[field]
+    ids, inverse = np.unique(ids, return_inverse=True)
+    merged = np.zeros(len(ids), old.dtype)
+    for field in ("parent", "child", "move"):
+        merged[field] = ids[field]
+    np.add.at(merged["games"], inverse, both["games"])
+    return merged
+
+
+# ======================================================================
+# minimax
+# ======================================================================
+
+def node_values(table, value="eval", eval_clip=3000):
+    """ 局面の素の値(手番側から見た評価値)。"""
+    nodes = table.nodes
+    games = np.maximum(nodes["games"], 1).astype(np.float64)
+    p = (nodes["wins"] + nodes["draws"] * 0.5) / games
+    p = np.clip(p, 1e-6, 1 - 1e-6)
+    v = np.clip(WINRATE_SCALE * np.log(p / (1 - p)), -eval_clip, eval_clip)
+    if value == "eval":
+        has_eval = nodes["eval_count"] > 0
+        v[has_eval] = nodes["eval_sum"][has_eval] / nodes["eval_count"][has_eval]
+    return v
+
+
+def backup(table, min_games=1, value="eval", eval_clip=3000):
+    """
+    min_games局以上指された手をたどって、手数の深い局面から順にnegamaxで値を伝播させる。
+    戻り値 : (値, 最善手のedgeの添字(なければ-1), 伝播できた手数) のノードごとの配列と、使ったedgeの添字の配列
+    """
+    nodes, edges = table.nodes, table.edges
+    v = node_values(table, value, eval_clip)
+    height = np.zeros(len(nodes), dtype=np.int32)
+    best_edge = np.full(len(nodes), -1, dtype=np.int64)
+
+    used = np.flatnonzero(edges["games"] >= min_games)
+    parent = table.node_index(edges["parent"][used])
+    child = table.node_index(edges["child"][used])
+    ply = nodes["ply"][parent].astype(np.int64)
+
+    # 親の手数の深い順に、手数ごとにまとめて処理する。
+    order = np.argsort(-ply, kind="stable")
+    used, parent, child, ply = used[order], parent[order], child[order], ply[order]
+    starts = np.flatnonzero(np.r_[True, ply[1:] != ply[:-1]])
+    ends = np.r_[starts[1:], len(ply)]
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        p, c = parent[s:e], child[s:e]
+        cand = -v[c]
+        best = np.full(len(nodes), -np.inf)
+        np.maximum.at(best, p, cand)
+        tie = cand == best[p]
+        best_edge[p[tie]] = used[s:e][tie]
+        np.maximum.at(height, p[tie], height[c[tie]] + 1)
+        parents = np.unique(p)
+        v[parents] = best[parents]
+    return v, best_edge, height, used
+
+
+def export_book(table, path, min_games=1, max_ply=0, value="eval", eval_clip=3000):
+    """ 集計表から定跡を作って書き出す。書き出した局面数を返す。"""
+    v, best_edge, height, used = backup(table, min_games, value, eval_clip)
+    nodes, edges = table.nodes, table.edges
+
+    parent = table.node_index(edges["parent"][used])
+    child = table.node_index(edges["child"][used])
+    book = {}
+    for e, p, c in zip(used.tolist(), parent.tolist(), child.tolist()):
+        if nodes["games"][p] < min_games or (max_ply and nodes["ply"][p] > max_ply):
+            continue
+        reply = best_edge[c]
+        ponder = move16_to_move(int(edges["move"][reply])) if reply >= 0 else "none"
+        book.setdefault(p, []).append(BookMove(move16_to_move(int(edges["move"][e])), ponder,
+                                               int(round(-v[c])), int(height[c]) + 1, int(edges["games"][e])))
+
+    entries = sorted((table.sfen_of(p), sort_moves(moves)) for p, moves in book.items())
+    return write_book(path, entries)
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+async def update(table, files, replayer, book_moves, eval_clip, max_ply, save):
+    """ 棋譜ファイルの新しい対局を集計表に足す。棋譜ファイル1つを読み終えるごとにsave()を呼ぶ。"""
+    total_added = total_skipped = 0
+    for path in files:
+        state_key = os.path.abspath(path)
+        offset = table.state.get(state_key, 0)
+        if os.path.getsize(path) < offset:
+            print(f"Warning! {path} is shorter than the last update, reading it from the beginning.")
+            offset = 0
+        games, end = read_games(path, offset)
+        for i in range(0, len(games), BATCH_GAMES):
+            batch = games[i:i + BATCH_GAMES]
+            added, skipped = table.add_games(batch, await replayer.replay(batch), book_moves, eval_clip, max_ply)
+            total_added += added
+            total_skipped += skipped
+        table.state[state_key] = end
+        save()
+        print(f"{path} : {len(games)} new games")
+    return total_added, total_skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accumulate match games into a position table and export a minimax-backed book.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("update", help="Add the games finished since the last update to the table.")
+    p.add_argument("table", type=str, help="Position table (.npz). Created if it does not exist.")
+    p.add_argument("kifu", type=str, nargs="+", help="Game record files (.sfen) written by engine_invoker.py.")
+    p.add_argument("--book_moves", type=int, default=24, help="Plies played from the opening book (their evals are placeholders).")
+    p.add_argument("--eval_clip", type=int, default=3000, help="Clip evals to +-this value before averaging.")
+    p.add_argument("--max_ply", type=int, default=0, help="Do not record positions deeper than this ply (0 = no limit).")
+    p.add_argument("--engine", type=str, default="", help="Engine used to replay the games when the core wrapper is not built.")
+    p.add_argument("--workers", type=int, default=1, help="Number of engine processes for --engine.")
+    p.add_argument("--option", type=str, action="append", default=[], help="NAME=VALUE engine option for --engine.")
+    p.add_argument("--export", type=str, default="", help="Also export the book to this file after the update.")
+    p.add_argument("--min_games", type=int, default=2, help="(export) Minimum number of games for a move to be in the book.")
+    p.add_argument("--export_max_ply", type=int, default=0, help="(export) Do not write positions deeper than this ply (0 = no limit).")
+    p.add_argument("--value", type=str, default="eval", choices=["eval", "result"], help="(export) Leaf value: mean eval or game results.")
+
+    p = sub.add_parser("export", help="Back up the values by minimax and write a .db book.")
+    p.add_argument("table", type=str)
+    p.add_argument("book", type=str, help="Output book file (.db).")
+    p.add_argument("--min_games", type=int, default=2, help="Minimum number of games for a move to be in the book.")
+    p.add_argument("--max_ply", type=int, default=0, help="Do not write positions deeper than this ply (0 = no limit).")
+    p.add_argument("--value", type=str, default="eval", choices=["eval", "result"], help="Leaf value: mean eval or game results.")
+    p.add_argument("--eval_clip", type=int, default=3000, help="Clip values converted from win rates to +-this value.")
+    args = parser.parse_args()
+
+    _require_numpy()
+    start = time.time()
+    table = GameTable.load(args.table)
+
+    if args.command == "update":
+        if core is not None:
+            replayer = CoreReplayer()
+        elif args.engine:
+            options = [tuple(o.split("=", 1)) for o in args.option]
+            replayer = EngineReplayer(args.engine, args.workers, options)
+        else:
+            print("Error! the core wrapper is not built. Build it with 'build.sh' or give --engine.")
+            sys.exit(1)
+
+        async def run():
+            await replayer.start()
+            try:
+                return await update(table, args.kifu, replayer, args.book_moves, args.eval_clip, args.max_ply,
+                                    lambda: table.save(args.table))
+            finally:
+                await replayer.close()
+
+        added, skipped = asyncio.run(run())
+        print(f"{args.table} : {added} games added ({skipped} skipped) , {len(table.nodes)} positions ,"
+              f" {len(table.edges)} moves , {time.time() - start:.1f}s")
+        if not args.export:
+            return
+        book_path, max_ply, eval_clip = args.export, args.export_max_ply, args.eval_clip
+    else:
+        book_path, max_ply, eval_clip = args.book, args.max_ply, args.eval_clip
+
+    start = time.time()
+    count = export_book(table, book_path, args.min_games, max_ply, args.value, eval_clip)
+    print(f"{book_path} : {count} positions , {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
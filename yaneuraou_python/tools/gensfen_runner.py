@@ -0,0 +1,367 @@
+"""
+教師局面の生成(gensfen)を、EVAL_LEARN版の思考エンジンを複数プロセス起動して並列に行うドライバ。
+
+gensfenは1プロセスの中ではThreadsの数だけ並列に動くが、こちらはプロセスを並べるので、
+NUMAノードごとにプロセスを分けたり、長時間の生成で1プロセスが落ちてもそこだけやり直したりできる。
+
+使い方:
+    python gensfen_runner.py run --engine YaneuraOu-learn --loop 100000000 --out_dir teacher --output teacher.bin
+                                 [--shards 8] [--threads 1] [--hash 256] [--option EvalDir=eval]
+                                 [--gensfen "depth 8 eval_limit 3000 write_minply 16"] [--seed 1]
+                                 [--max_restarts 5] [--stall_timeout 1800] [--report_interval 60]
+                                 [--memory 1024] [--no_merge]
+    python gensfen_runner.py merge teacher.bin teacher/shard_000.bin teacher/shard_001.bin ... [--memory 1024]
+
+処理の流れ:
+  1. loopの局面数をshardの数で分け、shardごとにエンジンを1つ起動して
+     "gensfen ... loop <担当数> output_file_name <out_dir>/shard_<n>.bin seed <seed>" を送る。
+     seedは--seedからshardごと・起動回数ごとに異なる値を作る。(同じseedで生成し直すと同じ局面が並ぶので)
+  2. report_interval秒ごとに、各shardのファイルの大きさから局面数と生成速度(positions/s)を表示する。
+  3. "gensfen finished." の前にエンジンが終了したり、stall_timeout秒ファイルが増えなかったりしたら、
+     書きかけの端数を切り詰めて、残りの局面数を新しいseedで生成し直す。(gensfenは出力ファイルに追記する)
+  4. 全shardが終わったら、psv_shuffle.shuffle_dedup()で一定のメモリのままシャッフルしながら1つのファイルにまとめる。
+     (重複局面は取り除かない。取り除くときはまとめたファイルに対して psv_shuffle.py を使う)
+
+中断しても、同じコマンドで再開すれば各shardのファイルにある局面の続きから生成する。
+shardごとの起動回数は <out_dir>/gensfen_state.json に記録しておき、再開時もseedが重ならないようにする。
+
+エンジンは gensfen の "seed" オプションに対応しているものを使うこと。(source/learn/learner.cpp)
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from psv_file import PSV_SIZE, truncate_partial
+from psv_shuffle import shuffle_dedup
+from usi_engine import UsiEngine, UsiEngineError
+
+# gensfenが終わったときにエンジンが出力する行
+FINISHED_LINE = "gensfen finished."
+
+# --gensfenでは指定できない(このドライバが決める)gensfenのオプション
+RESERVED_TOKENS = ("loop", "output_file_name", "seed", "save_every", "random_file_name")
+
+STATE_FILE = "gensfen_state.json"
+
+MASK64 = (1 << 64) - 1
+
+
+def splitmix64(x):
+    """ SplitMix64の1ステップ。連番から互いに相関のない64bitの値を作るのに使う。"""
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def shard_seed(base_seed, shard, attempt):
+    """ shard番目の、attempt回目の起動で使うseed。PRNGのseedは0ではいけないので0を避ける。"""
+    seed = splitmix64(splitmix64(base_seed) ^ splitmix64((shard << 32) | attempt))
+    return seed or 1
+
+
+def split_loop(loop, shards):
+    """ loopの局面数をshardsに分ける。端数は前のshardから1つずつ多くする。"""
+    return [loop // shards + (1 if i < loop % shards else 0) for i in range(shards)]
+
+
+def check_gensfen_args(tokens):
+    for token in tokens:
+        if token in RESERVED_TOKENS:
+            raise ValueError(f"'{token}' is set by gensfen_runner and cannot be given in --gensfen.")
+
+
+# ======================================================================
+# shard 1つ
+# ======================================================================
+
+class Shard:
+    """
+    1つのエンジンプロセスが担当する生成分。
+
+    target   : このshardで生成する局面数
+    attempts : これまでにエンジンを起動した回数(seedを作るのに使う。再開時はstateファイルから戻す)
+    """
+
+    def __init__(self, index, path, target, attempts=0):
+        self.index = index
+        self.path = path
+        self.target = target
+        self.attempts = attempts
+        self.restarts = 0
+        self.seed = None
+        self.engine = None
+        self.finished = False
+        self.failed = False
+
+        # 生成速度の計測用
+        self.last_records = 0
+        self.last_time = time.time()
+        self.last_growth = time.time()
+        self.rate = 0.0
+
+    def records(self):
+        return os.path.getsize(self.path) // PSV_SIZE if os.path.exists(self.path) else 0
+
+    def sample(self, now):
+        """ ファイルの大きさから局面数と前回からの生成速度を更新して、局面数を返す。"""
+        records = self.records()
+        if records != self.last_records:
+            self.last_growth = now
+        elapsed = now - self.last_time
+        if elapsed > 0:
+            self.rate = (records - self.last_records) / elapsed
+        self.last_records = records
+        self.last_time = now
+        return records
+
+
+# ======================================================================
+# 生成
+# ======================================================================
+
+class GensfenRunner:
+    """
+    gensfenの並列実行1回分。
+
+    options : エンジンに送るsetoptionの (name, value) のlist。Threads/USI_Hashは自動で送る。
+    gensfen : gensfenコマンドに付け足すオプションのtokenのlist。(loop/output_file_name/seedなどは不可)
+    """
+
+    def __init__(self, engine_path, out_dir, loop, shards=1, threads=1, hash_mb=256, options=(), gensfen=(),
+                 seed=None, max_restarts=5, stall_timeout=0, report_interval=60):
+        check_gensfen_args(gensfen)
+        self.engine_path = engine_path
+        self.out_dir = os.path.abspath(out_dir)
+        self.loop = loop
+        self.threads = threads
+        self.hash_mb = hash_mb
+        self.options = list(options)
+        self.gensfen = list(gensfen)
+        self.max_restarts = max_restarts
+        self.stall_timeout = stall_timeout
+        self.report_interval = report_interval
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.state_path = os.path.join(self.out_dir, STATE_FILE)
+        state = self.load_state()
+        if state is not None:
+            if state["loop"] != loop or state["shards"] != shards:
+                raise ValueError(f"{self.state_path} was made with loop {state['loop']} , shards {state['shards']}."
+                                 " Use the same values to resume, or another --out_dir.")
+            # 再開時は前回のseedを引き継ぐ。(--seedの指定は無視)
+            self.seed = state["seed"]
+            attempts = state["attempts"]
+        else:
+            self.seed = seed if seed is not None else int.from_bytes(os.urandom(8), "little")
+            attempts = [0] * shards
+
+        self.shards = [Shard(i, os.path.join(self.out_dir, f"shard_{i:03d}.bin"), target, attempts[i])
+                       for i, target in enumerate(split_loop(loop, shards))]
+
+    # ------------------------------------------------------------------
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_state(self):
+        state = {
+            "loop": self.loop,
+            "shards": len(self.shards),
+            "seed": self.seed,
+            "attempts": [shard.attempts for shard in self.shards],
+        }
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp, self.state_path)
+
+    def shard_paths(self):
+        return [shard.path for shard in self.shards]
+
+    # ------------------------------------------------------------------
+
+    async def _start_engine(self, shard, remain):
+        """ エンジンを起動して、残りremain局面のgensfenを開始する。"""
+        shard.seed = shard_seed(self.seed, shard.index, shard.attempts)
+        shard.attempts += 1
+        self.save_state()
+
+        cwd = os.path.dirname(os.path.abspath(self.engine_path)) or None
+        engine = await UsiEngine(self.engine_path, cwd=cwd).start()
+        shard.engine = engine
+        await engine.usi()
+        engine.setoption("Threads", self.threads)
+        engine.setoption("USI_Hash", self.hash_mb)
+        for name, value in self.options:
+            engine.setoption(name, value)
+        await engine.isready(timeout=600.0)
+        cmd = " ".join(["gensfen"] + self.gensfen
+                       + ["loop", str(remain), "output_file_name", shard.path, "seed", str(shard.seed)])
+        engine.send(cmd)
+        return engine
+
+    async def _run_shard(self, shard):
+        while True:
+            records = truncate_partial(shard.path) if os.path.exists(shard.path) else 0
+            remain = shard.target - records
+            if remain <= 0:
+                shard.finished = True
+                return
+
+            now = time.time()
+            shard.last_records, shard.last_time, shard.last_growth = records, now, now
+            try:
+                engine = await self._start_engine(shard, remain)
+                await engine.read_until(lambda line, rec: line.strip() == FINISHED_LINE)
+                await engine.quit()
+                shard.finished = True
+                return
+            except (UsiEngineError, OSError) as e:
+                reason = str(e)
+            finally:
+                if shard.engine is not None and shard.engine.poll() is None:
+                    shard.engine.kill_now()
+                    await shard.engine.wait_closed()
+                shard.engine = None
+
+            shard.restarts += 1
+            print(f"shard {shard.index} : engine failed ({reason}) , {shard.records()}/{shard.target} positions"
+                  f" , restart {shard.restarts}/{self.max_restarts}")
+            sys.stdout.flush()
+            if shard.restarts > self.max_restarts:
+                shard.failed = True
+                return
+
+    async def _watch(self):
+        """ 生成状況を定期的に表示して、ファイルが増えなくなったエンジンをkillする。"""
+        while True:
+            await asyncio.sleep(self.report_interval)
+            now = time.time()
+            total = 0
+            total_rate = 0.0
+            lines = []
+            for shard in self.shards:
+                records = shard.sample(now)
+                total += records
+                if shard.finished or shard.failed:
+                    state = "done" if shard.finished else "FAILED"
+                else:
+                    state = f"{shard.rate:.0f} positions/s"
+                    total_rate += shard.rate
+                    if (self.stall_timeout and shard.engine is not None
+                            and now - shard.last_growth >= self.stall_timeout):
+                        state += " , stalled"
+                        shard.engine.kill_now()
+                lines.append(f"  shard {shard.index} : {records}/{shard.target} , {state}")
+            print(f"{time.strftime('%Y/%m/%d %H:%M:%S')} : {total}/{self.loop} positions , {total_rate:.0f} positions/s")
+            print("\n".join(lines))
+            sys.stdout.flush()
+
+    async def run(self):
+        """ 全shardの生成を行い、すべて生成できたならTrueを返す。"""
+        print(f"gensfen : {self.loop} positions , {len(self.shards)} shards , seed {self.seed}"
+              f" , engine {self.engine_path}")
+        start = time.time()
+        start_records = sum(shard.records() for shard in self.shards)
+        watcher = asyncio.ensure_future(self._watch())
+        try:
+            await asyncio.gather(*(self._run_shard(shard) for shard in self.shards))
+        finally:
+            watcher.cancel()
+            for shard in self.shards:
+                if shard.engine is not None and shard.engine.poll() is None:
+                    shard.engine.kill_now()
+
+        elapsed = time.time() - start
+        generated = sum(shard.records() for shard in self.shards) - start_records
+        print(f"generated : {generated} positions in {elapsed:.1f}s ({generated / max(elapsed, 1e-9):.0f} positions/s)")
+        failed = [shard.index for shard in self.shards if shard.failed]
+        if failed:
+            print(f"Error! shards {failed} failed more than {self.max_restarts} times. Run the same command again to resume.")
+            return False
+        return True
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def merge(inputs, output, memory_mb, tmp_dir, seed):
+    start = time.time()
+    _, count = shuffle_dedup(inputs, output, dedup_mode="none", memory_mb=memory_mb, tmp_dir=tmp_dir, seed=seed)
+    elapsed = time.time() - start
+    print(f"{output} : {count} positions (shuffled) , {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} positions/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate teacher positions with gensfen on several engine processes and merge them.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="Run gensfen shards in parallel, restart failed ones, then shuffle-merge the output.")
+    p.add_argument("--engine", type=str, required=True, help="Engine executable built with EVAL_LEARN.")
+    p.add_argument("--loop", type=int, required=True, help="Total number of positions to generate.")
+    p.add_argument("--out_dir", type=str, required=True, help="Directory for shard files and the resume state.")
+    p.add_argument("--output", type=str, default="", help="Merged and shuffled output file (default: <out_dir>/shuffled.bin).")
+    p.add_argument("--shards", type=int, default=os.cpu_count(), help="Number of engine processes.")
+    p.add_argument("--threads", type=int, default=1, help="Threads per engine process.")
+    p.add_argument("--hash", type=int, default=256, help="USI_Hash per engine process [MB].")
+    p.add_argument("--option", type=str, action="append", default=[], help="NAME=VALUE engine option. Can be given multiple times.")
+    p.add_argument("--gensfen", type=str, default="", help="Extra gensfen options, e.g. \"depth 8 eval_limit 3000\".")
+    p.add_argument("--seed", type=int, default=None, help="Base seed for per-shard seeds (default: random). Ignored when resuming.")
+    p.add_argument("--max_restarts", type=int, default=5, help="Give up a shard after this many engine failures.")
+    p.add_argument("--stall_timeout", type=int, default=0, help="Kill and restart an engine whose shard file did not grow for this many seconds (0 = never).")
+    p.add_argument("--report_interval", type=int, default=60, help="Seconds between progress reports.")
+    p.add_argument("--memory", type=int, default=1024, help="Memory budget for the shuffle-merge [MB].")
+    p.add_argument("--tmp_dir", type=str, default=None, help="Directory for temporary files of the shuffle-merge (default: out_dir).")
+    p.add_argument("--no_merge", action="store_true", help="Only generate the shard files.")
+
+    p = sub.add_parser("merge", help="Shuffle-merge teacher files into one file with bounded memory.")
+    p.add_argument("output", type=str, help="Output file.")
+    p.add_argument("inputs", type=str, nargs="+", help="Teacher files.")
+    p.add_argument("--memory", type=int, default=1024, help="Memory budget [MB].")
+    p.add_argument("--tmp_dir", type=str, default=None, help="Directory for temporary files (default: system temp).")
+    p.add_argument("--seed", type=int, default=None, help="Random seed (default: random).")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        merge(args.inputs, args.output, args.memory, args.tmp_dir, args.seed)
+        return
+
+    options = []
+    for option in args.option:
+        name, sep, value = option.partition("=")
+        if not sep:
+            print(f"Error! bad option (NAME=VALUE) : {option}")
+            sys.exit(1)
+        options.append((name, value))
+
+    if args.shards < 1 or args.loop < 1:
+        print("Error! --shards and --loop must be positive.")
+        sys.exit(1)
+
+    try:
+        runner = GensfenRunner(args.engine, args.out_dir, args.loop, shards=args.shards, threads=args.threads,
+                               hash_mb=args.hash, options=options, gensfen=args.gensfen.split(), seed=args.seed,
+                               max_restarts=args.max_restarts, stall_timeout=args.stall_timeout,
+                               report_interval=args.report_interval)
+    except ValueError as e:
+        print(f"Error! {e}")
+        sys.exit(1)
+
+    if not asyncio.run(runner.run()):
+        sys.exit(1)
+    if args.no_merge:
+        return
+    output = args.output or os.path.join(args.out_dir, "shuffled.bin")
+    merge(runner.shard_paths(), output, args.memory, args.tmp_dir or runner.out_dir, runner.seed)
+
+
+if __name__ == "__main__":
+    main()
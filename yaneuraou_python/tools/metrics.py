@@ -0,0 +1,262 @@
+"""
+対局ランナーの稼働状況をPrometheusのtext形式で公開するためのモジュール。
+
+engine_invoker.py に --metrics_port 9100 のように指定すると、
+http://localhost:9100/metrics で以下のような値が見える。
+
+    yaneuraou_games_total{result="win"} 12
+    yaneuraou_moves_total 3456
+    yaneuraou_bestmove_latency_seconds_bucket{engine="1",le="0.5"} 789
+    yaneuraou_engine_nps{engine="0"} 1234567
+    yaneuraou_active_games 8
+    ...
+
+標準ライブラリ(http.server)だけで動く。サーバーはdaemon threadで動くので、
+メインの対局ループの終了を妨げない。
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# bestmove往復時間のヒストグラムの区切り[秒]
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+# メッセージキューでの滞留時間のヒストグラムの区切り[秒]
+QUEUE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+# ======================================================================
+# メトリクスの型
+# ======================================================================
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    """ ラベルの値の組ごとに値を持つメトリクスの基底クラス。"""
+    kind = ""
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, v in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, v in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [各bucketの件数(非累積), sum, count]
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                acc = 0
+                for b, c in zip(self.buckets, counts):
+                    acc += c
+                    le = 'le="' + _format_value(float(b)) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {acc}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """ メトリクスの集合。render()でPrometheusのtext形式(0.0.4)の文字列を返す。"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+# ======================================================================
+# 対局ランナー用のメトリクス一式
+# ======================================================================
+
+class MatchMetrics:
+    """ vs_match から呼び出すイベント単位のメソッドをまとめたもの。"""
+
+    def __init__(self):
+        r = self.registry = Registry()
+        self.start_time = r.register(Gauge(
+            "yaneuraou_start_time_seconds", "Unix time when the match runner started."))
+        self.games = r.register(Counter(
+            "yaneuraou_games_total", "Finished games by result from engine1's point of view.", ["result"]))
+        self.moves = r.register(Counter(
+            "yaneuraou_moves_total", "Moves played (bestmove received).", ["engine"]))
+        self.active_games = r.register(Gauge(
+            "yaneuraou_active_games", "Games currently in progress."))
+        self.bestmove_latency = r.register(Histogram(
+            "yaneuraou_bestmove_latency_seconds", "Time from sending go to receiving bestmove.", ["engine"],
+            LATENCY_BUCKETS))
+        self.queue_latency = r.register(Histogram(
+            "yaneuraou_queue_latency_seconds", "Time an engine output line waited in the message queue.", [],
+            QUEUE_BUCKETS))
+        self.nps = r.register(Gauge(
+            "yaneuraou_engine_nps", "Last reported nps per engine.", ["engine"]))
+        self.terminations = r.register(Counter(
+            "yaneuraou_engine_terminations_total", "Engine processes that exited unexpectedly.", ["engine"]))
+        self.timeouts = r.register(Counter(
+            "yaneuraou_engine_timeouts_total", "Searches that did not return bestmove in time.", ["engine"]))
+        self.restarts = r.register(Counter(
+            "yaneuraou_engine_restarts_total", "Engine processes restarted by the runner.", ["engine"]))
+        self.adjudications = r.register(Counter(
+            "yaneuraou_adjudications_total", "Games ended by score adjudication.", ["reason"]))
+        self.ponders = r.register(Counter(
+            "yaneuraou_ponder_total", "Ponder searches resolved by the opponent's move.", ["engine", "result"]))
+
+        self.start_time.set(time.time())
+
+    def on_game_start(self):
+        self.active_games.inc()
+
+    def on_game_end(self, result):
+        """ result : "win" | "lose" | "draw" (engine1から見た結果) """
+        self.active_games.dec()
+        self.games.inc(result=result)
+
+    def on_game_void(self):
+        """ エンジンの異常終了で対局が無効になった。"""
+        self.active_games.dec()
+
+    def on_bestmove(self, engine, latency, nps):
+        self.moves.inc(engine=engine)
+        self.bestmove_latency.observe(latency, engine=engine)
+        if nps is not None:
+            self.nps.set(nps, engine=engine)
+
+    def on_message(self, queued_time):
+        self.queue_latency.observe(time.time() - queued_time)
+
+    def on_terminated(self, engine):
+        self.terminations.inc(engine=engine)
+
+    def on_timeout(self, engine):
+        self.timeouts.inc(engine=engine)
+
+    def on_restart(self, engine):
+        self.restarts.inc(engine=engine)
+
+    def on_adjudication(self, reason):
+        self.adjudications.inc(reason=reason)
+
+    def on_ponder(self, engine, hit):
+        self.ponders.inc(engine=engine, result="hit" if hit else "miss")
+
+
+# ======================================================================
+# HTTPサーバー
+# ======================================================================
+
+def start_metrics_server(registry, port, host="127.0.0.1"):
+    """
+    registryの内容を http://host:port/metrics で公開するサーバーをdaemon threadで起動する。
+    起動したHTTPServerを返す。止めるときは server.shutdown() を呼ぶ。
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # アクセスのたびに標準エラーに出力されると対局ログが読みにくくなるので黙らせる。
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
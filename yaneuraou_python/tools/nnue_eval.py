@@ -0,0 +1,371 @@
+"""
+NNUE評価関数(nn.bin)をnumpyで計算する、エンジンの評価関数の参照実装。
+
+大量の局面をまとめて評価して、学習した評価関数や量子化の変更を、エンジンを動かさずに(USIでやりとりせずに)検証するためのもの。
+source/eval/nnue/architectures/ の各アーキテクチャ(halfkp_256x2-32-32 , halfkp_1024x2-8-64 , sfnnwop-1536 など)に対応する。
+(halfkpe9は入力特徴量に利きが要るので未対応)
+
+整数モード(既定)ではエンジンのscalar実装と同じ整数演算をするので、ネットワークの出力はエンジンとbit単位で一致する。
+    特徴量変換器 : 累積値はint16(桁あふれは折り返し)。SFNNwoPSQT型は読み込み時に重みを2倍する。(scale_weights())
+    全結合層     : int32の積和。ClippedReLUは >> kWeightScaleBits(6) してから0～127にclampする。
+float モード(--float)では、途中の切り捨て(>> 6 , / 512)をせずに実数で計算する。量子化による誤差を見るのに使う。
+
+局面の入力特徴量は、yaneuraou_python.core.nnue_piece_lists() で求めた駒リスト(BonaPiece)から求める。
+(ラッパーをビルドしていないときは、駒リストを自分で用意して NNUEEvaluator.evaluate_pieces() を呼ぶ)
+
+評価値は ネットワークの出力 / FV_SCALE を±VALUE_MAX_EVALにclampしたもの。(evaluate_nnue.cpp の ComputeScore())
+ただし、現在のComputeScore()はPSQTパスの作業中で、ネットワークの出力をそのまま返しているので、
+エンジンの評価値と比べるときは --raw で出力をそのまま表示して比べること。
+
+使い方:
+    python nnue_eval.py eval  nn.bin sfens.txt [--arch halfkp_256x2-32-32] [--raw] [--float] [-o values.tsv]
+    python nnue_eval.py stats nn.bin sfens.txt
+
+    sfens.txt は1行1局面のsfen。("startpos"も可。先頭の"sfen "は無視する)
+
+    with NNUEEvaluator("nn.bin") as ev:
+        output = ev.evaluate(sfens)            # int64 [局面数] ネットワークの出力
+        values = to_value(output)              # 評価値
+"""
+import argparse
+import os
+import sys
+
+from nnue_file import E_KING, FE_END, FE_END2, FILE_NB, SQ_NB, NNUEFile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# ラッパー(yaneuraou_python/core)で局面の駒リストを求める。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+try:
+    from yaneuraou_python import core
+except ImportError:
+    core = None
+
+# evaluate.h の fe_hand_end (手駒の終端。盤上の駒はここから)
+FE_HAND_END = 90
+
+# 駒リストでの玉の位置 (types.h の PIECE_NUMBER_KING。先手玉が38、後手玉が39)
+PIECE_NUMBER_KING = 38
+
+# 6筋の最初の升 (types.h の SQ_61)。HalfKP_vm , HalfKA_hm は玉がここより左にいるとき盤面をミラーする。
+SQ_61 = 5 * FILE_NB
+
+# nnue_common.h の kWeightScaleBits
+WEIGHT_SCALE_BITS = 6
+
+# FV_SCALEの既定値 (evaluate_nnue.cpp)
+FV_SCALE = 16
+
+# types.h の VALUE_MAX_EVAL (VALUE_MATE - MAX_PLY - 1)
+VALUE_MAX_EVAL = 32000 - 246 - 1
+
+# 一度に評価する局面数の既定値。特徴量変換器の累積値が 局面数 x 2 x half のint32になる。
+BATCH_SIZE = 1024
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+# ======================================================================
+# 入力特徴量
+# ======================================================================
+
+def _mir(sq):
+    """ 5筋を軸にミラーした升。(types.h の Mir()) """
+    return (FILE_NB - 1 - sq // FILE_NB) * FILE_NB + sq % FILE_NB
+
+
+def _mirror(sq_k, p):
+    """
+    玉が6筋～9筋にいるとき、玉と盤上の駒を4筋～1筋側にミラーする。持駒はそのまま。
+    (features/half_kp_vm.cpp などの MakeIndex())
+    """
+    mirrored = sq_k >= SQ_61
+    sq_k = np.where(mirrored, _mir(sq_k), sq_k)
+    q = p - FE_HAND_END
+    board = mirrored[..., None] & (p >= FE_HAND_END)
+    p = np.where(board, FE_HAND_END + q // SQ_NB * SQ_NB + _mir(q % SQ_NB), p)
+    return sq_k, p
+
+
+def feature_indices(feature, pieces):
+    """
+    駒リストから、値が1である入力特徴量のインデックスを求める。(features/*.cpp の AppendActiveIndices())
+
+    pieces : int [局面数][2(先手視点,後手視点)][40] の駒リスト。(core.nnue_piece_lists()の戻り値)
+    戻り値 : int64 [局面数][2][特徴量の数]
+    feature は nnue_arch_gen.py の入力特徴量名。
+    """
+    pieces = np.asarray(pieces, dtype=np.int64)
+    if (pieces[:, :, PIECE_NUMBER_KING:] < FE_END).any():
+        raise ValueError("positions without both kings cannot be evaluated.")
+    # 各視点の自玉の升 (Side::kFriend)。後手視点の駒リストでは盤面が180度回転している。
+    kings = np.stack([pieces[:, 0, PIECE_NUMBER_KING], pieces[:, 1, PIECE_NUMBER_KING + 1]], axis=1)
+    sq_k = (kings - FE_END) % SQ_NB
+    others = pieces[:, :, :PIECE_NUMBER_KING]
+
+    if feature == "halfkp":
+        return FE_END * sq_k[..., None] + others
+    if feature == "halfkpvm":
+        sq_k, p = _mirror(sq_k, others)
+        return FE_END * sq_k[..., None] + p
+    if feature == "kp":
+        # K(両玉の升 : 162次元)とP(玉以外の駒 : fe_end次元)を並べたもの。
+        return np.concatenate([pieces[:, :, PIECE_NUMBER_KING:] - FE_END, others + 2 * SQ_NB], axis=2)
+    if feature == "halfka1":
+        return FE_END2 * sq_k[..., None] + pieces
+    if feature == "halfkahm1":
+        sq_k, p = _mirror(sq_k, pieces)
+        return FE_END2 * sq_k[..., None] + p
+    if feature in ("halfka2", "halfkahm2", "halfkahm"):
+        # 相手玉は自玉と同じ平面に置く。
+        # halfkahm(SFNNwoPSQT型)の features/half_ka_hm.h はこのツリーにないので、次元数が同じHalfKA_hm2として扱う。
+        p = pieces
+        if feature != "halfka2":
+            sq_k, p = _mirror(sq_k, p)
+        return E_KING * sq_k[..., None] + np.where(p >= E_KING, p - SQ_NB, p)
+    raise ValueError(f"input feature {feature} is not supported.")
+
+
+# ======================================================================
+# 評価
+# ======================================================================
+
+def to_value(output, fv_scale=FV_SCALE):
+    """ ネットワークの出力を評価値にする。(output / FV_SCALE を±VALUE_MAX_EVALにclamp) """
+    output = np.asarray(output)
+    if np.issubdtype(output.dtype, np.integer):
+        # C++の整数の割り算は0方向に切り捨てる。
+        value = np.sign(output) * (np.abs(output) // fv_scale)
+    else:
+        value = output / fv_scale
+    return np.clip(value, -VALUE_MAX_EVAL, VALUE_MAX_EVAL)
+
+
+class NNUEEvaluator:
+    """
+    nn.binを読み込んで、局面をまとめて評価する。
+
+    net は nn.binのpath か NNUEFile。arch を省略すると、ファイルの構造文字列からアーキテクチャを推定する。
+    exact=True(整数モード)のとき出力はint64、Falseのときfloat64。
+    """
+
+    def __init__(self, net, arch=None, batch_size=BATCH_SIZE):
+        _require_numpy()
+        self._owns_net = not isinstance(net, NNUEFile)
+        self.net = NNUEFile(net, arch) if self._owns_net else net
+        lay = self.net.layout
+        self.spec = lay.spec
+        if self.spec.feature == "halfkpe9":
+            self.close()
+            raise ValueError("halfkpe9 needs the effects of the position and is not supported.")
+        self.half = lay.half_dims
+        self.batch_size = batch_size
+
+        # SFNNwoPSQT型はエンジンが読み込み時に特徴量変換器の重みとbiasを2倍する。
+        self._ft_scale = 2 if self.spec.sfnn else 1
+        # 全結合層は小さいので、行列積用にfloat64の[入力][出力]にしておく。
+        # 入力は0～127、重みはint8なので、積和はfloat64で誤差なく求まる。
+        self._fc = [(layer.weights[:, :layer.inputs].T.astype(np.float64), layer.biases.astype(np.int64))
+                    for layer in self.net.layers]
+
+    # ------------------------------------------------------------------
+    # 特徴量変換器
+    # ------------------------------------------------------------------
+
+    def accumulate(self, pieces):
+        """ 両視点の累積値を求める。int16 [局面数][2][half] (refresh_accumulator()) """
+        indices = feature_indices(self.spec.feature, pieces)
+        weights = self.net.ft_weights
+        acc = np.empty(indices.shape[:2] + (self.half,), dtype=np.int32)
+        acc[...] = self.net.ft_biases
+        # 疎な入力と重みの行列積は、値が1の特徴量の重みの行を足すのと同じ。
+        for k in range(indices.shape[2]):
+            acc += weights[indices[:, :, k]]
+        if self._ft_scale != 1:
+            acc *= self._ft_scale
+        # エンジンの累積値はint16なので、桁あふれは2の補数で折り返す。
+        return acc.astype(np.int16)
+
+    def transform(self, acc, side_to_move, exact=True):
+        """ 累積値を手番側 , 相手側の順に並べて、ネットワークの入力にする。(FeatureTransformer::Transform()) """
+        rows = np.arange(len(acc))
+        stm = np.asarray(side_to_move, dtype=np.intp)
+        both = np.stack([acc[rows, stm], acc[rows, 1 - stm]], axis=1)
+        if self.spec.sfnn:
+            # 前半と後半を0～254にclampして掛け合わせる。
+            h = self.half // 2
+            a = np.clip(both[..., :h], 0, 254).astype(np.int32)
+            b = np.clip(both[..., h:], 0, 254).astype(np.int32)
+            x = (a * b) // 512 if exact else a * b / 512.0
+        else:
+            x = np.clip(both, 0, 127)
+        return x.reshape(len(acc), -1).astype(np.float64)
+
+    # ------------------------------------------------------------------
+    # 全結合層
+    # ------------------------------------------------------------------
+
+    def _affine(self, i, x, exact):
+        weights, biases = self._fc[i]
+        y = np.asarray(x, dtype=np.float64) @ weights
+        return y.astype(np.int64) + biases if exact else y + biases
+
+    @staticmethod
+    def _clipped_relu(y, exact):
+        return np.clip(y >> WEIGHT_SCALE_BITS if exact else y / (1 << WEIGHT_SCALE_BITS), 0, 127)
+
+    @staticmethod
+    def _sqr_clipped_relu(y, exact):
+        # 2乗して >> (2 * kWeightScaleBits + 7) (layers/sqr_clipped_relu.h)
+        shift = 2 * WEIGHT_SCALE_BITS + 7
+        return np.minimum(127, (y * y) >> shift if exact else y * y / (1 << shift))
+
+    def propagate(self, x, exact=True):
+        """ ネットワークの出力を求める。 (Network::Propagate()) """
+        if self.spec.sfnn:
+            h1 = self.spec.hidden1
+            y0 = self._affine(0, x, exact)
+            x1 = np.concatenate([self._sqr_clipped_relu(y0[:, :h1], exact), self._clipped_relu(y0[:, :h1], exact)],
+                                axis=1)
+            x2 = self._clipped_relu(self._affine(1, x1, exact), exact)
+            # fc_0の最後の出力はshortcutとして出力に足す。
+            return self._affine(2, x2, exact)[:, 0] + y0[:, h1]
+
+        x1 = self._clipped_relu(self._affine(0, x, exact), exact)
+        x2 = self._clipped_relu(self._affine(1, x1, exact), exact)
+        return self._affine(2, x2, exact)[:, 0]
+
+    # ------------------------------------------------------------------
+
+    def evaluate_pieces(self, pieces, side_to_move, exact=True):
+        """ 駒リストと手番(先手=0)から、ネットワークの出力を求める。batch_size局面ずつ計算する。 """
+        n = len(side_to_move)
+        out = np.empty(n, dtype=np.int64 if exact else np.float64)
+        for start in range(0, n, self.batch_size):
+            end = min(n, start + self.batch_size)
+            acc = self.accumulate(pieces[start:end])
+            out[start:end] = self.propagate(self.transform(acc, side_to_move[start:end], exact), exact)
+        return out
+
+    def evaluate(self, sfens, exact=True):
+        """ sfen("startpos"も可)のlistから、ネットワークの出力を求める。 """
+        _require_core()
+        out = []
+        for start in range(0, len(sfens), self.batch_size):
+            pieces, side_to_move = core.nnue_piece_lists(sfens[start:start + self.batch_size])
+            out.append(self.evaluate_pieces(pieces, side_to_move, exact))
+        return np.concatenate(out) if out else np.empty(0, dtype=np.int64 if exact else np.float64)
+
+    def close(self):
+        if self._owns_net:
+            self.net.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _require_core():
+    if core is None:
+        print("Error! the core wrapper is not built. Build it with 'build.sh'.")
+        sys.exit(1)
+    core.init()
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def _read_sfens(path, batch_size):
+    """ 1行1局面のファイルから、batch_size局面ずつsfenのlistを返す。 """
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("sfen "):
+                line = line[5:]
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _print_distribution(name, values):
+    q = np.percentile(values, [1, 5, 25, 50, 75, 95, 99])
+    print(f"{name} : mean {values.mean():.2f} , std {values.std():.2f} , min {values.min()} , max {values.max()}")
+    print("  percentiles : " + " , ".join(f"{p}% {v:.0f}" for p, v in zip((1, 5, 25, 50, 75, 95, 99), q)))
+    saturated = int(np.count_nonzero(np.abs(values) >= VALUE_MAX_EVAL))
+    print(f"  |value| >= VALUE_MAX_EVAL : {saturated} ({100.0 * saturated / len(values):.3f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate positions with an NNUE file (nn.bin) in numpy, bit-exactly with the engine.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command, text in (("eval", "Print the evaluation of each position."),
+                          ("stats", "Show the distribution of the evaluations and the error of the integer network against float.")):
+        p = sub.add_parser(command, help=text)
+        p.add_argument("nn", type=str)
+        p.add_argument("sfens", type=str, help="File with one SFEN (or 'startpos') per line.")
+        p.add_argument("--arch", type=str, default=None,
+                       help="Architecture name as given to nnue_arch_gen.py (e.g. halfkp_256x2-32-32). Guessed from the file if omitted.")
+        p.add_argument("--batch_size", type=int, default=BATCH_SIZE, help="Positions evaluated at once.")
+        p.add_argument("--fv_scale", type=int, default=FV_SCALE, help="FV_SCALE used to turn the network output into an evaluation.")
+    p = sub.choices["eval"]
+    p.add_argument("--raw", action="store_true", help="Print the network output instead of output / FV_SCALE.")
+    p.add_argument("--float", action="store_true", help="Compute in floating point without the integer truncations.")
+    p.add_argument("-o", "--output", type=str, default=None, help="Write 'value<TAB>sfen' lines to this file instead of stdout.")
+    args = parser.parse_args()
+
+    _require_numpy()
+    _require_core()
+    try:
+        ev = NNUEEvaluator(args.nn, args.arch, args.batch_size)
+    except ValueError as e:
+        print(f"Error : {e}")
+        sys.exit(1)
+
+    with ev:
+        if args.command == "eval":
+            out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+            try:
+                for sfens in _read_sfens(args.sfens, args.batch_size):
+                    output = ev.evaluate(sfens, exact=not args.float)
+                    values = output if args.raw else to_value(output, args.fv_scale)
+                    out.writelines(f"{v:g}\t{s}\n" if args.float else f"{v}\t{s}\n" for v, s in zip(values.tolist(), sfens))
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+
+        else:
+            exact, approx = [], []
+            for sfens in _read_sfens(args.sfens, args.batch_size):
+                pieces, side_to_move = core.nnue_piece_lists(sfens)
+                exact.append(ev.evaluate_pieces(pieces, side_to_move, exact=True))
+                approx.append(ev.evaluate_pieces(pieces, side_to_move, exact=False))
+            if not exact:
+                print("Error! no positions.")
+                sys.exit(1)
+            exact, approx = np.concatenate(exact), np.concatenate(approx)
+            values = to_value(exact, args.fv_scale)
+            error = values - to_value(approx, args.fv_scale)
+            print(f"{args.nn} : {ev.spec.name} , {len(values)} positions")
+            _print_distribution("value", values)
+            print(f"integer - float : mean {error.mean():.3f} , mean_abs {np.abs(error).mean():.3f} , max_abs {np.abs(error).max():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""
+NNUE評価関数ファイル(nn.bin)を、エンジンをビルドせずにPythonから読むモジュール。
+
+ファイルはmmapで開き、特徴量変換器(FeatureTransformer)と全結合層(fc_0 , fc_1 , fc_2)のパラメータを
+ファイルの該当領域をそのまま見せるnumpyの配列として返す。(コピーしないので数百MBのnn.binでも一瞬で開ける)
+ただし、SFNNwoPSQT型などで特徴量変換器のパラメータがLEB128で圧縮されている場合は、展開したコピーになる。
+
+ファイルの中身 (source/eval/nnue/evaluate_nnue.cpp の ReadParameters() が読む順番)
+    version u32 , hash u32 , 構造文字列の長さ u32 , 構造文字列
+    特徴量変換器 : hash u32 , biases int16[half] , weights int16[input][half]
+    ネットワーク : hash u32 , 各全結合層について biases int32[out] , weights int8[out][padded_in]
+    (padded_in は入力の次元数を32の倍数に切り上げたもの)
+
+アーキテクチャは source/eval/nnue/architectures/nnue_arch_gen.py のアーキテクチャ名で指定する。
+省略したときは、ファイルに埋め込まれている構造文字列から推定する。
+
+使い方:
+    python nnue_file.py info  nn.bin [--arch halfkp_256x2-32-32]
+    python nnue_file.py stats nn.bin
+    python nnue_file.py diff  old/nn.bin new/nn.bin
+
+    with NNUEFile("nn.bin") as net:
+        print(net.layout.architecture)
+        for level, message in net.validate():
+            print(level, message)
+        w = net.ft_weights              # int16 [input][half]
+        fc_0 = net.layers[0]            # AffineLayer(name, biases int32[out], weights int8[out][padded_in], input_dims)
+"""
+import argparse
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# アーキテクチャ名の解釈は nnue_arch_gen.py と共通にする。
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'source', 'eval', 'nnue', 'architectures'))
+from nnue_arch_gen import parse_arch, structure_string
+
+# 評価関数ファイルのバージョン (nnue_common.h の kVersion)
+VERSION = 0x7AF32F16
+
+# SFNNwoPSQT型のhash値は固定。(evaluate_nnue.h の kHashValue , nnue_feature_transformer.h の GetHashValue())
+SFNN_HASH = 0x3C203B32
+SFNN_FT_HASH = 0x5F134AB8
+SFNN_NETWORK_HASH = 0x6333718A
+
+# LEB128で圧縮されているときに先頭にある文字列 (nnue_common.h の Leb128MagicString)
+LEB128_MAGIC = b"COMPRESSED_LEB128"
+# LEB128を展開するときに一度に扱うbyte数
+LEB128_BLOCK = 1 << 22
+
+# 全結合層の入力の次元数はこの倍数に切り上げられる。(nnue_common.h の kMaxSimdWidth)
+MAX_SIMD_WIDTH = 32
+
+MASK32 = 0xFFFFFFFF
+
+HEADER = struct.Struct("<III")
+
+# BonaPieceの終端 (evaluate.h。DISTINGUISH_GOLDSなし)
+SQ_NB = 81
+FILE_NB = 9
+FE_END = 90 + 81 * 18
+E_KING = FE_END + SQ_NB
+FE_END2 = E_KING + SQ_NB
+
+# 入力特徴量 : nnue_arch_gen.pyの入力特徴量名 → (構造文字列での名前 , hash値 , 次元数)
+# hash値はSide::kFriendのもの。(features/*.h の kHashValue)
+FEATURES = {
+    "halfkp"    : ("HalfKP(Friend)"    , 0x5D69D5B9 ^ 1, SQ_NB * FE_END),
+    "kp"        : ("K+P"               , 0xD3CEE169 ^ ((0x764CFB4B << 1) & MASK32) ^ (0x764CFB4B >> 31), SQ_NB * 2 + FE_END),
+    "halfkpe9"  : ("HalfKPE9(Friend)"  , 0x5D69D5B9 ^ 1, SQ_NB * FE_END * 9),
+    "halfkpvm"  : ("HalfKP_vm(Friend)" , 0x0B6B1D9B ^ 1, 5 * FILE_NB * FE_END),
+    "halfka1"   : ("HalfKA1(Friend)"   , 0x5F134CB9 ^ 1, SQ_NB * FE_END2),
+    "halfkahm1" : ("HalfKA_hm1(Friend)", 0x7F134CB9 ^ 1, 5 * FILE_NB * FE_END2),
+    "halfka2"   : ("HalfKA2(Friend)"   , 0x5F234CB9 ^ 1, SQ_NB * E_KING),
+    "halfkahm2" : ("HalfKA_hm2(Friend)", 0x7F234CB9 ^ 1, 5 * FILE_NB * E_KING),
+    # SFNNwoPSQT型の入力特徴量。SFNNのhash値は固定なので、特徴量のhash値は使わない。
+    "halfkahm"  : ("HalfKA_hm(Friend)" , None, 5 * FILE_NB * E_KING),
+}
+
+# 全結合層1つ分の形。padded_inputs は weights の1行の長さ。
+LayerShape = namedtuple("LayerShape", "name inputs padded_inputs outputs")
+
+# アーキテクチャから決まるファイルの形。
+#   spec         : nnue_arch_gen.parse_arch()の結果
+#   architecture : ファイルに埋め込まれる構造文字列
+#   hash         : ヘッダのhash値 , ft_hash / network_hash : 各部の先頭のhash値
+NetLayout = namedtuple("NetLayout", "spec architecture hash ft_hash network_hash input_dims half_dims layers")
+
+# 読み込んだ全結合層。weights は [outputs][padded_inputs] のint8 , biases は [outputs] のint32。
+AffineLayer = namedtuple("AffineLayer", "name biases weights inputs")
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+def _ceil(n, base):
+    return (n + base - 1) // base * base
+
+
+# ======================================================================
+# アーキテクチャ → ファイルの形
+# ======================================================================
+
+# 各層のGetHashValue()と同じ計算。C++側はすべてuint32の演算。
+
+def _input_slice_hash(outputs, offset=0):
+    return 0xEC42E90D ^ outputs ^ (offset << 10)
+
+
+def _affine_hash(outputs, prev):
+    h = (0xCC03DAE4 + outputs) & MASK32
+    h ^= prev >> 1
+    h ^= (prev << 31) & MASK32
+    return h
+
+
+def _clipped_relu_hash(prev):
+    return (0x538D24C7 + prev) & MASK32
+
+
+def layout(arch):
+    """ アーキテクチャ名(またはparse_arch()の結果)から、ファイルの形を求める。"""
+    spec = parse_arch(arch) if isinstance(arch, str) else arch
+    feature_name, feature_hash, input_dims = FEATURES[spec.feature]
+    half = spec.transformed
+    features = f"{feature_name}[{input_dims}->{half}x2]"
+
+    if spec.sfnn:
+        # FeatureTransformerは2つの視点それぞれ前半と後半を掛け合わせるので、出力はhalf次元。
+        layers = [LayerShape("fc_0", half, _ceil(half, MAX_SIMD_WIDTH), spec.hidden1 + 1),
+                  LayerShape("fc_1", spec.hidden1 * 2, _ceil(spec.hidden1 * 2, MAX_SIMD_WIDTH), spec.hidden2),
+                  LayerShape("fc_2", spec.hidden2, _ceil(spec.hidden2, MAX_SIMD_WIDTH), 1)]
+        return NetLayout(spec, f"Features={features},Network={structure_string(spec)}", SFNN_HASH, SFNN_FT_HASH,
+                         SFNN_NETWORK_HASH, input_dims, half, layers)
+
+    if feature_hash is None:
+        raise ValueError(f"input feature {spec.feature} is only supported by SFNNwoPSQT architectures.")
+
+    # InputSlice → ClippedReLU(AffineTransformSparseInput) → ClippedReLU(AffineTransform) → AffineTransform
+    inputs = half * spec.slices
+    layers = [LayerShape("fc_0", inputs, _ceil(inputs, MAX_SIMD_WIDTH), spec.hidden1),
+              LayerShape("fc_1", spec.hidden1, _ceil(spec.hidden1, MAX_SIMD_WIDTH), spec.hidden2),
+              LayerShape("fc_2", spec.hidden2, _ceil(spec.hidden2, MAX_SIMD_WIDTH), 1)]
+
+    network = f"InputSlice[{inputs}(0:{inputs})]"
+    h = _input_slice_hash(inputs)
+    for i, layer in enumerate(layers):
+        kind = "AffineTransformSparseInput" if i == 0 else "AffineTransform"
+        network = f"{kind}[{layer.outputs}<-{layer.inputs}]({network})"
+        h = _affine_hash(layer.outputs, h)
+        if i < len(layers) - 1:
+            network = f"ClippedReLU[{layer.outputs}]({network})"
+            h = _clipped_relu_hash(h)
+
+    ft_hash = feature_hash ^ (half * 2)
+    return NetLayout(spec, f"Features={features},Network={network}", ft_hash ^ h, ft_hash, h,
+                     input_dims, half, layers)
+
+
+def guess_arch(architecture):
+    """ ファイルに埋め込まれている構造文字列から、nnue_arch_gen.pyのアーキテクチャ名を推定する。 """
+    m = re.fullmatch(r"Features=(.+)\[(\d+)->(\d+)x2\],Network=(.+)", architecture)
+    if not m:
+        raise ValueError(f"unknown architecture string : {architecture}")
+    feature_name, _, half, network = m.groups()
+    feature = next((k for k, v in FEATURES.items() if v[0] == feature_name), None)
+    if feature is None:
+        raise ValueError(f"unknown input feature : {feature_name}")
+
+    if network == "SFNN-1536":
+        return "SFNNwoPSQT_halfkahm_1536-15-32-ls9"
+    if network.startswith("SFNNWOPSQT_"):
+        return network
+
+    # 外側(出力層)から順に並んでいる。
+    affines = re.findall(r"AffineTransform(?:SparseInput)?\[(\d+)<-(\d+)\]", network)
+    if len(affines) != 3:
+        raise ValueError(f"unknown network structure : {network}")
+    slices = int(affines[2][1]) // int(half)
+    return f"{feature}_{half}x{slices}-{affines[2][0]}-{affines[1][0]}"
+
+
+# ======================================================================
+# 読み込み
+# ======================================================================
+
+def _read_leb128(buf, offset, count, dtype):
+    """
+    offsetから始まるLEB128で圧縮された整数count個を展開する。(nnue_common.h の read_leb_128())
+    (展開した配列 , 次のoffset) を返す。一時配列が大きくならないように LEB128_BLOCK byteずつ展開する。
+    """
+    if bytes(buf[offset:offset + len(LEB128_MAGIC)]) != LEB128_MAGIC:
+        raise ValueError(f"LEB128 magic string not found at offset {offset}")
+    offset += len(LEB128_MAGIC)
+    (size,) = struct.unpack_from("<I", buf, offset)
+    offset += 4
+    data = np.frombuffer(buf, dtype=np.uint8, count=size, offset=offset)
+
+    out = np.empty(count, dtype=dtype)
+    pos = n = 0
+    while pos < size:
+        block = data[pos:pos + LEB128_BLOCK]
+        # 最上位bitが立っていないbyteが各整数の最後のbyte。
+        ends = np.flatnonzero(block < 0x80)
+        if len(ends) == 0 or n + len(ends) > count:
+            break
+        starts = np.empty_like(ends)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        lengths = ends - starts + 1
+
+        values = np.zeros(len(ends), dtype=np.int64)
+        for k in range(int(lengths.max())):
+            sel = lengths > k
+            values[sel] |= (block[starts[sel] + k].astype(np.int64) & 0x7F) << (7 * k)
+
+        # 最後のbyteの0x40が符号bit
+        negative = (block[ends] & 0x40) != 0
+        values[negative] -= np.left_shift(1, 7 * lengths[negative])
+        out[n:n + len(ends)] = values
+        n += len(ends)
+        pos += int(ends[-1]) + 1
+
+    if pos != size or n != count:
+        raise ValueError(f"broken LEB128 data ({n} values in {pos} bytes , expected {count} values in {size} bytes)")
+    return out, offset + size
+
+
+class NNUEFile:
+    """
+    mmapで開いたnn.bin。開くときはheaderと各部の位置を求めるだけ。
+
+    ft_biases / ft_weights / layers[i].biases / layers[i].weights は、ファイルの各領域をそのまま見せるnumpyの配列。
+    arch を省略すると、ファイルの構造文字列からアーキテクチャを推定する。
+    """
+
+    def __init__(self, path, arch=None):
+        _require_numpy()
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load(arch)
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def _load(self, arch):
+        mm = self._mm
+        if len(mm) < HEADER.size:
+            raise ValueError(f"{self.path} is too small for an NNUE file.")
+        self.version, self.hash, size = HEADER.unpack_from(mm, 0)
+        if self.version != VERSION:
+            raise ValueError(f"{self.path} : NNUE header version mismatch: expected {VERSION:#010x} got {self.version:#010x}")
+        offset = HEADER.size
+        self.architecture = mm[offset:offset + size].decode("utf-8", errors="replace")
+        offset += size
+
+        self.layout = layout(arch if arch else guess_arch(self.architecture))
+        lay = self.layout
+
+        (self.ft_hash,) = struct.unpack_from("<I", mm, offset)
+        offset += 4
+        self.compressed = bytes(mm[offset:offset + len(LEB128_MAGIC)]) == LEB128_MAGIC
+        if self.compressed:
+            self.ft_biases, offset = _read_leb128(mm, offset, lay.half_dims, np.int16)
+            weights, offset = _read_leb128(mm, offset, lay.input_dims * lay.half_dims, np.int16)
+        else:
+            self._check_size(offset + (lay.half_dims + lay.input_dims * lay.half_dims) * 2)
+            self.ft_biases = np.frombuffer(mm, dtype="<i2", count=lay.half_dims, offset=offset)
+            offset += lay.half_dims * 2
+            weights = np.frombuffer(mm, dtype="<i2", count=lay.input_dims * lay.half_dims, offset=offset)
+            offset += weights.nbytes
+        self.ft_weights = weights.reshape(lay.input_dims, lay.half_dims)
+
+        self._check_size(offset + 4 + sum(l.outputs * (4 + l.padded_inputs) for l in lay.layers))
+        (self.network_hash,) = struct.unpack_from("<I", mm, offset)
+        offset += 4
+        self.layers = []
+        for shape in lay.layers:
+            biases = np.frombuffer(mm, dtype="<i4", count=shape.outputs, offset=offset)
+            offset += biases.nbytes
+            weights = np.frombuffer(mm, dtype=np.int8, count=shape.outputs * shape.padded_inputs, offset=offset)
+            offset += weights.nbytes
+            self.layers.append(AffineLayer(shape.name, biases, weights.reshape(shape.outputs, shape.padded_inputs),
+                                           shape.inputs))
+        self.end_offset = offset
+
+    def _check_size(self, end):
+        if end > len(self._mm):
+            raise ValueError(f"{self.path} is too small for {self.layout.spec.name} (truncated file or wrong architecture)")
+
+    def validate(self):
+        """
+        エンジンが読み込めるかを調べる。(level , message) のlistを返す。問題がなければ空。
+        levelは "error"(エンジンが読み込みに失敗する) か "warning"(読み込めるが、エンジンも警告を出す)。
+        """
+        lay = self.layout
+        result = []
+        if self.hash != lay.hash:
+            result.append(("error", f"hash mismatch: expected {lay.hash:#010x} got {self.hash:#010x}"))
+        if self.end_offset != len(self._mm):
+            result.append(("error", f"file size mismatch: expected {self.end_offset} bytes got {len(self._mm)}"))
+        if self.architecture != lay.architecture:
+            result.append(("warning", f"architecture string mismatch: expected {lay.architecture}"))
+        if self.ft_hash != lay.ft_hash:
+            result.append(("warning", f"feature transformer hash mismatch: expected {lay.ft_hash:#010x} got {self.ft_hash:#010x}"))
+        # SFNNのときはエンジンはネットワーク部のhash値を見ていない。(書き出すときも0)
+        if not lay.spec.sfnn and self.network_hash != lay.network_hash:
+            result.append(("warning", f"network hash mismatch: expected {lay.network_hash:#010x} got {self.network_hash:#010x}"))
+        for layer in self.layers:
+            if layer.weights.shape[1] != layer.inputs and layer.weights[:, layer.inputs:].any():
+                result.append(("warning", f"{layer.name} : padding weights are not zero"))
+        return result
+
+    def tensors(self):
+        """ (名前 , 配列) をファイルに入っている順に返す。 """
+        yield "ft.biases", self.ft_biases
+        yield "ft.weights", self.ft_weights
+        for layer in self.layers:
+            yield f"{layer.name}.biases", layer.biases
+            yield f"{layer.name}.weights", layer.weights
+
+    def close(self):
+        # numpyの配列がmmapを参照している間はcloseできないので先に捨てる。
+        self.ft_biases = self.ft_weights = None
+        self.layers = []
+        try:
+            self._mm.close()
+        except BufferError:
+            # 呼び出し側がまだ配列を持っている。mmapはその配列が捨てられたときに閉じられる。
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ======================================================================
+# 統計・比較
+# ======================================================================
+
+# 大きな配列は、この要素数ずつに分けて集計する。(float64の一時配列が大きくならないように)
+CHUNK_ELEMENTS = 1 << 24
+
+TensorStats = namedtuple("TensorStats", "count min max mean std zeros saturated zero_rows")
+
+
+def _chunks(a):
+    """ 2次元以上の配列を行方向に分割する。"""
+    if a.ndim < 2:
+        yield a
+        return
+    rows = max(1, CHUNK_ELEMENTS // max(1, a[0].size))
+    for i in range(0, len(a), rows):
+        yield a[i:i + rows]
+
+
+def tensor_stats(a):
+    """
+    量子化したパラメータの統計。saturatedは型の最大値・最小値に張り付いている要素の数、
+    zero_rowsは(2次元のとき)すべて0の行の数。(特徴量変換器なら一度も学習されていない特徴量)
+    """
+    info = np.iinfo(a.dtype)
+    lo, hi = info.max, info.min
+    total = total_sq = 0.0
+    zeros = saturated = zero_rows = 0
+    for c in _chunks(a):
+        if c.size == 0:
+            continue
+        lo = min(lo, int(c.min()))
+        hi = max(hi, int(c.max()))
+        f = c.astype(np.float64)
+        total += float(f.sum())
+        total_sq += float((f * f).sum())
+        zeros += int(np.count_nonzero(c == 0))
+        saturated += int(np.count_nonzero((c == info.min) | (c == info.max)))
+        if c.ndim >= 2:
+            zero_rows += int(np.count_nonzero(~c.reshape(len(c), -1).any(axis=1)))
+    n = a.size
+    mean = total / n if n else 0.0
+    std = max(0.0, total_sq / n - mean * mean) ** 0.5 if n else 0.0
+    return TensorStats(n, lo, hi, mean, std, zeros, saturated, zero_rows)
+
+
+TensorDiff = namedtuple("TensorDiff", "count changed max_abs mean_abs")
+
+
+def tensor_diff(a, b):
+    """ 同じ形の2つの配列の差。changedは値が異なる要素の数。"""
+    changed = 0
+    max_abs = 0
+    total = 0.0
+    for ca, cb in zip(_chunks(a), _chunks(b)):
+        d = np.abs(ca.astype(np.int64) - cb.astype(np.int64))
+        if d.size == 0:
+            continue
+        changed += int(np.count_nonzero(d))
+        max_abs = max(max_abs, int(d.max()))
+        total += float(d.sum())
+    return TensorDiff(a.size, changed, max_abs, total / a.size if a.size else 0.0)
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def _print_info(net):
+    lay = net.layout
+    print(f"{net.path} : {os.path.getsize(net.path)} bytes")
+    print(f"  architecture name   : {lay.spec.name}")
+    print(f"  architecture string : {net.architecture}")
+    print(f"  hash                : {net.hash:#010x} (feature transformer {net.ft_hash:#010x} , network {net.network_hash:#010x})")
+    print(f"  feature transformer : {lay.input_dims} -> {lay.half_dims}x2" + (" (LEB128 compressed)" if net.compressed else ""))
+    for layer in net.layers:
+        out, padded = layer.weights.shape
+        print(f"  {layer.name:<19} : {layer.inputs} -> {out}" + (f" (padded to {padded})" if padded != layer.inputs else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect NNUE evaluation files (nn.bin) without building the engine.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("info", help="Show the header and layer shapes, and check that the engine can load the file.")
+    p.add_argument("nn", type=str)
+    p.add_argument("--arch", type=str, default=None,
+                   help="Architecture name as given to nnue_arch_gen.py (e.g. halfkp_256x2-32-32). Guessed from the file if omitted.")
+    p = sub.add_parser("stats", help="Show quantization statistics of each parameter tensor.")
+    p.add_argument("nn", type=str)
+    p.add_argument("--arch", type=str, default=None, help="Architecture name. Guessed from the file if omitted.")
+    p = sub.add_parser("diff", help="Compare the parameters of two files with the same architecture.")
+    p.add_argument("nn", type=str)
+    p.add_argument("other", type=str)
+    p.add_argument("--arch", type=str, default=None, help="Architecture name. Guessed from the files if omitted.")
+    args = parser.parse_args()
+
+    try:
+        net = NNUEFile(args.nn, args.arch)
+    except ValueError as e:
+        print(f"Error : {e}")
+        sys.exit(1)
+
+    with net:
+        if args.command == "info":
+            _print_info(net)
+            problems = net.validate()
+            for level, message in problems:
+                print(f"  {level} : {message}")
+            if not problems:
+                print("  ok")
+            if any(level == "error" for level, _ in problems):
+                sys.exit(1)
+
+        elif args.command == "stats":
+            _print_info(net)
+            print(f"{'tensor':<12} {'count':>11} {'min':>7} {'max':>7} {'mean':>9} {'std':>9} {'zero%':>7} {'sat%':>7} {'zero_rows':>9}")
+            for name, a in net.tensors():
+                s = tensor_stats(a)
+                print(f"{name:<12} {s.count:>11} {s.min:>7} {s.max:>7} {s.mean:>9.3f} {s.std:>9.3f}"
+                      f" {100.0 * s.zeros / s.count:>7.2f} {100.0 * s.saturated / s.count:>7.3f} {s.zero_rows:>9}")
+
+        else:
+            try:
+                other = NNUEFile(args.other, args.arch or net.layout.spec.name)
+            except ValueError as e:
+                print(f"Error : {e}")
+                sys.exit(1)
+            with other:
+                if other.architecture != net.architecture:
+                    print(f"Warning : architecture strings differ ({net.architecture} / {other.architecture})")
+                print(f"{'tensor':<12} {'count':>11} {'changed':>11} {'changed%':>9} {'max_abs':>8} {'mean_abs':>10}")
+                for (name, a), (_, b) in zip(net.tensors(), other.tensors()):
+                    d = tensor_diff(a, b)
+                    print(f"{name:<12} {d.count:>11} {d.changed:>11} {100.0 * d.changed / d.count:>9.3f}"
+                          f" {d.max_abs:>8} {d.mean_abs:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+gensfenで生成した教師局面ファイル(PackedSfenValueの列)を扱うモジュール。
+
+1局面は40バイトの固定長 (source/learn/learn.h の PackedSfenValue)
+    sfen        u8[32]  PackedSfen(局面を256bitに詰めたもの)
+    score       s16     探索の評価値(手番側から見た値)
+    move        u16     PVの初手
+    gamePly     u16     初期局面からの手数
+    game_result s8      この局面の手番側から見た対局の勝敗(1:勝ち , 0:引き分け , -1:負け)
+    padding     u8      40バイトにするためのpadding
+をリトルエンディアンでそのまま並べたもの。ヘッダはない。
+
+C++側(learnコマンドのshuffleなど)と同じく、ファイル末尾の40バイトに満たない端数は読まずに捨てる。
+(書き込みの途中でエンジンが落ちたファイルでも、そこまでの局面はそのまま使える)
+
+使い方:
+    python psv_file.py info    teacher1.bin teacher2.bin ...
+    python psv_file.py shuffle shuffled.bin teacher1.bin teacher2.bin ... [--memory 1024] [--tmp_dir tmp] [--seed 1]
+                                                                          [--workers 8]
+
+shuffleは psv_shuffle.shuffle_dedup() で重複を取り除かずに(--dedup none)シャッフルだけ行う。
+
+    for chunk in iter_chunks(["teacher1.bin"]):    # numpyの構造化配列(PSV_DTYPE)
+        print(chunk["score"].mean())
+"""
+import argparse
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# PackedSfenValue 1局面のバイト数
+PSV_SIZE = 40
+
+# iter_chunks() で1回に読む局面数の既定値 (40MB)
+CHUNK_RECORDS = 1 << 20
+
+if np is not None:
+    PSV_DTYPE = np.dtype([
+        ("sfen", "u1", (32,)),
+        ("score", "<i2"),
+        ("move", "<u2"),
+        ("gamePly", "<u2"),
+        ("game_result", "i1"),
+        ("padding", "u1"),
+    ])
+    assert PSV_DTYPE.itemsize == PSV_SIZE
+else:
+    PSV_DTYPE = None
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+# ======================================================================
+# 読み書き
+# ======================================================================
+
+def count_records(path):
+    """ ファイルに入っている局面数。末尾の端数は数えない。"""
+    return os.path.getsize(path) // PSV_SIZE
+
+
+def truncate_partial(path):
+    """
+    末尾の40バイトに満たない端数を切り詰めて、局面数を返す。
+    書き込み途中で落ちたファイルに追記を再開する前に呼ぶ。(端数が残っていると以降の局面がずれる)
+    """
+    size = os.path.getsize(path)
+    if size % PSV_SIZE:
+        with open(path, "r+b") as f:
+            f.truncate(size - size % PSV_SIZE)
+    return size // PSV_SIZE
+
+
+def iter_chunks(paths, chunk_records=CHUNK_RECORDS):
+    """ ファイルを順に読んで、最大chunk_records局面ずつPSV_DTYPEの配列を返す。"""
+    _require_numpy()
+    for path in paths:
+        remain = count_records(path)
+        with open(path, "rb") as f:
+            while remain > 0:
+                chunk = np.fromfile(f, dtype=PSV_DTYPE, count=min(chunk_records, remain))
+                if len(chunk) == 0:
+                    break
+                remain -= len(chunk)
+                yield chunk
+
+
+def read_records(path):
+    """ ファイル全体をPSV_DTYPEの配列として読む。"""
+    _require_numpy()
+    with open(path, "rb") as f:
+        return np.fromfile(f, dtype=PSV_DTYPE, count=count_records(path))
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def print_info(paths):
+    for path in paths:
+        size = os.path.getsize(path)
+        count = size // PSV_SIZE
+        print(f"{path} : {count} positions" + (f" ({size % PSV_SIZE} trailing bytes ignored)" if size % PSV_SIZE else ""))
+        if count == 0:
+            continue
+        n = 0
+        score_sum = 0.0
+        score_sq = 0.0
+        ply_max = 0
+        results = np.zeros(3, dtype=np.int64)
+        for chunk in iter_chunks([path]):
+            score = chunk["score"].astype(np.float64)
+            n += len(chunk)
+            score_sum += score.sum()
+            score_sq += (score * score).sum()
+            ply_max = max(ply_max, int(chunk["gamePly"].max()))
+            results += np.bincount(chunk["game_result"].astype(np.int64) + 1, minlength=3)[:3]
+        mean = score_sum / n
+        std = max(0.0, score_sq / n - mean * mean) ** 0.5
+        print(f"  score : mean {mean:.1f} , std {std:.1f}")
+        print(f"  gamePly max : {ply_max}")
+        print(f"  game_result : win {results[2]} , draw {results[1]} , lose {results[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and shuffle gensfen teacher files (PackedSfenValue, 40 bytes per position).")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("info", help="Show the number of positions and score/result statistics.")
+    p.add_argument("inputs", type=str, nargs="+", help="Teacher files.")
+
+    p = sub.add_parser("shuffle", help="Concatenate teacher files into one uniformly shuffled file with bounded memory.")
+    p.add_argument("output", type=str, help="Output file.")
+    p.add_argument("inputs", type=str, nargs="+", help="Teacher files.")
+    p.add_argument("--memory", type=int, default=1024, help="Memory budget [MB].")
+    p.add_argument("--tmp_dir", type=str, default=None, help="Directory for temporary bucket files (default: system temp).")
+    p.add_argument("--seed", type=int, default=None, help="Random seed (default: random).")
+    p.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    args = parser.parse_args()
+
+    _require_numpy()
+    if args.command == "info":
+        print_info(args.inputs)
+        return
+
+    # psv_shuffleはこのモジュールをimportするので、ここでimportする。
+    from psv_shuffle import shuffle_dedup
+
+    start = time.time()
+    try:
+        _, count = shuffle_dedup(args.inputs, args.output, dedup_mode="none", workers=args.workers,
+                                 memory_mb=args.memory, tmp_dir=args.tmp_dir, seed=args.seed)
+    except ValueError as e:
+        print(f"Error! {e}")
+        sys.exit(1)
+    elapsed = time.time() - start
+    print(f"{args.output} : {count} positions , {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} positions/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+教師局面ファイル(PackedSfenValueの列)を、メモリに載らない大きさでもシャッフルし、重複局面を取り除くツール。
+
+learnコマンドの shuffle はエンジンの中で1スレッドで動き、重複局面は取り除かない。こちらは数十億局面を想定して、
+ディスク上の一時ファイルを使い(external memory)、プロセスを並べて処理する。
+
+処理の流れ:
+  1. 分割 : 各局面を、重複とみなす範囲(--dedup sfenならPackedSfenの32バイト)のhash値でバケツ(一時ファイル)に振り分ける。
+            同じ局面は必ず同じバケツに入るので、重複はバケツの中だけ見ればよい。
+            入力はworkersの数のプロセスで、ファイルの範囲ごとに並列に読む。
+  2. 重複除去とシャッフル : バケツを1つずつメモリに読み、重複を取り除いてからシャッフルして書き戻す。
+            (これもバケツごとにworkersの数のプロセスで並列に行う。重複した局面のうち、どれが残るかはseedで決まるランダム)
+            同じ局面が大量にあってメモリに載らないバケツは、少しずつ読んで重複を除いてから扱う。
+  3. 混ぜ合わせ : 各バケツから、残りの局面数に比例する確率で局面を取り出して出力に並べる。
+            ブロック単位で多変量超幾何分布から各バケツの取り出し数を決めて、ブロックの中をシャッフルするので、
+            結果は全体を一様にシャッフルしたものと同じ分布になる。
+
+使うメモリはおよそ--memory[MB]で、局面数によらない。一時ファイルのために--tmp_dirに入力の2倍ほどの空きが要る。
+出力は入力と同じ40バイトのPackedSfenValueの列なので、そのままlearnコマンドの教師に使える。
+
+使い方:
+    python psv_shuffle.py shuffled.bin teacher1.bin teacher2.bin ... [--dedup sfen] [--workers 8]
+                          [--memory 4096] [--tmp_dir tmp] [--seed 1]
+
+--dedup
+    sfen   : 局面(盤面・手駒・手番)が同じなら重複とみなす。評価値や手数が違っても1つだけ残す。(既定)
+    record : 評価値・指し手・手数・勝敗まで同じものだけを重複とみなす。
+    none   : 重複を取り除かず、シャッフルだけ行う。
+
+psv_file.py shuffle と gensfen_runner.py merge も、--dedup none でこのshuffle_dedup()を使う。
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from psv_file import PSV_DTYPE, PSV_SIZE, count_records, iter_chunks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 分割のときに1回のタスクで読む局面数
+SPLIT_RECORDS = 1 << 22
+
+# 重複とみなす範囲のバイト数 (PackedSfenValueの先頭から)
+DEDUP_BYTES = {
+    "sfen": 32,     # PackedSfen
+    "record": 39,   # paddingを除いた全体
+    "none": 0,
+}
+
+# 混ぜ合わせに使う乱数の系列 (バケツごとのシャッフルに使う [seed , salt , ...] と重ならない値)
+INTERLEAVE_STREAM = 1 << 32
+
+# numpyの超幾何分布(hypergeometric , multivariate_hypergeometric)が扱える母集団の大きさの上限
+HYPERGEOMETRIC_LIMIT = 10 ** 9
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+def _raise_file_limit():
+    """ 一時ファイルを同時にたくさん開くので、開けるファイル数の上限をhard limitまで上げておく。"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def key_hash(records, key_bytes, salt=0):
+    """
+    各局面の先頭key_bytesバイトから64bitのhash値を求める。先頭key_bytesバイトが同じなら同じ値になる。
+    key_bytesが32ならPackedSfen(局面)のhash値。
+    """
+    words = np.ascontiguousarray(records).view(np.uint8).reshape(len(records), PSV_SIZE).view("<u8")
+    n_words = -(-key_bytes // 8)
+    h = np.full(len(records), 0x9E3779B97F4A7C15 * (salt + 1) & ((1 << 64) - 1), dtype=np.uint64)
+    for i in range(n_words):
+        w = words[:, i]
+        if i == n_words - 1 and key_bytes % 8:
+            w = w & np.uint64((1 << (8 * (key_bytes % 8))) - 1)
+        # SplitMix64のfinalizerで1wordずつ混ぜる。
+        h ^= w
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+def dedup(records, dedup_bytes, seed):
+    """
+    先頭dedup_bytesバイトが同じ局面を1つにまとめる。残る順番はdedup_bytesバイトの辞書順になる。
+
+    重複したもののうち、seedで決まるhash値(局面の40バイト全体のhash)が最小のものを残す。
+    入力の並びや、何回に分けて重複を除いたかによらず同じものが残り、どれが残るかはseedごとにランダムになる。
+    """
+    if dedup_bytes == 0 or len(records) == 0:
+        return records
+    records = records[np.argsort(key_hash(records, PSV_SIZE, seed), kind="stable")]
+    keys = records.view(np.uint8).reshape(len(records), PSV_SIZE)[:, :dedup_bytes]
+    keys = np.ascontiguousarray(keys).view(f"V{dedup_bytes}").ravel()
+    _, index = np.unique(keys, return_index=True)
+    return records[index]
+
+
+# ======================================================================
+# 各プロセスで行う処理 (multiprocessing.Poolから呼ばれるので、引数はpickleできるものだけ)
+# ======================================================================
+
+def _bucket_path(tmp_dir, salt, bucket, part):
+    """ バケツの一時ファイル名。bucketは"3"や、分け直したバケツなら"3-1"のような名前。"""
+    return os.path.join(tmp_dir, f"b{salt}_{bucket}_{part}.bin")
+
+
+def _split_task(task):
+    """
+    入力ファイルの範囲 [start, start + count) を先頭key_bytesバイトのhashでバケツに振り分けて、
+    バケツごとの一時ファイルに書き足す。一時ファイルはプロセスごとに分けるので、ロックは要らない。処理した局面数を返す。
+    """
+    path, start, count, tmp_dir, n_buckets, salt, prefix, key_bytes = task
+    part = os.getpid()
+    with open(path, "rb") as f:
+        f.seek(start * PSV_SIZE)
+        records = np.fromfile(f, dtype=PSV_DTYPE, count=count)
+    buckets = key_hash(records, key_bytes, salt) % np.uint64(n_buckets)
+    order = np.argsort(buckets, kind="stable")
+    ends = np.cumsum(np.bincount(buckets.astype(np.int64), minlength=n_buckets))
+    records = records[order]
+    begin = 0
+    for bucket, end in enumerate(ends):
+        if end > begin:
+            with open(_bucket_path(tmp_dir, salt, f"{prefix}{bucket}", part), "ab") as out:
+                records[begin:end].tofile(out)
+        begin = end
+    return len(records)
+
+
+def _compact(parts, out_path, dedup_bytes, chunk_records, seed):
+    """
+    partsの局面を、chunk_records局面ずつ読んでその中で重複を除きながらout_pathに書き出す。局面数を返す。
+    同じ局面ばかりが大量にあるバケツでも、メモリはchunk_records局面分しか使わない。
+    (チャンクをまたいだ重複は残るが、dedup()で残すものはチャンクの分け方によらないので、あとで除けば同じ結果になる)
+    """
+    with open(out_path, "wb") as out:
+        for chunk in iter_chunks(parts, chunk_records):
+            dedup(chunk, dedup_bytes, seed).tofile(out)
+    for p in parts:
+        os.remove(p)
+    return count_records(out_path)
+
+
+def _single_key(parts, key_bytes, chunk_records):
+    """ partsの局面の先頭key_bytesバイトがすべて同じならTrue。(hashでは分けられないバケツ) """
+    first = None
+    for chunk in iter_chunks(parts, chunk_records):
+        keys = chunk.view(np.uint8).reshape(len(chunk), PSV_SIZE)[:, :key_bytes]
+        if first is None:
+            first = keys[0].copy()
+        if not (keys == first).all():
+            return False
+    return True
+
+
+def _shuffle_task(task):
+    """
+    バケツ1つの一時ファイルをすべて読んで、重複を取り除いてシャッフルし、1つのファイルに書き出す。
+    (読み込んだ局面数 , 書き出した局面数 , 書き出したファイルのlist) を返す。
+
+    メモリに載らないほど大きなバケツは、
+      - 重複を除くなら、まずチャンクごとに重複を除いて小さくする。(同じ局面が大量にあって大きくなったバケツ)
+      - 重複を除かないなら、局面の40バイトがすべて同じものだけのバケツは、シャッフルしても同じなのでそのまま書き出す。
+      - それでも大きければ、hashを変えてさらに分け直す。
+    """
+    tmp_dir, salt, bucket, dedup_bytes, bucket_records, seed = task
+    key_bytes = dedup_bytes or PSV_SIZE
+    parts = sorted(glob.glob(_bucket_path(tmp_dir, salt, bucket, "*")))
+    read = total = sum(count_records(p) for p in parts)
+    rng = np.random.default_rng([seed, salt] + [int(i) for i in bucket.split("-")])
+    out_path = os.path.join(tmp_dir, f"s{salt}_{bucket}.bin")
+
+    if total > bucket_records * 2 and dedup_bytes:
+        compact_path = os.path.join(tmp_dir, f"c{salt}_{bucket}.bin")
+        total = _compact(parts, compact_path, dedup_bytes, bucket_records, seed)
+        parts = [compact_path]
+
+    if total > bucket_records * 2:
+        if not dedup_bytes and _single_key(parts, key_bytes, bucket_records):
+            with open(out_path, "wb") as out:
+                for p in parts:
+                    with open(p, "rb") as f:
+                        shutil.copyfileobj(f, out, 1 << 24)
+                    os.remove(p)
+            return read, total, [out_path]
+
+        n_sub = max(2, -(-total // bucket_records))
+        for p in parts:
+            for start in range(0, count_records(p), bucket_records):
+                _split_task((p, start, min(bucket_records, count_records(p) - start), tmp_dir, n_sub, salt + 1,
+                             f"{bucket}-", key_bytes))
+            os.remove(p)
+        outputs = []
+        written = 0
+        for sub in range(n_sub):
+            _, w, out = _shuffle_task((tmp_dir, salt + 1, f"{bucket}-{sub}", dedup_bytes, bucket_records, seed))
+            written += w
+            outputs += out
+        return read, written, outputs
+
+    records = np.concatenate([np.fromfile(p, dtype=PSV_DTYPE, count=count_records(p)) for p in parts]) \
+        if parts else np.empty(0, PSV_DTYPE)
+    if dedup_bytes:
+        # dedup()の結果は入力の並びによらない。
+        records = dedup(records, dedup_bytes, seed)
+    else:
+        # 一時ファイルはプロセスごとなので、どのプロセスが読んだかで並びが変わる。一度バイト列の順に並べてから
+        # シャッフルして、seedが同じなら同じ結果になるようにする。
+        records = np.sort(records.view(f"V{PSV_SIZE}")).view(PSV_DTYPE)
+    records = records[rng.permutation(len(records))]
+    with open(out_path, "wb") as f:
+        records.tofile(f)
+    for p in parts:
+        os.remove(p)
+    return read, len(records), [out_path] if len(records) else []
+
+
+# ======================================================================
+# 全体
+# ======================================================================
+
+class Throughput:
+    """ 処理した局面数を数えて、一定時間ごとに速度を表示する。"""
+
+    def __init__(self, phase, total, interval=10.0):
+        self.phase = phase
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = self.last = time.time()
+
+    def add(self, records):
+        self.done += records
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.start, 1e-9)
+        s = f"  {self.phase} : {self.done}/{self.total} positions , {self.done / elapsed:.0f} positions/s"
+        if final:
+            s += f" , {elapsed:.1f}s"
+        print(s)
+        sys.stdout.flush()
+
+
+def block_counts(rng, remain, n):
+    """
+    残りremain[i]局面ずつあるファイル群から、n局面を非復元で一様に取り出したときの各ファイルからの取り出し数。
+    (多変量超幾何分布)
+
+    numpyの multivariate_hypergeometric() は残りの合計が10億以上だと使えない。そのときは
+    [0, 合計) から重複のないn個の通し番号を選び、どのファイルの範囲に入るかを数える。
+    (通し番号の選び方が一様なので、取り出し数の分布はまったく同じになる)
+    番号の衝突が増えないように、1回に選ぶのは合計の1/4までにして、残りは取り出したあとの残りから続けて選ぶ。
+    """
+    remain = np.asarray(remain, dtype=np.int64)
+    take = np.zeros(len(remain), dtype=np.int64)
+    while n > 0:
+        total = int((remain - take).sum())
+        if total < HYPERGEOMETRIC_LIMIT:
+            return take + rng.multivariate_hypergeometric(remain - take, n, method="marginals")
+        m = min(n, total // 4)
+        picked = np.empty(0, dtype=np.int64)
+        while len(picked) < m:
+            picked = np.sort(np.concatenate([picked, rng.integers(total, size=m - len(picked), dtype=np.int64)]))
+            # 重複した番号を除く。(np.unique()より速い)
+            picked = picked[np.concatenate(([True], picked[1:] != picked[:-1]))]
+        owner = np.searchsorted(np.cumsum(remain - take), picked, side="right")
+        take += np.bincount(owner, minlength=len(remain))
+        n -= m
+    return take
+
+
+def _interleave(paths, output, block_records, rng, total):
+    """
+    シャッフル済みのファイルを、残りの局面数に比例した確率で混ぜながらoutputに書き出す。
+    ブロックごとに各ファイルからの取り出し数を多変量超幾何分布(block_counts())で決め、ブロックの中をシャッフルする。
+    """
+    remain = np.array([count_records(p) for p in paths], dtype=np.int64)
+    offsets = [0] * len(paths)
+    meter = Throughput("interleave", total)
+    tmp_output = output + ".tmp"
+    with open(tmp_output, "wb") as out:
+        while remain.sum() > 0:
+            n = int(min(block_records, remain.sum()))
+            take = block_counts(rng, remain, n)
+            block = []
+            for i in np.flatnonzero(take):
+                # ファイルを開いたままにすると、バケツが多いときにファイル数の上限にかかるので毎回開く。
+                with open(paths[i], "rb") as f:
+                    f.seek(offsets[i] * PSV_SIZE)
+                    block.append(np.fromfile(f, dtype=PSV_DTYPE, count=int(take[i])))
+                offsets[i] += int(take[i])
+            remain -= take
+            block = np.concatenate(block)
+            block[rng.permutation(len(block))].tofile(out)
+            meter.add(len(block))
+    os.replace(tmp_output, output)
+    meter.report(final=True)
+
+
+def shuffle_dedup(paths, output, dedup_mode="sfen", workers=None, memory_mb=4096, tmp_dir=None, seed=None):
+    """
+    pathsの局面の重複を取り除き、一様にシャッフルしてoutputに書き出す。(読み込んだ局面数 , 書き出した局面数) を返す。
+
+    dedup_mode : "sfen" , "record" , "none" (DEDUP_BYTES)
+    workers    : 並列に動かすプロセス数。Noneならcpuの数。
+    memory_mb  : 全プロセスで使うメモリのおおよその上限[MB]。
+    """
+    _require_numpy()
+    dedup_bytes = DEDUP_BYTES[dedup_mode]
+    # 重複を除くときは重複とみなす範囲で、除かないときは40バイト全体でhashをとってバケツに分ける。
+    key_bytes = dedup_bytes or PSV_SIZE
+    workers = workers or os.cpu_count() or 1
+    if seed is None:
+        seed = int.from_bytes(os.urandom(8), "little")
+    if any(os.path.exists(output) and os.path.samefile(path, output) for path in paths):
+        raise ValueError(f"output file {output} is also an input.")
+    _raise_file_limit()
+
+    total = sum(count_records(path) for path in paths)
+    # 1プロセスあたりのメモリで、バケツ(読み込み・シャッフルしたコピー・重複除去の作業領域)が載る大きさにする。
+    per_worker = memory_mb * 1024 * 1024 // workers
+    bucket_records = max(1, per_worker // (PSV_SIZE * 6))
+    split_records = max(1, min(SPLIT_RECORDS, per_worker // (PSV_SIZE * 3)))
+    # バケツの大きさの期待値をbucket_recordsの8割にしておく。
+    n_buckets = max(1, -(-total * 5 // (bucket_records * 4)))
+    # 混ぜ合わせは1プロセスで行うので、メモリをすべて使える。(ブロックとシャッフルしたコピーの2つ分と、
+    # 10億局面以上のときにblock_counts()で選ぶ通し番号(int64)の分)
+    block_records = max(1, memory_mb * 1024 * 1024 // (PSV_SIZE * 2 + 16))
+
+    print(f"input : {total} positions in {len(paths)} files , dedup {dedup_mode} , {workers} workers ,"
+          f" {n_buckets} buckets , seed {seed}")
+    sys.stdout.flush()
+
+    work_dir = tempfile.mkdtemp(prefix="psv_shuffle_", dir=tmp_dir)
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            tasks = [(path, start, min(split_records, count_records(path) - start), work_dir, n_buckets, 0, "", key_bytes)
+                     for path in paths for start in range(0, count_records(path), split_records)]
+            meter = Throughput("split", total)
+            for records in pool.imap_unordered(_split_task, tasks):
+                meter.add(records)
+            meter.report(final=True)
+
+            tasks = [(work_dir, 0, str(bucket), dedup_bytes, bucket_records, seed) for bucket in range(n_buckets)]
+            meter = Throughput("dedup+shuffle", total)
+            shuffled = []
+            written = 0
+            for read, wrote, outputs in pool.imap_unordered(_shuffle_task, tasks):
+                meter.add(read)
+                written += wrote
+                shuffled += outputs
+            meter.report(final=True)
+
+        if dedup_bytes:
+            print(f"  duplicates : {total - written} positions removed , {written} left"
+                  f" ({(total - written) * 100 / max(total, 1):.2f}%)")
+        # 並列に処理したので終わった順がばらばらになっている。同じseed・workers・memoryなら同じ結果になるように並べ直す。
+        shuffled.sort()
+        _interleave(shuffled, output, block_records, np.random.default_rng([seed, INTERLEAVE_STREAM]), written)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return total, written
+
+
+# ======================================================================
+# コマンドライン
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Shuffle and deduplicate gensfen teacher files with external-memory bucketing.")
+    parser.add_argument("output", type=str, help="Output file (PackedSfenValue, usable by 'learn').")
+    parser.add_argument("inputs", type=str, nargs="+", help="Teacher files.")
+    parser.add_argument("--dedup", type=str, default="sfen", choices=sorted(DEDUP_BYTES),
+                        help="sfen: same position is a duplicate (default). record: all fields must match. none: shuffle only.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    parser.add_argument("--memory", type=int, default=4096, help="Memory budget for all workers [MB].")
+    parser.add_argument("--tmp_dir", type=str, default=None, help="Directory for temporary bucket files (default: system temp).")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed (default: random).")
+    args = parser.parse_args()
+
+    _require_numpy()
+    start = time.time()
+    try:
+        total, written = shuffle_dedup(args.inputs, args.output, dedup_mode=args.dedup, workers=args.workers,
+                                       memory_mb=args.memory, tmp_dir=args.tmp_dir, seed=args.seed)
+    except ValueError as e:
+        print(f"Error! {e}")
+        sys.exit(1)
+    elapsed = time.time() - start
+    print(f"{args.output} : {written} positions (from {total}) , {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} positions/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+複数の対局ジョブを、決められたコア数(core budget)の中でまとめて消化するスケジューラ。
+
+engine_invoker.py の main() は evaldir × 持ち時間 の組み合わせを1つずつ順番に回すので、
+各組み合わせの終盤(最後の数局を待っている間)にコアが遊んでしまう。
+ここでは、ジョブごとに vs_match をスレッドで走らせて、対局スロット単位でコアを貸し出す。
+
+  - 空いたコアは、まだ開始していないジョブに優先して割り当てる。
+  - 開始待ちのジョブがなければ、走っているジョブが並列数(max_parallel)まで対局スロットを増やす。
+  - 対局数が足りた/SPRTで打ち切られたジョブのスロットは、その場でエンジンを終了してコアを返却する。
+
+使い方:
+    python scheduler.py jobs.yaml
+
+jobs.yamlの例:
+    home: /mnt/d/shogi_home
+    core_budget: 32
+    book_moves: 24
+    rand_book: true
+    jobs:
+      - engine1: YaneuraOu.exe
+        eval1: nnue/base
+        engine2: YaneuraOu.exe
+        eval2: nnue/test1
+        time: b1000
+        loop: 2000
+        max_parallel: 16
+      - engine1: YaneuraOu.exe
+        eval1: nnue/base
+        engine2: YaneuraOu.exe
+        eval2: nnue/test2
+        time: b1000
+        loop: 20000
+        sprt: {alpha: 0.05, beta: 0.05, elo0: 0, elo1: 5}
+        adjudication: {resign_score: 3000, resign_plies: 6, draw_score: 50, draw_plies: 20, draw_min_ply: 160, mate: true}
+
+ジョブで省略した項目(engine_threads, hash1, hash2, max_parallel, kifu_format, telemetry, ponder, adjudication)は、
+ファイル先頭の同名の項目、それもなければ engine_invoker.py と同じ既定値になる。
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+from collections import deque
+
+import yaml
+
+from engine_invoker import vs_match, create_option, engine_to_full, output_rating, read_book_sfens
+from sprt_invoker import SPRT
+from adjudication import AdjudicationRules
+
+
+# ======================================================================
+# ジョブ
+# ======================================================================
+
+class MatchJob:
+    """
+    vs_match 1回分の対局条件。
+
+    engine_threads : 1エンジンあたりのスレッド数。ponderなしでは1局で同時に思考するのは片方だけなので、
+                     1対局スロットが使うコア数もこの値とする。ponderありなら両方が思考するのでその2倍。
+    max_parallel   : このジョブで同時に進める対局数の上限
+    sprt           : sprt_invoker.SPRT 。Noneでなければ終局ごとに判定し、決着したら打ち切る。
+    adjudication   : adjudication.AdjudicationRules 。Noneでなければ評価値で勝敗を判定して打ち切る。
+    """
+
+    def __init__(self, name, engines_full, options, loop, book_sfens, book_moves,
+                 engine_threads=1, max_parallel=1, sprt=None, opt2=None,
+                 kifu_format="sfen", telemetry_format="none", file_logging=False, ponder=False,
+                 adjudication=None):
+        self.name = name
+        self.engines_full = engines_full
+        self.options = options
+        self.loop = loop
+        self.book_sfens = book_sfens
+        self.book_moves = book_moves
+        self.cores = engine_threads * (2 if ponder else 1)
+        self.ponder = ponder
+        self.max_parallel = max_parallel
+        self.sprt = sprt
+        self.opt2 = opt2 if opt2 is not None else name
+        self.kifu_format = kifu_format
+        self.telemetry_format = telemetry_format
+        self.file_logging = file_logging
+        self.adjudication = adjudication
+
+        # "QUEUED" | "RUNNING" | "DONE" | "ACCEPTED" | "REJECTED" | "FAILED"
+        self.status = "QUEUED"
+        self.llr = 0.0
+        # (win, lose, draw, win_black, win_white)
+        self.result = None
+
+    def should_stop(self, win, lose, draw):
+        if self.sprt is None:
+            return False
+        status, self.llr = self.sprt.check_status(win, lose, draw)
+        if status != "CONTINUE":
+            self.status = status
+            print(f"\n*** {self.name} : SPRT {status} (LLR = {self.llr:.4f}) after {win + lose + draw} games ***")
+            sys.stdout.flush()
+            return True
+        return False
+
+
+# ======================================================================
+# コアの貸し出し
+# ======================================================================
+
+class SlotLease:
+    """
+    vs_match に渡す、対局スロット1つ分のコアを借りる/返すための窓口。
+    prepaid : ジョブ開始時にスケジューラが確保済みのスロット数
+    """
+
+    def __init__(self, scheduler, job, prepaid=0):
+        self.scheduler = scheduler
+        self.job = job
+        self.prepaid = prepaid
+        self.held = 0
+
+    def acquire(self):
+        if self.prepaid > 0:
+            self.prepaid -= 1
+        elif not self.scheduler._take(self.job):
+            return False
+        self.held += 1
+        return True
+
+    def release(self):
+        if self.held > 0:
+            self.held -= 1
+            self.scheduler._give_back(self.job)
+
+    def release_all(self):
+        while self.held > 0:
+            self.release()
+        while self.prepaid > 0:
+            self.prepaid -= 1
+            self.scheduler._give_back(self.job)
+
+
+class MatchScheduler:
+    """
+    jobsを core_budget コアの範囲で並行して消化する。
+    run()は全ジョブが終わるまで戻らない。
+    """
+
+    def __init__(self, jobs, core_budget, metrics=None, checkpoint=None, max_restarts=10):
+        self.jobs = list(jobs)
+        self.core_budget = core_budget
+        self.metrics = metrics
+        self.checkpoint = checkpoint
+        self.max_restarts = max_restarts
+
+        self.cond = threading.Condition()
+        self.free = core_budget
+        self.pending = deque(self.jobs)
+        self.running = 0
+
+        for job in self.jobs:
+            if job.cores > core_budget:
+                raise ValueError(f"{job.name} needs {job.cores} cores but core_budget is {core_budget}")
+
+    def _take(self, job):
+        """ 走っているジョブが対局スロットを1つ増やしたいときに呼ばれる。"""
+        with self.cond:
+            # 開始待ちのジョブがあるなら、空いたコアはそちらに回す。
+            if self.pending or self.free < job.cores:
+                return False
+            self.free -= job.cores
+            return True
+
+    def _give_back(self, job):
+        with self.cond:
+            self.free += job.cores
+            self.cond.notify_all()
+
+    def _run_job(self, job, lease):
+        try:
+            job.result = vs_match(
+                job.engines_full,
+                job.options,
+                job.max_parallel,
+                job.loop,
+                job.book_sfens,
+                job.file_logging,
+                job.opt2,
+                job.book_moves,
+                kifu_format=job.kifu_format,
+                telemetry_format=job.telemetry_format,
+                metrics=self.metrics,
+                checkpoint=self.checkpoint,
+                block_key=job.name,
+                max_restarts=self.max_restarts,
+                should_stop=job.should_stop,
+                lease=lease,
+                ponder=job.ponder,
+                adjudication=job.adjudication,
+            )
+            if job.status == "RUNNING":
+                job.status = "DONE"
+        except BaseException as e:
+            # vs_matchはエンジンの起動に失敗するとsys.exit()するので、SystemExitもここで受ける。
+            print(f"Error! job {job.name} failed : {e!r}")
+            job.status = "FAILED"
+        finally:
+            lease.release_all()
+            with self.cond:
+                self.running -= 1
+                self.cond.notify_all()
+
+    def run(self):
+        threads = []
+        with self.cond:
+            while True:
+                # 開始待ちのジョブのうち、空きコアに収まるものを先頭から開始する。
+                for job in list(self.pending):
+                    if self.free < job.cores:
+                        continue
+                    self.pending.remove(job)
+                    self.free -= job.cores
+                    self.running += 1
+                    job.status = "RUNNING"
+                    print(f"start job {job.name} (free cores = {self.free})")
+                    sys.stdout.flush()
+                    t = threading.Thread(target=self._run_job, args=(job, SlotLease(self, job, prepaid=1)), daemon=True)
+                    threads.append(t)
+                    t.start()
+
+                if not self.pending and self.running == 0:
+                    break
+                self.cond.wait(timeout=1.0)
+
+        for t in threads:
+            t.join()
+        return self.jobs
+
+
+# ======================================================================
+# ジョブファイルからの実行
+# ======================================================================
+
+def build_job(home, spec, defaults, book_sfens, book_moves, index):
+    """ jobs.yamlのジョブ1つ分の辞書からMatchJobを作る。"""
+    def get(key, default):
+        return spec.get(key, defaults.get(key, default))
+
+    engine_threads = get("engine_threads", 1)
+    play_time = str(get("time", "b1000"))
+    hashes = [str(get("hash1", "128")), str(get("hash2", "128"))]
+
+    engines = (engine_to_full(spec["engine1"]), engine_to_full(spec["engine2"]))
+    engines_full = (os.path.join(home, "exe", engines[0]), os.path.join(home, "exe", engines[1]))
+    evals = (spec["eval1"], spec["eval2"])
+    evals_full = (os.path.join(home, "eval", evals[0]), os.path.join(home, "eval", evals[1]))
+    options = create_option(engines, engine_threads, evals_full, play_time, hashes, get("param_log_path", ""))
+
+    sprt = None
+    if "sprt" in spec:
+        p = spec["sprt"]
+        sprt = SPRT(p.get("alpha", 0.05), p.get("beta", 0.05), p.get("elo0", 0.0), p.get("elo1", 5.0))
+
+    name = spec.get("name", f"{evals[0]}-{evals[1]}|{play_time}")
+    # opt2は棋譜ファイル名にも使われるので、同じ秒に開始したジョブ同士で衝突しないようにジョブ番号を入れる。
+    opt2 = f"J{index}," + "T" + str(engine_threads) + "," + play_time
+
+    return MatchJob(name, engines_full, options, get("loop", 100), book_sfens, book_moves,
+                    engine_threads=engine_threads,
+                    max_parallel=get("max_parallel", get("parallel_games", 1)),
+                    sprt=sprt,
+                    opt2=opt2,
+                    kifu_format=get("kifu_format", "sfen"),
+                    telemetry_format=get("telemetry", "none"),
+                    file_logging=get("log", False),
+                    ponder=get("ponder", False),
+                    adjudication=AdjudicationRules.from_dict(get("adjudication", None)))
+
+
+def print_job_results(jobs):
+    print("\nresults : ")
+    for job in jobs:
+        print(f"{job.name} : {job.status}" + (f" LLR = {job.llr:.4f}" if job.sprt else ""))
+        if job.result:
+            w, l, d, wb, ww = job.result
+            output_rating(w, d, l, wb, ww, job.opt2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a queue of match jobs over a shared core budget.")
+    parser.add_argument('jobs', type=str, help="Path to a YAML job file.")
+    parser.add_argument('--core_budget', type=int, default=0, help="Number of cores to fill (overrides the job file).")
+    parser.add_argument('--metrics_port', type=int, default=0, help="Serve Prometheus-style match metrics on this port (0 = disabled).")
+    args = parser.parse_args()
+
+    with open(args.jobs, 'r') as f:
+        config = yaml.safe_load(f)
+
+    home = config["home"]
+    core_budget = args.core_budget or config.get("core_budget", os.cpu_count())
+    book_moves = config.get("book_moves", 24)
+
+    book_sfens = read_book_sfens(home, book_moves)
+    if config.get("rand_book", False):
+        random.shuffle(book_sfens)
+
+    jobs = [build_job(home, spec, config, book_sfens, book_moves, i) for i, spec in enumerate(config["jobs"])]
+
+    metrics = None
+    if args.metrics_port:
+        from metrics import MatchMetrics, start_metrics_server
+        metrics = MatchMetrics()
+        start_metrics_server(metrics.registry, args.metrics_port)
+
+    print(f"core_budget : {core_budget} , jobs : {len(jobs)}")
+    MatchScheduler(jobs, core_budget, metrics=metrics).run()
+    print_job_results(jobs)
+
+
+if __name__ == "__main__":
+    main()
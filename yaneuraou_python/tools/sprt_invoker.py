@@ -107,39 +107,30 @@ def main():
     options = create_option([e1, e2], args.engine_threads, evals_full, args.time, ["128", "128"], "")
 
     # 対局ループ
-    # 注: engine_invoker の vs_match は一度に大量の対局を回すため、
-    # 逐次判定を行うために少しずつ回すようにするか、vs_match 内部を修正する必要があります。
-    # ここでは vs_match が結果を返すたびに SPRT 判定を行います。
-    
-    total_wins = total_losses = total_draws = 0
-    total_win_black = total_win_white = 0
-    
-    batch_size = args.parallel_games * 2 # 効率のため並列数分を1バッチとする
-    
-    print("Starting matches...")
-    status = "CONTINUE"
-    while (total_wins + total_losses + total_draws) < args.max_games:
-        # 1バッチ分実行 (vs_match を現在の進捗から継続できるように調整が必要)
-        # engine_invoker.py の vs_match はループ回数(loop)を指定して一気に回す仕様
-        # そのため、loop=batch_size で呼び出す。
-        
-        w, l, d, wb, ww = vs_match(engines_full, options, args.parallel_games, batch_size, book_sfens, False, "SPRT", args.book_moves)
-        
-        total_wins += w
-        total_losses += l
-        total_draws += d
-        
-        status, llr = sprt.check_status(total_wins, total_losses, total_draws)
-        total_n = total_wins + total_losses + total_draws
-        
-        print(f"\n[{total_n} games] W:{total_wins} L:{total_losses} D:{total_draws} | LLR:{llr:.4f}")
-        
+    # vs_match に終局ごとの判定関数(should_stop)を渡し、エンジンを起動したまま1回の呼び出しで回す。
+    # 判定が決着したら新しい対局は開始されず、対局中のものが終わりしだい vs_match から戻ってくる。
+    # 判定が決着した時点の結果。打ち切り後に終わった対局は判定には使わない。
+    decision = {}
+
+    def should_stop(wins, losses, draws):
+        status, llr = sprt.check_status(wins, losses, draws)
+        total_n = wins + losses + draws
+        if status != "CONTINUE" or total_n % 10 == 0:
+            print(f"\n[{total_n} games] W:{wins} L:{losses} D:{draws} | LLR:{llr:.4f}")
         if status != "CONTINUE":
-            print(f"\n*** SPRT Result: {status} ***")
-            print(f"Final LLR: {llr:.4f}")
-            break
+            decision.update(status=status, llr=llr)
+            return True
+        return False
+
+    print("Starting matches...")
+    w, l, d, wb, ww = vs_match(engines_full, options, args.parallel_games, args.max_games, book_sfens, False, "SPRT", args.book_moves,
+                               should_stop=should_stop)
 
-    if status == "CONTINUE":
+    print(f"\n[{w + l + d} games] W:{w} L:{l} D:{d}")
+    if decision:
+        print(f"\n*** SPRT Result: {decision['status']} ***")
+        print(f"Final LLR: {decision['llr']:.4f}")
+    else:
         print("\nReached max games without definitive SPRT result.")
 
 if __name__ == "__main__":
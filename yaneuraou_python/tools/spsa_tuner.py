@@ -0,0 +1,393 @@
+"""
+SPSA(Simultaneous Perturbation Stochastic Approximation)で、エンジンのTUNEパラメーターを
+自己対局の結果から調整するツール。
+
+source/tune.h の TUNE() で登録したパラメーターは、USIの spin オプションとして見えるようになり、
+さらにエンジン起動時に次の形式(Fishtestにそのまま貼れる形式)の行が標準出力に出る。
+
+    オプション名 , 現在値 , min , max , C_end , R_end
+
+このツールはエンジンを1回起動して "usi" を送り、この行と "option name ... type spin ..." 行から
+チューニング対象のパラメーターを集める。(--params を指定したときは、その名前のspinオプションだけを対象にする)
+
+SPSAの1 iteration:
+    Δ_i = ±1 をランダムに選び、
+    θ+ = θ + c_k Δ を engine1 に、 θ- = θ - c_k Δ を engine2 に setoption して、同じ定跡局面から手番を入れ替えた2局を指す。
+    r = (θ+側の勝ち数) - (θ+側の負け数)  (-2 ～ +2)
+    θ_i += a_k / c_k * r * Δ_i
+
+    c_k = c / (k+1)^gamma
+    a_k = a / (A+k+1)^alpha
+    c = C_end * N^gamma , a = R_end * C_end^2 * (A+N)^alpha , A = 0.1 * N (Fishtestと同じ)
+
+iterationは並列対局のスロットごとに独立に進み、終わったものから順にθに反映する。
+エンジンは起動したままで、対局ごとに "isready" の前に setoption を送り直す。
+
+使い方:
+    python spsa_tuner.py --home /mnt/d/shogi_home --engine YaneuraOu.exe --eval nnue/base \\
+        --parallel_games 8 --iterations 5000 --time b1000 --checkpoint spsa.json
+
+    中断したときは同じコマンドに --resume を付けて実行すると、保存したθとiteration数から続ける。
+
+出力:
+    終了時(と --checkpoint の保存のたび)に、Fishtestと同じ "名前,値" 形式で現在のθを表示する。
+    --checkpoint はiterationがθに反映されたときに(前回の保存から --checkpoint_interval 秒以上経っていれば)保存する。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from engine_invoker import vs_match, create_option, engine_to_full, read_book_sfens, GameResult
+from usi_engine import UsiEngine, UsiEngineError
+from usi_parser import parse_line
+
+SPSA_STATE_VERSION = 1
+
+
+# ======================================================================
+# パラメーター
+# ======================================================================
+
+class SpsaParam:
+    """
+    チューニング対象のパラメーター1つ。
+    value は実数で持ち、エンジンに送るときに四捨五入して[min, max]に収める。
+    """
+    __slots__ = ("name", "value", "min", "max", "c_end", "r_end")
+
+    def __init__(self, name, value, min, max, c_end=None, r_end=0.002):
+        self.name = name
+        self.value = float(value)
+        self.min = min
+        self.max = max
+        # tune.cppと同じ既定値。
+        self.c_end = c_end if c_end is not None else (max - min) / 20.0
+        self.r_end = r_end
+
+    def clamp(self, v):
+        return min(max(v, self.min), self.max)
+
+    def to_engine(self, v):
+        return int(round(self.clamp(v)))
+
+    def __repr__(self):
+        return f"SpsaParam({self.name!r}, {self.value:.3f}, {self.min}, {self.max}, {self.c_end}, {self.r_end})"
+
+
+def parse_tune_line(line):
+    """ tune.cppが出力する "name,v,min,max,C_end,R_end" 行ならSpsaParamにする。そうでなければNone。"""
+    fields = line.strip().split(",")
+    if len(fields) != 6 or not fields[0] or " " in fields[0]:
+        return None
+    try:
+        v, lo, hi = int(fields[1]), int(fields[2]), int(fields[3])
+        c_end, r_end = float(fields[4]), float(fields[5])
+    except ValueError:
+        return None
+    return SpsaParam(fields[0], v, lo, hi, c_end, r_end)
+
+
+def probe_engine(engine_full, timeout=30.0):
+    """
+    エンジンを起動して"usi"を送り、usiokまでの出力から
+      (spinオプションの辞書 {name: OptionRecord}, TUNEパラメーターのlist[SpsaParam])
+    を返す。
+    """
+    async def probe():
+        async with UsiEngine(engine_full) as engine:
+            return engine, await engine.usi(timeout)
+
+    try:
+        engine, lines = asyncio.run(probe())
+    except UsiEngineError:
+        print(f"Error! {engine_full} did not answer usiok.")
+        sys.exit(1)
+
+    spins = {name: rec for name, rec in engine.options.items()
+             if rec.type == "spin" and rec.min is not None and rec.max is not None}
+    tunes = []
+    for line in lines:
+        if parse_line(line) is None:
+            p = parse_tune_line(line)
+            if p is not None:
+                tunes.append(p)
+    return spins, tunes
+
+
+def select_params(spins, tunes, names=None, pattern=None):
+    """
+    チューニング対象を決める。
+      names   : 指定されていれば、その名前のspinオプション(TUNE行があればその C_end/R_end を使う)
+      pattern : 指定されていれば、名前がこの正規表現にマッチするものだけ
+    どちらもなければTUNE行の出ていたパラメーターすべて。
+    """
+    by_name = {p.name: p for p in tunes}
+    if names:
+        params = []
+        for name in names:
+            if name in by_name:
+                params.append(by_name[name])
+            elif name in spins:
+                o = spins[name]
+                params.append(SpsaParam(name, o.default, o.min, o.max))
+            else:
+                print(f"Error! {name} is not a spin option of the engine.")
+                sys.exit(1)
+    else:
+        params = list(tunes)
+    if pattern:
+        r = re.compile(pattern)
+        params = [p for p in params if r.search(p.name)]
+    return params
+
+
+# ======================================================================
+# SPSA本体
+# ======================================================================
+
+class _Iteration:
+    """ 1 iteration分(1つの対局スロットで指す2局)の状態。sfen_noは2局で使う定跡の行番号。"""
+    __slots__ = ("k", "delta", "plus", "minus", "ck", "score", "games", "sfen_no")
+
+    def __init__(self, k, delta, plus, minus, ck):
+        self.k = k
+        self.delta = delta
+        self.plus = plus
+        self.minus = minus
+        self.ck = ck
+        self.score = 0
+        self.games = 0
+        self.sfen_no = None
+
+
+class SpsaTuner:
+    """
+    vs_match の game_hooks として渡す。
+      setup_commands(i)   : engine i (偶数 = θ+ , 奇数 = θ-) に送るsetoptionのlist
+      pick_sfen_no(g, no) : iterationの2局目は、1局目と同じ定跡の行番号を返す。(手番はvs_matchが入れ替える)
+      on_game_end(g, r)   : スロットgの対局結果を受け取り、2局揃ったらθを更新する。
+
+    iterations   : 総iteration数 N (対局数は 2N)
+    state        : 保存しておいた to_state() の戻り値。指定されれば、θ/iteration数/乱数の状態をそこから再開する。
+    on_iteration : Noneでなければ、iterationをθに反映するたびに on_iteration(self) を呼ぶ。(チェックポイントの保存用)
+    """
+
+    def __init__(self, params, iterations, alpha=0.602, gamma=0.101, A_ratio=0.1, seed=None, state=None, on_iteration=None):
+        self.params = params
+        self.iterations = iterations
+        self.alpha = alpha
+        self.gamma = gamma
+        self.A = A_ratio * iterations
+        self.rand = random.Random(seed)
+        self.on_iteration = on_iteration
+
+        N = iterations
+        self.c = [p.c_end * N ** gamma for p in params]
+        self.a = [p.r_end * p.c_end ** 2 * (self.A + N) ** alpha for p in params]
+
+        # 開始したiteration数 , θに反映済みのiteration数
+        self.started = 0
+        self.done = 0
+        # 反映済みiterationの r の累計(進み具合の目安)
+        self.score_sum = 0
+
+        if state is not None:
+            values = state["values"]
+            for p in params:
+                if p.name in values:
+                    p.value = float(values[p.name])
+            self.started = self.done = state["done"]
+            self.score_sum = state.get("score_sum", 0)
+            if "rand_state" in state:
+                self.rand.setstate(_to_tuple(state["rand_state"]))
+
+        # 対局スロットごとの進行中のiteration
+        self.slot_iter = {}
+        # vs_matchのスレッドとcheckpoint保存から触るのでlockしておく。
+        self.lock = threading.Lock()
+
+    def _new_iteration(self):
+        k = self.started
+        self.started += 1
+        delta = [self.rand.choice((-1, 1)) for _ in self.params]
+        ck = [c / (k + 1) ** self.gamma for c in self.c]
+        plus = [p.to_engine(p.value + c * d) for p, c, d in zip(self.params, ck, delta)]
+        minus = [p.to_engine(p.value - c * d) for p, c, d in zip(self.params, ck, delta)]
+        return _Iteration(k, delta, plus, minus, ck)
+
+    def setup_commands(self, i):
+        g = i // 2
+        with self.lock:
+            it = self.slot_iter.get(g)
+            if it is None:
+                it = self.slot_iter[g] = self._new_iteration()
+            values = it.plus if (i % 2) == 0 else it.minus
+        return ["setoption name " + p.name + " value " + str(v) for p, v in zip(self.params, values)]
+
+    def pick_sfen_no(self, g, no):
+        with self.lock:
+            it = self.slot_iter.get(g)
+            if it is None:
+                return no
+            if it.sfen_no is None:
+                it.sfen_no = no
+            return it.sfen_no
+
+    def on_game_end(self, g, result):
+        with self.lock:
+            it = self.slot_iter.get(g)
+            if it is None:
+                return
+            if result == GameResult.P1_WIN:
+                it.score += 1
+            elif result == GameResult.P2_WIN:
+                it.score -= 1
+            it.games += 1
+            if it.games < 2:
+                # 同じ定跡局面から手番を入れ替えてもう1局、同じθ±で指す。
+                return
+
+            del self.slot_iter[g]
+            ak_list = [a / (self.A + it.k + 1) ** self.alpha for a in self.a]
+            for p, ak, ck, d in zip(self.params, ak_list, it.ck, it.delta):
+                p.value = p.clamp(p.value + ak / ck * it.score * d)
+            self.done += 1
+            self.score_sum += it.score
+
+        # to_state()がlockを取るので、lockの外で呼ぶ。
+        if self.on_iteration is not None:
+            self.on_iteration(self)
+
+    def to_state(self):
+        """ チェックポイントに保存する内容。進行中のiterationは捨て、再開時に引き直す。"""
+        with self.lock:
+            return {
+                "version": SPSA_STATE_VERSION,
+                "done": self.done,
+                "score_sum": self.score_sum,
+                "values": {p.name: p.value for p in self.params},
+                "rand_state": self.rand.getstate(),
+            }
+
+    def print_params(self):
+        print(f"\n[SPSA] iteration {self.done}/{self.iterations} , score sum = {self.score_sum}")
+        for p in self.params:
+            print(f"{p.name},{p.to_engine(p.value)}   ({p.value:.3f})")
+        sys.stdout.flush()
+
+
+def _to_tuple(x):
+    """ JSONで list になった random.getstate() の戻り値を tuple に戻す。"""
+    return tuple(_to_tuple(v) for v in x) if isinstance(x, list) else x
+
+
+def save_state(path, state):
+    """ checkpoint.RunCheckpoint と同じく、一時ファイルに書いてから置き換える。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_state(path):
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != SPSA_STATE_VERSION:
+        raise ValueError(f"unsupported SPSA state version : {state.get('version')}")
+    return state
+
+
+# ======================================================================
+# メイン処理
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune engine parameters with SPSA self-play.")
+
+    parser.add_argument('--home', type=str, required=True, help="Path to the home directory containing 'exe', 'eval' and 'book' folders.")
+    parser.add_argument('--engine', type=str, required=True, help="Engine to tune (both sides use it).")
+    parser.add_argument('--eval', type=str, required=True, help="Name of the evaluation function folder.")
+    parser.add_argument('--parallel_games', type=int, default=2, help="Number of iterations (game pairs) to run in parallel.")
+    parser.add_argument('--engine_threads', type=int, default=1)
+    parser.add_argument('--hash', type=str, default="128")
+    parser.add_argument('--time', type=str, default="b1000")
+    parser.add_argument('--book_moves', type=int, default=24)
+    parser.add_argument('--rand_book', action='store_true', help="Shuffle the opening book entries.")
+
+    parser.add_argument('--params', type=str, default="", help="Comma separated spin option names to tune (default: all TUNE parameters).")
+    parser.add_argument('--filter', type=str, default="", help="Only tune parameters whose name matches this regex.")
+    parser.add_argument('--iterations', type=int, default=1000, help="Total SPSA iterations N (2 games each).")
+    parser.add_argument('--alpha', type=float, default=0.602)
+    parser.add_argument('--gamma', type=float, default=0.101)
+    parser.add_argument('--A_ratio', type=float, default=0.1, help="A = A_ratio * N")
+    parser.add_argument('--seed', type=int, default=None)
+
+    parser.add_argument('--checkpoint', type=str, default="", help="Save theta to this JSON file periodically.")
+    parser.add_argument('--checkpoint_interval', type=float, default=60.0, help="Seconds between checkpoint saves.")
+    parser.add_argument('--resume', action='store_true', help="Resume from --checkpoint.")
+
+    args = parser.parse_args()
+
+    engine = engine_to_full(args.engine)
+    engine_full = os.path.join(args.home, "exe", engine)
+    eval_full = os.path.join(args.home, "eval", args.eval)
+
+    spins, tunes = probe_engine(engine_full)
+    names = [s.strip() for s in args.params.split(",") if s.strip()]
+    params = select_params(spins, tunes, names, args.filter)
+    if not params:
+        print("Error! no parameters to tune. Build the engine with TUNE() or specify --params.")
+        sys.exit(1)
+
+    state = None
+    if args.resume:
+        if not args.checkpoint or not os.path.exists(args.checkpoint):
+            print("Error! --resume needs an existing --checkpoint file.")
+            sys.exit(1)
+        state = load_state(args.checkpoint)
+
+    # iterationをθに反映したときに、前回の保存から一定時間経っていればθを保存する。
+    # (2局揃ったところで保存するので、保存したθに1局分だけの結果が混ざることはない)
+    last_save = [time.time()]
+
+    def checkpoint_if_needed(tuner):
+        if args.checkpoint and time.time() - last_save[0] >= args.checkpoint_interval:
+            save_state(args.checkpoint, tuner.to_state())
+            tuner.print_params()
+            last_save[0] = time.time()
+
+    tuner = SpsaTuner(params, args.iterations, args.alpha, args.gamma, args.A_ratio, args.seed, state, checkpoint_if_needed)
+    print(f"SPSA : {len(params)} parameters , N = {args.iterations} , done = {tuner.done}")
+    for p, c, a in zip(params, tuner.c, tuner.a):
+        print(f"  {p.name} : value = {p.value:.3f} [{p.min}, {p.max}] , c = {c:.4f} , a = {a:.4f}")
+
+    remain = args.iterations - tuner.done
+    if remain <= 0:
+        tuner.print_params()
+        return
+
+    book_sfens = read_book_sfens(args.home, args.book_moves)
+    if args.rand_book:
+        random.Random(args.seed).shuffle(book_sfens)
+
+    options = create_option([engine, engine], args.engine_threads, (eval_full, eval_full), args.time, [args.hash, args.hash], "")
+
+    opt2 = "SPSA,T" + str(args.engine_threads) + "," + args.time
+    vs_match((engine_full, engine_full), options, args.parallel_games, remain * 2, book_sfens, False, opt2, args.book_moves,
+             game_hooks=tuner)
+
+    if args.checkpoint:
+        save_state(args.checkpoint, tuner.to_state())
+    tuner.print_params()
+
+
+if __name__ == "__main__":
+    main()
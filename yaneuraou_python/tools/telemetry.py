@@ -0,0 +1,163 @@
+"""
+対局中の1手ごとの探索テレメトリ(消費時間, nodes, nps, depth, seldepth, score, hashfull)を
+事前確保した配列に記録し、NumPy(.npy)またはParquetに書き出すモジュール。
+
+engine_invoker.py の vs_match から --telemetry npy|parquet で使う。
+
+書き出したファイルの読み方:
+    import glob, numpy as np
+    t = np.concatenate([np.load(p) for p in sorted(glob.glob("xxx.telemetry.*.npy"))])
+    # または
+    import pandas as pd
+    t = pd.concat([pd.read_parquet(p) for p in sorted(glob.glob("xxx.telemetry.*.parquet"))])
+"""
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# 値がない(エンジンが出力しなかった)ときに入れる値
+MISSING = -1
+# scoreがないときに入れる値。やねうら王のVALUE_NONEと同じ値。
+VALUE_NONE = 32002
+
+# 1手分のレコードの列定義
+TELEMETRY_COLUMNS = [
+    ("game",     "i4"),  # 通し番号の対局ID(vs_match内で0から)
+    ("engine",   "i1"),  # 0 = engine1 , 1 = engine2
+    ("side",     "i1"),  # 0 = 先手 , 1 = 後手
+    ("ply",      "i2"),  # 初期局面からの手数(定跡手順を含む。この指し手で何手目か - 1)
+    ("time_ms",  "i4"),  # goを送ってからbestmoveを受信するまでの時間[ms]
+    ("nodes",    "i8"),
+    ("nps",      "i8"),
+    ("depth",    "i2"),
+    ("seldepth", "i2"),
+    ("score",    "i4"),  # 手番側から見た評価値。mateは±(32000-手数)に換算済み。
+    ("hashfull", "i2"),
+]
+
+FORMATS = ("npy", "parquet")
+
+
+def _require_numpy():
+    if np is None:
+        print("numpy is not installed. Please install it with 'pip install numpy'")
+        sys.exit(1)
+
+
+class TelemetryRecorder:
+    """
+    並列対局のスロットごとに max_moves 行の配列を事前確保しておき、bestmoveのたびに1行書き込む。
+    対局が終わるとその対局分の行を書き出し用バッファに移し、バッファが一杯になったらファイルに書き出す。
+
+    path_base      : 出力ファイル名の先頭部分。 path_base + ".telemetry.00000.parquet" などになる。
+    fmt            : "npy" | "parquet"
+    parallel_games : 並列対局数(スロット数)
+    max_moves      : 1局あたりの最大記録手数
+    flush_rows     : 書き出し用バッファの行数。これが一杯になるごとに書き出す。
+    part_no        : 最初に書き出すpart番号。チェックポイントから再開するときに指定する。
+
+    npyはflushごとに1ファイル、parquetはroll()を呼ぶまで同じファイルにrow groupを追記していく。
+    """
+
+    def __init__(self, path_base, fmt, parallel_games, max_moves, flush_rows=1 << 16, part_no=0):
+        _require_numpy()
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown telemetry format : {fmt}")
+
+        self.path_base = path_base
+        self.fmt = fmt
+        self.dtype = np.dtype(TELEMETRY_COLUMNS)
+
+        self.slots = np.zeros((parallel_games, max_moves), dtype=self.dtype)
+        self.slot_rows = [0] * parallel_games
+        self.slot_game = [0] * parallel_games
+
+        self.buffer = np.zeros(max(flush_rows, max_moves), dtype=self.dtype)
+        self.buffer_rows = 0
+
+        self.part_no = part_no
+        self.parquet_writer = None
+
+    def begin_game(self, slot, game_id):
+        """ スロットslotで新しい対局を開始する。"""
+        self.slot_rows[slot] = 0
+        self.slot_game[slot] = game_id
+
+    def record(self, slot, engine, ply, time_ms, info):
+        """
+        1手分を記録する。
+        info : usi_parser.SearchInfo (その手の探索中に受信したinfoの集約)
+        """
+        n = self.slot_rows[slot]
+        if n >= self.slots.shape[1]:
+            return
+        row = self.slots[slot, n]
+        row["game"] = self.slot_game[slot]
+        row["engine"] = engine
+        row["side"] = ply & 1
+        row["ply"] = ply
+        row["time_ms"] = time_ms
+        row["nodes"] = MISSING if info.nodes is None else info.nodes
+        row["nps"] = MISSING if info.nps is None else info.nps
+        row["depth"] = MISSING if info.depth is None else info.depth
+        row["seldepth"] = MISSING if info.seldepth is None else info.seldepth
+        row["score"] = VALUE_NONE if info.score is None else info.score
+        row["hashfull"] = MISSING if info.hashfull is None else info.hashfull
+        self.slot_rows[slot] = n + 1
+
+    def end_game(self, slot):
+        """ スロットslotの対局が終わったので、記録を書き出し用バッファに移す。"""
+        n = self.slot_rows[slot]
+        if self.buffer_rows + n > len(self.buffer):
+            self.flush()
+        self.buffer[self.buffer_rows:self.buffer_rows + n] = self.slots[slot, :n]
+        self.buffer_rows += n
+        self.slot_rows[slot] = 0
+
+    def discard_game(self, slot):
+        """ スロットslotの対局の記録を捨てる。"""
+        self.slot_rows[slot] = 0
+
+    def flush(self):
+        """ 書き出し用バッファの内容をファイルに書き出す。"""
+        if self.buffer_rows == 0:
+            return
+        rows = self.buffer[:self.buffer_rows]
+        if self.fmt == "npy":
+            np.save(f"{self.path_base}.telemetry.{self.part_no:05d}.npy", rows)
+            self.part_no += 1
+        else:
+            self._write_parquet(rows)
+        self.buffer_rows = 0
+
+    def _write_parquet(self, rows):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("pyarrow is not installed. Please install it with 'pip install pyarrow'")
+            sys.exit(1)
+
+        table = pa.table({name: rows[name] for name, _ in TELEMETRY_COLUMNS})
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(f"{self.path_base}.telemetry.{self.part_no:05d}.parquet", table.schema)
+        # flushのたびに1つのrow groupとして追記される。
+        self.parquet_writer.write_table(table)
+
+    def roll(self):
+        """
+        ここまでに終局した対局の記録をすべてファイルに書き出して閉じ、次のpartに進む。
+        戻り値は次に書き出すpart番号。チェックポイントにはこの値を保存しておく。
+        """
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+            self.part_no += 1
+        return self.part_no
+
+    def close(self):
+        self.roll()
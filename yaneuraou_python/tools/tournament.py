@@ -0,0 +1,274 @@
+"""
+3つ以上のエンジン(評価関数)で、総当たり(round-robin)または1対多(gauntlet)の対局を行い、
+結果をクロス表と、全対局から同時に最尤推定したElo(Bradley-Terryモデル)にまとめるツール。
+
+対局の組み合わせごとに scheduler.MatchJob を1つ作り、scheduler.MatchScheduler で
+共通のコア数(core budget)の中で並行して消化する。定跡は最初に1回だけ読み込む。
+共有しているのはコア数(対局スロットの数)だけで、エンジンのプロセスは組み合わせごとに起動し直す。
+(vs_matchは1組のエンジンを対局スロットごとに起動して使うので、組み合わせをまたいでプロセスを使い回すことはしない。
+ そのぶん起動と評価関数の読み込みが組み合わせの数だけかかる)
+
+使い方:
+    python tournament.py tournament.yaml
+
+tournament.yamlの例:
+    home: /mnt/d/shogi_home
+    core_budget: 32
+    mode: roundrobin       # roundrobin | gauntlet (gauntletは先頭のエンジン対その他)
+    time: b1000
+    loop: 200              # 1組あたりの対局数
+    max_parallel: 8        # 1組あたりの最大並列対局数
+    book_moves: 24
+    rand_book: true
+    ponder: false          # trueなら相手の手番中もponderさせる(全組み合わせ共通。goが"go btime ..."の形式のときだけ)
+    anchor: base           # Eloを0とするエンジン名(省略時は平均を0とする)
+    adjudication: {resign_score: 3000, resign_plies: 6, mate: true}   # 評価値による勝敗の判定(省略時はしない)
+    engines:
+      - name: base
+        engine: YaneuraOu.exe
+        eval: nnue/base
+      - name: test1
+        engine: YaneuraOu.exe
+        eval: nnue/test1
+      - name: test2
+        engine: YaneuraOu.exe
+        eval: nnue/test2
+        hash: 256
+
+エンジンごとの項目(engine_threads, hash, time)は省略するとファイル先頭の同名の項目になる。
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+
+import numpy as np
+import yaml
+
+from adjudication import AdjudicationRules
+from elo_stats import ELO_SCALE
+from engine_invoker import create_option, engine_to_full, read_book_sfens
+from scheduler import MatchJob, MatchScheduler
+
+
+# ======================================================================
+# 対局の組み合わせ
+# ======================================================================
+
+def make_pairs(n, mode):
+    """ n個のエンジンの対局の組み合わせ(i, j)のlistを返す。"""
+    if mode == "roundrobin":
+        return list(itertools.combinations(range(n), 2))
+    if mode == "gauntlet":
+        return [(0, j) for j in range(1, n)]
+    raise ValueError(f"unknown tournament mode : {mode}")
+
+
+def build_pair_job(home, config, a, b, book_sfens, index):
+    """ エンジン設定a, bの対局をMatchJobにする。 """
+    def get(spec, key, default):
+        return spec.get(key, config.get(key, default))
+
+    # 1回のvs_matchの中では2つのエンジンのスレッド数は共通
+    engine_threads = max(get(a, "engine_threads", 1), get(b, "engine_threads", 1))
+    play_time = str(get(a, "time", "b1000")) + "." + str(get(b, "time", "b1000"))
+    hashes = [str(get(a, "hash", "128")), str(get(b, "hash", "128"))]
+
+    engines = (engine_to_full(a["engine"]), engine_to_full(b["engine"]))
+    engines_full = (os.path.join(home, "exe", engines[0]), os.path.join(home, "exe", engines[1]))
+    evals_full = (os.path.join(home, "eval", a["eval"]), os.path.join(home, "eval", b["eval"]))
+    options = create_option(engines, engine_threads, evals_full, play_time, hashes, "")
+
+    name = a["name"] + "-" + b["name"]
+    opt2 = f"J{index}," + name + ",T" + str(engine_threads) + "," + play_time
+    return MatchJob(name, engines_full, options, config.get("loop", 100), book_sfens, config.get("book_moves", 24),
+                    engine_threads=engine_threads,
+                    max_parallel=config.get("max_parallel", 1),
+                    opt2=opt2,
+                    kifu_format=config.get("kifu_format", "sfen"),
+                    telemetry_format=config.get("telemetry", "none"),
+                    file_logging=config.get("log", False),
+                    ponder=config.get("ponder", False),
+                    adjudication=AdjudicationRules.from_dict(config.get("adjudication")))
+
+
+# ======================================================================
+# クロス表とElo
+# ======================================================================
+
+class CrossTable:
+    """
+    wins[i, j]  : エンジンiがエンジンjに勝った数
+    draws[i, j] : エンジンiとエンジンjの引き分けの数 (対称行列)
+    """
+
+    def __init__(self, names):
+        n = len(names)
+        self.names = list(names)
+        self.wins = np.zeros((n, n), dtype=np.int64)
+        self.draws = np.zeros((n, n), dtype=np.int64)
+
+    def add(self, i, j, win, lose, draw):
+        """ vs_matchの結果(engine1 = i から見たwin, lose, draw)を加える。"""
+        self.wins[i, j] += win
+        self.wins[j, i] += lose
+        self.draws[i, j] += draw
+        self.draws[j, i] += draw
+
+    @property
+    def games(self):
+        return self.wins + self.wins.T + self.draws
+
+    def fit_elo(self, anchor=None, prior=1.0, iterations=10000, tol=1e-10):
+        """
+        Bradley-Terryモデル P(iがjに勝つ) = γ_i / (γ_i + γ_j) の最尤推定をMMアルゴリズム(Hunter 2004)で行う。
+        引き分けは0.5勝0.5敗として数える。
+        全勝/全敗のエンジンがあっても発散しないように、対局のある組ごとに prior 局の引き分けを加える。(BayesEloの事前分布の簡易版)
+
+        anchor : Eloを0とするエンジンの番号。Noneなら平均が0になるようにする。
+        戻り値 : (elo, se) 。seはFisher情報量から求めたEloの標準誤差(anchorからの差の誤差)。
+        """
+        n = len(self.names)
+        played = self.games > 0
+        w = self.wins + 0.5 * self.draws + 0.5 * prior * played
+        g = self.games + prior * played
+        score = w.sum(axis=1)
+
+        gamma = np.ones(n)
+        for _ in range(iterations):
+            denom = (g / (gamma[:, None] + gamma[None, :])).sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                new = np.where(denom > 0, score / denom, gamma)
+            new /= np.exp(np.mean(np.log(new)))
+            if np.max(np.abs(new - gamma)) < tol:
+                gamma = new
+                break
+            gamma = new
+
+        r = np.log(gamma)
+        r -= r[anchor] if anchor is not None else r.mean()
+
+        # 対数尤度のHessian(rについて)。 -H がFisher情報量。
+        p = gamma[:, None] / (gamma[:, None] + gamma[None, :])
+        info = g * p * p.T
+        fisher = np.diag(info.sum(axis=1)) - info
+        # rは定数を足しても尤度が変わらないので、anchor(または平均)を固定した上で逆行列をとる。
+        if anchor is not None:
+            keep = [k for k in range(n) if k != anchor]
+            cov = np.zeros((n, n))
+            if keep:
+                cov[np.ix_(keep, keep)] = np.linalg.pinv(fisher[np.ix_(keep, keep)])
+        else:
+            cov = np.linalg.pinv(fisher)
+        se = np.sqrt(np.clip(np.diag(cov), 0.0, None))
+
+        return r * ELO_SCALE, se * ELO_SCALE
+
+    def print_table(self, anchor=None):
+        elo, se = self.fit_elo(anchor)
+        games = self.games
+        order = np.argsort(-elo)
+        width = max(8, max(len(s) for s in self.names))
+
+        print("\nranking :")
+        for rank, i in enumerate(order, 1):
+            total = games[i].sum()
+            points = self.wins[i].sum() + 0.5 * self.draws[i].sum()
+            pct = points / total * 100 if total else 0.0
+            print(f"{rank:3d}. {self.names[i]:<{width}} Elo {elo[i]:+8.2f} +/- {1.96 * se[i]:6.2f}"
+                  f"   games {int(total):6d}  score {pct:6.2f}%")
+
+        print("\ncross table (W-D-L of the row engine) :")
+        print(" " * width + "".join(f" {self.names[j]:>15}" for j in order))
+        for i in order:
+            cells = []
+            for j in order:
+                if i == j or games[i, j] == 0:
+                    cells.append(f" {'-':>15}")
+                else:
+                    cells.append(f" {f'{self.wins[i, j]}-{self.draws[i, j]}-{self.wins[j, i]}':>15}")
+            print(f"{self.names[i]:<{width}}" + "".join(cells))
+        sys.stdout.flush()
+
+
+# ======================================================================
+# メイン処理
+# ======================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Round-robin or gauntlet tournament between several engines.")
+    parser.add_argument('config', type=str, help="Path to a YAML tournament file.")
+    parser.add_argument('--core_budget', type=int, default=0, help="Number of cores to fill (overrides the file).")
+    parser.add_argument('--metrics_port', type=int, default=0, help="Serve Prometheus-style match metrics on this port (0 = disabled).")
+    parser.add_argument('--checkpoint', type=str, default="", help="Save progress to this JSON file and skip pairs already finished in it.")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+
+    home = config["home"]
+    specs = config["engines"]
+    names = [s.get("name", s["eval"]) for s in specs]
+    if len(set(names)) != len(names):
+        print("Error! engine names must be unique.")
+        sys.exit(1)
+    for s, name in zip(specs, names):
+        s["name"] = name
+    anchor = names.index(config["anchor"]) if config.get("anchor") else None
+
+    mode = config.get("mode", "roundrobin")
+    pairs = make_pairs(len(specs), mode)
+    core_budget = args.core_budget or config.get("core_budget", os.cpu_count())
+
+    checkpoint = None
+    if args.checkpoint:
+        from checkpoint import RunCheckpoint
+        checkpoint = RunCheckpoint.load(args.checkpoint) if os.path.exists(args.checkpoint) else RunCheckpoint(args.checkpoint)
+
+    book_moves = config.get("book_moves", 24)
+    book_sfens = read_book_sfens(home, book_moves)
+    if config.get("rand_book", False):
+        seed = random.randrange(1 << 31)
+        if checkpoint:
+            # 再開したときに同じ順序になるように、seedはチェックポイントに残す。
+            if checkpoint.book_seed is None:
+                checkpoint.book_seed = seed
+            seed = checkpoint.book_seed
+        random.Random(seed).shuffle(book_sfens)
+
+    table = CrossTable(names)
+    jobs = []
+    job_pairs = []
+    for index, (i, j) in enumerate(pairs):
+        job = build_pair_job(home, config, specs[i], specs[j], book_sfens, index)
+        block = checkpoint.block(job.name) if checkpoint else None
+        if block and block.get("done"):
+            print(job.name + " : skip (already done in checkpoint)")
+            w, l, d = block["result"][:3]
+            table.add(i, j, w, l, d)
+            continue
+        jobs.append(job)
+        job_pairs.append((i, j))
+
+    metrics = None
+    if args.metrics_port:
+        from metrics import MatchMetrics, start_metrics_server
+        metrics = MatchMetrics()
+        start_metrics_server(metrics.registry, args.metrics_port)
+
+    print(f"{mode} : {len(names)} engines , {len(pairs)} pairs ({len(jobs)} to play) , core_budget : {core_budget}")
+    MatchScheduler(jobs, core_budget, metrics=metrics, checkpoint=checkpoint).run()
+
+    for job, (i, j) in zip(jobs, job_pairs):
+        if job.result:
+            w, l, d = job.result[:3]
+            table.add(i, j, w, l, d)
+        else:
+            print(f"Error! {job.name} : {job.status}")
+
+    table.print_table(anchor)
+
+
+if __name__ == "__main__":
+    main()
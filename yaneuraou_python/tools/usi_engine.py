@@ -0,0 +1,390 @@
+"""
+asyncioで思考エンジン(USI)を動かすクライアント。
+
+engine_invoker.py / spsa_tuner.py / script/bench.py はエンジンの起動・通信をすべてここで行う。
+
+使い方(asyncioのコードから):
+    async with UsiEngine("/path/to/YaneuraOu") as engine:
+        await engine.usi()
+        engine.setoption("Threads", 4)
+        await engine.isready()
+        engine.position("startpos", ["7g7f"])
+        search = engine.go("btime 0 wtime 0 byoyomi 1000")
+        async for info in search:           # InfoRecordが届くたびに返る
+            print(info.depth, info.score)
+        print(search.bestmove.move)          # 探索を止めたいときは engine.stop()
+
+使い方(スレッドで書かれた同期コードから):
+    host = EngineHost()                      # イベントループを別スレッドで回す
+    engine = host.spawn(path, on_line=callback, on_exit=callback)
+    engine.post("isready")                   # どのスレッドからでも送れる
+    ...
+    host.close()
+
+- 送信するコマンドはすぐには書き込まず、イベントループの1回の処理の間に送られた分を1回のwriteにまとめる。
+  ("position ..."と"go ..."は1回のシステムコールで届く)
+- 受信は1行ずつusi_parserで解析する。長い読み筋の行でも詰まらないよう、読み込みのバッファとパイプを大きくとる。
+"""
+import asyncio
+import os
+import sys
+import threading
+
+from usi_parser import parse_line, InfoRecord, BestMoveRecord, ReadyOkRecord, UsiOkRecord, OptionRecord, SearchInfo
+
+# StreamReaderの1行の上限。読み筋の長い行や"bench"の出力でも足りるように大きくとる。
+STREAM_LIMIT = 1 << 20
+
+# Linuxでのパイプのサイズ(F_SETPIPE_SZ)。既定の64KBだと、エンジンが大量に出力したときに書き込みで待たされる。
+PIPE_SIZE = 1 << 20
+
+
+class UsiEngineError(Exception):
+    """ エンジンが時間内に応答しない/終了したときに送出する。"""
+
+
+def _enlarge_pipe(pipe):
+    """ パイプのバッファを大きくする。Linux以外や、権限がなくて失敗したときは何もしない。"""
+    if pipe is None or not sys.platform.startswith("linux"):
+        return
+    try:
+        import fcntl
+        fcntl.fcntl(pipe.fileno(), getattr(fcntl, "F_SETPIPE_SZ", 1031), PIPE_SIZE)
+    except (OSError, ValueError, AttributeError):
+        pass
+
+
+# ======================================================================
+# 探索1回分
+# ======================================================================
+
+class SearchStream:
+    """
+    UsiEngine.go() の戻り値。"bestmove"が届くまで、InfoRecordを順に返すasync iterator。
+
+    info     : ここまでに届いたinfoの集約(usi_parser.SearchInfo)
+    bestmove : 届いたBestMoveRecord。まだならNone。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.info = SearchInfo()
+        self.bestmove = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.bestmove is not None:
+            raise StopAsyncIteration
+        while True:
+            line = await self.engine.readline()
+            rec = parse_line(line)
+            if isinstance(rec, InfoRecord):
+                self.info.update(rec)
+                return rec
+            if isinstance(rec, BestMoveRecord):
+                self.bestmove = rec
+                raise StopAsyncIteration
+
+    async def wait(self, timeout=None):
+        """ "bestmove"が届くまで読み進めて、BestMoveRecordを返す。 """
+        async def drain():
+            async for _ in self:
+                pass
+        await asyncio.wait_for(drain(), timeout)
+        return self.bestmove
+
+
+# ======================================================================
+# エンジン1つ
+# ======================================================================
+
+class UsiEngine:
+    """
+    思考エンジンのプロセス1つ。
+
+    on_line : Noneでなければ、エンジンの出力1行(改行なしのstr)ごとに呼ぶ。
+              このときはreadline()/go()などの読み込み側のメソッドは使えない。(行をためない)
+    on_exit : Noneでなければ、プロセスが終了したときに終了コードを引数に呼ぶ。
+    """
+
+    def __init__(self, path, args=(), cwd=None, encoding="utf-8", on_line=None, on_exit=None):
+        self.path = path
+        self.args = list(args)
+        # 評価関数などを相対パスで読むエンジンのために、既定では実行ファイルのあるフォルダで起動する。
+        self.cwd = cwd if cwd is not None else (os.path.dirname(path) or None)
+        self.encoding = encoding
+        self.on_line = on_line
+        self.on_exit = on_exit
+
+        self.proc = None
+        self.loop = None
+        self.options = {}       # "usi"で届いた option name → OptionRecord
+        self.name = None        # "id name"
+        self._lines = None
+        self._pending = []
+        self._flush_scheduled = False
+        self._reader = None
+        self._closed = None
+
+    # ------------------------------------------------------------------
+    # 起動と終了
+    # ------------------------------------------------------------------
+
+    async def start(self):
+        """ プロセスを起動する。起動できなければOSErrorが送出される。"""
+        self.loop = asyncio.get_running_loop()
+        self._closed = self.loop.create_future()
+        if self.on_line is None:
+            self._lines = asyncio.Queue()
+        self.proc = await asyncio.create_subprocess_exec(
+            self.path, *self.args,
+            cwd=self.cwd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=STREAM_LIMIT)
+        # パイプのfdはasyncioの公開APIからは取れないので、プロセスのtransportから取り出す。
+        # (非公開の属性なので、取れないPythonの版ではパイプの大きさは既定のままにする)
+        transport = getattr(self.proc, "_transport", None)
+        if transport is not None:
+            for fd in (0, 1):
+                pipe_transport = transport.get_pipe_transport(fd)
+                if pipe_transport is not None:
+                    _enlarge_pipe(pipe_transport.get_extra_info("pipe"))
+        self._reader = self.loop.create_task(self._read_loop())
+        return self
+
+    async def _read_loop(self):
+        stdout = self.proc.stdout
+        while True:
+            try:
+                raw = await stdout.readline()
+            except (asyncio.LimitOverrunError, ValueError):
+                # STREAM_LIMITを超える1行は捨てる。
+                continue
+            if not raw:
+                break
+            line = raw.decode(self.encoding, errors="replace").rstrip("\r\n")
+            if self.on_line is not None:
+                self.on_line(line)
+            else:
+                self._lines.put_nowait(line)
+
+        retcode = await self.proc.wait()
+        if self._lines is not None:
+            self._lines.put_nowait(None)
+        if self.on_exit is not None:
+            self.on_exit(retcode)
+        if not self._closed.done():
+            self._closed.set_result(retcode)
+
+    async def quit(self, timeout=5.0):
+        """ "quit"を送って終了を待つ。時間内に終了しなければkillする。終了コードを返す。"""
+        if self.proc is None:
+            return None
+        if self.proc.returncode is None:
+            self.send("quit")
+            self._flush()
+        return await self.wait_closed(timeout)
+
+    async def wait_closed(self, timeout=5.0):
+        """ プロセスの終了を待つ。時間内に終了しなければkillする。"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._closed), timeout)
+        except asyncio.TimeoutError:
+            if self.proc.returncode is None:
+                self.proc.kill()
+            return await self._closed
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.quit()
+
+    # ------------------------------------------------------------------
+    # 送信
+    # ------------------------------------------------------------------
+
+    def send(self, cmd):
+        """
+        コマンドを1行送る。イベントループのスレッドから呼ぶこと。
+        実際の書き込みはイベントループに制御が戻ったときに、それまでの分をまとめて1回で行う。
+        """
+        self._pending.append(cmd + "\n")
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if not self._pending:
+            return
+        data = "".join(self._pending).encode(self.encoding)
+        self._pending.clear()
+        stdin = self.proc.stdin
+        if stdin is None or stdin.is_closing():
+            return
+        try:
+            stdin.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # エンジンが落ちている。終了はon_exit/readline()の側で分かる。
+            pass
+
+    async def drain(self):
+        """ ためているコマンドを書き込んで、パイプに流れるまで待つ。"""
+        self._flush()
+        try:
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def setoption(self, name, value):
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        self.send(f"setoption name {name} value {value}")
+
+    def position(self, sfen="startpos", moves=()):
+        """ sfenは"startpos"か、"sfen ..."を除いた局面文字列。"""
+        cmd = "position startpos" if sfen == "startpos" else "position sfen " + sfen
+        if moves:
+            cmd += " moves " + " ".join(moves)
+        self.send(cmd)
+
+    def go(self, args=""):
+        """ "go <args>"を送って、SearchStreamを返す。"""
+        self.send("go " + args if args else "go")
+        return SearchStream(self)
+
+    def stop(self):
+        self.send("stop")
+
+    def ponderhit(self):
+        self.send("ponderhit")
+
+    # ------------------------------------------------------------------
+    # 受信
+    # ------------------------------------------------------------------
+
+    async def readline(self, timeout=None):
+        """ 1行読む。エンジンが終了していたらUsiEngineErrorを送出する。"""
+        self._flush()
+        if timeout is None:
+            line = await self._lines.get()
+        else:
+            try:
+                line = await asyncio.wait_for(self._lines.get(), timeout)
+            except asyncio.TimeoutError:
+                raise UsiEngineError(f"{self.path} : no response in {timeout} sec") from None
+        if line is None:
+            # 他の読み手も終了に気づけるように戻しておく。
+            self._lines.put_nowait(None)
+            raise UsiEngineError(f"{self.path} : process terminated (code {self.proc.returncode})")
+        return line
+
+    async def read_until(self, predicate, timeout=None):
+        """
+        predicate(line, record) がTrueになる行まで読んで、そこまでの行のlistを返す。
+        timeout は全体の秒数。
+        """
+        async def read():
+            lines = []
+            while True:
+                line = await self.readline()
+                lines.append(line)
+                if predicate(line, parse_line(line)):
+                    return lines
+        try:
+            return await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            raise UsiEngineError(f"{self.path} : no response in {timeout} sec") from None
+
+    async def usi(self, timeout=30.0):
+        """ "usi"を送ってusiokまで待つ。optionsとnameを埋め、受信した行のlistを返す。"""
+        self.send("usi")
+        lines = await self.read_until(lambda line, rec: isinstance(rec, UsiOkRecord), timeout)
+        for line in lines:
+            rec = parse_line(line)
+            if isinstance(rec, OptionRecord):
+                self.options[rec.name] = rec
+            elif line.startswith("id name "):
+                self.name = line[len("id name "):]
+        return lines
+
+    async def isready(self, timeout=60.0):
+        """ "isready"を送ってreadyokまで待つ。受信した行のlistを返す。"""
+        self.send("isready")
+        return await self.read_until(lambda line, rec: isinstance(rec, ReadyOkRecord), timeout)
+
+    # ------------------------------------------------------------------
+    # 別スレッドから使うとき(EngineHost)
+    # ------------------------------------------------------------------
+
+    def post(self, cmd):
+        """ send()のスレッドセーフ版。同じループの1回の処理の間にpostされた分はまとめて書き込まれる。"""
+        self.loop.call_soon_threadsafe(self.send, cmd)
+
+    def poll(self):
+        """ 終了していれば終了コード、動いていればNone。(subprocess.Popen.poll()と同じ)"""
+        return self.proc.returncode if self.proc else None
+
+    def kill(self):
+        self.loop.call_soon_threadsafe(self._signal, "kill")
+
+    def kill_now(self):
+        """ kill()のイベントループのスレッドから呼ぶ版。予約せずにその場でkillする。"""
+        self._signal("kill")
+
+    def terminate(self):
+        self.loop.call_soon_threadsafe(self._signal, "terminate")
+
+    def _signal(self, how):
+        if self.proc.returncode is None:
+            try:
+                getattr(self.proc, how)()
+            except ProcessLookupError:
+                pass
+
+
+# ======================================================================
+# 同期コードから使うための入れ物
+# ======================================================================
+
+class EngineHost:
+    """
+    イベントループを1本のデーモンスレッドで回して、その上でUsiEngineを動かす。
+    エンジンが何十個あっても、読み込みはこのスレッド1本で行う。
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.engines = []
+
+    def run(self, coro, timeout=None):
+        """ コルーチンをイベントループで実行して、結果を返す。(呼び出したスレッドは待つ)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def spawn(self, path, cwd=None, on_line=None, on_exit=None):
+        """ エンジンを起動して、UsiEngineを返す。on_line/on_exitはイベントループのスレッドから呼ばれる。"""
+        engine = self.run(UsiEngine(path, cwd=cwd, on_line=on_line, on_exit=on_exit).start())
+        # 終了したエンジンは持っていても仕方がないので、ここで外す。(再起動を繰り返してもたまっていかない)
+        self.engines = [e for e in self.engines if e.poll() is None]
+        self.engines.append(engine)
+        return engine
+
+    def close(self, timeout=5.0):
+        """ 動いているエンジンをterminateして終了を待ち、イベントループを止める。"""
+        async def shutdown():
+            for engine in self.engines:
+                engine._signal("terminate")
+            await asyncio.gather(*(engine.wait_closed(timeout) for engine in self.engines))
+        try:
+            self.run(shutdown())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
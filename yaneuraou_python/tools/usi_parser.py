@@ -0,0 +1,363 @@
+"""
+USIプロトコルのエンジン出力を1パスで解析して、型付きのレコードにするモジュール。
+
+engine_invoker.py / sprt_invoker.py / script/bench.py から共通で使う。
+
+使い方:
+    from usi_parser import parse_line, InfoRecord, BestMoveRecord
+
+    rec = parse_line("info depth 10 seldepth 14 score cp 35 nodes 12345 nps 1000000 pv 7g7f 3c3d")
+    if isinstance(rec, InfoRecord):
+        print(rec.depth, rec.score, rec.pv)
+
+1行につき split() を1回だけ行い、トークン列を先頭から1回なめるだけで全フィールドを取り出す。
+"nodes" in line のような部分文字列検索はしないので、"info string ... win ..." のような
+行に誤反応することもない。
+"""
+
+# 詰みスコアを評価値に換算するときの基準値。
+# mate N (N手で詰ます) → MATE_VALUE - N , mate -N (N手で詰まされる) → -MATE_VALUE + N
+MATE_VALUE = 32000
+
+
+# ======================================================================
+# レコード型
+# ======================================================================
+
+class InfoRecord:
+    """
+    "info ..." 行。出現しなかったフィールドは None。
+
+    score_type : "cp" | "mate" | None
+    score      : 評価値。mateの場合は ±(MATE_VALUE - 手数) に換算済み。
+    mate       : mateの手数(符号付き)。"mate -0"のときは0で、scoreの符号で負けを表す。
+    bound      : "lowerbound" | "upperbound" | None
+    pv         : 読み筋(USI文字列のlist)。出力がなければ None。
+    string     : "info string ..." の本文。
+    """
+    __slots__ = ("depth", "seldepth", "time", "nodes", "nps", "hashfull", "multipv",
+                 "currmove", "currmovenumber", "score_type", "score", "mate", "bound",
+                 "pv", "string")
+
+    def __init__(self):
+        self.depth = None
+        self.seldepth = None
+        self.time = None
+        self.nodes = None
+        self.nps = None
+        self.hashfull = None
+        self.multipv = None
+        self.currmove = None
+        self.currmovenumber = None
+        self.score_type = None
+        self.score = None
+        self.mate = None
+        self.bound = None
+        self.pv = None
+        self.string = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__ if getattr(self, k) is not None)
+        return f"InfoRecord({fields})"
+
+
+class BestMoveRecord:
+    """ "bestmove <move> [ponder <move>]" 行。 move は "resign" / "win" のこともある。"""
+    __slots__ = ("move", "ponder")
+
+    def __init__(self, move, ponder=None):
+        self.move = move
+        self.ponder = ponder
+
+    @property
+    def is_resign(self):
+        return self.move == "resign"
+
+    @property
+    def is_win(self):
+        return self.move == "win"
+
+    def __repr__(self):
+        return f"BestMoveRecord(move={self.move!r}, ponder={self.ponder!r})"
+
+
+class ReadyOkRecord:
+    """ "readyok" 行。"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "ReadyOkRecord()"
+
+
+class UsiOkRecord:
+    """ "usiok" 行。"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UsiOkRecord()"
+
+
+class OptionRecord:
+    """
+    "option name <name> type <type> [default <v>] [min <v>] [max <v>] [var <v> ...]" 行。
+    spinの default/min/max は int に変換済み。それ以外の型では文字列のまま。
+    """
+    __slots__ = ("name", "type", "default", "min", "max", "vars")
+
+    def __init__(self, name, type, default=None, min=None, max=None, vars=None):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.min = min
+        self.max = max
+        self.vars = vars if vars is not None else []
+
+    def __repr__(self):
+        return (f"OptionRecord(name={self.name!r}, type={self.type!r}, default={self.default!r}, "
+                f"min={self.min!r}, max={self.max!r})")
+
+
+class BenchRecord:
+    """
+    "bench"コマンドの集計行。
+      Total time (ms) : 1234   → name = "time"
+      Nodes searched  : 5678   → name = "nodes"
+      Nodes/second    : 9012   → name = "nps"
+    """
+    __slots__ = ("name", "value")
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return f"BenchRecord(name={self.name!r}, value={self.value!r})"
+
+
+# 引数なしのレコードは共有インスタンスを返す。
+_READYOK = ReadyOkRecord()
+_USIOK = UsiOkRecord()
+
+# "info"行で、直後に整数値を1つ取るキーワードとInfoRecordの属性名の対応
+_INT_KEYS = {
+    "depth": "depth",
+    "seldepth": "seldepth",
+    "time": "time",
+    "nodes": "nodes",
+    "nps": "nps",
+    "hashfull": "hashfull",
+    "multipv": "multipv",
+    "currmovenumber": "currmovenumber",
+}
+
+# benchの集計行の見出しとBenchRecord.nameの対応
+_BENCH_KEYS = {
+    "Total time (ms)": "time",
+    "Nodes searched": "nodes",
+    "Nodes/second": "nps",
+}
+
+
+# ======================================================================
+# パーサー
+# ======================================================================
+
+def _to_int(s):
+    try:
+        return int(s)
+    except ValueError:
+        return None
+
+
+def mate_to_value(token):
+    """
+    "mate"の後ろのトークン("5", "-3", "+", "-", "-0")を評価値と手数に換算する。
+    戻り値 : (score, mate)
+    """
+    negative = token.startswith("-")
+    digits = token.lstrip("+-")
+    plies = int(digits) if digits.isdigit() else 0
+    if negative:
+        return -MATE_VALUE + plies, -plies
+    return MATE_VALUE - plies, plies
+
+
+def parse_info(tokens):
+    """ "info"で始まる行をsplit()したトークン列からInfoRecordを作る。"""
+    rec = InfoRecord()
+    n = len(tokens)
+    i = 1  # tokens[0] == "info"
+    while i < n:
+        t = tokens[i]
+        attr = _INT_KEYS.get(t)
+        if attr is not None:
+            if i + 1 < n:
+                setattr(rec, attr, _to_int(tokens[i + 1]))
+            i += 2
+        elif t == "score":
+            if i + 2 < n:
+                kind = tokens[i + 1]
+                if kind == "cp":
+                    rec.score_type = "cp"
+                    rec.score = _to_int(tokens[i + 2])
+                elif kind == "mate":
+                    rec.score_type = "mate"
+                    rec.score, rec.mate = mate_to_value(tokens[i + 2])
+            i += 3
+        elif t == "lowerbound" or t == "upperbound":
+            rec.bound = t
+            i += 1
+        elif t == "currmove":
+            if i + 1 < n:
+                rec.currmove = tokens[i + 1]
+            i += 2
+        elif t == "pv":
+            # pv以降は行末までが読み筋
+            rec.pv = tokens[i + 1:]
+            break
+        elif t == "string":
+            # string以降は行末までが自由文字列
+            rec.string = " ".join(tokens[i + 1:])
+            break
+        else:
+            # 未知のキーワード(wdl, tbhits, ...)は読み飛ばす。
+            i += 1
+    return rec
+
+
+def parse_option(tokens):
+    """ "option"で始まる行をsplit()したトークン列からOptionRecordを作る。"""
+    # name は "type" が出てくるまで(空白を含むことがある)
+    try:
+        type_pos = tokens.index("type", 2)
+    except ValueError:
+        return None
+    if len(tokens) < 3 or tokens[1] != "name" or type_pos + 1 >= len(tokens):
+        return None
+    rec = OptionRecord(" ".join(tokens[2:type_pos]), tokens[type_pos + 1])
+
+    n = len(tokens)
+    i = type_pos + 2
+    while i < n:
+        t = tokens[i]
+        if t in ("default", "min", "max"):
+            # stringのdefaultは空白を含むことがあるので、次のキーワードまでを値とする。
+            j = i + 1
+            while j < n and tokens[j] not in ("default", "min", "max", "var"):
+                j += 1
+            value = " ".join(tokens[i + 1:j])
+            if rec.type == "spin":
+                value = _to_int(value)
+            setattr(rec, t, value)
+            i = j
+        elif t == "var":
+            if i + 1 < n:
+                rec.vars.append(tokens[i + 1])
+            i += 2
+        else:
+            i += 1
+    return rec
+
+
+def parse_line(line):
+    """
+    エンジンの出力1行を解析してレコードを返す。
+    対象外の行(id, option, 空行, その他のデバッグ出力)ならNoneを返す。
+    """
+    tokens = line.split()
+    if not tokens:
+        return None
+
+    head = tokens[0]
+    if head == "info":
+        return parse_info(tokens)
+    if head == "bestmove":
+        if len(tokens) < 2:
+            # 指し手のない"bestmove"。探索は終わっているので、Noneにすると呼び出し側がbestmoveを待ち続けてしまう。
+            # 指せる手がなかったものとして投了扱いにする。
+            return BestMoveRecord("resign")
+        ponder = tokens[3] if len(tokens) >= 4 and tokens[2] == "ponder" else None
+        return BestMoveRecord(tokens[1], ponder)
+    if head == "readyok":
+        return _READYOK
+    if head == "usiok":
+        return _USIOK
+    if head == "option":
+        return parse_option(tokens)
+
+    # benchの集計行 "Nodes searched  : 12345"
+    if ":" in line:
+        key, _, value = line.partition(":")
+        name = _BENCH_KEYS.get(key.strip())
+        if name is not None:
+            v = _to_int(value.strip())
+            if v is not None:
+                return BenchRecord(name, v)
+
+    return None
+
+
+def parse_lines(lines):
+    """ 行のiterableを受け取り、解析できたレコードを順にyieldするgenerator。"""
+    for line in lines:
+        rec = parse_line(line)
+        if rec is not None:
+            yield rec
+
+
+# ======================================================================
+# 探索1回分のinfoの集約
+# ======================================================================
+
+class SearchInfo:
+    """
+    "go"から"bestmove"までの間に流れてくるinfoを集約して、最新の値を保持する。
+    nodesとscoreが別の行で来ても、それぞれ最後に出現した値が残る。
+    "info string"や"currmove"だけの行では何も更新しない。
+    """
+    __slots__ = ("depth", "seldepth", "nodes", "nps", "hashfull", "time",
+                 "score_type", "score", "mate", "bound", "pv")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.depth = None
+        self.seldepth = None
+        self.nodes = None
+        self.nps = None
+        self.hashfull = None
+        self.time = None
+        self.score_type = None
+        self.score = None
+        self.mate = None
+        self.bound = None
+        self.pv = None
+
+    def update(self, rec):
+        """ InfoRecordの内容を反映させる。multipv 2以降の行は無視する。"""
+        if rec.multipv is not None and rec.multipv > 1:
+            return
+        if rec.depth is not None:
+            self.depth = rec.depth
+        if rec.seldepth is not None:
+            self.seldepth = rec.seldepth
+        if rec.nodes is not None:
+            self.nodes = rec.nodes
+        if rec.nps is not None:
+            self.nps = rec.nps
+        if rec.hashfull is not None:
+            self.hashfull = rec.hashfull
+        if rec.time is not None:
+            self.time = rec.time
+        if rec.score_type is not None:
+            self.score_type = rec.score_type
+            self.score = rec.score
+            self.mate = rec.mate
+            self.bound = rec.bound
+        if rec.pv:
+            self.pv = rec.pv
+
+    def score_str(self):
+        """ 棋譜に書き出すための評価値文字列。scoreが一度も来ていなければ"?"。"""
+        return "?" if self.score is None else str(self.score)